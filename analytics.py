@@ -0,0 +1,97 @@
+"""
+Текстовый отчет по заполняемости расписания (/analytics)
+
+Сводку считает хранилище (get_booking_analytics): группировка по дню недели и часу выполняется
+в SQL, результат кэшируется до следующей записи или изменения слотов. Здесь только оформление:
+отчет — моноширинный текст для блока кода в Telegram, без графиков и сторонних библиотек.
+"""
+
+from typing import Dict, List
+
+from database import LEAD_TIME_BUCKETS
+
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+# Оттенки ячейки тепловой карты по доле занятых мест: от пустой к полной
+_SHADES = " ░▒▓█"
+# Час без слотов
+_NO_SLOTS = "·"
+# Ширина столбца гистограммы при максимальном значении
+_BAR_WIDTH = 16
+
+
+def _rate(part: int, total: int) -> float:
+    return 100.0 * part / total if total else 0.0
+
+
+def _shade(booked: int, seats: int) -> str:
+    """Символ ячейки: доля занятых мест, округленная до одного из оттенков"""
+    if not seats:
+        return _SHADES[0]
+    return _SHADES[min(len(_SHADES) - 1, round(booked / seats * (len(_SHADES) - 1)))]
+
+
+def lead_time_labels() -> List[str]:
+    """Подписи интервалов заблаговременности: границы LEAD_TIME_BUCKETS в днях"""
+    days = [hours // 24 for hours in LEAD_TIME_BUCKETS]
+    labels = [f"< {days[0]} дн"]
+    labels += [f"{low}–{high} дн" for low, high in zip(days, days[1:])]
+    labels.append(f"≥ {days[-1]} дн")
+    return labels
+
+
+def heatmap(cells: List[Dict]) -> List[str]:
+    """Тепловая карта: строки — дни недели, столбцы — часы, в которые бывают слоты"""
+    by_cell = {(cell['weekday'], cell['hour']): cell for cell in cells}
+    hours = sorted({cell['hour'] for cell in cells})
+    lines = ["  " + "".join(f"{hour:>3}" for hour in hours)]
+    for weekday, name in enumerate(WEEKDAYS):
+        row = ""
+        for hour in hours:
+            cell = by_cell.get((weekday, hour))
+            row += f"{(_shade(cell['booked'], cell['seats']) if cell else _NO_SLOTS) * 2:>3}"
+        lines.append(name + row)
+    lines.append(f"  {_NO_SLOTS} нет слотов, " + " ".join(
+        f"{shade}{100 * index // (len(_SHADES) - 1)}%" for index, shade in enumerate(_SHADES) if shade != " "))
+    return lines
+
+
+def occupancy_report(analytics: Dict, top: int = 5) -> str:
+    """Отчет по сводке get_booking_analytics: тепловая карта, лучшее время, заблаговременность, отмены"""
+    cells = analytics['cells']
+    if not cells:
+        return "Слотов пока нет."
+
+    seats = sum(cell['seats'] for cell in cells)
+    booked = sum(cell['booked'] for cell in cells)
+    cancelled = sum(cell['cancelled'] for cell in cells)
+
+    lines = [f"Заполненность по дням и часам (занято {booked} из {seats} мест, {_rate(booked, seats):.1f}%)", ""]
+    lines += heatmap(cells)
+
+    ranked = sorted((cell for cell in cells if cell['seats']),
+                    key=lambda cell: (-cell['booked'] / cell['seats'], -cell['booked'], cell['weekday'], cell['hour']))
+    lines += ["", "Быстрее всего заполняются:"]
+    for cell in ranked[:top]:
+        lines.append(f"  {WEEKDAYS[cell['weekday']]} {cell['hour']:02d}:00  "
+                     f"{_rate(cell['booked'], cell['seats']):5.1f}%  ({cell['booked']} из {cell['seats']})")
+
+    lead_time = analytics['lead_time']
+    total = sum(lead_time)
+    lines += ["", f"За сколько до занятия записываются (всего записей {total}):"]
+    labels = lead_time_labels()
+    width = max(len(label) for label in labels)
+    peak = max(lead_time) or 1
+    for label, count in zip(labels, lead_time):
+        bar = "█" * round(count / peak * _BAR_WIDTH)
+        lines.append(f"  {label:<{width}} {bar:<{_BAR_WIDTH}} {count} ({_rate(count, total):.0f}%)")
+
+    lines += ["", f"Отмены: {cancelled} из {booked + cancelled} ({_rate(cancelled, booked + cancelled):.1f}%)"]
+    by_weekday = {}
+    for cell in cells:
+        counts = by_weekday.setdefault(cell['weekday'], [0, 0])
+        counts[0] += cell['cancelled']
+        counts[1] += cell['booked'] + cell['cancelled']
+    lines.append("  " + "  ".join(f"{WEEKDAYS[weekday]} {_rate(*counts):.0f}%"
+                                   for weekday, counts in sorted(by_weekday.items()) if counts[1]))
+    return "\n".join(lines)
@@ -0,0 +1,13 @@
+"""
+Микробенчмарки слоя базы данных.
+
+Запуск:
+    python -m benchmarks generate --users 10000 --slots 1000000 --years 5
+    python -m benchmarks run --db bench.db --out results.json
+    python -m benchmarks run --db bench.db --backend memory
+    python -m benchmarks compare old.json new.json
+    python -m benchmarks logging
+    python -m benchmarks startup
+    python -m benchmarks conformance
+    python -m benchmarks scaleout --db bench.db --workers 1 2 4
+"""
@@ -0,0 +1,133 @@
+"""
+Командная строка бенчмарков
+"""
+
+import sys
+import json
+import logging
+import argparse
+
+from benchmarks.dataset import generate_dataset
+from benchmarks.bench_database import run_benchmarks, compare_results, write_results
+from benchmarks.bench_logging import run_logging_benchmark
+from benchmarks.bench_startup import run_startup_benchmark
+from benchmarks.conformance import check_conformance
+from benchmarks.bench_scaleout import run_scaleout_benchmark
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Бенчмарки базы данных')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help='Создать синтетическую базу')
+    generate.add_argument('--out', default='bench.db')
+    generate.add_argument('--users', type=int, default=10000)
+    generate.add_argument('--slots', type=int, default=1000000)
+    generate.add_argument('--years', type=int, default=5)
+    generate.add_argument('--future-days', type=int, default=90)
+    generate.add_argument('--booking-rate', type=float, default=0.6)
+    generate.add_argument('--cancel-rate', type=float, default=0.1)
+    generate.add_argument('--seed', type=int, default=42)
+
+    run = subparsers.add_parser('run', help='Замерить методы Database')
+    run.add_argument('--db', default='bench.db')
+    run.add_argument('--out', default='-', help="Файл результатов JSON ('-' — stdout)")
+    run.add_argument('--repeat', type=int, default=20)
+    run.add_argument('--heavy-repeat', type=int, default=3)
+    run.add_argument('--only', nargs='*', help='Замерить только указанные методы')
+    run.add_argument('--baseline', help='Сравнить с результатами предыдущего прогона')
+    run.add_argument('--threshold', type=float, default=1.25)
+    run.add_argument('--backend', choices=['sqlite', 'memory'], default='sqlite')
+
+    compare = subparsers.add_parser('compare', help='Сравнить два файла результатов')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=1.25)
+
+    log_bench = subparsers.add_parser('logging', help='Задержка logger.info до и после очереди логирования')
+    log_bench.add_argument('--calls', type=int, default=20000)
+    log_bench.add_argument('--sample-every', type=int, default=10)
+    log_bench.add_argument('--out', default='-')
+
+    startup = subparsers.add_parser('startup', help='Проверить время холодного старта по бюджетам')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--out', default='-')
+
+    subparsers.add_parser('conformance', help='Сравнить реализации хранилища с SQLite на общем сценарии')
+
+    scaleout = subparsers.add_parser('scaleout', help='Нагрузка нескольких процессов на общую базу')
+    scaleout.add_argument('--db', default='bench.db')
+    scaleout.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    scaleout.add_argument('--duration', type=float, default=5.0)
+    scaleout.add_argument('--cache-sync-interval', type=float, default=0.2)
+    scaleout.add_argument('--out', default='-')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO,
+                        stream=sys.stderr)
+
+    if args.command == 'generate':
+        meta = generate_dataset(
+            args.out, users=args.users, slots=args.slots, years=args.years, future_days=args.future_days,
+            booking_rate=args.booking_rate, cancel_rate=args.cancel_rate, seed=args.seed
+        )
+        with open(args.out + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return 0
+
+    if args.command == 'run':
+        results = run_benchmarks(args.db, repeat=args.repeat, heavy_repeat=args.heavy_repeat, only=args.only,
+                                 backend=args.backend)
+        write_results(results, args.out)
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            return _report(compare_results(baseline, results, args.threshold))
+        return 0
+
+    if args.command == 'logging':
+        write_results(run_logging_benchmark(args.calls, args.sample_every), args.out)
+        return 0
+
+    if args.command == 'startup':
+        results = run_startup_benchmark(args.runs)
+        write_results(results, args.out)
+        for name in results['violations']:
+            print(f"РЕГРЕССИЯ запуска: {name} превышает бюджет", file=sys.stderr)
+        return 1 if results['violations'] else 0
+
+    if args.command == 'scaleout':
+        results = run_scaleout_benchmark(args.db, workers=args.workers, duration=args.duration,
+                                         cache_sync_interval=args.cache_sync_interval)
+        write_results(results, args.out)
+        for violation in results['violations']:
+            print(f"НАРУШЕНИЕ {violation}", file=sys.stderr)
+        return 1 if results['violations'] else 0
+
+    if args.command == 'conformance':
+        results = check_conformance()
+        for item in results['failures']:
+            print(f"НЕСОВМЕСТИМОСТЬ {item}", file=sys.stderr)
+        print(f"Шагов сценария: {results['steps']}, реализаций: {', '.join(results['backends'])}, "
+              f"расхождений: {len(results['failures'])}", file=sys.stderr)
+        return 1 if results['failures'] else 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    return _report(compare_results(baseline, current, args.threshold))
+
+
+def _report(regressions: list) -> int:
+    """Вывести регрессии; код возврата 1, если они есть (для CI перед деплоем)"""
+    for item in regressions:
+        print(f"РЕГРЕССИЯ {item['method']}: {item['baseline_ms']} мс -> {item['current_ms']} мс "
+              f"(x{item['ratio']})", file=sys.stderr)
+    if not regressions:
+        print("Регрессий не обнаружено", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""
+Замер времени публичных методов Database
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import sqlite3
+import inspect
+import logging
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import Database
+from memory_database import MemoryDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class BenchContext:
+    """Пулы идентификаторов из базы, из которых берутся аргументы вызовов"""
+
+    def __init__(self, db_path: str, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.now = datetime.now()
+        self.next_user_id = 900000000
+
+        with sqlite3.connect(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id FROM users ORDER BY RANDOM() LIMIT 2000")
+            self.user_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute("""
+                SELECT id FROM time_slots
+                WHERE is_booked = 0 AND datetime > datetime('now', '+24 hours')
+                ORDER BY RANDOM() LIMIT 2000
+            """)
+            self.free_slot_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute("SELECT id FROM time_slots ORDER BY RANDOM() LIMIT 2000")
+            self.slot_ids = [row[0] for row in cursor.fetchall()]
+
+            cursor.execute("""
+                SELECT id, user_id FROM bookings
+                WHERE cancelled_at IS NULL ORDER BY RANDOM() LIMIT 2000
+            """)
+            self.active_bookings = cursor.fetchall()
+
+            cursor.execute("""
+                SELECT DISTINCT CAST(strftime('%Y', datetime) AS INTEGER),
+                                CAST(strftime('%m', datetime) AS INTEGER)
+                FROM time_slots
+            """)
+            self.months = cursor.fetchall() or [(self.now.year, self.now.month)]
+
+    def user_id(self):
+        return self.rng.choice(self.user_ids) if self.user_ids else 1
+
+    def new_user_id(self):
+        self.next_user_id += 1
+        return self.next_user_id
+
+    def slot_id(self):
+        return self.rng.choice(self.slot_ids) if self.slot_ids else 1
+
+    def take(self, pool):
+        """Взять элемент из пула без повторов (для методов, меняющих данные)"""
+        return pool.pop() if pool else None
+
+    def month(self):
+        return self.rng.choice(self.months)
+
+    def day(self):
+        year, month = self.month()
+        return year, month, self.rng.randint(1, 28)
+
+    def new_slug(self):
+        self.next_user_id += 1
+        return f"bench{self.next_user_id}"
+
+    def future_datetime(self):
+        return (self.now + timedelta(days=self.rng.randint(2, 60), minutes=self.rng.randint(0, 1440))).replace(
+            second=0, microsecond=0)
+
+
+def _booking_args(ctx):
+    booking = ctx.take(ctx.active_bookings)
+    return booking if booking else (0, 0)
+
+
+def _user_day_args(ctx):
+    return (ctx.user_id(),) + ctx.day()
+
+
+def _day_slots_args(ctx):
+    """Расписание дня пакетом: 10 часовых слотов с проверкой пересечений и лимита на день"""
+    day = ctx.day()
+    return [(datetime(*day, hour), "Бенчмарк") for hour in range(8, 18)], 1, 1, 60, 10
+
+
+# Фабрики аргументов: имя метода -> функция, возвращающая кортеж аргументов.
+# Публичный метод без фабрики попадает в отчет как "skipped", чтобы новые методы не терялись.
+CASES = {
+    'add_user': lambda ctx: (ctx.new_user_id(), "bench_user"),
+    'add_users': lambda ctx: ([(ctx.new_user_id(), f"bench_user_{i}") for i in range(200)],),
+    'free_user_bookings': lambda ctx: (ctx.user_id(),),
+    'remove_user': lambda ctx: (ctx.user_id(),),
+    'is_user_allowed': lambda ctx: (ctx.user_id(),),
+    'user_exists': lambda ctx: (ctx.user_id(),),
+    'get_all_users': lambda ctx: (),
+    'get_users_page': lambda ctx: (1, ctx.user_id()),
+    'search_users': lambda ctx: (f"user{ctx.rng.randint(1, 999)}",),
+    'search_slots': lambda ctx: (f"Занятие {ctx.rng.randint(0, 49)}",),
+    'add_slot': lambda ctx: (ctx.future_datetime(), "Бенчмарк"),
+    'add_slots': _day_slots_args,
+    'add_schedule_template': lambda ctx: ([0, 1, 2, 3, 4], ["08:00", "09:30", "11:00"], "Бенчмарк"),
+    'get_schedule_templates': lambda ctx: (),
+    'remove_schedule_template': lambda ctx: (ctx.rng.randint(1, 20),),
+    'generate_template_slots': lambda ctx: (ctx.now.date() + timedelta(days=1), ctx.now.date() + timedelta(days=28)),
+    'set_slot_capacity': lambda ctx: (ctx.slot_id(), ctx.rng.randint(1, 4)),
+    'remove_slot': lambda ctx: (ctx.slot_id(),),
+    'get_slot': lambda ctx: (ctx.slot_id(),),
+    'get_available_slots': lambda ctx: (),
+    'book_slot': lambda ctx: (ctx.take(ctx.free_slot_ids) or 0, ctx.user_id()),
+    'cancel_booking': _booking_args,
+    'get_user_bookings': lambda ctx: (ctx.user_id(),),
+    'get_all_bookings': lambda ctx: (),
+    'get_bookings_page': lambda ctx: (1, (datetime(*ctx.day()), 0, 0)),
+    'get_stats': lambda ctx: (),
+    'cache_version': lambda ctx: ('users', 'slots'),
+    'get_booking_analytics': lambda ctx: (),
+    'get_slots_by_month': lambda ctx: ctx.month(),
+    'delete_slot': lambda ctx: (ctx.slot_id(),),
+    'force_delete_slot': lambda ctx: (ctx.slot_id(),),
+    'get_bookings_by_slot': lambda ctx: (ctx.slot_id(),),
+    'get_user_bookings_by_month': lambda ctx: (ctx.user_id(),) + ctx.month(),
+    'get_user_bookings_by_day': _user_day_args,
+    'get_available_slots_by_month': lambda ctx: ctx.month(),
+    'get_available_slots_by_day': lambda ctx: ctx.day(),
+    'get_user_role': lambda ctx: (ctx.user_id(),),
+    'set_user_role': lambda ctx: (ctx.user_id(), 'user'),
+    'schema_version': lambda ctx: (),
+    'get_admins': lambda ctx: (),
+    'get_user_tenant': lambda ctx: (ctx.user_id(),),
+    'set_user_tenant': lambda ctx: (ctx.user_id(), 1),
+    'add_tenant': lambda ctx: ("Бенчмарк", ctx.new_slug()),
+    'ensure_tenant': lambda ctx: ("Бенчмарк", ctx.new_slug()),
+    'get_tenants': lambda ctx: (),
+    'get_tenant': lambda ctx: (1,),
+    'get_tenant_by_slug': lambda ctx: ("default",),
+    'get_tenant_by_group': lambda ctx: (0,),
+    'set_tenant_group': lambda ctx: (1, None),
+    'get_group_member': lambda ctx: (-100, ctx.user_id()),
+    'set_group_member': lambda ctx: (-100, ctx.user_id(), True),
+    'get_stale_group_members': lambda ctx: (-100, 1, 24 * 3600),
+    'sync_cache': lambda ctx: (True,),
+    'try_acquire_lease': lambda ctx: ("bench", "bench", 60),
+    'release_lease': lambda ctx: ("bench", "other"),
+    'get_setting': lambda ctx: ("bench",),
+    'set_setting': lambda ctx: ("bench", {'value': ctx.rng.random()}),
+    'get_user_state': lambda ctx: (ctx.user_id(), "pending_time"),
+    'set_user_state': lambda ctx: (ctx.user_id(), "pending_time", {'year': 2030, 'month': 1, 'day': 1}),
+    'clear_user_state': lambda ctx: (ctx.user_id(), "pending_time"),
+    'set_user_states': lambda ctx: ([(ctx.user_id(), "user_data", {'tenant_hint': 1}) for _ in range(20)],),
+    'purge_user_state': lambda ctx: (24 * 3600,),
+    'get_booking_events': lambda ctx: (ctx.slot_id(),),
+    'create_booking_snapshot': lambda ctx: (),
+    'rebuild_booking_state': lambda ctx: (),
+    'archive_old_data': lambda ctx: (ctx.now - timedelta(days=365 * 4),),
+    'iter_slots': lambda ctx: (),
+    'iter_bookings': lambda ctx: (),
+    'iter_users': lambda ctx: (),
+    'get_calendar_token': lambda ctx: (ctx.user_id(),),
+    'reset_calendar_token': lambda ctx: (ctx.user_id(),),
+    'get_user_by_calendar_token': lambda ctx: ("bench-" + str(ctx.rng.random()),),
+    'join_waitlist': lambda ctx: (ctx.slot_id(), ctx.user_id()),
+    'leave_waitlist': lambda ctx: (ctx.slot_id(), ctx.user_id()),
+    'get_user_waitlist': lambda ctx: (ctx.user_id(),),
+    'take_notifications': lambda ctx: (),
+    'ack_notifications': lambda ctx: ([ctx.rng.randint(1, 1000) for _ in range(20)],),
+}
+
+# Методы, которые читают всю таблицу: по умолчанию вызываются реже
+HEAVY_METHODS = {'get_all_users', 'get_available_slots', 'get_all_bookings', 'create_booking_snapshot',
+                 'rebuild_booking_state', 'archive_old_data', 'iter_slots', 'iter_bookings', 'iter_users',
+                 'get_booking_analytics'}
+
+# Методы, меняющие данные: выполняются последними, чтобы не влиять на замеры чтения
+WRITE_METHODS = {
+    'add_user', 'add_users', 'free_user_bookings', 'remove_user', 'add_slot', 'add_slots', 'set_slot_capacity',
+    'remove_slot', 'add_schedule_template', 'remove_schedule_template', 'generate_template_slots',
+    'book_slot', 'cancel_booking', 'delete_slot', 'force_delete_slot', 'set_user_role',
+    'set_user_tenant', 'add_tenant', 'ensure_tenant', 'set_tenant_group', 'set_group_member',
+    'try_acquire_lease', 'release_lease', 'set_setting', 'set_user_state', 'clear_user_state',
+    'set_user_states', 'purge_user_state',
+    'create_booking_snapshot', 'rebuild_booking_state', 'archive_old_data',
+    'get_calendar_token', 'reset_calendar_token',
+    'join_waitlist', 'leave_waitlist', 'take_notifications', 'ack_notifications',
+}
+
+# Служебные методы, которые не замеряются
+EXCLUDED_METHODS = {'init_database'}
+
+
+def public_methods(db) -> list:
+    """Список публичных методов объекта базы данных"""
+    return sorted(
+        name for name, member in inspect.getmembers(db, predicate=inspect.ismethod)
+        if not name.startswith('_') and name not in EXCLUDED_METHODS
+    )
+
+
+def _consume(result):
+    """Генераторы (выгрузка) замеряются вместе с чтением всех строк"""
+    if inspect.isgenerator(result):
+        for _ in result:
+            pass
+
+
+def _summary(samples: list) -> dict:
+    """Статистика по замерам в миллисекундах"""
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        'calls': len(ordered),
+        'min_ms': round(ordered[0], 4),
+        'median_ms': round(statistics.median(ordered), 4),
+        'mean_ms': round(statistics.fmean(ordered), 4),
+        'p95_ms': round(ordered[p95_index], 4),
+        'max_ms': round(ordered[-1], 4),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def run_benchmarks(db_path: str, repeat: int = 20, heavy_repeat: int = 3, only=None, seed: int = 1,
+                   backend: str = 'sqlite') -> dict:
+    """
+    Замерить все публичные методы хранилища на копии базы `db_path`.
+
+    Исходная база не изменяется, поэтому ее можно переиспользовать между коммитами.
+    При backend='memory' данные копии загружаются в MemoryDatabase.
+    """
+    workdir = tempfile.mkdtemp(prefix='schedule_bench_')
+    work_db = os.path.join(workdir, 'bench.db')
+    shutil.copyfile(db_path, work_db)
+
+    try:
+        if backend == 'memory':
+            db = MemoryDatabase.from_sqlite(work_db)
+        else:
+            db = Database(work_db)
+        ctx = BenchContext(work_db, seed=seed)
+
+        methods = public_methods(db)
+        if only:
+            methods = [name for name in methods if name in only]
+        methods.sort(key=lambda name: name in WRITE_METHODS)
+
+        results = {}
+        for name in methods:
+            factory = CASES.get(name)
+            if factory is None:
+                results[name] = {'skipped': 'нет фабрики аргументов'}
+                logger.warning(f"Метод {name} не замеряется: добавьте его в CASES")
+                continue
+
+            method = getattr(db, name)
+            calls = heavy_repeat if name in HEAVY_METHODS else repeat
+
+            if name not in WRITE_METHODS:
+                _consume(method(*factory(ctx)))  # прогрев кэша страниц
+
+            samples = []
+            for _ in range(calls):
+                args = factory(ctx)
+                started = time.perf_counter()
+                _consume(method(*args))
+                samples.append((time.perf_counter() - started) * 1000)
+
+            results[name] = _summary(samples)
+            logger.info(f"{name}: median {results[name]['median_ms']} мс")
+
+        meta = {
+            'commit': _git_commit(),
+            'backend': backend,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'db_size_bytes': os.path.getsize(db_path),
+            'repeat': repeat,
+            'heavy_repeat': heavy_repeat,
+        }
+        dataset_meta = db_path + '.json'
+        if os.path.exists(dataset_meta):
+            with open(dataset_meta, encoding='utf-8') as f:
+                meta['dataset'] = json.load(f)
+
+        return {'meta': meta, 'results': results}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 1.25, min_delta_ms: float = 0.05) -> list:
+    """
+    Сравнить два прогона по медиане.
+
+    Возвращает список регрессий: метод медленнее базового больше чем в `threshold` раз
+    и больше чем на `min_delta_ms` (чтобы не реагировать на шум на микросекундах).
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base or 'median_ms' not in base or 'median_ms' not in result:
+            continue
+        old, new = base['median_ms'], result['median_ms']
+        if new > old * threshold and new - old > min_delta_ms:
+            regressions.append({
+                'method': name,
+                'baseline_ms': old,
+                'current_ms': new,
+                'ratio': round(new / old, 2) if old else None,
+            })
+    return regressions
+
+
+def write_results(results: dict, path: str):
+    """Сохранить результаты в JSON (или вывести в stdout при path == '-')"""
+    text = json.dumps(results, ensure_ascii=False, indent=2, sort_keys=True)
+    if path == '-':
+        sys.stdout.write(text + '\n')
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
@@ -0,0 +1,87 @@
+"""
+Сравнение задержки вызова logger.info: синхронные обработчики против очереди
+"""
+
+import os
+import queue
+import logging
+import logging.handlers
+import tempfile
+import statistics
+import time
+
+from logging_setup import LazyQueueHandler, SamplingFilter
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def _file_handlers(directory: str) -> list:
+    """Консоль (перенаправленная в файл) и файл лога, как в LOGGING_CONFIG"""
+    console = logging.StreamHandler(open(os.path.join(directory, 'console.log'), 'w', encoding='utf-8'))
+    console.setFormatter(logging.Formatter(FORMAT))
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(directory, 'bot.log'), maxBytes=5 * 1024 * 1024, backupCount=3, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    return [console, file_handler]
+
+
+def _measure(logger: logging.Logger, calls: int, lazy: bool) -> list:
+    samples = []
+    user_id, group_id, status = 123456789, -1003114498461, 'member'
+    for _ in range(calls):
+        started = time.perf_counter()
+        if lazy:
+            logger.info("Пользователь %s найден в группе %s со статусом: %s",
+                        user_id, group_id, status, extra={'sampled': True})
+        else:
+            logger.info(f"Пользователь {user_id} найден в группе {group_id} со статусом: {status}")
+        samples.append((time.perf_counter() - started) * 1e6)
+    return samples
+
+
+def _summary(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        'calls': len(ordered),
+        'median_us': round(statistics.median(ordered), 2),
+        'mean_us': round(statistics.fmean(ordered), 2),
+        'p99_us': round(ordered[int(0.99 * (len(ordered) - 1))], 2),
+        'max_us': round(ordered[-1], 2),
+    }
+
+
+def run_logging_benchmark(calls: int = 20000, sample_every: int = 10) -> dict:
+    """Задержка logger.info в вызывающем потоке до и после перехода на очередь (в микросекундах)"""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='schedule_log_bench_') as directory:
+        # До: обработчики пишут на диск прямо в вызывающем потоке, сообщения — f-строки
+        logger = logging.getLogger('bench.sync')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handlers = _file_handlers(directory)
+        for handler in handlers:
+            logger.addHandler(handler)
+        results['sync_fstring'] = _summary(_measure(logger, calls, lazy=False))
+        for handler in handlers:
+            logger.removeHandler(handler)
+            handler.close()
+
+        # После: очередь + поток-слушатель, ленивое форматирование и прореживание
+        for name, every in (('queue_lazy', 1), ('queue_lazy_sampled', sample_every)):
+            logger = logging.getLogger(f'bench.{name}')
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handlers = _file_handlers(directory)
+            log_queue = queue.SimpleQueue()
+            queue_handler = LazyQueueHandler(log_queue)
+            queue_handler.addFilter(SamplingFilter(every))
+            logger.addHandler(queue_handler)
+            listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+            listener.start()
+            results[name] = _summary(_measure(logger, calls, lazy=True))
+            listener.stop()
+            logger.removeHandler(queue_handler)
+            for handler in handlers:
+                handler.close()
+
+    return {'results': results, 'calls': calls, 'sample_every': sample_every}
@@ -0,0 +1,224 @@
+"""
+Нагрузочный прогон нескольких процессов на общей базе SQLite (режим WORKERS > 1).
+
+Каждый процесс выполняет смесь чтений и записей через Database с инвалидацией кэша между
+процессами и борется за аренду лидера. После прогона проверяются инварианты: нет двойных
+записей на слот, состояние слотов совпадает с историей записей и с журналом событий, аренду
+лидера в каждый момент держал не более чем один процесс, кэш каждого процесса видит последнюю
+запись других.
+"""
+
+import os
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import tempfile
+import statistics
+import multiprocessing
+from datetime import datetime
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Доли операций в нагрузке
+OPERATIONS = {
+    'book_slot': 25,
+    'cancel_booking': 15,
+    'get_slots_by_month': 30,
+    'get_user_role': 20,
+    'set_user_role': 10,
+}
+
+
+def _worker(index, db_path, duration, cache_sync_interval, lease_ttl, slot_ids, user_ids, probe_user, months,
+            barrier, queue):
+    """Нагрузка одного процесса; результат отправляется в очередь"""
+    logging.disable(logging.CRITICAL)
+    db = Database(db_path, cache_sync_interval=cache_sync_interval)
+    rng = random.Random(index)
+    holder = f"worker-{index}"
+    names, weights = zip(*OPERATIONS.items())
+    latencies = {name: [] for name in names}
+    lease_intervals = []
+    my_bookings = []
+    conflicts = 0
+
+    barrier.wait()
+    deadline = time.time() + duration
+    next_lease = 0.0
+    while time.time() < deadline:
+        if time.time() >= next_lease:
+            before = time.time()
+            if db.try_acquire_lease('leader', holder, lease_ttl):
+                # Внутренний интервал: начало — после ответа базы, конец — от времени до запроса
+                lease_intervals.append((time.time(), before + lease_ttl))
+            next_lease = before + lease_ttl / 3
+
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        if name == 'book_slot':
+            user_id = rng.choice(user_ids)
+            slot_id = rng.choice(slot_ids)
+            if db.book_slot(slot_id, user_id):
+                my_bookings.append(user_id)
+            else:
+                conflicts += 1
+        elif name == 'cancel_booking':
+            if my_bookings:
+                user_id = my_bookings.pop(rng.randrange(len(my_bookings)))
+                bookings = db.get_user_bookings(user_id)
+                if bookings:
+                    db.cancel_booking(bookings[0]['id'], user_id)
+        elif name == 'get_slots_by_month':
+            db.get_slots_by_month(*rng.choice(months))
+        elif name == 'get_user_role':
+            db.get_user_role(probe_user if rng.random() < 0.5 else rng.choice(user_ids))
+        else:
+            db.set_user_role(probe_user, rng.choice(['user', 'admin']))
+        latencies[name].append((time.perf_counter() - started) * 1000)
+
+    # Все процессы закончили нагрузку и держат роль пробного пользователя в кэше. Процесс 0 меняет ее;
+    # через интервал сверки кэш каждого процесса должен видеть новое значение
+    barrier.wait()
+    db.get_user_role(probe_user)
+    barrier.wait()
+    if index == 0:
+        db.set_user_role(probe_user, 'checked')
+    barrier.wait()
+    time.sleep((cache_sync_interval or 0) + 0.05)
+    final_role = db.get_user_role(probe_user)
+
+    queue.put({
+        'index': index,
+        'latencies': latencies,
+        'lease_intervals': lease_intervals,
+        'conflicts': conflicts,
+        'final_role': final_role,
+    })
+
+
+def _summary(samples: list) -> dict:
+    if not samples:
+        return {'calls': 0}
+    ordered = sorted(samples)
+    return {
+        'calls': len(ordered),
+        'median_ms': round(statistics.median(ordered), 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+def _lease_overlaps(results: list) -> int:
+    """Количество пар пересекающихся интервалов аренды разных процессов"""
+    intervals = sorted(
+        (start, end, result['index'])
+        for result in results for start, end in result['lease_intervals'] if end > start
+    )
+    overlaps = 0
+    for i, (start, end, owner) in enumerate(intervals):
+        for other_start, other_end, other_owner in intervals[i + 1:]:
+            if other_start >= end:
+                break
+            if other_owner != owner:
+                overlaps += 1
+    return overlaps
+
+
+def _check_bookings(db_path: str, slot_ids: list) -> dict:
+    """Записи сверх числа мест и расхождения счетчиков time_slots с историей записей среди слотов нагрузки"""
+    placeholders = ','.join('?' * len(slot_ids))
+    with sqlite3.connect(db_path) as conn:
+        double = conn.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT b.slot_id FROM bookings b JOIN time_slots ts ON ts.id = b.slot_id
+                WHERE b.cancelled_at IS NULL AND b.slot_id IN ({placeholders})
+                GROUP BY b.slot_id HAVING COUNT(*) > MAX(ts.capacity)
+            )
+        """, slot_ids).fetchone()[0]
+        mismatched = conn.execute(f"""
+            SELECT COUNT(*) FROM time_slots ts
+            WHERE ts.id IN ({placeholders})
+            AND (ts.seats_taken != (SELECT COUNT(*) FROM bookings b WHERE b.slot_id = ts.id AND b.cancelled_at IS NULL)
+                 OR ts.is_booked != (ts.seats_taken >= ts.capacity))
+        """, slot_ids).fetchone()[0]
+    return {'double_bookings': double, 'state_mismatches': mismatched}
+
+
+def run_scaleout_benchmark(db_path: str, workers=(1, 2, 4), duration: float = 5.0,
+                           cache_sync_interval: float = 0.2, lease_ttl: float = 0.5, pool_size: int = 300) -> dict:
+    """
+    Прогнать нагрузку для каждого числа процессов из `workers` на копии базы `db_path`.
+
+    pool_size — число свободных будущих слотов, за которые соревнуются процессы (чем меньше, тем больше конфликтов).
+    """
+    context = multiprocessing.get_context('spawn')
+    runs = {}
+    violations = []
+    for count in workers:
+        workdir = tempfile.mkdtemp(prefix='schedule_scaleout_')
+        work_db = os.path.join(workdir, 'scaleout.db')
+        shutil.copyfile(db_path, work_db)
+        try:
+            # Миграция схемы и включение WAL до запуска процессов
+            Database(work_db)
+            with sqlite3.connect(work_db) as conn:
+                slot_ids = [row[0] for row in conn.execute("""
+                    SELECT id FROM time_slots
+                    WHERE is_booked = 0 AND datetime > datetime('now', '+24 hours')
+                    ORDER BY id LIMIT ?
+                """, (pool_size,))]
+                user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id LIMIT 500")]
+                now = datetime.now()
+                months = [(now.year, now.month), (now.year + (now.month == 12), now.month % 12 + 1)]
+            probe_user = user_ids[0]
+
+            barrier = context.Barrier(count)
+            queue = context.Queue()
+            processes = [
+                context.Process(target=_worker, args=(index, work_db, duration, cache_sync_interval, lease_ttl,
+                                                      slot_ids, user_ids, probe_user, months, barrier, queue))
+                for index in range(count)
+            ]
+            for process in processes:
+                process.start()
+            results = [queue.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            truth = 'checked'
+            latencies = {}
+            for result in results:
+                for name, samples in result['latencies'].items():
+                    latencies.setdefault(name, []).extend(samples)
+            total_ops = sum(len(samples) for samples in latencies.values())
+
+            run = {
+                'workers': count,
+                'ops_per_second': round(total_ops / duration, 1),
+                'operations': {name: _summary(samples) for name, samples in latencies.items()},
+                'booking_conflicts': sum(result['conflicts'] for result in results),
+                'lease_overlaps': _lease_overlaps(results),
+                'stale_cache_reads': sum(1 for result in results if result['final_role'] != truth),
+                **_check_bookings(work_db, slot_ids),
+                # Состояние, восстановленное из журнала записей, должно совпасть с таблицами
+                'log_mismatches': sum(
+                    value for key, value in Database(work_db).rebuild_booking_state().items()
+                    if key != 'events_replayed'
+                ),
+            }
+            runs[str(count)] = run
+            logger.info(f"{count} процесс(ов): {run['ops_per_second']} оп/с, конфликтов записи "
+                        f"{run['booking_conflicts']}")
+            for check in ('lease_overlaps', 'stale_cache_reads', 'double_bookings', 'state_mismatches',
+                          'log_mismatches'):
+                if run[check]:
+                    violations.append(f"{count} процесс(ов): {check} = {run[check]}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {'runs': runs, 'violations': violations, 'duration_s': duration,
+            'cache_sync_interval_s': cache_sync_interval, 'lease_ttl_s': lease_ttl}
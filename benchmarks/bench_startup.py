@@ -0,0 +1,92 @@
+"""
+Проверка времени холодного старта: каждый этап замеряется в отдельном процессе Python
+"""
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Код, выполняемый в дочернем процессе. Печатает JSON с длительностью этапа в миллисекундах.
+_PROBES = {
+    # Импорт без python-telegram-bot: все, что бот загружает помимо библиотеки
+    'import_local_modules': """
+import time
+started = time.perf_counter()
+import database, storage, cache, sql_profiler, logging_setup, startup
+elapsed = (time.perf_counter() - started) * 1000
+""",
+    'import_main': """
+import time
+started = time.perf_counter()
+try:
+    import main
+    elapsed = (time.perf_counter() - started) * 1000
+except ImportError:
+    elapsed = None
+""",
+    'database_init_new': """
+import time, os
+from database import Database
+path = os.path.join(os.getcwd(), 'startup_new.db')
+started = time.perf_counter()
+Database(path)
+elapsed = (time.perf_counter() - started) * 1000
+""",
+    'database_init_existing': """
+import time, os
+from database import Database
+path = os.path.join(os.getcwd(), 'startup_existing.db')
+Database(path)
+started = time.perf_counter()
+Database(path)
+elapsed = (time.perf_counter() - started) * 1000
+""",
+}
+
+# Бюджеты по умолчанию (мс). Превышение — регрессия времени запуска.
+DEFAULT_BUDGETS = {
+    'import_local_modules': 150,
+    'import_main': 3000,
+    'database_init_new': 300,
+    'database_init_existing': 20,
+}
+
+
+def _run_probe(code: str, workdir: str, runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        script = code + "\nimport json, sys\nsys.stdout.write(json.dumps(elapsed))\n"
+        env = dict(os.environ, PYTHONPATH=PROJECT_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=workdir, env=env,
+                                         stderr=subprocess.DEVNULL)
+        value = json.loads(output)
+        if value is None:
+            return []
+        samples.append(value)
+        for name in os.listdir(workdir):
+            if name.startswith('startup_new'):
+                os.remove(os.path.join(workdir, name))
+    return samples
+
+
+def run_startup_benchmark(runs: int = 5, budgets: dict = None) -> dict:
+    """Медиана каждого этапа и список превышенных бюджетов"""
+    budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+    results = {}
+    violations = []
+    with tempfile.TemporaryDirectory(prefix='schedule_startup_') as workdir:
+        for name, code in _PROBES.items():
+            samples = sorted(_run_probe(code, workdir, runs))
+            if not samples:
+                results[name] = {'skipped': 'модуль недоступен'}
+                continue
+            median = samples[len(samples) // 2]
+            results[name] = {'median_ms': round(median, 2), 'max_ms': round(samples[-1], 2),
+                             'budget_ms': budgets[name]}
+            if median > budgets[name]:
+                violations.append(name)
+    return {'results': results, 'violations': violations, 'runs': runs}
@@ -0,0 +1,453 @@
+"""
+Проверка совместимости реализаций хранилища: один сценарий выполняется на каждой реализации,
+результаты сравниваются с эталоном (SQLite)
+"""
+
+import os
+import shutil
+import inspect
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+from database import Database
+from memory_database import MemoryDatabase
+from storage import Storage, storage_methods
+
+logger = logging.getLogger(__name__)
+
+
+def _page_key(booking: dict) -> tuple:
+    """Курсор страницы записей по записи на ее границе"""
+    return booking['datetime'], booking['slot_id'], booking['id']
+
+
+def _scenario(now: datetime) -> list:
+    """
+    Шаги сценария: (метод, аргументы). Время слотов задается относительно `now`.
+
+    Вместо аргументов можно передать функцию, которая получит хранилище и вернет их.
+    """
+    def at(days, hour=10):
+        return (now + timedelta(days=days)).replace(hour=hour, minute=0, second=0, microsecond=0)
+
+    future, soon, past = at(5), now + timedelta(hours=2), at(-40)
+    steps = [
+        ('schema_version', ()),
+        ('add_tenant', ("Север", "north", -100)),
+        ('add_tenant', ("Дубль", "north", None)),
+        ('add_tenant', ("Дубль группы", "dup", -100)),
+        ('ensure_tenant', ("Юг", "south")),
+        ('ensure_tenant', ("Юг", "south", -200)),
+        ('set_tenant_group', (3, -100)),
+        ('get_tenants', ()),
+        ('get_tenant_by_slug', ("south",)),
+        ('get_tenant_by_group', (-200,)),
+        ('get_tenant', (99,)),
+        ('add_user', (1, "anna")),
+        ('add_user', (2, "boris")),
+        ('add_user', (3, "vera", 2)),
+        ('add_user', (1, "anna")),
+        ('add_user', (1, "anna_new", 2)),
+        # Пачка: новые, переименование своего, пользователь другого арендатора не меняется
+        ('add_users', ([(20, "gleb"), (1, "anna_bulk"), (3, "vera_bulk"), (21, "dina"), (20, "gleb")],)),
+        ('add_users', ([(21, "dina")], 2)),
+        ('add_users', ([],)),
+        ('get_user_tenant', (21,)),
+        # Членство в группах: неизвестное — None, сверка берет неизвестных и давно не проверенных
+        ('get_group_member', (-100, 1)),
+        ('set_group_member', (-100, 1, True)),
+        ('set_group_member', (-100, 2, False)),
+        ('set_group_member', (-100, 2, True)),
+        ('get_group_member', (-100, 1)),
+        ('get_group_member', (-100, 2)),
+        ('get_group_member', (-200, 1)),
+        ('get_stale_group_members', (-100, 1, 3600)),
+        ('get_stale_group_members', (-100, 1, 3600, 1)),
+        ('user_exists', (1,)),
+        ('user_exists', (42,)),
+        ('is_user_allowed', (2,)),
+        ('get_user_tenant', (1,)),
+        ('get_user_tenant', (3,)),
+        ('set_user_role', (2, 'admin')),
+        ('set_user_role', (7, 'admin', 2)),
+        ('get_user_role', (2,)),
+        ('get_user_role', (42,)),
+        ('get_admins', ()),
+        ('get_admins', (2,)),
+        ('set_user_tenant', (2, 2)),
+        ('set_user_tenant', (42, 2)),
+        ('set_user_tenant', (2, 1)),
+        ('add_slot', (future, "Вождение")),
+        ('add_slot', (at(5, 8), "Утро")),
+        ('add_slot', (at(5, 12), "Утро, второй слот")),
+        ('add_slot', (soon, "Скоро")),
+        ('add_slot', (past, "Прошлое")),
+        ('add_slot', (at(6), "Север", 2)),
+        ('add_slot', (at(35), "Следующий месяц")),
+        ('get_slot', (1,)),
+        ('get_slot', (99,)),
+        ('book_slot', (1, 1)),
+        ('book_slot', (1, 2)),
+        ('book_slot', (99, 1)),
+        ('book_slot', (4, 2)),
+        ('book_slot', (5, 2)),
+        ('book_slot', (6, 3)),
+        ('get_available_slots', ()),
+        ('get_available_slots', (2,)),
+        ('get_user_bookings', (1,)),
+        ('get_user_bookings', (2,)),
+        ('get_all_bookings', ()),
+        ('get_all_bookings', (2,)),
+        ('get_stats', ()),
+        ('get_stats', (2,)),
+        ('get_booking_analytics', (2,)),
+        ('get_slots_by_month', (future.year, future.month)),
+        ('get_slots_by_month', (past.year, past.month)),
+        ('get_slots_by_month', (at(6).year, at(6).month, 2)),
+        ('get_available_slots_by_month', (future.year, future.month)),
+        ('get_available_slots_by_day', (future.year, future.month, future.day)),
+        ('get_available_slots_by_day', (at(6).year, at(6).month, at(6).day, 2)),
+        ('get_user_bookings_by_month', (1, future.year, future.month)),
+        ('get_user_bookings_by_day', (2, past.year, past.month, past.day)),
+        ('get_bookings_by_slot', (1,)),
+        ('get_bookings_by_slot', (2,)),
+        ('cancel_booking', (1, 2)),
+        ('cancel_booking', (1, 1)),
+        ('cancel_booking', (1, 1)),
+        ('get_slots_by_month', (future.year, future.month)),
+        ('delete_slot', (4,)),
+        ('delete_slot', (2,)),
+        ('delete_slot', (99,)),
+        ('force_delete_slot', (4,)),
+        ('force_delete_slot', (99,)),
+        ('remove_slot', (3,)),
+        ('remove_slot', (99,)),
+        ('book_slot', (7, 2)),
+        ('free_user_bookings', (2,)),
+        ('get_user_bookings', (2,)),
+        ('get_stats', ()),
+        ('book_slot', (7, 3)),
+        ('remove_user', (3,)),
+        ('remove_user', (42,)),
+        ('get_all_bookings', ()),
+        ('get_all_users', ()),
+        ('get_all_users', (2,)),
+        ('add_slot', (at(7), "После удалений")),
+        ('get_slots_by_month', (at(7).year, at(7).month)),
+        # free_user_bookings отменяет запись; повторная отмена не должна освободить слот, занятый другим
+        ('book_slot', (1, 1)),
+        ('free_user_bookings', (1,)),
+        ('book_slot', (1, 2)),
+        ('get_user_bookings', (1,)),
+        ('cancel_booking', (7, 1)),
+        ('get_slot', (1,)),
+        ('try_acquire_lease', ("leader", "w1", 60)),
+        ('try_acquire_lease', ("leader", "w2", 60)),
+        ('try_acquire_lease', ("leader", "w1", 60)),
+        ('release_lease', ("leader", "w2")),
+        ('release_lease', ("leader", "w1")),
+        ('try_acquire_lease', ("leader", "w2", 60)),
+        ('try_acquire_lease', ("expired", "w1", -1)),
+        ('try_acquire_lease', ("expired", "w2", 60)),
+        ('get_setting', ("sql_profile",)),
+        ('get_setting', ("sql_profile", {'enabled': False})),
+        ('set_setting', ("sql_profile", {'enabled': True, 'threshold_ms': 25.0})),
+        ('get_setting', ("sql_profile",)),
+        ('get_user_state', (1, "pending_time")),
+        ('set_user_state', (1, "pending_time", {'year': 2030, 'month': 1, 'day': 2})),
+        ('get_user_state', (1, "pending_time")),
+        ('clear_user_state', (1, "pending_time")),
+        ('clear_user_state', (1, "pending_time")),
+        ('get_user_state', (1, "pending_time", {})),
+        ('set_user_states', ([(1, "user_data", {'tenant_hint': 2}), (2, "user_data", {}), (3, "find_query", "an")],)),
+        ('get_user_state', (1, "user_data")),
+        ('get_user_state', (1, "user_data", None, 3600)),
+        ('set_user_states', ([(1, "user_data", None), (4, "user_data", None)],)),
+        ('get_user_state', (1, "user_data")),
+        ('purge_user_state', (3600,)),
+        ('get_user_state', (2, "user_data")),
+        ('get_booking_events', ()),
+        ('get_booking_events', (1,)),
+        ('get_booking_events', (None, 2)),
+        ('get_booking_events', (None, None, 3, 2)),
+        ('create_booking_snapshot', ()),
+        ('create_booking_snapshot', ()),
+        ('book_slot', (8, 1)),
+        ('cancel_booking', (9, 1)),
+        ('book_slot', (8, 2)),
+        ('rebuild_booking_state', ()),
+        ('create_booking_snapshot', ()),
+        ('rebuild_booking_state', ()),
+        ('get_all_bookings', ()),
+        ('get_stats', ()),
+        # Архив: прошедшие слоты с записями уходят из рабочих данных, но видны в выборках за прошлые даты
+        ('add_slot', (at(-20), "Архивный")),
+        ('book_slot', (9, 1)),
+        ('add_slot', (at(-20, 12), "Архивный свободный")),
+        ('archive_old_data', (at(-10), 1)),
+        ('archive_old_data', (at(-10),)),
+        ('get_setting', ("archive_cutoff",)),
+        ('get_slot', (9,)),
+        ('get_bookings_by_slot', (9,)),
+        ('get_slots_by_month', (at(-20).year, at(-20).month)),
+        ('get_user_bookings_by_month', (1, at(-20).year, at(-20).month)),
+        ('get_user_bookings_by_day', (1, at(-20).year, at(-20).month, at(-20).day)),
+        ('get_all_bookings', ()),
+        ('get_stats', ()),
+        ('get_booking_analytics', ()),
+        ('rebuild_booking_state', ()),
+        ('archive_old_data', (now + timedelta(minutes=1),)),
+        ('get_booking_events', (None, None, 20)),
+        ('add_slot', (at(8), "После архива")),
+        ('book_slot', (11, 2)),
+        ('get_user_bookings', (2,)),
+        ('iter_slots', ()),
+        ('iter_slots', (1, at(-30), at(6))),
+        ('iter_slots', (2,)),
+        ('iter_bookings', ()),
+        ('iter_bookings', (1, at(-25), at(-15))),
+        ('iter_users', ()),
+        ('iter_users', (2,)),
+        # Токены календаря случайные: сравнивается только наличие, поиск идет по токену этой же реализации
+        ('get_calendar_token', (1,)),
+        ('get_calendar_token', (42,)),
+        ('get_user_by_calendar_token', lambda storage: (storage.get_calendar_token(1),)),
+        ('get_user_by_calendar_token', ("unknown",)),
+        ('reset_calendar_token', (1,)),
+        ('reset_calendar_token', (42,)),
+        ('get_user_by_calendar_token', lambda storage: (storage.get_calendar_token(1),)),
+        ('add_user', (5, "dasha")),
+        ('get_calendar_token', (5,)),
+        ('remove_user', (5,)),
+        ('get_calendar_token', (5,)),
+        # Лист ожидания: освободившийся слот (11, занят пользователем 2) получает первый в очереди
+        ('add_user', (8, "egor")),
+        ('add_user', (9, "zhenya")),
+        ('join_waitlist', (11, 2)),
+        ('join_waitlist', (11, 1)),
+        ('join_waitlist', (11, 8)),
+        ('join_waitlist', (11, 1)),
+        ('add_slot', (at(9), "Свободный")),
+        ('join_waitlist', (12, 1)),
+        ('join_waitlist', (99, 1)),
+        ('add_slot', (now + timedelta(hours=3), "Меньше суток")),
+        ('book_slot', (13, 2)),
+        ('join_waitlist', (13, 1)),
+        ('get_user_waitlist', (1,)),
+        ('get_user_waitlist', (8,)),
+        ('leave_waitlist', (11, 8)),
+        ('leave_waitlist', (11, 8)),
+        ('join_waitlist', (11, 8)),
+        ('take_notifications', ()),
+        ('cancel_booking', lambda storage: (next(booking['id'] for booking in storage.get_user_bookings(2)
+                                                 if booking['description'] == "После архива"), 2)),
+        ('get_slot', (11,)),
+        ('get_user_waitlist', (1,)),
+        ('get_user_waitlist', (8,)),
+        ('take_notifications', ()),
+        ('free_user_bookings', (1,)),
+        ('get_slot', (11,)),
+        ('join_waitlist', (11, 9)),
+        ('force_delete_slot', (11,)),
+        ('take_notifications', (1,)),
+        ('take_notifications', ()),
+        ('get_user_waitlist', (9,)),
+        # Забранные уведомления выдаются снова после задержки, пока их не подтвердит ack_notifications;
+        # после max_attempts попыток удаляются
+        ('take_notifications', ()),
+        ('take_notifications', (100, -1)),
+        ('ack_notifications', ([1, 2, 99],)),
+        ('take_notifications', (100, -1, 2)),
+        ('take_notifications', (100, -1)),
+        ('rebuild_booking_state', ()),
+        # Групповой слот (14): места занимаются счетчиком, у пользователя не больше одного места
+        ('add_slot', (at(10), "Теория", 1, 3)),
+        ('book_slot', (14, 1)),
+        ('book_slot', (14, 1)),
+        ('get_available_slots_by_day', (at(10).year, at(10).month, at(10).day)),
+        ('book_slot', (14, 2)),
+        ('book_slot', (14, 8)),
+        ('book_slot', (14, 9)),
+        ('get_slot', (14,)),
+        ('get_bookings_by_slot', (14,)),
+        ('get_slots_by_month', (at(10).year, at(10).month)),
+        ('join_waitlist', (14, 1)),
+        ('join_waitlist', (14, 9)),
+        ('set_slot_capacity', (14, 2)),
+        ('set_slot_capacity', (14, 0)),
+        ('set_slot_capacity', (99, 2)),
+        ('set_slot_capacity', (14, 4)),
+        ('get_slot', (14,)),
+        ('take_notifications', ()),
+        ('cancel_booking', lambda storage: (next(booking['id'] for booking in storage.get_user_bookings(2)
+                                                 if booking['description'] == "Теория"), 2)),
+        ('get_slot', (14,)),
+        ('get_stats', ()),
+        ('get_booking_analytics', ()),
+        ('set_slot_capacity', (14, 3)),
+        ('set_slot_capacity', (14, 1)),
+        ('add_slot', (at(11), "Одно место")),
+        ('book_slot', (15, 8)),
+        ('set_slot_capacity', (15, 2)),
+        ('get_slot', (15,)),
+        ('set_slot_capacity', (15, 1)),
+        ('get_slot', (15,)),
+        ('get_bookings_by_slot', (15,)),
+        ('rebuild_booking_state', ()),
+        ('iter_slots', (1, at(10), at(12))),
+        # Постраничные списки: курсор — ключ последней (первой) строки соседней страницы
+        ('get_users_page', (1, None, None, 2)),
+        ('get_users_page', lambda storage: (1, storage.get_users_page(1, None, None, 2)['users'][-1][0], None, 2)),
+        ('get_users_page', (1, None, 9, 2)),
+        ('get_users_page', (1, None, 1, 2)),
+        ('get_users_page', (2,)),
+        ('get_bookings_page', (1, None, None, 2)),
+        ('get_bookings_page', lambda storage: (1, _page_key(storage.get_bookings_page(1, None, None, 2)['bookings'][-1]),
+                                               None, 2)),
+        ('get_bookings_page', lambda storage: (1, None, _page_key(storage.get_bookings_page(1, None, None, 100)
+                                                                  ['bookings'][-1]), 2)),
+        ('get_bookings_page', (1, None, None, 100)),
+        ('get_bookings_page', (2,)),
+        # Поиск: префиксы слов username и описаний, поиск по ID, страницы
+        ('search_users', ("an",)),
+        ('search_users', ("@Boris",)),
+        ('search_users', ("new",)),
+        ('search_users', ("9",)),
+        ('search_users', ("e", 1, 0, 1)),
+        ('search_users', ("e", 1, 1, 1)),
+        ('search_users', ("user", 2)),
+        ('search_users', ("!!",)),
+        ('search_users', ("zz",)),
+        ('search_slots', ("тео",)),
+        ('search_slots', ("УТРО слот",)),
+        ('search_slots', ("о", 1, 0, 2)),
+        ('search_slots', ("о", 1, 2, 2)),
+        ('search_slots', ("прошлое",)),
+        ('search_slots', ("север", 2)),
+        ('add_user', (10, "anna_k")),
+        ('search_users', ("anna",)),
+        ('remove_slot', (15,)),
+        ('search_slots', ("место",)),
+        # Пересечения слотов: интервалы [начало, начало + длительность), пакет проверяется и сам с собой
+        ('add_slot', (future + timedelta(minutes=30), "Пересекается с первым")),
+        ('add_slot', (future + timedelta(minutes=60), "Сразу после первого")),
+        ('add_slots', ([(future - timedelta(minutes=90), "Длинный")], 1, 1, 120)),
+        ('add_slot', (at(5, 9), "Дубль у другого арендатора", 2)),
+        ('add_slots', ([(at(12, 9), "Первый"), (at(12, 9) + timedelta(minutes=30), "Внутри пакета"),
+                        (at(12, 10), "Встык"), (at(12, 8), "Раньше"), (at(12, 9), "Тот же час")],)),
+        ('add_slots', ([(at(12, 14), "Четвертый в дне"), (at(12, 16), "Пятый в дне"), (at(13, 9), "Другой день")],
+                       1, 1, 60, 4)),
+        ('add_slots', ([(at(13, 12), "Нулевой")], 1, 1, 0)),
+        ('add_slots', ([],)),
+        ('get_slots_by_month', (at(12).year, at(12).month)),
+        ('get_slot', (17,)),
+        # Шаблоны расписания: слоты создаются один раз на каждый день горизонта
+        ('add_schedule_template', ([0, 2, 4, 2], ["18:00", "9:00"], "По шаблону")),
+        ('add_schedule_template', ([5], ["10:00"], "Выходной", 2, 2, 90)),
+        ('add_schedule_template', ([0], ["09:30"], "Пересекается с шаблоном")),
+        ('add_schedule_template', ([], ["09:00"], "Без дней")),
+        ('add_schedule_template', ([1], ["25:00"], "Неверное время")),
+        ('get_schedule_templates', ()),
+        ('get_schedule_templates', (2,)),
+        ('generate_template_slots', (at(40).date(), at(53).date(), 10)),
+        ('generate_template_slots', (at(40).date(), at(53).date(), 10)),
+        ('generate_template_slots', (at(40).date(), at(54).date(), 1)),
+        ('iter_slots', (1, at(40, 0), at(55, 0))),
+        ('iter_slots', (2, at(40, 0), at(55, 0))),
+        ('remove_schedule_template', (1,)),
+        ('remove_schedule_template', (1,)),
+        ('get_schedule_templates', ()),
+        # Поиск среди многих совпадений: арендатор, точное совпадение и время проверяются до ограничения выдачи
+        ('add_users', ([(100000 + i, f"ivan{i}") for i in range(1200)],)),
+        ('add_user', (106000, "ivan")),
+        ('add_user', (106001, "ivan", 2)),
+        ('search_users', ("ivan",)),
+        ('search_users', ("ivan", 2)),
+        ('search_users', ("@ivan", 1, 10, 5)),
+        ('add_slots', ([(at(60 + i // 12, 8 + i % 12), "Массовое занятие") for i in range(1200)],)),
+        ('search_slots', ("массовое",)),
+        ('search_slots', ("массовое", 1, 1190, 20)),
+    ]
+    return steps
+
+
+# Методы со случайным результатом: сравнивается только наличие значения
+RANDOM_RESULTS = {'get_calendar_token', 'reset_calendar_token'}
+
+# Поля результатов, которые зависят от момента выполнения и не сравниваются
+VOLATILE_FIELDS = {
+    'get_booking_events': {'created_at'},
+    'iter_bookings': {'created_at', 'cancelled_at'},
+    'iter_users': {'created_at'},
+}
+
+
+def _normalize(value):
+    """Привести результат к сравнимому виду (кортежи и списки не различаются)"""
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+def _run(storage, steps) -> list:
+    results = []
+    for name, args in steps:
+        try:
+            if callable(args):
+                args = args(storage)
+            result = getattr(storage, name)(*args)
+            if name in RANDOM_RESULTS:
+                result = result is not None
+            if inspect.isgenerator(result):
+                result = list(result)
+            if name in VOLATILE_FIELDS:
+                result = [{key: item for key, item in row.items() if key not in VOLATILE_FIELDS[name]}
+                          for row in result]
+            results.append(_normalize(result))
+        except Exception as e:
+            results.append(f"исключение {type(e).__name__}")
+    return results
+
+
+def check_conformance(factories: dict = None) -> dict:
+    """
+    Выполнить сценарий на каждой реализации и сравнить с SQLite.
+
+    `factories` — имя -> функция без аргументов, создающая пустое хранилище.
+    Возвращает {'steps': ..., 'failures': [...]}; пустой список failures — реализации совместимы.
+    """
+    workdir = tempfile.mkdtemp(prefix='schedule_conformance_')
+    try:
+        factories = factories or {'memory': MemoryDatabase}
+        reference = Database(os.path.join(workdir, 'reference.db'))
+        failures = []
+
+        # Интерфейс должен покрывать все публичные методы Database
+        public = {name for name in dir(Database) if not name.startswith('_')}
+        missing_in_protocol = sorted(public - set(storage_methods()))
+        if missing_in_protocol:
+            failures.append({'backend': 'Storage', 'error': f"нет в интерфейсе: {', '.join(missing_in_protocol)}"})
+
+        now = datetime.now()
+        steps = _scenario(now)
+        expected = _run(reference, steps)
+
+        for backend, factory in factories.items():
+            storage = factory()
+            if not isinstance(storage, Storage):
+                missing = [name for name in storage_methods() if not hasattr(storage, name)]
+                failures.append({'backend': backend, 'error': f"нет методов: {', '.join(missing)}"})
+                continue
+            actual = _run(storage, steps)
+            for (name, args), want, got in zip(steps, expected, actual):
+                if want != got:
+                    failures.append({'backend': backend, 'method': name, 'args': repr(args),
+                                     'expected': repr(want), 'actual': repr(got)})
+        return {'steps': len(steps), 'backends': sorted(factories), 'failures': failures}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,125 @@
+"""
+Генератор синтетической базы данных для бенчмарков
+"""
+
+import os
+import random
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+
+from database import Database, BOOKING_LEAD, SLOT_DEFAULT_MINUTES, backfill_booking_events
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки для executemany
+BATCH_SIZE = 50000
+
+USER_ID_BASE = 100000000
+
+
+def _batched(rows, size=BATCH_SIZE):
+    """Разбить поток строк на пачки"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_dataset(db_path: str, users: int = 10000, slots: int = 1000000, years: int = 5,
+                     future_days: int = 90, booking_rate: float = 0.6, cancel_rate: float = 0.1,
+                     admins: int = 3, seed: int = 42) -> dict:
+    """
+    Создать синтетическую базу данных.
+
+    Слоты равномерно распределяются на `years` лет истории плюс `future_days` дней вперед.
+    Доля `booking_rate` слотов занята, для доли `cancel_rate` слотов в истории есть
+    отмененная запись. Возвращает параметры набора данных (для метаданных результатов).
+    """
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+    rng = random.Random(seed)
+
+    # Схема создается штатным кодом, чтобы бенчмарк проверял реальные таблицы
+    Database(db_path)
+
+    now = datetime.now().replace(second=0, microsecond=0)
+    start = now - timedelta(days=365 * years)
+    end = now + timedelta(days=future_days)
+    step = max((end - start).total_seconds() / max(slots, 1), 60)
+
+    user_ids = [USER_ID_BASE + i for i in range(users)]
+
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        # Генерация не требует надежности записи. Режим журнала остается WAL (его включает схема):
+        # переключение требует монопольного доступа к базе
+        cursor.execute("PRAGMA synchronous = OFF")
+
+        cursor.executemany(
+            "INSERT INTO users (user_id, username, role) VALUES (?, ?, ?)",
+            ((user_id, f"user{i}", 'admin' if i < admins else 'user') for i, user_id in enumerate(user_ids))
+        )
+
+        booked_total = 0
+        cancelled_total = 0
+        slot_id = 0
+
+        def slot_rows():
+            nonlocal booked_total, slot_id
+            for i in range(slots):
+                slot_id += 1
+                slot_datetime = start + timedelta(seconds=int(i * step) // 60 * 60)
+                booked_by = rng.choice(user_ids) if users and rng.random() < booking_rate else None
+                if booked_by is not None:
+                    booked_total += 1
+                yield (slot_id, slot_datetime.isoformat(' '), f"Занятие {i % 50}",
+                       1 if booked_by else 0, booked_by, 1 if booked_by else 0,
+                       (slot_datetime + timedelta(minutes=SLOT_DEFAULT_MINUTES)).isoformat(' '),
+                       (slot_datetime - BOOKING_LEAD).isoformat(' '))
+
+        for batch in _batched(slot_rows()):
+            cursor.executemany("""
+                INSERT INTO time_slots (id, datetime, description, is_booked, booked_by, seats_taken, end_datetime,
+                                        bookable_until)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+
+            booking_rows = []
+            for row in batch:
+                if users and rng.random() < cancel_rate:
+                    booking_rows.append((row[0], rng.choice(user_ids), row[1], row[1]))
+                    cancelled_total += 1
+                if row[4] is not None:
+                    booking_rows.append((row[0], row[4], row[1], None))
+            cursor.executemany("""
+                INSERT INTO bookings (slot_id, user_id, created_at, cancelled_at)
+                VALUES (?, ?, ?, ?)
+            """, booking_rows)
+
+        # Журнал записей строится по сгенерированной истории, как при миграции существующей базы
+        backfill_booking_events(cursor)
+        conn.commit()
+        cursor.execute("ANALYZE")
+
+    logger.info(f"Сгенерирована база {db_path}: {users} пользователей, {slots} слотов, "
+                f"{booked_total} записей, {cancelled_total} отмен")
+
+    return {
+        'users': users,
+        'slots': slots,
+        'years': years,
+        'future_days': future_days,
+        'booking_rate': booking_rate,
+        'cancel_rate': cancel_rate,
+        'seed': seed,
+        'booked': booked_total,
+        'cancelled': cancelled_total,
+        'generated_at': now.isoformat(),
+    }
@@ -0,0 +1,88 @@
+"""
+Кэш результатов запросов с инвалидацией по пространствам имен
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class QueryCache:
+    """
+    LRU-кэш с TTL. Ключ — (пространство имен, аргументы).
+
+    Запись в базу сбрасывает целое пространство имен через bump(): у каждого пространства
+    есть номер версии, и записи со старой версией считаются отсутствующими.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (namespace, key) -> (версия, истекает, значение)
+        self._versions = {}
+        self._remote_versions = {}  # последние версии из общего хранилища (см. apply_versions)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def get(self, namespace: str, key, default=None):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is not None:
+                version, expires, value = entry
+                if version == self._versions.get(namespace, 0) and expires > time.monotonic():
+                    self._entries.move_to_end((namespace, key))
+                    self.hits += 1
+                    return value
+                del self._entries[(namespace, key)]
+            self.misses += 1
+            return default
+
+    def set(self, namespace: str, key, value, ttl: float = None):
+        with self._lock:
+            expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries[(namespace, key)] = (self._versions.get(namespace, 0), expires, value)
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, namespace: str, key, loader, ttl: float = None):
+        """Вернуть значение из кэша или вызвать loader() и запомнить результат"""
+        value = self.get(namespace, key, _MISSING)
+        if value is not _MISSING:
+            return value
+        version = self.version(namespace)
+        value = loader()
+        # Если во время загрузки была запись, результат мог устареть — не кэшируем
+        if self.version(namespace) == version:
+            self.set(namespace, key, value, ttl)
+        return value
+
+    def bump(self, *namespaces: str):
+        """Инвалидировать пространства имен"""
+        with self._lock:
+            for namespace in namespaces:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def apply_versions(self, remote_versions: dict):
+        """
+        Учесть версии пространств имен из общего хранилища (например, таблицы в базе).
+
+        Пространство сбрасывается, если его внешняя версия изменилась с прошлой сверки, —
+        так записи других процессов инвалидируют локальный кэш.
+        """
+        with self._lock:
+            for namespace, version in remote_versions.items():
+                if self._remote_versions.get(namespace) != version:
+                    if namespace in self._remote_versions:
+                        self._versions[namespace] = self._versions.get(namespace, 0) + 1
+                    self._remote_versions[namespace] = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
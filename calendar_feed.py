@@ -0,0 +1,93 @@
+"""
+Лента iCalendar с записями пользователя для подписки в календарных приложениях
+
+Адрес ленты — /calendar/<токен>.ics, токен выдает команда /calendar. Готовая лента хранится
+в памяти, пока не изменятся будущие записи пользователя; при изменении заново формируются только
+события новых или измененных записей. ETag вычисляется по самим записям, поэтому совпадает во всех
+процессах, и приложение, повторяющее запрос с If-None-Match, получает пустой ответ 304.
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from web import Request, Response, etag_matches
+from exporter import ical_event, ical_header, ICAL_FOOTER
+from config import CALENDAR_CACHE_USERS, CALENDAR_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+FEED_PREFIX = "/calendar/"
+
+
+def feed_path(token: str) -> str:
+    """Путь ленты пользователя на HTTP-сервере"""
+    return f"{FEED_PREFIX}{token}.ics"
+
+
+class CalendarFeed:
+    """Формирование и кэширование лент .ics; обработчик маршрута для WebServer"""
+
+    def __init__(self, storage, max_users: int = CALENDAR_CACHE_USERS):
+        self.storage = storage
+        self.max_users = max_users
+        # user_id -> (записи, ETag, тело, {booking_id: ((время, описание), VEVENT)})
+        self._feeds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, user_id: int) -> Tuple[str, bytes]:
+        """ETag и тело ленты пользователя. Читает базу — вызывается вне цикла событий"""
+        bookings = self.storage.get_user_bookings(user_id)
+        signature = tuple((booking['id'], booking['datetime'], booking['description']) for booking in bookings)
+
+        with self._lock:
+            cached = self._feeds.get(user_id)
+            if cached is not None and cached[0] == signature:
+                self._feeds.move_to_end(user_id)
+                return cached[1], cached[2]
+            previous = cached[3] if cached is not None else {}
+
+        # События неизмененных записей берутся из прошлой ленты
+        events = {}
+        for booking in bookings:
+            key = (booking['datetime'], booking['description'])
+            event = previous.get(booking['id'])
+            if event is None or event[0] != key:
+                event = (key, ical_event(f"booking-{booking['id']}@schedule_bot", booking['datetime'],
+                                         booking['description'], status='CONFIRMED'))
+            events[booking['id']] = event
+
+        body = (ical_header("Мои занятия") + ''.join(text for _, text in events.values()) + ICAL_FOOTER).encode('utf-8')
+        etag = '"' + hashlib.sha1(repr((user_id, signature)).encode('utf-8')).hexdigest()[:20] + '"'
+
+        with self._lock:
+            self._feeds[user_id] = (signature, etag, body, events)
+            self._feeds.move_to_end(user_id)
+            while len(self._feeds) > self.max_users:
+                self._feeds.popitem(last=False)
+        return etag, body
+
+    def _lookup(self, token: str) -> Optional[Tuple[str, bytes]]:
+        user_id = self.storage.get_user_by_calendar_token(token)
+        if user_id is None:
+            return None
+        return self.render(user_id)
+
+    async def handle(self, request: Request) -> Response:
+        """GET /calendar/<токен>.ics"""
+        name = request.path[len(FEED_PREFIX):]
+        if not name.endswith('.ics'):
+            return Response(404, b"Not Found")
+
+        feed = await asyncio.to_thread(self._lookup, name[:-len('.ics')])
+        if feed is None:
+            return Response(404, b"Not Found")
+
+        etag, body = feed
+        headers = {"ETag": etag, "Cache-Control": f"private, max-age={CALENDAR_MAX_AGE}"}
+        if etag_matches(request.headers.get('if-none-match', ''), etag):
+            return Response(304, headers=headers)
+        return Response(200, body, "text/calendar; charset=utf-8", headers=headers)
@@ -0,0 +1,45 @@
+"""
+Текущее время расписания
+
+Время слотов хранится без часового пояса — как местное время расписания (config.SCHEDULE_TIMEZONE),
+в котором администратор его вводит. Правила записи сравнивают его с "сейчас" в том же поясе,
+вычисленным в Python: datetime('now') в SQLite — это UTC, и сравнение с местным временем слотов
+сдвигало границу 24 часов на разницу поясов.
+
+Для выборок доступных слотов "сейчас" округляется вниз до bucket_seconds: в пределах интервала
+результат один и тот же, поэтому кэшируется с ключом по интервалу и общий для всех пользователей.
+Граница записи при этом может запаздывать не больше чем на bucket_seconds.
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+# Отсчет интервалов округления (полночь: при делителе суток интервалы начинаются с ровных минут и часов)
+_EPOCH = datetime(2000, 1, 1)
+
+
+class ScheduleClock:
+    """Текущее время в поясе расписания без tzinfo, точное и округленное до интервала"""
+
+    def __init__(self, timezone: Optional[str] = None, bucket_seconds: int = 60):
+        # None — пояс системы (datetime.now())
+        self.timezone = ZoneInfo(timezone) if timezone else None
+        self.bucket_seconds = bucket_seconds
+
+    def now(self) -> datetime:
+        """Точное текущее время расписания"""
+        if self.timezone is None:
+            return datetime.now()
+        return datetime.now(self.timezone).replace(tzinfo=None)
+
+    def utc_offset(self) -> timedelta:
+        """Текущее смещение пояса расписания от UTC (отметки CURRENT_TIMESTAMP в базе — в UTC)"""
+        if self.timezone is None:
+            return datetime.now().astimezone().utcoffset()
+        return datetime.now(self.timezone).utcoffset()
+
+    def bucket(self) -> datetime:
+        """Текущее время, округленное вниз до bucket_seconds (ключ кэша выборок доступности)"""
+        now = self.now()
+        return now - (now - _EPOCH) % timedelta(seconds=self.bucket_seconds)
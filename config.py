@@ -13,9 +13,18 @@ ADMIN_IDS = [
 # ID группы, из которой разрешено добавлять пользователей (опционально)
 ALLOWED_GROUP_ID = -1003114498461
 
+# Дополнительные арендаторы (автошколы, инструкторы) со своими расписаниями.
+# Основной арендатор "default" создается всегда и использует ALLOWED_GROUP_ID.
+# Пример: {"name": "Автошкола Север", "slug": "north", "group_id": -1001234567890}
+TENANTS = []
+
 # Настройки базы данных
 DATABASE_PATH = "schedule_bot.db"
 
+# Хранилище: "sqlite" (база DATABASE_PATH) или "memory" (данные в памяти, теряются при перезапуске;
+# для нагрузочных прогонов и отладки)
+STORAGE_BACKEND = "sqlite"
+
 # Настройки уведомлений
 ENABLE_NOTIFICATIONS = True
 NOTIFICATION_TIME_BEFORE = 60  # Минуты до начала занятия
@@ -23,6 +32,105 @@ NOTIFICATION_TIME_BEFORE = 60  # Минуты до начала занятия
 # Настройки расписания
 DEFAULT_SLOT_DURATION = 60  # Длительность слота в минутах
 MAX_SLOTS_PER_DAY = 10  # Максимальное количество слотов в день
+MAX_SLOT_CAPACITY = 30  # Максимум мест в одном слоте (групповое занятие)
+
+# Часовой пояс расписания: время слотов вводится и хранится как местное время этого пояса,
+# правила записи (за 24 часа) считаются от "сейчас" в нем же. None — пояс сервера
+SCHEDULE_TIMEZONE = "Europe/Moscow"
+# Выборки доступных слотов считаются от "сейчас", округленного до стольких секунд,
+# и кэшируются на этот интервал (граница записи может запаздывать на столько же)
+AVAILABILITY_BUCKET_SECONDS = 60
+
+# Шаблоны расписания (/add_template): слоты по ним создаются заранее на SLOT_GENERATION_HORIZON_DAYS дней.
+# Процесс-лидер раз в SLOT_GENERATION_INTERVAL секунд дополняет горизонт новыми днями (одной транзакцией)
+SLOT_GENERATION_HORIZON_DAYS = 28
+SLOT_GENERATION_INTERVAL = 24 * 3600
+
+# Постраничные списки в панели администратора: страница читается от курсора в кнопке "Далее"/"Назад"
+USERS_PAGE_SIZE = 10
+BOOKINGS_PAGE_SIZE = 15
+FIND_PAGE_SIZE = 8  # Пользователей и слотов на странице результатов /find
+
+# Повторная правка сообщения тем же содержимым (навигация по календарю, обновление дня) не
+# отправляется в Telegram. Отпечатки последних правок хранятся в памяти процесса для стольких сообщений
+EDIT_CACHE_MESSAGES = 10000
+
+# Состояние диалогов (ввод времени слота, context.user_data): хранится в базе, переживает перезапуск
+# и доступно всем процессам. Брошенный диалог удаляется через CONVERSATION_STATE_TTL секунд
+CONVERSATION_STATE_TTL = 24 * 3600
+CONVERSATION_CACHE_ENTRIES = 10000  # Состояний в LRU процесса (только при WORKERS = 1)
+CONVERSATION_MEMORY_USERS = 5000  # Пользователей, чьи user_data держит в памяти приложение
+CONVERSATION_FLUSH_INTERVAL = 10  # Период пакетного сохранения user_data (с)
+CONVERSATION_PURGE_INTERVAL = 3600  # Период удаления брошенных состояний (с); выполняет лидер
+
+# Настройки метрик (Prometheus)
+METRICS_ENABLED = False  # При False обертки не устанавливаются и метрики ничего не стоят
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Профилирование SQL (переключается командой /sql_profile)
+SQL_PROFILE_ENABLED = False
+SQL_SLOW_QUERY_MS = 50  # Порог медленного запроса в миллисекундах
+SQL_PROFILE_TOP_N = 15  # Размер сводки по запросам
+
+# Масштабирование: несколько процессов-обработчиков за вебхуком с общей базой SQLite (режим WAL).
+# При WORKERS > 1 нужен WEBHOOK_URL: long polling допускает только один процесс.
+WORKERS = 1
+WEBHOOK_URL = ""  # Публичный адрес, например "https://bot.example.com/telegram"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443  # Процесс с номером N слушает WEBHOOK_PORT + N (балансировщик распределяет запросы)
+WEBHOOK_SECRET = ""  # Секрет заголовка X-Telegram-Bot-Api-Secret-Token (рекомендуется)
+CACHE_SYNC_INTERVAL = 1.0  # Максимальная задержка (с) инвалидации кэша после записи другим процессом
+LEADER_LEASE_SECONDS = 60  # Срок аренды лидера; периодические задачи выполняет только лидер
+# Членство в группах берется из обновлений chat_member (бот должен быть администратором группы).
+# Сверка с Telegram — страховка от пропущенных обновлений: раз в GROUP_CHECK_INTERVAL секунд проверяются
+# не больше GROUP_RECONCILE_BATCH пользователей, чье членство не подтверждалось GROUP_RECONCILE_AGE секунд
+GROUP_CHECK_INTERVAL = 300
+GROUP_RECONCILE_AGE = 24 * 3600
+GROUP_RECONCILE_BATCH = 20
+BOOKING_SNAPSHOT_INTERVAL = 3600  # Период снимков журнала записей (с); восстановление читает снимок и хвост журнала
+
+# Архив: слоты старше ARCHIVE_RETENTION_DAYS дней (с записями) и давно отмененные записи переносятся
+# в архивные таблицы, рабочие таблицы остаются небольшими. Календари за прошлые месяцы читают и архив.
+ARCHIVE_RETENTION_DAYS = 180  # 0 — не архивировать
+ARCHIVE_INTERVAL = 24 * 3600  # Период переноса (с); выполняет процесс-лидер
+ARCHIVE_BATCH_SIZE = 500  # Строк в одной транзакции переноса
+
+# Выгрузка /export: строки читаются курсором и пишутся во временный файл, который остается в памяти
+# до EXPORT_SPOOL_MAX_BYTES и затем переносится на диск
+EXPORT_SPOOL_MAX_BYTES = 4 * 1024 * 1024
+EXPORT_PROGRESS_EVERY = 5000  # Строк между обновлениями сообщения о ходе выгрузки
+
+# Импорт /import_users: файл CSV или текст с ID и username в каждой строке
+IMPORT_MAX_BYTES = 1024 * 1024
+IMPORT_MAX_USERS = 5000  # Пользователей в одном файле
+IMPORT_CHECK_CONCURRENCY = 8  # Одновременных запросов getChatMember при проверке членства в группе
+
+# Уведомления пользователям (например, о записи из листа ожидания): изменения записей кладут их
+# в очередь в базе, любой процесс забирает и отправляет с соблюдением лимитов Bot API
+NOTIFY_RATE_PER_SECOND = 25  # Сообщений в секунду от процесса (лимит Telegram — около 30)
+NOTIFY_PER_CHAT_INTERVAL = 1.0  # Минимальный интервал между сообщениями в один чат (с)
+NOTIFY_POLL_INTERVAL = 5  # Период проверки очереди (с); изменения в этом же процессе отправляются сразу
+NOTIFY_RETRY_DELAY = 300  # Неотправленное уведомление (ошибка или остановка процесса) повторяется через столько секунд
+NOTIFY_MAX_ATTEMPTS = 5  # После стольких неудачных попыток уведомление удаляется из очереди
+
+# Подписка на календарь (/calendar): лента .ics с записями пользователя по секретной ссылке.
+# Календарные приложения опрашивают ее условными GET-запросами (If-None-Match) вместо вопросов боту.
+CALENDAR_FEED_ENABLED = False
+CALENDAR_HOST = "0.0.0.0"
+CALENDAR_PORT = 8090  # Процесс с номером N слушает CALENDAR_PORT + N
+CALENDAR_PUBLIC_URL = ""  # Внешний адрес сервера, например "https://bot.example.com"
+CALENDAR_CACHE_USERS = 1000  # Сколько готовых лент хранится в памяти процесса
+CALENDAR_MAX_AGE = 900  # Cache-Control: max-age (с) — подсказка приложениям, как часто опрашивать
+
+# Панель администратора только для чтения: статистика, расписание на сегодня, записи и пользователи
+# в HTML и JSON. Слушает локальный адрес; снаружи открывать только через прокси с авторизацией.
+DASHBOARD_ENABLED = False
+DASHBOARD_HOST = "127.0.0.1"
+DASHBOARD_PORT = 8095  # Процесс с номером N слушает DASHBOARD_PORT + N
+DASHBOARD_TOKEN = ""  # Если задан, запрос должен передать его: ?token=... или Authorization: Bearer ...
+DASHBOARD_PAGE_SIZE = 50  # Строк на странице записей и пользователей
+DASHBOARD_CACHE_ENTRIES = 256  # Сколько готовых ответов хранится в памяти процесса
 
 # Текстовые сообщения
 MESSAGES = {
@@ -78,6 +186,10 @@ MESSAGES = {
 }
 
 # Настройки логирования
+# Обработчики из LOGGING_CONFIG работают в отдельном потоке (см. logging_setup.py)
+LOG_JSON = False  # Писать файл лога в формате JSON Lines
+LOG_SAMPLE_EVERY = 10  # Из частых сообщений на каждый запрос в лог попадает одно из N
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -94,11 +206,14 @@ LOGGING_CONFIG = {
             "stream": "ext://sys.stdout",
         },
         "file": {
-            "class": "logging.FileHandler",
+            "class": "logging.handlers.RotatingFileHandler",
             "level": "DEBUG",
             "formatter": "default",
             "filename": "bot.log",
             "mode": "a",
+            "maxBytes": 5 * 1024 * 1024,
+            "backupCount": 3,
+            "encoding": "utf-8",
         },
     },
     "root": {
@@ -0,0 +1,241 @@
+"""
+Состояние диалогов пользователей: таблица user_state в базе и LRU в памяти процесса
+
+ConversationStore — запись сразу в базу (следующее сообщение может обработать другой процесс
+или процесс после перезапуска) и чтение через ограниченный LRU. Кэшируется и отсутствие состояния:
+handle_message проверяет ввод времени на каждое сообщение. При нескольких процессах чтение идет
+из базы, иначе кэш мог бы вернуть состояние, уже измененное другим процессом.
+
+StatePersistence подключает хранилище к python-telegram-bot вместо хранения context.user_data
+только в памяти: данные пользователя загружаются при первом обновлении от него, изменения
+сохраняются пачкой раз в update_interval, а данные давно не писавших пользователей выгружаются
+из памяти приложения (в базе они остаются).
+"""
+
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import (CONVERSATION_STATE_TTL, CONVERSATION_CACHE_ENTRIES, CONVERSATION_MEMORY_USERS,
+                    CONVERSATION_FLUSH_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+# Ключ user_state, под которым хранится context.user_data
+USER_DATA_KEY = 'user_data'
+
+_ABSENT = object()
+
+
+class ConversationStore:
+    """Состояния диалогов (user_id, ключ) -> значение JSON; брошенные истекают через ttl секунд"""
+
+    def __init__(self, storage, ttl: float = CONVERSATION_STATE_TTL, max_entries: int = CONVERSATION_CACHE_ENTRIES,
+                 cache: bool = True):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = cache
+        self._entries = OrderedDict()  # (user_id, ключ) -> (значение или _ABSENT, истекает по monotonic)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, user_id: int, key: str, value):
+        if not self.cache:
+            return
+        with self._lock:
+            self._entries[(user_id, key)] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id: int, key: str, default=None):
+        """Состояние пользователя или default. Значение не изменяйте на месте — сохраняйте через set()"""
+        if self.cache:
+            with self._lock:
+                entry = self._entries.get((user_id, key))
+                if entry is not None and entry[1] > time.monotonic():
+                    self._entries.move_to_end((user_id, key))
+                    self.hits += 1
+                    return default if entry[0] is _ABSENT else entry[0]
+            self.misses += 1
+
+        value = self.storage.get_user_state(user_id, key, _ABSENT, max_age=self.ttl)
+        self._remember(user_id, key, value)
+        return default if value is _ABSENT else value
+
+    def set(self, user_id: int, key: str, value) -> bool:
+        """Сохранить состояние (в базу сразу, затем в кэш)"""
+        if not self.storage.set_user_state(user_id, key, value):
+            self._forget(user_id, key)
+            return False
+        self._remember(user_id, key, value)
+        return True
+
+    def clear(self, user_id: int, key: str) -> bool:
+        """Удалить состояние. Возвращает True, если оно было"""
+        if self.cache:
+            with self._lock:
+                entry = self._entries.get((user_id, key))
+            if entry is not None and entry[0] is _ABSENT and entry[1] > time.monotonic():
+                # Состояния нет — запрос к базе не нужен (кнопки меню очищают ввод на каждое нажатие)
+                return False
+        cleared = self.storage.clear_user_state(user_id, key)
+        self._remember(user_id, key, _ABSENT)
+        return cleared
+
+    def set_many(self, items: List[Tuple[int, str, object]]) -> bool:
+        """Сохранить несколько состояний одной транзакцией (None удаляет состояние)"""
+        if not items:
+            return True
+        if not self.storage.set_user_states(items):
+            for user_id, key, _ in items:
+                self._forget(user_id, key)
+            return False
+        for user_id, key, value in items:
+            self._remember(user_id, key, _ABSENT if value is None else value)
+        return True
+
+    def _forget(self, user_id: int, key: str):
+        with self._lock:
+            self._entries.pop((user_id, key), None)
+
+    def purge_expired(self) -> int:
+        """Удалить из базы состояния, не менявшиеся дольше ttl"""
+        return self.storage.purge_user_state(self.ttl)
+
+
+class StatePersistence(BasePersistence):
+    """
+    Хранение context.user_data в ConversationStore.
+
+    Данные чатов, бота и callback_data не сохраняются: бот их не использует.
+    """
+
+    def __init__(self, store: Optional[ConversationStore] = None, update_interval: float = CONVERSATION_FLUSH_INTERVAL,
+                 max_users: int = CONVERSATION_MEMORY_USERS):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True,
+                                                     callback_data=False),
+                         update_interval=update_interval)
+        self.store = store  # задается после создания хранилища (приложение строится раньше базы)
+        self.application = None  # для выгрузки данных из памяти; задается после Application.build()
+        self.max_users = max_users
+        self._saved: Dict[int, str] = {}  # user_id -> JSON последних сохраненных (загруженных) данных
+        self._recent = OrderedDict()  # пользователи с данными в памяти приложения, по давности обновлений
+        self._pending: Dict[int, Optional[dict]] = {}
+        self._evicted = set()
+        self._flush_task = None
+
+    @staticmethod
+    def _snapshot(data: dict) -> str:
+        return json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        # Данные загружаются по одному пользователю в refresh_user_data, а не все при старте
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        """Перед обработкой обновления: подгрузить данные пользователя из базы"""
+        self._recent[user_id] = None
+        self._recent.move_to_end(user_id)
+        self._evicted.discard(user_id)
+        # При нескольких процессах данные могли измениться в другом процессе — читаем каждый раз
+        if (user_id in self._saved and self.store.cache) or user_id in self._pending:
+            return
+        stored = await asyncio.to_thread(self.store.get, user_id, USER_DATA_KEY, {})
+        user_data.clear()
+        user_data.update(stored)
+        self._saved[user_id] = self._snapshot(user_data)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        """Вызывается раз в update_interval для данных в памяти; изменившиеся сохраняются пачкой"""
+        snapshot = self._snapshot(data)
+        if self._saved.get(user_id, self._snapshot({})) == snapshot:
+            return
+        self._pending[user_id] = dict(data) if data else None
+        self._saved[user_id] = snapshot
+        # Приложение вызывает update_user_data для всех пользователей сразу (asyncio.gather):
+        # сохранение запускается после них и пишет все изменения одной транзакцией
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def drop_user_data(self, user_id: int):
+        if user_id in self._evicted:
+            # Выгружен из памяти этим классом — данные в базе нужны
+            self._evicted.discard(user_id)
+            return
+        self._pending.pop(user_id, None)
+        self._saved.pop(user_id, None)
+        self._recent.pop(user_id, None)
+        await asyncio.to_thread(self.store.clear, user_id, USER_DATA_KEY)
+
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        pending, self._pending = self._pending, {}
+        if pending:
+            items = [(user_id, USER_DATA_KEY, data) for user_id, data in pending.items()]
+            if not await asyncio.to_thread(self.store.set_many, items):
+                # Не сохранилось — повторим при следующем обновлении
+                for user_id in pending:
+                    self._saved.pop(user_id, None)
+            logger.debug(f"Сохранены данные пользователей: {len(items)}")
+        self._evict()
+
+    def _evict(self):
+        """Выгрузить из памяти приложения данные пользователей сверх max_users (давно не писавших)"""
+        if self.application is None:
+            return
+        while len(self._recent) > self.max_users:
+            user_id, _ = self._recent.popitem(last=False)
+            if user_id in self._pending or user_id not in self._saved:
+                continue
+            self._saved.pop(user_id, None)
+            self._evicted.add(user_id)
+            self.application.drop_user_data(user_id)
+
+    async def flush(self):
+        """При остановке приложения: дописать несохраненные изменения"""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
+
+    # Остальные данные не сохраняются
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
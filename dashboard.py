@@ -0,0 +1,222 @@
+"""
+Панель администратора только для чтения (DASHBOARD_ENABLED)
+
+Страницы /dashboard/<вид> в HTML и /dashboard/<вид>.json в JSON: today — статистика и расписание
+на сегодня, bookings и users — постраничные списки (курсор в параметрах after и before), analytics —
+отчет /analytics. Параметр tenant выбирает арендатора.
+
+Данные читаются теми же методами хранилища, что и у бота: статистика и аналитика берутся из кэша,
+списки — страницами по индексу. Готовый ответ хранится, пока не изменились версии пространств кэша,
+от которых он зависит (Storage.cache_version): обновление страницы без изменений в базе не читает
+таблиц, а запрос с If-None-Match получает пустой ответ 304.
+"""
+
+import html
+import json
+import asyncio
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, Tuple
+from urllib.parse import urlencode
+
+from web import Request, Response, etag_matches
+from analytics import occupancy_report
+from database import DEFAULT_TENANT_ID
+from config import DASHBOARD_TOKEN, DASHBOARD_PAGE_SIZE, DASHBOARD_CACHE_ENTRIES
+
+DASHBOARD_PREFIX = "/dashboard/"
+
+# Вид -> (заголовок, пространства имен кэша, от которых зависят данные)
+VIEWS = {
+    'today': ("Сегодня", ('users', 'slots')),
+    'bookings': ("Записи", ('users', 'slots')),
+    'users': ("Пользователи", ('users',)),
+    'analytics': ("Аналитика", ('slots',)),
+}
+
+_STYLE = ("body{font-family:sans-serif;margin:2em}table{border-collapse:collapse}"
+          "td,th{border:1px solid #ccc;padding:.3em .6em;text-align:left}nav a{margin-right:1em}")
+
+
+def booking_cursor(booking: Dict) -> str:
+    """Курсор страницы записей для адреса: время слота, ID слота и ID записи (как в кнопках бота)"""
+    return f"{booking['datetime'].strftime('%Y%m%d%H%M%S')}_{booking['slot_id']}_{booking['id']}"
+
+
+def parse_booking_cursor(cursor: str) -> Tuple[datetime, int, int]:
+    """Курсор из адреса -> (время слота, ID слота, ID записи); ValueError при неверном формате"""
+    moment, slot_id, booking_id = cursor.split("_")
+    return datetime.strptime(moment, '%Y%m%d%H%M%S'), int(slot_id), int(booking_id)
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def _table(headers, rows) -> str:
+    head = "".join(f"<th>{html.escape(str(header))}</th>" for header in headers)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + "</tr>" for row in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+class Dashboard:
+    """Формирование и кэширование страниц панели; обработчик маршрута для WebServer"""
+
+    def __init__(self, storage, clock, token: str = DASHBOARD_TOKEN, page_size: int = DASHBOARD_PAGE_SIZE,
+                 max_entries: int = DASHBOARD_CACHE_ENTRIES):
+        self.storage = storage
+        self.clock = clock
+        self.token = token
+        self.page_size = page_size
+        self.max_entries = max_entries
+        # (вид, формат, арендатор, after, before, интервал часов) -> (версии кэша, ETag, тело)
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _link(self, view: str, tenant_id: int, fmt: str = 'html', **params) -> str:
+        query = {'tenant': tenant_id, **{name: value for name, value in params.items() if value is not None}}
+        if self.token:
+            query['token'] = self.token
+        suffix = '.json' if fmt == 'json' else ''
+        return html.escape(f"{DASHBOARD_PREFIX}{view}{suffix}?{urlencode(query)}")
+
+    # Данные страниц: читают базу, вызываются вне цикла событий
+    def _today(self, tenant_id: int, after, before) -> Dict:
+        start = datetime.combine(self.clock.now().date(), datetime.min.time())
+        return {
+            'date': start.date(),
+            'stats': self.storage.get_stats(tenant_id),
+            'slots': list(self.storage.iter_slots(tenant_id, start, start + timedelta(days=1))),
+        }
+
+    def _bookings(self, tenant_id: int, after, before) -> Dict:
+        page = self.storage.get_bookings_page(tenant_id, after, before, self.page_size)
+        bookings = page['bookings']
+        return {
+            **page,
+            'prev': booking_cursor(bookings[0]) if bookings and page['has_prev'] else None,
+            'next': booking_cursor(bookings[-1]) if bookings and page['has_next'] else None,
+        }
+
+    def _users(self, tenant_id: int, after, before) -> Dict:
+        page = self.storage.get_users_page(tenant_id, after, before, self.page_size)
+        users = page['users']
+        return {
+            'users': [{'user_id': user_id, 'username': username} for user_id, username in users],
+            'has_prev': page['has_prev'],
+            'has_next': page['has_next'],
+            'prev': users[0][0] if users and page['has_prev'] else None,
+            'next': users[-1][0] if users and page['has_next'] else None,
+        }
+
+    def _analytics(self, tenant_id: int, after, before) -> Dict:
+        analytics = self.storage.get_booking_analytics(tenant_id)
+        return {**analytics, 'report': occupancy_report(analytics)}
+
+    # Оформление HTML
+    def _html(self, view: str, tenant_id: int, data: Dict) -> str:
+        if view == 'today':
+            stats = data['stats']
+            content = _table(["Показатель", "Значение"], [
+                ("Пользователей", stats['total_users']),
+                ("Будущих слотов", stats['total_slots']),
+                ("Свободных слотов", stats['available_slots']),
+                ("Активных записей", stats['total_bookings']),
+                ("Заполненность", f"{stats['occupancy_rate']:.1f}%"),
+            ])
+            content += f"<h2>Расписание на {data['date'].strftime('%d.%m.%Y')}</h2>"
+            content += _table(["Время", "Занятие", "Мест занято", "Записан"], [
+                (slot['datetime'].strftime('%H:%M'), slot['description'],
+                 f"{slot['seats_taken']} из {slot['capacity']}", slot['username'] or "")
+                for slot in data['slots']
+            ]) if data['slots'] else "<p>Слотов нет.</p>"
+        elif view == 'bookings':
+            content = _table(["Время", "Занятие", "Пользователь", "ID"], [
+                (booking['datetime'].strftime('%d.%m.%Y %H:%M'), booking['description'], booking['username'],
+                 booking['user_id'])
+                for booking in data['bookings']
+            ]) if data['bookings'] else "<p>Активных записей нет.</p>"
+        elif view == 'users':
+            content = _table(["ID", "Username"], [(user['user_id'], user['username']) for user in data['users']])
+        else:
+            content = f"<pre>{html.escape(data['report'])}</pre>"
+
+        pages = []
+        if data.get('prev') is not None:
+            pages.append(f'<a href="{self._link(view, tenant_id, before=data["prev"])}">⬅️ Назад</a>')
+        if data.get('next') is not None:
+            pages.append(f'<a href="{self._link(view, tenant_id, after=data["next"])}">Далее ➡️</a>')
+        nav = "".join(f'<a href="{self._link(name, tenant_id)}">{title}</a>' for name, (title, _) in VIEWS.items())
+        nav += f'<a href="{self._link(view, tenant_id, "json")}">JSON</a>'
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{VIEWS[view][0]}</title>'
+                f'<style>{_STYLE}</style></head><body><nav>{nav}</nav><h1>{VIEWS[view][0]}</h1>{content}'
+                f'<p>{" ".join(pages)}</p></body></html>')
+
+    def render(self, view: str, fmt: str, tenant_id: int, after=None, before=None) -> Tuple[str, bytes]:
+        """ETag и тело страницы. Читает базу — вызывается вне цикла событий"""
+        versions = self.storage.cache_version(*VIEWS[view][1])
+        # Статистика на сегодня зависит от "сейчас": ответ живет не дольше интервала часов расписания
+        key = (view, fmt, tenant_id, after, before, self.clock.bucket() if view == 'today' else None)
+        if versions is not None:
+            with self._lock:
+                cached = self._responses.get(key)
+                if cached is not None and cached[0] == versions:
+                    self._responses.move_to_end(key)
+                    return cached[1], cached[2]
+
+        data = getattr(self, f'_{view}')(tenant_id, after, before)
+        if fmt == 'json':
+            body = json.dumps(data, ensure_ascii=False, default=_json_default).encode('utf-8')
+        else:
+            body = self._html(view, tenant_id, data).encode('utf-8')
+        # ETag по содержимому: совпадает во всех процессах и после перезапуска
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+        # Версии прочитаны до данных: запись во время загрузки даст новые версии и пересчет при следующем запросе
+        if versions is not None:
+            with self._lock:
+                self._responses[key] = (versions, etag, body)
+                self._responses.move_to_end(key)
+                while len(self._responses) > self.max_entries:
+                    self._responses.popitem(last=False)
+        return etag, body
+
+    def _authorized(self, request: Request) -> bool:
+        if not self.token:
+            return True
+        supplied = request.query.get('token') or request.headers.get('authorization', '').removeprefix('Bearer ')
+        return secrets.compare_digest(supplied.strip().encode('utf-8'), self.token.encode('utf-8'))
+
+    async def handle(self, request: Request) -> Response:
+        """GET /dashboard/<вид>[.json]"""
+        if not self._authorized(request):
+            return Response(403, b"Forbidden")
+
+        name = request.path[len(DASHBOARD_PREFIX):] if request.path.startswith(DASHBOARD_PREFIX) else ''
+        fmt = 'html'
+        if name.endswith('.json'):
+            name, fmt = name[:-len('.json')], 'json'
+        view = name or 'today'
+        if view not in VIEWS:
+            return Response(404, b"Not Found")
+
+        # Параметры проверяются до обращения к базе
+        parse = parse_booking_cursor if view == 'bookings' else int
+        try:
+            tenant_id = int(request.query.get('tenant', DEFAULT_TENANT_ID))
+            after, before = (parse(request.query[param]) if request.query.get(param) else None
+                             for param in ('after', 'before'))
+        except ValueError:
+            return Response(400, b"Bad Request")
+
+        etag, body = await asyncio.to_thread(self.render, view, fmt, tenant_id, after, before)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get('if-none-match', ''), etag):
+            return Response(304, headers=headers)
+        content_type = "application/json" if fmt == 'json' else "text/html; charset=utf-8"
+        return Response(200, body, content_type, headers=headers)
@@ -1,20 +1,314 @@
+import re
+import json
+import time
+import secrets
 import sqlite3
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Iterator, Optional, Tuple
+
+from sql_profiler import SQLProfiler
+from cache import QueryCache
+from clock import ScheduleClock
 
 logger = logging.getLogger(__name__)
 
+# Версия схемы (PRAGMA user_version). Увеличивайте при любом изменении DDL в init_database,
+# иначе существующие базы не получат изменения: при совпадении версии DDL пропускается.
+SCHEMA_VERSION = 16
+
+# Арендатор по умолчанию: все данные однотенантной установки принадлежат ему
+DEFAULT_TENANT_ID = 1
+
+# Пространства имен QueryCache, версии которых хранятся в базе и общие для всех процессов
+CACHE_NAMESPACES = ('users', 'slots', 'tenants', 'settings', 'members')
+
+# События журнала записей (таблица booking_events, только добавление)
+BOOKING_EVENTS = ('booked', 'cancelled', 'slot_deleted', 'slot_archived', 'user_removed')
+
+# Уведомления из таблицы notifications: слот достался из листа ожидания / слот с очередью удален
+NOTIFICATION_KINDS = ('waitlist_promoted', 'waitlist_slot_deleted')
+
+# Столбцы, общие для рабочих и архивных таблиц
+SLOT_COLUMNS = ("id, datetime, description, is_booked, booked_by, created_at, tenant_id, capacity, seats_taken, "
+                "end_datetime, bookable_until")
+BOOKING_COLUMNS = "id, slot_id, user_id, created_at, cancelled_at"
+
+# Длительность слота по умолчанию и наибольшая (минуты). Пересечения нового слота ищутся среди
+# слотов, начавшихся не раньше чем за SLOT_MAX_MINUTES до него, — это диапазон индекса (tenant_id, datetime)
+SLOT_DEFAULT_MINUTES = 60
+SLOT_MAX_MINUTES = 24 * 60
+
+# Запись и лист ожидания закрываются за столько до начала слота. Граница хранится в слоте
+# (bookable_until = datetime - BOOKING_LEAD) и сравнивается с "сейчас" из ScheduleClock
+BOOKING_LEAD = timedelta(hours=24)
+
+# Аналитика /analytics: границы интервалов заблаговременности записи (часов до начала слота).
+# Интервал записи — число границ, не превышающих ее заблаговременность (0 — меньше первой границы)
+LEAD_TIME_BUCKETS = (48, 72, 168, 336)
+
+# Шаблоны расписания: дни недели (0 — понедельник) и время, по которым слоты создаются заранее
+TEMPLATE_COLUMNS = "id, tenant_id, weekdays, times, description, capacity, duration, generated_until"
+
+# Сколько последних снимков журнала хранится
+BOOKING_SNAPSHOTS_KEPT = 3
+
+# Занять место в слоте. Проверка свободного места и повторной записи — в том же UPDATE, поэтому
+# два процесса не займут одно место. is_booked означает "мест нет"; booked_by заполняется только
+# у слотов на одно место (записавшиеся на групповое занятие — в таблице bookings)
+_TAKE_SEAT_SQL = """
+    UPDATE time_slots
+    SET seats_taken = seats_taken + 1, is_booked = seats_taken + 1 >= capacity,
+        booked_by = CASE WHEN capacity = 1 THEN :user_id END
+    WHERE id = :slot_id AND seats_taken < capacity AND NOT EXISTS (
+        SELECT 1 FROM bookings WHERE slot_id = :slot_id AND user_id = :user_id AND cancelled_at IS NULL
+    )
+"""
+
+
+def _month_range(year: int, month: int) -> Tuple[str, str]:
+    """Границы месяца в формате хранения datetime (для поиска по индексу вместо strftime)"""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start.isoformat(' '), end.isoformat(' ')
+
+
+def _day_range(year: int, month: int, day: int) -> Tuple[str, str]:
+    """Границы дня в формате хранения datetime"""
+    start = datetime(year, month, day)
+    return start.isoformat(' '), (start + timedelta(days=1)).isoformat(' ')
+
+
+def _weekday_hour(cell: str) -> Tuple[int, int]:
+    """Ячейка strftime('%w%H') -> (день недели с понедельника = 0, час)"""
+    return (int(cell[0]) + 6) % 7, int(cell[1:])
+
+
+def _period(start: Optional[datetime], end: Optional[datetime]) -> Tuple[str, str]:
+    """Границы периода в формате хранения datetime (None — без ограничения)"""
+    # Границы без ограничения — тоже полные даты: столбец datetime имеет числовое сродство,
+    # и строка вроде '9999' сравнивалась бы как число
+    return (start or datetime.min).isoformat(' '), (end or datetime.max).isoformat(' ')
+
+
+def slot_window(intervals: List[Tuple[datetime, datetime]]) -> Tuple[datetime, datetime]:
+    """Промежуток [начало, конец), слоты из которого нужны plan_new_slots для новых слотов (начало, конец)"""
+    last = max(start for start, _ in intervals)
+    next_day = datetime.combine(last.date(), datetime.min.time()) + timedelta(days=1)
+    # Слева — начавшиеся раньше и, возможно, еще идущие; справа — до конца последнего нового слота
+    # и до конца дня последнего начала (счетчик слотов в день)
+    return (min(start for start, _ in intervals) - timedelta(minutes=SLOT_MAX_MINUTES),
+            max(max(end for _, end in intervals), next_day))
+
+
+def plan_new_slots(existing: List[Tuple[datetime, datetime, int]], intervals: List[Tuple[datetime, datetime]],
+                   max_per_day: Optional[int] = None) -> List[Optional[Tuple[str, Optional[int]]]]:
+    """
+    Проверить новые слоты (начало, конец) за один проход по времени.
+
+    existing — слоты арендатора из slot_window в виде (начало, конец, id) по возрастанию начала.
+    Для каждого нового слота возвращает None (слот можно создать) или (причина, id слота, с которым
+    он пересекается): 'overlap' или 'day_full' (в дне уже max_per_day слотов). Слоты пакета проверяются
+    и друг с другом: принятый слот занимает свое время, id у него еще нет (None).
+    """
+    per_day = {}
+    for start, _, _ in existing:
+        per_day[start.date()] = per_day.get(start.date(), 0) + 1
+
+    plan = [None] * len(intervals)
+    # Самый поздний конец среди слотов, начавшихся раньше текущего нового
+    latest_end, latest_id = datetime.min, None
+    position = 0
+    for index in sorted(range(len(intervals)), key=lambda i: intervals[i]):
+        start, end = intervals[index]
+        while position < len(existing) and existing[position][0] < start:
+            if existing[position][1] > latest_end:
+                latest_end, latest_id = existing[position][1], existing[position][2]
+            position += 1
+        if latest_end > start:
+            plan[index] = ('overlap', latest_id)
+        elif position < len(existing) and existing[position][0] < end:
+            plan[index] = ('overlap', existing[position][2])
+        elif max_per_day is not None and per_day.get(start.date(), 0) >= max_per_day:
+            plan[index] = ('day_full', None)
+        else:
+            per_day[start.date()] = per_day.get(start.date(), 0) + 1
+            if end > latest_end:
+                latest_end, latest_id = end, None
+    return plan
+
+
+def template_fields(weekdays: List[int], times: List[str]) -> Tuple[str, str]:
+    """Дни недели и время шаблона в виде хранения ('0,2,4', '08:00,09:30'); ValueError — неверные значения"""
+    days = sorted(set(weekdays))
+    if not days or not all(0 <= day <= 6 for day in days):
+        raise ValueError(f"дни недели должны быть от 0 до 6: {weekdays}")
+    normalized = sorted({datetime.strptime(value, '%H:%M').strftime('%H:%M') for value in times})
+    if not normalized:
+        raise ValueError("не указано время")
+    return ','.join(map(str, days)), ','.join(normalized)
+
+
+def template_from_row(row) -> Dict:
+    """Шаблон расписания из строки TEMPLATE_COLUMNS"""
+    template_id, tenant_id, weekdays, times, description, capacity, duration, generated_until = row
+    return {
+        'id': template_id,
+        'tenant_id': tenant_id,
+        'weekdays': [int(day) for day in weekdays.split(',')],
+        'times': times.split(','),
+        'description': description,
+        'capacity': capacity,
+        'duration': duration,
+        'generated_until': date.fromisoformat(generated_until) if generated_until else None
+    }
+
+
+def template_slots(template: Dict, start: date, end: date) -> List[Tuple[datetime, datetime]]:
+    """Слоты (начало, конец) шаблона на дни [start, end], которые еще не создавались (после generated_until)"""
+    if template['generated_until'] is not None:
+        start = max(start, template['generated_until'] + timedelta(days=1))
+    length = timedelta(minutes=template['duration'])
+    slots = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        if day.weekday() in template['weekdays']:
+            for value in template['times']:
+                slot_datetime = datetime.combine(day, datetime.strptime(value, '%H:%M').time())
+                slots.append((slot_datetime, slot_datetime + length))
+    return slots
+
+
+def _reject_slots(slots: List[Tuple[datetime, str]], reason: str) -> Dict:
+    """Результат add_slots, в котором не создан ни один слот"""
+    return {'created': [], 'rejected': [{'datetime': slot_datetime, 'reason': reason, 'conflict_id': None}
+                                        for slot_datetime, _ in slots]}
+
+
+def search_terms(text: str) -> List[str]:
+    """Слова поискового запроса в нижнем регистре (как их разбивает токенизатор unicode61)"""
+    return re.findall(r'[^\W_]+', text.lower())
+
+
+def _fts_query(terms: List[str]) -> str:
+    """Выражение MATCH: каждое слово — префикс слова в тексте"""
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def replay_booking_events(state: Dict[int, Tuple[int, int]], events) -> Dict[int, Tuple[int, int]]:
+    """
+    Применить события журнала к активным записям {booking_id: (slot_id, user_id)}.
+
+    `events` — кортежи (event, booking_id, slot_id, user_id) в порядке журнала.
+    Одна функция для всех хранилищ: состояние после восстановления везде получается одинаковым.
+    """
+    for event, booking_id, slot_id, user_id in events:
+        if event == 'booked':
+            state[booking_id] = (slot_id, user_id)
+        elif event == 'cancelled':
+            state.pop(booking_id, None)
+        elif event in ('slot_deleted', 'slot_archived'):
+            for key in [key for key, (slot, _) in state.items() if slot == slot_id]:
+                del state[key]
+        elif event == 'user_removed':
+            for key in [key for key, (_, user) in state.items() if user == user_id]:
+                del state[key]
+    return state
+
+
+def backfill_booking_events(cursor: sqlite3.Cursor) -> int:
+    """
+    Заполнить пустой журнал событий по таблице bookings (миграция существующих баз).
+
+    Активные записи, слот которых уже освобожден или занят другим пользователем, сначала
+    отменяются: раньше free_user_bookings и remove_user освобождали слоты, не отменяя записи.
+    """
+    cursor.execute("SELECT COUNT(*) FROM booking_events")
+    if cursor.fetchone()[0]:
+        return 0
+    cursor.execute("""
+        UPDATE bookings SET cancelled_at = CURRENT_TIMESTAMP
+        WHERE cancelled_at IS NULL AND NOT EXISTS (
+            SELECT 1 FROM time_slots ts WHERE ts.id = bookings.slot_id AND ts.booked_by = bookings.user_id
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO booking_events (event, booking_id, slot_id, user_id, created_at)
+        SELECT event, booking_id, slot_id, user_id, created_at FROM (
+            SELECT 'booked' AS event, id AS booking_id, slot_id, user_id, created_at, 0 AS step
+            FROM bookings
+            UNION ALL
+            SELECT 'cancelled', id, slot_id, user_id, cancelled_at, 1
+            FROM bookings WHERE cancelled_at IS NOT NULL
+        )
+        ORDER BY created_at, booking_id, step
+    """)
+    return cursor.rowcount
+
+
+def recount_slot_seats(cursor: sqlite3.Cursor):
+    """Пересчитать занятые места слотов по активным записям (миграция на слоты с несколькими местами)"""
+    for slots_table, bookings_table in (('time_slots', 'bookings'), ('time_slots_archive', 'bookings_archive')):
+        cursor.execute(f"""
+            UPDATE {slots_table} SET seats_taken = (
+                SELECT COUNT(*) FROM {bookings_table} b WHERE b.slot_id = {slots_table}.id AND b.cancelled_at IS NULL
+            )
+        """)
+        cursor.execute(f"""
+            UPDATE {slots_table} SET
+                is_booked = seats_taken >= capacity,
+                booked_by = CASE WHEN capacity = 1 THEN (
+                    SELECT b.user_id FROM {bookings_table} b
+                    WHERE b.slot_id = {slots_table}.id AND b.cancelled_at IS NULL ORDER BY b.id LIMIT 1
+                ) END
+        """)
+
+
 class Database:
-    def __init__(self, db_path: str = "schedule_bot.db"):
+    def __init__(self, db_path: str = "schedule_bot.db", profiler: Optional[SQLProfiler] = None,
+                 cache_sync_interval: Optional[float] = None, clock: Optional[ScheduleClock] = None):
+        """
+        cache_sync_interval — режим нескольких процессов: записи отмечаются в таблице cache_versions,
+        а кэш не реже чем раз в столько секунд сверяется с ней. None — один процесс, сверка не нужна.
+        clock — "сейчас" для правил записи (пояс расписания); по умолчанию время системы.
+        """
         self.db_path = db_path
+        self.clock = clock or ScheduleClock()
+        self.profiler = profiler or SQLProfiler()
+        self.cache = QueryCache()
+        self.cache_sync_interval = cache_sync_interval
+        self._cache_synced_at = float('-inf')
         self.init_database()
     
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть соединение с базой (с профилированием, если оно включено)"""
+        if self.profiler.enabled:
+            conn = self.profiler.connect(self.db_path)
+        else:
+            conn = sqlite3.connect(self.db_path)
+        # В режиме WAL фиксация без fsync на каждую транзакцию не рискует целостностью базы
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def schema_version(self) -> int:
+        """Версия схемы существующей базы"""
+        with self._connect() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+    
     def init_database(self):
         """Инициализация базы данных и создание таблиц"""
-        with sqlite3.connect(self.db_path) as conn:
+        # Быстрый путь холодного старта: схема уже актуальна, DDL не нужен
+        if self.schema_version() == SCHEMA_VERSION:
+            logger.info("База данных инициализирована (схема актуальна)")
+            return
+        
+        with self._connect() as conn:
             cursor = conn.cursor()
             
+            # WAL: читатели не блокируются писателем, несколько процессов работают с одной базой.
+            # Режим сохраняется в файле базы, поэтому включается один раз при миграции.
+            cursor.execute("PRAGMA journal_mode=WAL")
+            
             # Таблица пользователей
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -33,6 +327,22 @@ class Database:
                 # Поле уже существует
                 pass
             
+            # Таблица арендаторов (автошкол и инструкторов) со своей группой доступа
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS tenants (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    slug TEXT UNIQUE,
+                    group_id INTEGER UNIQUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                INSERT OR IGNORE INTO tenants (id, name, slug) VALUES (?, 'Основная', 'default')
+            """, (DEFAULT_TENANT_ID,))
+            
+            self._add_column(cursor, "users", f"tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID}")
+            
             # Таблица слотов времени
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS time_slots (
@@ -46,6 +356,8 @@ class Database:
                 )
             """)
             
+            self._add_column(cursor, "time_slots", f"tenant_id INTEGER NOT NULL DEFAULT {DEFAULT_TENANT_ID}")
+            
             # Таблица записей (для истории)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS bookings (
@@ -59,19 +371,337 @@ class Database:
                 )
             """)
             
+            # Индексы: запросы по арендатору и диапазону дат идут по индексу, а не полным сканом
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_time_slots_tenant_datetime
+                ON time_slots (tenant_id, datetime)
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_time_slots_booked_by ON time_slots (booked_by)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_tenant ON users (tenant_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings (slot_id, cancelled_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings (user_id, cancelled_at)")
+            
+            # Аренды: периодические задачи выполняет только процесс, удерживающий аренду
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            
+            # Общие настройки, изменяемые командами бота во время работы
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Версии пространств имен кэша для инвалидации между процессами
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS cache_versions (
+                    namespace TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            cursor.executemany("INSERT OR IGNORE INTO cache_versions (namespace) VALUES (?)",
+                               [(namespace,) for namespace in CACHE_NAMESPACES])
+            
+            # Состояние диалога (ввод времени слота и т.п.): следующее сообщение может попасть в другой процесс
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_state (
+                    user_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, key)
+                )
+            """)
+            # Брошенные диалоги удаляются по времени последней записи
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_state_updated ON user_state (updated_at)")
+            
+            # Журнал записей: события только добавляются, текущее состояние (time_slots.is_booked,
+            # bookings.cancelled_at) обновляется в той же транзакции и восстанавливается из журнала
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS booking_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event TEXT NOT NULL,
+                    booking_id INTEGER,
+                    slot_id INTEGER,
+                    user_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_events_slot ON booking_events (slot_id, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_booking_events_user ON booking_events (user_id, id)")
+            
+            # Снимки активных записей: восстановление читает последний снимок и хвост журнала после него
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS booking_snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    last_event_id INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Архив: прошедшие слоты с их записями и давно отмененные записи переносятся сюда
+            # (archive_old_data), чтобы рабочие таблицы не росли с годами истории
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS time_slots_archive (
+                    id INTEGER PRIMARY KEY,
+                    datetime TIMESTAMP NOT NULL,
+                    description TEXT NOT NULL,
+                    is_booked BOOLEAN DEFAULT 0,
+                    booked_by INTEGER,
+                    created_at TIMESTAMP,
+                    tenant_id INTEGER NOT NULL,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS bookings_archive (
+                    id INTEGER PRIMARY KEY,
+                    slot_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    created_at TIMESTAMP,
+                    cancelled_at TIMESTAMP,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_time_slots_archive_tenant_datetime
+                ON time_slots_archive (tenant_id, datetime)
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_slot ON bookings_archive (slot_id, cancelled_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_user ON bookings_archive (user_id, cancelled_at)")
+            
+            # Места в слоте: групповое занятие — один слот с capacity местами, а не capacity слотов
+            for slots_table in ('time_slots', 'time_slots_archive'):
+                self._add_column(cursor, slots_table, "capacity INTEGER NOT NULL DEFAULT 1")
+                self._add_column(cursor, slots_table, "seats_taken INTEGER NOT NULL DEFAULT 0")
+                # Конец слота: пересечения проверяются по интервалам [datetime, end_datetime)
+                self._add_column(cursor, slots_table, "end_datetime TIMESTAMP")
+                cursor.execute(f"""
+                    UPDATE {slots_table} SET end_datetime = datetime(datetime, '+{SLOT_DEFAULT_MINUTES} minutes')
+                    WHERE end_datetime IS NULL
+                """)
+                # Граница записи: выборки доступных слотов сравнивают ее с "сейчас" без вычислений по строкам
+                self._add_column(cursor, slots_table, "bookable_until TIMESTAMP")
+                cursor.execute(f"""
+                    UPDATE {slots_table} SET bookable_until = datetime(datetime, '-{int(BOOKING_LEAD.total_seconds())} seconds')
+                    WHERE bookable_until IS NULL
+                """)
+            
+            # Частичный индекс открытых для записи слотов по границе записи (список доступных слотов)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_time_slots_bookable
+                ON time_slots (tenant_id, bookable_until) WHERE is_booked = 0
+            """)
+            
+            # Частичный индекс занятых слотов: страницы списка записей читаются по нему без пропуска свободных слотов
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_time_slots_taken
+                ON time_slots (tenant_id, datetime, id) WHERE seats_taken > 0
+            """)
+            
+            # Представления для отчетов за весь период (рабочие таблицы и архив).
+            # Пересоздаются: состав столбцов меняется вместе со схемой
+            cursor.execute("DROP VIEW IF EXISTS all_time_slots")
+            cursor.execute(f"""
+                CREATE VIEW IF NOT EXISTS all_time_slots AS
+                SELECT {SLOT_COLUMNS} FROM time_slots
+                UNION ALL SELECT {SLOT_COLUMNS} FROM time_slots_archive
+            """)
+            cursor.execute(f"""
+                CREATE VIEW IF NOT EXISTS all_bookings AS
+                SELECT {BOOKING_COLUMNS} FROM bookings
+                UNION ALL SELECT {BOOKING_COLUMNS} FROM bookings_archive
+            """)
+            
+            # Секретные ссылки на ленты .ics пользователей (подписка на календарь)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS calendar_tokens (
+                    user_id INTEGER PRIMARY KEY,
+                    token TEXT NOT NULL UNIQUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Лист ожидания занятых слотов: освободившийся слот получает первый в очереди
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS waitlist (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    slot_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (slot_id, user_id)
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_slot ON waitlist (slot_id, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_user ON waitlist (user_id)")
+            
+            # Исходящие уведомления: добавляются в транзакции изменения, отправляет любой процесс.
+            # take_notifications отмечает уведомление забранным (claimed_at, attempts), ack_notifications
+            # удаляет отправленное; неотправленное забирается снова после задержки
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS notifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    slot_id INTEGER,
+                    slot_datetime TIMESTAMP,
+                    description TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self._add_column(cursor, "notifications", "claimed_at REAL")
+            self._add_column(cursor, "notifications", "attempts INTEGER NOT NULL DEFAULT 0")
+            
+            # Шаблоны расписания: слоты по ним создает фоновая задача на SLOT_GENERATION_HORIZON_DAYS вперед.
+            # generated_until — последний день, до которого слоты шаблона уже созданы
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schedule_templates (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tenant_id INTEGER NOT NULL,
+                    weekdays TEXT NOT NULL,
+                    times TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    capacity INTEGER NOT NULL DEFAULT 1,
+                    duration INTEGER NOT NULL,
+                    generated_until DATE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self._add_column(cursor, "time_slots", "template_id INTEGER")
+            # Слот шаблона на одно время у арендатора — один: повторная генерация ничего не добавляет.
+            # Индекс частичный: в старых базах могут быть созданные вручную слоты на одно время
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_time_slots_template
+                ON time_slots (tenant_id, datetime) WHERE template_id IS NOT NULL
+            """)
+            
+            # Членство в группах арендаторов по обновлениям chat_member: источник правды для доступа.
+            # is_member = 0 — пользователь вышел или исключен; checked_at — время последнего подтверждения
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS group_members (
+                    group_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    is_member BOOLEAN NOT NULL,
+                    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (group_id, user_id)
+                ) WITHOUT ROWID
+            """)
+            
+            # Полнотекстовый поиск /find по username и описаниям слотов. Индексы внешнего содержимого
+            # (текст хранится только в users и time_slots) поддерживаются триггерами
+            try:
+                self._create_search_index(cursor, 'users_fts', 'users', 'user_id', 'username')
+                self._create_search_index(cursor, 'time_slots_fts', 'time_slots', 'id', 'description')
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Полнотекстовый поиск недоступен (нужен SQLite с FTS5): {e}")
+            
+            backfilled = backfill_booking_events(cursor)
+            if backfilled:
+                logger.info(f"Журнал записей заполнен по истории: {backfilled} событий")
+            recount_slot_seats(cursor)
+            
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             conn.commit()
             logger.info("База данных инициализирована")
     
-    def add_user(self, user_id: int, username: str) -> bool:
-        """Добавить пользователя"""
+    def _touch(self, cursor: sqlite3.Cursor, *namespaces: str):
+        """Отметить изменение пространств имен кэша для других процессов (в той же транзакции)"""
+        if self.cache_sync_interval is not None:
+            # Отдельный курсор: rowcount и lastrowid основного запроса должны сохраниться
+            cursor.connection.executemany("UPDATE cache_versions SET version = version + 1 WHERE namespace = ?",
+                                          [(namespace,) for namespace in namespaces])
+    
+    def sync_cache(self, force: bool = False):
+        """Сбросить записи кэша, измененные другими процессами (не чаще cache_sync_interval)"""
+        if self.cache_sync_interval is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._cache_synced_at < self.cache_sync_interval:
+            return
+        self._cache_synced_at = now
+        try:
+            with self._connect() as conn:
+                versions = dict(conn.execute("SELECT namespace, version FROM cache_versions").fetchall())
+            self.cache.apply_versions(versions)
+        except Exception as e:
+            logger.error(f"Ошибка при сверке версий кэша: {e}")
+    
+    def cache_version(self, *namespaces: str) -> Optional[Tuple[int, ...]]:
+        """
+        Версии пространств имен кэша после сверки с другими процессами.
+
+        Пока версии те же, данные этих пространств не менялись: по ним панель администратора
+        проверяет актуальность готовых ответов, не обращаясь к таблицам.
+        """
+        self.sync_cache()
+        return tuple(self.cache.version(namespace) for namespace in namespaces)
+    
+    @staticmethod
+    def _append_events(cursor: sqlite3.Cursor, events):
+        """Добавить события (event, booking_id, slot_id, user_id) в журнал в транзакции изменения"""
+        # Отдельный курсор: rowcount и lastrowid основного запроса должны сохраниться
+        cursor.connection.executemany("""
+            INSERT INTO booking_events (event, booking_id, slot_id, user_id) VALUES (?, ?, ?, ?)
+        """, events)
+    
+    @staticmethod
+    def _create_search_index(cursor: sqlite3.Cursor, index: str, table: str, key: str, column: str):
+        """Создать индекс FTS5 по столбцу таблицы, триггеры синхронизации и заполнить его"""
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+                {column}, content='{table}', content_rowid='{key}',
+                tokenize='unicode61 remove_diacritics 0', prefix='2 3'
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {index} (rowid, {column}) VALUES (new.{key}, new.{column});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {index} ({index}, rowid, {column}) VALUES ('delete', old.{key}, old.{column});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {column} ON {table} BEGIN
+                INSERT INTO {index} ({index}, rowid, {column}) VALUES ('delete', old.{key}, old.{column});
+                INSERT INTO {index} (rowid, {column}) VALUES (new.{key}, new.{column});
+            END
+        """)
+        cursor.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+    
+    @staticmethod
+    def _add_column(cursor: sqlite3.Cursor, table: str, column_definition: str):
+        """Добавить столбец в существующую таблицу, если его еще нет"""
+        try:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column_definition}")
+        except sqlite3.OperationalError:
+            # Поле уже существует
+            pass
+    
+    def add_user(self, user_id: int, username: str, tenant_id: int = DEFAULT_TENANT_ID) -> bool:
+        """Добавить пользователя (арендатор задается только при создании)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Проверяем, существует ли пользователь
-                cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
+                cursor.execute("SELECT username FROM users WHERE user_id = ?", (user_id,))
                 existing_user = cursor.fetchone()
                 
+                if existing_user and existing_user[0] == username:
+                    # Username не изменился — запись не нужна (вызывается на каждое обращение)
+                    return True
+                
                 if existing_user:
                     # Обновляем только username, сохраняя существующую роль
                     cursor.execute("""
@@ -82,37 +712,70 @@ class Database:
                 else:
                     # Создаем нового пользователя с ролью 'user' по умолчанию
                     cursor.execute("""
-                        INSERT INTO users (user_id, username, role)
-                        VALUES (?, ?, 'user')
-                    """, (user_id, username))
+                        INSERT INTO users (user_id, username, role, tenant_id)
+                        VALUES (?, ?, 'user', ?)
+                    """, (user_id, username, tenant_id))
                 
+                self._touch(cursor, 'users')
                 conn.commit()
+                self.cache.bump('users')
                 return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Ошибка при добавлении пользователя: {e}")
             return False
     
+    def add_users(self, users: List[Tuple[int, str]], tenant_id: int = DEFAULT_TENANT_ID) -> Dict:
+        """
+        Добавить пользователей пачкой (/import_users) одной транзакцией.
+
+        Новые создаются в арендаторе tenant_id, у существующих того же арендатора обновляется username;
+        пользователи других арендаторов не меняются. Возвращает {'added', 'updated', 'unchanged'}
+        (None — ошибка записи).
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT COUNT(*) FROM users")
+                before = cursor.fetchone()[0]
+                cursor.executemany("""
+                    INSERT INTO users (user_id, username, role, tenant_id)
+                    VALUES (?, ?, 'user', ?)
+                    ON CONFLICT (user_id) DO UPDATE SET username = excluded.username
+                    WHERE users.tenant_id = excluded.tenant_id AND users.username != excluded.username
+                """, [(user_id, username, tenant_id) for user_id, username in users])
+                # rowcount executemany — сумма вставленных и обновленных строк
+                changed = cursor.rowcount if users else 0
+                cursor.execute("SELECT COUNT(*) FROM users")
+                added = cursor.fetchone()[0] - before
+                if changed:
+                    self._touch(cursor, 'users')
+                conn.commit()
+                if changed:
+                    self.cache.bump('users')
+                logger.info(f"Импорт пользователей: добавлено {added}, обновлено {changed - added}")
+                return {'added': added, 'updated': changed - added, 'unchanged': len(users) - changed}
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении пользователей: {e}")
+            return None
+    
     def free_user_bookings(self, user_id: int) -> int:
-        """Освободить все забронированные слоты пользователя"""
+        """Освободить все места, занятые пользователем. Возвращает число слотов"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                # Сначала подсчитываем количество слотов для освобождения
-                cursor.execute("""
-                    SELECT COUNT(*) FROM time_slots 
-                    WHERE booked_by = ? AND is_booked = 1
-                """, (user_id,))
-                count = cursor.fetchone()[0]
-                
-                # Освобождаем все забронированные слоты пользователя
-                cursor.execute("""
-                    UPDATE time_slots 
-                    SET is_booked = 0, booked_by = NULL 
-                    WHERE booked_by = ?
-                """, (user_id,))
+                # Отменяем активные записи пользователя и освобождаем их места
+                cancelled = self._cancel_user_bookings(cursor, user_id)
+                freed = self._release_seats(cursor, [slot_id for _, slot_id in cancelled])
+                count = len(freed)
                 
+                self._append_events(cursor, [('cancelled', booking_id, slot_id, user_id)
+                                             for booking_id, slot_id in cancelled])
+                self._promote_waitlist(cursor, freed)
+                self._touch(cursor, 'slots')
                 conn.commit()
+                self.cache.bump('slots')
                 logger.info(f"Освобождено {count} слотов пользователя {user_id}")
                 return count
         except Exception as e:
@@ -122,28 +785,114 @@ class Database:
     def remove_user(self, user_id: int) -> bool:
         """Удалить пользователя"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Отменяем все активные записи пользователя
-                cursor.execute("""
-                    UPDATE time_slots 
-                    SET is_booked = 0, booked_by = NULL 
-                    WHERE booked_by = ?
-                """, (user_id,))
+                cancelled = self._cancel_user_bookings(cursor, user_id)
+                freed = self._release_seats(cursor, [slot_id for _, slot_id in cancelled])
                 
-                # Удаляем пользователя
+                # Удаляем пользователя; его ссылка на календарь, очереди и уведомления удаляются
+                cursor.execute("DELETE FROM calendar_tokens WHERE user_id = ?", (user_id,))
+                cursor.execute("DELETE FROM waitlist WHERE user_id = ?", (user_id,))
+                cursor.execute("DELETE FROM notifications WHERE user_id = ?", (user_id,))
                 cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+                removed = cursor.rowcount > 0
+                if removed or cancelled:
+                    self._append_events(cursor, [('user_removed', None, None, user_id)])
+                self._promote_waitlist(cursor, freed)
+                self._touch(cursor, 'users', 'slots')
                 conn.commit()
-                return cursor.rowcount > 0
+                self.cache.bump('users', 'slots')
+                return removed
         except Exception as e:
             logger.error(f"Ошибка при удалении пользователя: {e}")
             return False
     
+    @staticmethod
+    def _cancel_user_bookings(cursor: sqlite3.Cursor, user_id: int) -> List[Tuple[int, int]]:
+        """Отменить активные записи пользователя. Возвращает [(booking_id, slot_id)]"""
+        # Отмененные записи возвращает сам UPDATE: запись, добавленная другим процессом после чтения,
+        # не может оказаться отмененной без освобождения места и события в журнале
+        cursor.execute("""
+            UPDATE bookings SET cancelled_at = CURRENT_TIMESTAMP
+            WHERE user_id = ? AND cancelled_at IS NULL
+            RETURNING id, slot_id
+        """, (user_id,))
+        return sorted(cursor.fetchall())
+    
+    @staticmethod
+    def _release_seats(cursor: sqlite3.Cursor, slot_ids) -> List[int]:
+        """Освободить по одному месту в слотах отмененных записей. Возвращает слоты, где место освободилось"""
+        freed = []
+        for slot_id in slot_ids:
+            cursor.execute("""
+                UPDATE time_slots SET seats_taken = seats_taken - 1, is_booked = 0, booked_by = NULL
+                WHERE id = ? AND seats_taken > 0
+            """, (slot_id,))
+            if cursor.rowcount > 0:
+                freed.append(slot_id)
+        return freed
+    
+    def _promote_waitlist(self, cursor: sqlite3.Cursor, slot_ids) -> int:
+        """
+        Отдать освободившиеся места первым в листе ожидания (в транзакции освобождения).
+
+        `slot_ids` — по одному элементу на освободившееся место. Действует правило записи: до начала
+        слота не менее 24 часов. Получивший место убирается из очереди и получает уведомление.
+        Возвращает число записанных из очереди.
+        """
+        promoted = 0
+        for slot_id in slot_ids:
+            cursor.execute("""
+                SELECT datetime, description FROM time_slots
+                WHERE id = ? AND seats_taken < capacity AND bookable_until > ?
+            """, (slot_id, self.clock.bucket().isoformat(' ')))
+            slot = cursor.fetchone()
+            if not slot:
+                continue
+            cursor.execute("""
+                SELECT w.id, w.user_id FROM waitlist w
+                JOIN users u ON u.user_id = w.user_id
+                WHERE w.slot_id = ? AND u.is_allowed = 1 AND NOT EXISTS (
+                    SELECT 1 FROM bookings b
+                    WHERE b.slot_id = w.slot_id AND b.user_id = w.user_id AND b.cancelled_at IS NULL
+                )
+                ORDER BY w.id LIMIT 1
+            """, (slot_id,))
+            waiter = cursor.fetchone()
+            if not waiter:
+                continue
+            entry_id, user_id = waiter
+            cursor.execute(_TAKE_SEAT_SQL, {'slot_id': slot_id, 'user_id': user_id})
+            cursor.execute("INSERT INTO bookings (slot_id, user_id) VALUES (?, ?)", (slot_id, user_id))
+            self._append_events(cursor, [('booked', cursor.lastrowid, slot_id, user_id)])
+            cursor.execute("DELETE FROM waitlist WHERE id = ?", (entry_id,))
+            cursor.execute("""
+                INSERT INTO notifications (user_id, kind, slot_id, slot_datetime, description)
+                VALUES (?, 'waitlist_promoted', ?, ?, ?)
+            """, (user_id, slot_id, slot[0], slot[1]))
+            promoted += 1
+        if promoted:
+            logger.info(f"Из листа ожидания записано: {promoted}")
+        return promoted
+    
+    @staticmethod
+    def _drop_waitlist(cursor: sqlite3.Cursor, slot_id: int):
+        """Удалить очередь слота перед удалением слота; ожидавшим — уведомление"""
+        cursor.execute("""
+            INSERT INTO notifications (user_id, kind, slot_id, slot_datetime, description)
+            SELECT w.user_id, 'waitlist_slot_deleted', w.slot_id, ts.datetime, ts.description
+            FROM waitlist w JOIN time_slots ts ON ts.id = w.slot_id
+            WHERE w.slot_id = ?
+            ORDER BY w.id
+        """, (slot_id,))
+        cursor.execute("DELETE FROM waitlist WHERE slot_id = ?", (slot_id,))
+    
     def is_user_allowed(self, user_id: int) -> bool:
         """Проверить, разрешен ли пользователь"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT is_allowed FROM users WHERE user_id = ?
@@ -157,45 +906,246 @@ class Database:
     def user_exists(self, user_id: int) -> bool:
         """Проверить, существует ли пользователь в базе"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-                return result is not None
+            self.sync_cache()
+            return self.cache.get_or_load('users', ('exists', user_id), lambda: self._fetch_user_exists(user_id))
         except Exception as e:
             logger.error(f"Ошибка при проверке существования пользователя: {e}")
             return False
 
-    def get_all_users(self) -> list:
-        """Получить всех пользователей из базы"""
+    def _fetch_user_exists(self, user_id: int) -> bool:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
+            return cursor.fetchone() is not None
+
+    def get_all_users(self, tenant_id: Optional[int] = None) -> list:
+        """Получить всех пользователей из базы (или только пользователей арендатора)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT user_id, username FROM users")
+                if tenant_id is None:
+                    cursor.execute("SELECT user_id, username FROM users")
+                else:
+                    cursor.execute("SELECT user_id, username FROM users WHERE tenant_id = ?", (tenant_id,))
                 return cursor.fetchall()
         except Exception as e:
             logger.error(f"Ошибка при получении списка пользователей: {e}")
             return []
     
-    def add_slot(self, datetime_obj: datetime, description: str) -> int:
-        """Добавить слот времени"""
+    def get_users_page(self, tenant_id: int = DEFAULT_TENANT_ID, after_id: Optional[int] = None,
+                       before_id: Optional[int] = None, limit: int = 10) -> Dict:
+        """
+        Страница пользователей арендатора по возрастанию ID: после after_id или перед before_id.
+
+        Возвращает {'users': [(user_id, username)], 'has_prev': bool, 'has_next': bool}.
+        Страница читается по индексу от курсора, стоимость не зависит от числа пользователей.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                if before_id is not None:
+                    cursor.execute("""
+                        SELECT user_id, username FROM users
+                        WHERE tenant_id = ? AND user_id < ?
+                        ORDER BY user_id DESC
+                        LIMIT ?
+                    """, (tenant_id, before_id, limit + 1))
+                    rows = cursor.fetchall()
+                    return {'users': rows[:limit][::-1], 'has_prev': len(rows) > limit, 'has_next': True}
+                
+                conditions, params = ["tenant_id = ?"], [tenant_id]
+                if after_id is not None:
+                    conditions.append("user_id > ?")
+                    params.append(after_id)
+                cursor.execute(f"""
+                    SELECT user_id, username FROM users
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY user_id
+                    LIMIT ?
+                """, params + [limit + 1])
+                rows = cursor.fetchall()
+                return {'users': rows[:limit], 'has_prev': after_id is not None, 'has_next': len(rows) > limit}
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы пользователей: {e}")
+            return {'users': [], 'has_prev': False, 'has_next': False}
+    
+    def add_slot(self, datetime_obj: datetime, description: str, tenant_id: int = DEFAULT_TENANT_ID,
+                 capacity: int = 1, duration: int = SLOT_DEFAULT_MINUTES, max_per_day: Optional[int] = None) -> int:
+        """
+        Добавить слот времени на capacity мест длительностью duration минут.
+
+        Возвращает ID слота; 0 — слот пересекается с другим или в дне уже max_per_day слотов
+        (причину возвращает add_slots); -1 — ошибка.
+        """
+        result = self.add_slots([(datetime_obj, description)], tenant_id, capacity, duration, max_per_day)
+        if result['created']:
+            return result['created'][0]
+        return 0 if result['rejected'][0]['reason'] in ('overlap', 'day_full') else -1
+    
+    def add_slots(self, slots: List[Tuple[datetime, str]], tenant_id: int = DEFAULT_TENANT_ID, capacity: int = 1,
+                  duration: int = SLOT_DEFAULT_MINUTES, max_per_day: Optional[int] = None) -> Dict:
+        """
+        Добавить слоты [(время, описание)] одной транзакцией.
+
+        Слот не создается, если пересекается с существующим или с другим слотом пакета, а также сверх
+        max_per_day слотов в день. Возвращает {'created': [ID созданных], 'rejected': [{'datetime', 'reason',
+        'conflict_id'}]} в порядке slots; reason — 'overlap' (conflict_id — слот, с которым пересекается;
+        None — слот этого же пакета), 'day_full', 'invalid' (длительность не от 1 до SLOT_MAX_MINUTES) или 'error'.
+        """
+        if not slots:
+            return {'created': [], 'rejected': []}
+        if not 0 < duration <= SLOT_MAX_MINUTES:
+            return _reject_slots(slots, 'invalid')
+        
+        intervals = [(slot_datetime, slot_datetime + timedelta(minutes=duration)) for slot_datetime, _ in slots]
+        window_start, window_end = slot_window(intervals)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                # Проверка и вставка — в одной транзакции записи: другой процесс не создаст слот между ними
+                cursor.execute("BEGIN IMMEDIATE")
                 cursor.execute("""
-                    INSERT INTO time_slots (datetime, description)
-                    VALUES (?, ?)
-                """, (datetime_obj, description))
+                    SELECT datetime, end_datetime, id FROM time_slots
+                    WHERE tenant_id = ? AND datetime >= ? AND datetime < ?
+                    ORDER BY datetime, id
+                """, (tenant_id, window_start.isoformat(' '), window_end.isoformat(' ')))
+                existing = [(datetime.fromisoformat(start), datetime.fromisoformat(end), slot_id)
+                            for start, end, slot_id in cursor.fetchall()]
+                plan = plan_new_slots(existing, intervals, max_per_day)
+                
+                created, rejected = [], []
+                for (slot_datetime, description), (_, end), verdict in zip(slots, intervals, plan):
+                    if verdict is not None:
+                        rejected.append({'datetime': slot_datetime, 'reason': verdict[0], 'conflict_id': verdict[1]})
+                        continue
+                    cursor.execute("""
+                        INSERT INTO time_slots (datetime, end_datetime, bookable_until, description, tenant_id, capacity)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (slot_datetime, end, slot_datetime - BOOKING_LEAD, description, tenant_id, capacity))
+                    created.append(cursor.lastrowid)
+                if created:
+                    self._touch(cursor, 'slots')
+                conn.commit()
+                if created:
+                    self.cache.bump('slots')
+                return {'created': created, 'rejected': rejected}
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении слотов: {e}")
+            return _reject_slots(slots, 'error')
+    
+    def add_schedule_template(self, weekdays: List[int], times: List[str], description: str,
+                              tenant_id: int = DEFAULT_TENANT_ID, capacity: int = 1,
+                              duration: int = SLOT_DEFAULT_MINUTES) -> int:
+        """Добавить шаблон расписания: слоты в дни недели weekdays (0 — понедельник) во время times ('ЧЧ:ММ')"""
+        try:
+            if not 0 < duration <= SLOT_MAX_MINUTES or capacity < 1:
+                raise ValueError(f"длительность {duration}, мест {capacity}")
+            weekdays_value, times_value = template_fields(weekdays, times)
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO schedule_templates (tenant_id, weekdays, times, description, capacity, duration)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (tenant_id, weekdays_value, times_value, description, capacity, duration))
                 conn.commit()
                 return cursor.lastrowid
         except Exception as e:
-            logger.error(f"Ошибка при добавлении слота: {e}")
+            logger.error(f"Ошибка при добавлении шаблона расписания: {e}")
             return -1
     
+    def get_schedule_templates(self, tenant_id: Optional[int] = None) -> List[Dict]:
+        """Шаблоны расписания арендатора (None — всех арендаторов)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                if tenant_id is None:
+                    cursor.execute(f"SELECT {TEMPLATE_COLUMNS} FROM schedule_templates ORDER BY id")
+                else:
+                    cursor.execute(f"SELECT {TEMPLATE_COLUMNS} FROM schedule_templates WHERE tenant_id = ? ORDER BY id",
+                                   (tenant_id,))
+                return [template_from_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка при получении шаблонов расписания: {e}")
+            return []
+    
+    def remove_schedule_template(self, template_id: int) -> bool:
+        """Удалить шаблон расписания (уже созданные по нему слоты остаются)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM schedule_templates WHERE id = ?", (template_id,))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при удалении шаблона расписания: {e}")
+            return False
+    
+    def generate_template_slots(self, start: date, end: date, max_per_day: Optional[int] = None) -> Dict:
+        """
+        Создать слоты по всем шаблонам расписания на дни [start, end] одной транзакцией.
+
+        Шаблон продолжает со дня после generated_until: ночной запуск добавляет только новые дни
+        горизонта, а удаленный администратором слот не создается снова. Слоты, пересекающиеся
+        с существующими, и сверх max_per_day в день пропускаются. Повторный запуск ничего не добавляет
+        (уникальный индекс idx_time_slots_template). Возвращает {'templates', 'created', 'skipped'}.
+        """
+        stats = {'templates': 0, 'created': 0, 'skipped': 0}
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(f"SELECT {TEMPLATE_COLUMNS} FROM schedule_templates ORDER BY id")
+                new_slots = {}  # арендатор -> [(начало, конец, шаблон)]
+                for template in map(template_from_row, cursor.fetchall()):
+                    if template['generated_until'] is not None and template['generated_until'] >= end:
+                        continue
+                    stats['templates'] += 1
+                    for interval in template_slots(template, start, end):
+                        new_slots.setdefault(template['tenant_id'], []).append(interval + (template,))
+                    cursor.execute("UPDATE schedule_templates SET generated_until = ? WHERE id = ?",
+                                   (end.isoformat(), template['id']))
+                
+                for tenant_id, slots in new_slots.items():
+                    intervals = [(slot_start, slot_end) for slot_start, slot_end, _ in slots]
+                    window_start, window_end = slot_window(intervals)
+                    cursor.execute("""
+                        SELECT datetime, end_datetime, id FROM time_slots
+                        WHERE tenant_id = ? AND datetime >= ? AND datetime < ?
+                        ORDER BY datetime, id
+                    """, (tenant_id, window_start.isoformat(' '), window_end.isoformat(' ')))
+                    existing = [(datetime.fromisoformat(slot_start), datetime.fromisoformat(slot_end), slot_id)
+                                for slot_start, slot_end, slot_id in cursor.fetchall()]
+                    accepted = [(slot_start, slot_end, slot_start - BOOKING_LEAD, template['description'], tenant_id,
+                                 template['capacity'], template['id'])
+                                for (slot_start, slot_end, template), verdict
+                                in zip(slots, plan_new_slots(existing, intervals, max_per_day)) if verdict is None]
+                    created = 0
+                    if accepted:
+                        cursor.executemany("""
+                            INSERT OR IGNORE INTO time_slots
+                                (datetime, end_datetime, bookable_until, description, tenant_id, capacity, template_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """, accepted)
+                        created = cursor.rowcount
+                    stats['created'] += created
+                    stats['skipped'] += len(slots) - created
+                
+                if stats['created']:
+                    self._touch(cursor, 'slots')
+                conn.commit()
+                if stats['created']:
+                    self.cache.bump('slots')
+                if stats['templates']:
+                    logger.info(f"Слоты по шаблонам до {end.isoformat()}: {stats}")
+                return stats
+        except Exception as e:
+            logger.error(f"Ошибка при создании слотов по шаблонам: {e}")
+            return {'templates': 0, 'created': 0, 'skipped': 0}
+    
     def remove_slot(self, slot_id: int) -> bool:
         """Удалить слот времени"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Отменяем все записи на этот слот
@@ -205,9 +1155,14 @@ class Database:
                     WHERE slot_id = ? AND cancelled_at IS NULL
                 """, (slot_id,))
                 
-                # Удаляем слот
+                # Удаляем слот; ожидавшие его получают уведомление
+                self._drop_waitlist(cursor, slot_id)
                 cursor.execute("DELETE FROM time_slots WHERE id = ?", (slot_id,))
+                if cursor.rowcount > 0:
+                    self._append_events(cursor, [('slot_deleted', None, slot_id, None)])
+                self._touch(cursor, 'slots')
                 conn.commit()
+                self.cache.bump('slots')
                 return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Ошибка при удалении слота: {e}")
@@ -216,61 +1171,130 @@ class Database:
     def get_slot(self, slot_id: int) -> Optional[Dict]:
         """Получить информацию о слоте"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT id, datetime, description, is_booked, booked_by
+                    SELECT id, datetime, description, is_booked, booked_by, tenant_id, capacity, seats_taken,
+                           end_datetime, bookable_until
                     FROM time_slots WHERE id = ?
                 """, (slot_id,))
                 result = cursor.fetchone()
                 
+                if not result:
+                    # Прошедший слот мог быть перенесен в архив
+                    cursor.execute("""
+                        SELECT id, datetime, description, is_booked, booked_by, tenant_id, capacity, seats_taken,
+                               end_datetime, bookable_until
+                        FROM time_slots_archive WHERE id = ?
+                    """, (slot_id,))
+                    result = cursor.fetchone()
+                
                 if result:
                     return {
                         'id': result[0],
                         'datetime': datetime.fromisoformat(result[1]),
                         'description': result[2],
                         'is_booked': bool(result[3]),
-                        'booked_by': result[4]
+                        'booked_by': result[4],
+                        'tenant_id': result[5],
+                        'capacity': result[6],
+                        'seats_taken': result[7],
+                        'end_datetime': datetime.fromisoformat(result[8]),
+                        'bookable_until': datetime.fromisoformat(result[9])
                     }
                 return None
         except Exception as e:
             logger.error(f"Ошибка при получении слота: {e}")
             return None
     
-    def get_available_slots(self) -> List[Dict]:
-        """Получить доступные слоты (только те, на которые можно записаться за 24+ часов)"""
+    def set_slot_capacity(self, slot_id: int, capacity: int) -> bool:
+        """
+        Изменить число мест в слоте. Нельзя сделать мест меньше, чем уже занято.
+
+        Появившиеся места сразу получают ожидающие в листе ожидания.
+        """
+        if capacity < 1:
+            return False
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                # Проверка занятых мест — в том же UPDATE: запись из другого процесса не потеряется
                 cursor.execute("""
-                    SELECT id, datetime, description, is_booked, booked_by
-                    FROM time_slots 
-                    WHERE datetime > datetime('now', '+24 hours') AND is_booked = 0
-                    ORDER BY datetime
-                """)
-                results = cursor.fetchall()
+                    UPDATE time_slots
+                    SET capacity = :capacity, is_booked = seats_taken >= :capacity,
+                        booked_by = CASE WHEN :capacity = 1 THEN (
+                            SELECT user_id FROM bookings
+                            WHERE slot_id = time_slots.id AND cancelled_at IS NULL ORDER BY id LIMIT 1
+                        ) END
+                    WHERE id = :slot_id AND seats_taken <= :capacity
+                """, {'slot_id': slot_id, 'capacity': capacity})
+                if cursor.rowcount == 0:
+                    return False
                 
-                slots = []
-                for result in results:
-                    slots.append({
-                        'id': result[0],
-                        'datetime': datetime.fromisoformat(result[1]),
-                        'description': result[2],
-                        'is_booked': bool(result[3]),
-                        'booked_by': result[4]
-                    })
-                return slots
+                cursor.execute("SELECT capacity - seats_taken FROM time_slots WHERE id = ?", (slot_id,))
+                self._promote_waitlist(cursor, [slot_id] * cursor.fetchone()[0])
+                self._touch(cursor, 'slots')
+                conn.commit()
+                self.cache.bump('slots')
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка при изменении числа мест слота {slot_id}: {e}")
+            return False
+    
+    def _cached_availability(self, key: Tuple, loader) -> List[Dict]:
+        """
+        Выборка доступных слотов через кэш 'slots'. "Сейчас" округляется до интервала часов расписания
+        и входит в ключ: в пределах интервала результат общий для всех пользователей.
+        """
+        self.sync_cache()
+        now = self.clock.bucket()
+        # Записи прошлых интервалов больше не запрашиваются — живут не дольше интервала
+        slots = self.cache.get_or_load('slots', key + (now,), lambda: loader(now.isoformat(' ')),
+                                       ttl=self.clock.bucket_seconds)
+        # Копии: вызывающий код может изменять словари
+        return [dict(slot) for slot in slots]
+    
+    def get_available_slots(self, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
+        """Получить доступные слоты (только те, на которые можно записаться за 24+ часов)"""
+        try:
+            return self._cached_availability(('available', tenant_id),
+                                             lambda now: self._fetch_available_slots(tenant_id, now))
         except Exception as e:
             logger.error(f"Ошибка при получении доступных слотов: {e}")
             return []
     
+    def _fetch_available_slots(self, tenant_id: int, now: str) -> List[Dict]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            # bookable_until отстает от datetime на постоянное BOOKING_LEAD: порядок тот же,
+            # но строки идут по индексу idx_time_slots_bookable без сортировки
+            cursor.execute("""
+                SELECT id, datetime, description, is_booked, booked_by, capacity - seats_taken
+                FROM time_slots 
+                WHERE tenant_id = ? AND bookable_until > ? AND is_booked = 0
+                ORDER BY bookable_until
+            """, (tenant_id, now))
+            results = cursor.fetchall()
+            
+            slots = []
+            for result in results:
+                slots.append({
+                    'id': result[0],
+                    'datetime': datetime.fromisoformat(result[1]),
+                    'description': result[2],
+                    'is_booked': bool(result[3]),
+                    'booked_by': result[4],
+                    'seats_left': result[5]
+                })
+            return slots
+    
     def book_slot(self, slot_id: int, user_id: int) -> bool:
         """Записаться на слот"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                # Проверяем, что слот свободен
+                # Проверяем, что в слоте есть свободные места
                 cursor.execute("""
                     SELECT is_booked FROM time_slots WHERE id = ?
                 """, (slot_id,))
@@ -279,18 +1303,20 @@ class Database:
                 if not result or result[0]:
                     return False
                 
-                # Записываем пользователя
-                cursor.execute("""
-                    UPDATE time_slots 
-                    SET is_booked = 1, booked_by = ? 
-                    WHERE id = ?
-                """, (user_id, slot_id))
+                # Занимаем место. Условие свободного места повторяется в UPDATE: другой процесс
+                # мог занять последнее место между проверкой и записью
+                cursor.execute(_TAKE_SEAT_SQL, {'slot_id': slot_id, 'user_id': user_id})
+                if cursor.rowcount == 0:
+                    return False
                 
                 # Добавляем запись в историю
                 cursor.execute("""
                     INSERT INTO bookings (slot_id, user_id)
                     VALUES (?, ?)
                 """, (slot_id, user_id))
+                self._append_events(cursor, [('booked', cursor.lastrowid, slot_id, user_id)])
+                # Записавшемуся напрямую очередь на этот слот больше не нужна
+                cursor.execute("DELETE FROM waitlist WHERE slot_id = ? AND user_id = ?", (slot_id, user_id))
                 
                 # Обновляем username пользователя в таблице users (если изменился)
                 cursor.execute("""
@@ -301,7 +1327,9 @@ class Database:
                     WHERE user_id = ?
                 """, (user_id, user_id))
                 
+                self._touch(cursor, 'slots')
                 conn.commit()
+                self.cache.bump('slots')
                 return True
         except Exception as e:
             logger.error(f"Ошибка при записи на слот: {e}")
@@ -310,7 +1338,7 @@ class Database:
     def cancel_booking(self, booking_id: int, user_id: int) -> bool:
         """Отменить запись"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Получаем информацию о записи
@@ -326,22 +1354,25 @@ class Database:
                 
                 slot_id = result[0]
                 
-                # Освобождаем слот
-                cursor.execute("""
-                    UPDATE time_slots 
-                    SET is_booked = 0, booked_by = NULL 
-                    WHERE id = ?
-                """, (slot_id,))
-                
-                # Отмечаем запись как отмененную
+                # Отмечаем запись как отмененную (повторная отмена из другого процесса ничего не изменит)
                 cursor.execute("""
                     UPDATE bookings 
                     SET cancelled_at = CURRENT_TIMESTAMP 
-                    WHERE id = ?
+                    WHERE id = ? AND cancelled_at IS NULL
                 """, (booking_id,))
+                if cursor.rowcount == 0:
+                    return False
+                
+                # Освобождаем место в слоте
+                freed = bool(self._release_seats(cursor, [slot_id]))
                 
+                self._append_events(cursor, [('cancelled', booking_id, slot_id, user_id)])
+                if freed:
+                    self._promote_waitlist(cursor, [slot_id])
+                self._touch(cursor, 'slots')
                 conn.commit()
-                return cursor.rowcount > 0
+                self.cache.bump('slots')
+                return True
         except Exception as e:
             logger.error(f"Ошибка при отмене записи: {e}")
             return False
@@ -349,16 +1380,16 @@ class Database:
     def get_user_bookings(self, user_id: int) -> List[Dict]:
         """Получить записи пользователя (только будущие)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT b.id, ts.datetime, ts.description
                     FROM bookings b
                     JOIN time_slots ts ON b.slot_id = ts.id
                     WHERE b.user_id = ? AND b.cancelled_at IS NULL
-                    AND ts.datetime > datetime('now')
+                    AND ts.datetime > ?
                     ORDER BY ts.datetime
-                """, (user_id,))
+                """, (user_id, self.clock.now().isoformat(' ')))
                 results = cursor.fetchall()
                 
                 bookings = []
@@ -374,19 +1405,19 @@ class Database:
             return []
     
     
-    def get_all_bookings(self) -> List[Dict]:
+    def get_all_bookings(self, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
         """Получить все активные записи"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     SELECT b.id, ts.datetime, ts.description, u.username, u.user_id
                     FROM bookings b
                     JOIN time_slots ts ON b.slot_id = ts.id
                     JOIN users u ON b.user_id = u.user_id
-                    WHERE b.cancelled_at IS NULL
+                    WHERE b.cancelled_at IS NULL AND ts.tenant_id = ?
                     ORDER BY ts.datetime
-                """)
+                """, (tenant_id,))
                 results = cursor.fetchall()
                 
                 bookings = []
@@ -403,44 +1434,152 @@ class Database:
             logger.error(f"Ошибка при получении всех записей: {e}")
             return []
     
-    def get_stats(self) -> Dict:
-        """Получить статистику"""
+    def get_bookings_page(self, tenant_id: int = DEFAULT_TENANT_ID,
+                          after: Optional[Tuple[datetime, int, int]] = None,
+                          before: Optional[Tuple[datetime, int, int]] = None, limit: int = 15) -> Dict:
+        """
+        Страница активных записей по времени слота: после курсора after или перед курсором before.
+
+        Курсор — (время слота, ID слота, ID записи) первой или последней записи соседней страницы.
+        Возвращает {'bookings': [...], 'has_prev': bool, 'has_next': bool}; записи — как в
+        get_all_bookings, с добавлением 'slot_id'. Слоты читаются по частичному индексу занятых слотов
+        от курсора, поэтому стоимость страницы не зависит от числа слотов и записей.
+        """
+        backward = before is not None
+        key = before if backward else after
+        # Начало списка — курсор меньше любой записи
+        slot_datetime, slot_id, booking_id = key if key is not None else (datetime.min, 0, 0)
+        compare, order = ('<', 'DESC') if backward else ('>', 'ASC')
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT b.id, ts.datetime, ts.description, u.username, u.user_id, ts.id
+                    FROM time_slots ts
+                    JOIN bookings b ON b.slot_id = ts.id AND b.cancelled_at IS NULL
+                    JOIN users u ON b.user_id = u.user_id
+                    WHERE ts.tenant_id = ? AND ts.seats_taken > 0
+                    AND (ts.datetime, ts.id) {compare}= (?, ?) AND (ts.datetime, ts.id, b.id) {compare} (?, ?, ?)
+                    ORDER BY ts.datetime {order}, ts.id {order}, b.id {order}
+                    LIMIT ?
+                """, (tenant_id, slot_datetime.isoformat(' '), slot_id,
+                      slot_datetime.isoformat(' '), slot_id, booking_id, limit + 1))
+                rows = cursor.fetchall()
                 
-                # Общее количество пользователей
-                cursor.execute("SELECT COUNT(*) FROM users")
-                total_users = cursor.fetchone()[0]
-                
-                # Общее количество слотов
-                cursor.execute("SELECT COUNT(*) FROM time_slots WHERE datetime > datetime('now')")
-                total_slots = cursor.fetchone()[0]
+                bookings = [
+                    {'id': row[0], 'datetime': datetime.fromisoformat(row[1]), 'description': row[2],
+                     'username': row[3], 'user_id': row[4], 'slot_id': row[5]}
+                    for row in rows[:limit]
+                ]
+                if backward:
+                    return {'bookings': bookings[::-1], 'has_prev': len(rows) > limit, 'has_next': True}
+                return {'bookings': bookings, 'has_prev': key is not None, 'has_next': len(rows) > limit}
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы записей: {e}")
+            return {'bookings': [], 'has_prev': False, 'has_next': False}
+    
+    def search_users(self, text: str, tenant_id: int = DEFAULT_TENANT_ID, offset: int = 0,
+                     limit: int = 10) -> Dict:
+        """
+        Пользователи арендатора, в username которых есть слова, начинающиеся со слов запроса.
+
+        Точное совпадение username с запросом — первым, далее короткие username выше; числовой запрос
+        также находит пользователя по ID. Возвращает {'users': [{'user_id', 'username', 'role'}], 'has_next'}.
+        """
+        terms = search_terms(text)
+        if not terms:
+            return {'users': [], 'has_next': False}
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                rows = []
+                user_id_text = text.strip().lstrip('@')
+                if offset == 0 and user_id_text.isdigit():
+                    cursor.execute("SELECT user_id, username, role FROM users WHERE user_id = ? AND tenant_id = ?",
+                                   (int(user_id_text), tenant_id))
+                    rows.extend(cursor.fetchall())
                 
-                # Количество записей
+                # Арендатор проверяется до ранжирования и LIMIT: совпадения других арендаторов не вытесняют своих
                 cursor.execute("""
-                    SELECT COUNT(*) FROM bookings 
-                    WHERE cancelled_at IS NULL
-                """)
-                total_bookings = cursor.fetchone()[0]
+                    SELECT u.user_id, u.username, u.role FROM users_fts f
+                    JOIN users u ON u.user_id = f.rowid
+                    WHERE users_fts MATCH ? AND u.tenant_id = ?
+                    ORDER BY u.username <> ?, length(u.username), u.user_id
+                    LIMIT ? OFFSET ?
+                """, (_fts_query(terms), tenant_id, user_id_text, limit + 1, offset))
+                matches = cursor.fetchall()
+                found_ids = {row[0] for row in rows}
+                rows.extend(row for row in matches[:limit] if row[0] not in found_ids)
                 
-                # Свободные слоты
+                return {
+                    'users': [{'user_id': row[0], 'username': row[1], 'role': row[2] or 'user'} for row in rows],
+                    'has_next': len(matches) > limit
+                }
+        except Exception as e:
+            logger.error(f"Ошибка при поиске пользователей: {e}")
+            return {'users': [], 'has_next': False}
+    
+    def search_slots(self, text: str, tenant_id: int = DEFAULT_TENANT_ID, offset: int = 0,
+                     limit: int = 10) -> Dict:
+        """
+        Предстоящие слоты арендатора, в описании которых есть слова, начинающиеся со слов запроса.
+
+        Ранжируются по времени: ближайшие первыми.
+        Возвращает {'slots': [{'id', 'datetime', 'description', 'capacity', 'seats_taken'}], 'has_next'}.
+        """
+        terms = search_terms(text)
+        if not terms:
+            return {'slots': [], 'has_next': False}
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # Арендатор и время проверяются до сортировки и LIMIT: в выдачу попадают ближайшие слоты
                 cursor.execute("""
-                    SELECT COUNT(*) FROM time_slots 
-                    WHERE datetime > datetime('now') AND is_booked = 0
-                """)
-                available_slots = cursor.fetchone()[0]
-                
-                # Процент заполненности
-                occupancy_rate = (total_bookings / total_slots * 100) if total_slots > 0 else 0
-                
+                    SELECT ts.id, ts.datetime, ts.description, ts.capacity, ts.seats_taken FROM time_slots_fts f
+                    JOIN time_slots ts ON ts.id = f.rowid
+                    WHERE time_slots_fts MATCH ? AND ts.tenant_id = ? AND ts.datetime >= ?
+                    ORDER BY ts.datetime, ts.id
+                    LIMIT ? OFFSET ?
+                """, (_fts_query(terms), tenant_id, self.clock.now().isoformat(' '), limit + 1, offset))
+                rows = cursor.fetchall()
                 return {
-                    'total_users': total_users,
-                    'total_slots': total_slots,
-                    'total_bookings': total_bookings,
-                    'available_slots': available_slots,
-                    'occupancy_rate': occupancy_rate
+                    'slots': [
+                        {'id': row[0], 'datetime': datetime.fromisoformat(row[1]), 'description': row[2],
+                         'capacity': row[3], 'seats_taken': row[4]}
+                        for row in rows[:limit]
+                    ],
+                    'has_next': len(rows) > limit
                 }
+        except Exception as e:
+            logger.error(f"Ошибка при поиске слотов: {e}")
+            return {'slots': [], 'has_next': False}
+    
+    def get_stats(self, tenant_id: int = DEFAULT_TENANT_ID) -> Dict:
+        """
+        Получить статистику.
+
+        Счетчики берутся из кэша: число пользователей — до изменения пользователей, слоты и записи —
+        до следующей записи и не дольше интервала часов расписания ("сейчас" округляется, как у выборок
+        доступных слотов).
+        """
+        try:
+            self.sync_cache()
+            total_users = self.cache.get_or_load('users', ('count', tenant_id), lambda: self._count_users(tenant_id))
+            now = self.clock.bucket()
+            total_slots, total_seats, total_bookings, available_slots = self.cache.get_or_load(
+                'slots', ('stats', tenant_id, now), lambda: self._fetch_slot_stats(tenant_id, now.isoformat(' ')),
+                ttl=self.clock.bucket_seconds)
+            
+            # Процент заполненности (по местам)
+            occupancy_rate = (total_bookings / total_seats * 100) if total_seats > 0 else 0
+            
+            return {
+                'total_users': total_users,
+                'total_slots': total_slots,
+                'total_bookings': total_bookings,
+                'available_slots': available_slots,
+                'occupancy_rate': occupancy_rate
+            }
         except Exception as e:
             logger.error(f"Ошибка при получении статистики: {e}")
             return {
@@ -451,41 +1590,135 @@ class Database:
                 'occupancy_rate': 0
             }
     
-    def get_slots_by_month(self, year, month):
+    def _count_users(self, tenant_id: int) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM users WHERE tenant_id = ?", (tenant_id,)).fetchone()[0]
+    
+    def _fetch_slot_stats(self, tenant_id: int, now: str) -> Tuple[int, int, int, int]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            
+            # Общее количество будущих слотов, мест в них и свободных слотов — за один проход
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(capacity), 0), COALESCE(SUM(is_booked = 0), 0) FROM time_slots
+                WHERE tenant_id = ? AND datetime > ?
+            """, (tenant_id, now))
+            total_slots, total_seats, available_slots = cursor.fetchone()
+            
+            # Количество записей
+            cursor.execute("""
+                SELECT COUNT(*) FROM bookings b
+                JOIN time_slots ts ON b.slot_id = ts.id
+                WHERE b.cancelled_at IS NULL AND ts.tenant_id = ?
+            """, (tenant_id,))
+            total_bookings = cursor.fetchone()[0]
+            
+            return total_slots, total_seats, total_bookings, available_slots
+    
+    def get_booking_analytics(self, tenant_id: int = DEFAULT_TENANT_ID) -> Dict:
+        """
+        Сводка для /analytics за всю историю, включая архив.
+
+        'cells' — по дню недели (0 — понедельник) и часу начала слотов: слоты, места, активные
+        и отмененные записи; 'lead_time' — число записей в интервалах LEAD_TIME_BUCKETS.
+        Результат кэшируется до следующего изменения слотов или записей.
+        """
+        try:
+            self.sync_cache()
+            analytics = self.cache.get_or_load('slots', ('analytics', tenant_id),
+                                               lambda: self._fetch_booking_analytics(tenant_id))
+            return {'cells': [dict(cell) for cell in analytics['cells']], 'lead_time': list(analytics['lead_time'])}
+        except Exception as e:
+            logger.error(f"Ошибка при расчете аналитики записей: {e}")
+            return {'cells': [], 'lead_time': [0] * (len(LEAD_TIME_BUCKETS) + 1)}
+    
+    def _fetch_booking_analytics(self, tenant_id: int) -> Dict:
+        # Время слота местное, created_at записи — UTC: заблаговременность поправляется на смещение пояса
+        offset_hours = self.clock.utc_offset().total_seconds() / 3600
+        bucket = " + ".join(f"(lead >= {bound})" for bound in LEAD_TIME_BUCKETS)
+        cells = {}
+        lead_time = [0] * (len(LEAD_TIME_BUCKETS) + 1)
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            # Группировка выполняется в SQLite: в Python приходят сотни строк, а не вся история.
+            # Ячейка — strftime('%w%H'): день недели (0 — воскресенье) и час за один разбор даты
+            cursor.execute("""
+                SELECT strftime('%w%H', datetime), COUNT(*), SUM(capacity)
+                FROM all_time_slots WHERE tenant_id = ?
+                GROUP BY 1
+            """, (tenant_id,))
+            for cell, slots, seats in cursor.fetchall():
+                cells[_weekday_hour(cell)] = {'slots': slots, 'seats': seats, 'booked': 0, 'cancelled': 0}
+            # Записи — за один проход: ячейка и интервал заблаговременности вместе. Таблицы соединяются
+            # попарно, а не через представления: слот ищется по первичному ключу без материализации истории
+            pairs = [(bookings, slots) for bookings in ('bookings', 'bookings_archive')
+                     for slots in ('time_slots', 'time_slots_archive')]
+            history = " UNION ALL ".join(f"""
+                SELECT strftime('%w%H', ts.datetime) AS cell,
+                       (julianday(ts.datetime) - julianday(b.created_at)) * 24 - :offset AS lead, b.cancelled_at
+                FROM {bookings} b JOIN {slots} ts ON ts.id = b.slot_id
+                WHERE ts.tenant_id = :tenant_id
+            """ for bookings, slots in pairs)
+            cursor.execute(f"""
+                SELECT cell, {bucket}, SUM(cancelled_at IS NULL), SUM(cancelled_at IS NOT NULL)
+                FROM ({history})
+                GROUP BY 1, 2
+            """, {'offset': offset_hours, 'tenant_id': tenant_id})
+            for cell_key, lead_bucket, booked, cancelled in cursor.fetchall():
+                cell = cells[_weekday_hour(cell_key)]
+                cell['booked'] += booked
+                cell['cancelled'] += cancelled
+                lead_time[lead_bucket or 0] += booked + cancelled
+        return {
+            'cells': [{'weekday': weekday, 'hour': hour, **cell} for (weekday, hour), cell in sorted(cells.items())],
+            'lead_time': lead_time
+        }
+    
+    def get_slots_by_month(self, year, month, tenant_id: int = DEFAULT_TENANT_ID):
         """Получить все слоты за определенный месяц"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Получаем все слоты за месяц
-                cursor.execute("""
-                    SELECT ts.id, ts.datetime, ts.description, 
-                           COUNT(b.id) as booking_count
-                    FROM time_slots ts
-                    LEFT JOIN bookings b ON ts.id = b.slot_id AND b.cancelled_at IS NULL
-                    WHERE strftime('%Y', ts.datetime) = ? 
-                    AND strftime('%m', ts.datetime) = ?
-                    GROUP BY ts.id, ts.datetime, ts.description
-                    ORDER BY ts.datetime
-                """, (str(year), f"{month:02d}"))
-                
-                # Преобразуем строки datetime в объекты datetime
-                slots = []
-                for row in cursor.fetchall():
-                    slot_id, datetime_str, description, booking_count = row
-                    slot_datetime = datetime.fromisoformat(datetime_str)
-                    slots.append((slot_id, slot_datetime, description, booking_count))
-                
-                return slots
+            self.sync_cache()
+            slots = self.cache.get_or_load('slots', ('month', tenant_id, year, month),
+                                           lambda: self._fetch_slots_by_month(year, month, tenant_id))
+            return list(slots)
         except Exception as e:
             logger.error(f"Ошибка при получении слотов за месяц: {e}")
             return []
     
+    def _fetch_slots_by_month(self, year, month, tenant_id):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            
+            # Получаем все слоты за месяц (за прошедшие месяцы — и из архива). Число записей —
+            # счетчик занятых мест, соединение с таблицей записей не нужно
+            start, end = _month_range(year, month)
+            queries = []
+            for slots_table, _ in self._slot_tables(start):
+                queries.append(f"""
+                    SELECT id, datetime, description, seats_taken, capacity
+                    FROM {slots_table}
+                    WHERE tenant_id = ? AND datetime >= ? AND datetime < ?
+                """)
+            cursor.execute(" UNION ALL ".join(queries) + " ORDER BY datetime",
+                           (tenant_id, start, end) * len(queries))
+            
+            # Преобразуем строки datetime в объекты datetime
+            slots = []
+            for row in cursor.fetchall():
+                slot_id, datetime_str, description, booking_count, capacity = row
+                slot_datetime = datetime.fromisoformat(datetime_str)
+                slots.append((slot_id, slot_datetime, description, booking_count, capacity))
+            
+            return slots
+    
     def delete_slot(self, slot_id):
         """Удалить слот по ID"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                # Проверка и удаление — в одной транзакции записи: запись другого процесса
+                # не появится между ними на удаляемом слоте
+                cursor.execute("BEGIN IMMEDIATE")
                 
                 # Проверяем, есть ли активные записи на этот слот
                 cursor.execute("""
@@ -498,9 +1731,14 @@ class Database:
                 if active_bookings > 0:
                     return False, f"Нельзя удалить слот с {active_bookings} активными записями"
                 
-                # Удаляем слот
+                # Удаляем слот; ожидавшие его получают уведомление
+                self._drop_waitlist(cursor, slot_id)
                 cursor.execute("DELETE FROM time_slots WHERE id = ?", (slot_id,))
+                if cursor.rowcount > 0:
+                    self._append_events(cursor, [('slot_deleted', None, slot_id, None)])
+                self._touch(cursor, 'slots')
                 conn.commit()
+                self.cache.bump('slots')
                 
                 if cursor.rowcount > 0:
                     logger.info(f"Слот {slot_id} успешно удален")
@@ -515,8 +1753,11 @@ class Database:
     def force_delete_slot(self, slot_id):
         """Принудительно удалить слот с уведомлением пользователей"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
+                # Чтение записей и их отмена — в одной транзакции записи: запись, сделанная другим
+                # процессом в это время, не будет отменена без уведомления пользователя
+                cursor.execute("BEGIN IMMEDIATE")
                 
                 # Получаем информацию о слоте
                 cursor.execute("""
@@ -546,9 +1787,13 @@ class Database:
                     WHERE slot_id = ? AND cancelled_at IS NULL
                 """, (slot_id,))
                 
-                # Удаляем слот
+                # Удаляем слот; ожидавшие его получают уведомление
+                self._drop_waitlist(cursor, slot_id)
                 cursor.execute("DELETE FROM time_slots WHERE id = ?", (slot_id,))
+                self._append_events(cursor, [('slot_deleted', None, slot_id, None)])
+                self._touch(cursor, 'slots')
                 conn.commit()
+                self.cache.bump('slots')
                 
                 logger.info(f"Слот {slot_id} принудительно удален, затронуто пользователей: {len(affected_users)}")
                 return True, "Слот принудительно удален", affected_users
@@ -560,37 +1805,59 @@ class Database:
     def get_bookings_by_slot(self, slot_id):
         """Получить все записи на определенный слот"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
-                # Получаем информацию о забронированном слоте из time_slots
-                cursor.execute("""
-                    SELECT ts.id, ts.datetime, ts.description, ts.is_booked, ts.booked_by,
-                           u.username
-                    FROM time_slots ts
-                    LEFT JOIN users u ON ts.booked_by = u.user_id
-                    WHERE ts.id = ? AND ts.is_booked = 1
-                """, (slot_id,))
-                
-                return cursor.fetchall()
+                # Активные записи слота, по строке на место (прошедший слот — из архива)
+                for slots_table, bookings_table in (('time_slots', 'bookings'), ('time_slots_archive', 'bookings_archive')):
+                    cursor.execute(f"""
+                        SELECT ts.id, ts.datetime, ts.description, ts.is_booked, b.user_id,
+                               u.username
+                        FROM {slots_table} ts
+                        JOIN {bookings_table} b ON b.slot_id = ts.id AND b.cancelled_at IS NULL
+                        LEFT JOIN users u ON b.user_id = u.user_id
+                        WHERE ts.id = ?
+                        ORDER BY b.id
+                    """, (slot_id,))
+                    rows = cursor.fetchall()
+                    if rows:
+                        return rows
+                return []
         except Exception as e:
             logger.error(f"Ошибка при получении записей слота {slot_id}: {e}")
             return []
     
+    def _slot_tables(self, start: str) -> List[Tuple[str, str]]:
+        """
+        Пары таблиц (слоты, записи) для выборки за период, начинающийся в `start`.
+        
+        Архив читается, только если период начинается раньше границы архива: выборки
+        текущих и будущих дат идут только по небольшим рабочим таблицам.
+        """
+        tables = [('time_slots', 'bookings')]
+        cutoff = self.get_setting('archive_cutoff')
+        if cutoff is not None and start < cutoff:
+            tables.append(('time_slots_archive', 'bookings_archive'))
+        return tables
+    
+    def _fetch_user_bookings_between(self, cursor: sqlite3.Cursor, user_id: int, start: str, end: str) -> list:
+        """Активные записи пользователя на слоты в полуинтервале [start, end)"""
+        queries = [f"""
+            SELECT b.id, ts.datetime, ts.description
+            FROM {bookings_table} b
+            JOIN {slots_table} ts ON b.slot_id = ts.id
+            WHERE b.user_id = ? AND b.cancelled_at IS NULL
+            AND ts.datetime >= ? AND ts.datetime < ?
+        """ for slots_table, bookings_table in self._slot_tables(start)]
+        cursor.execute(" UNION ALL ".join(queries) + " ORDER BY datetime", (user_id, start, end) * len(queries))
+        return cursor.fetchall()
+    
     def get_user_bookings_by_month(self, user_id: int, year: int, month: int) -> List[Dict]:
         """Получить записи пользователя за определенный месяц"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT b.id, ts.datetime, ts.description
-                    FROM bookings b
-                    JOIN time_slots ts ON b.slot_id = ts.id
-                    WHERE b.user_id = ? AND b.cancelled_at IS NULL
-                    AND strftime('%Y', ts.datetime) = ? AND strftime('%m', ts.datetime) = ?
-                    ORDER BY ts.datetime
-                """, (user_id, str(year), f"{month:02d}"))
-                results = cursor.fetchall()
+                results = self._fetch_user_bookings_between(cursor, user_id, *_month_range(year, month))
                 
                 bookings = []
                 for result in results:
@@ -608,19 +1875,9 @@ class Database:
     def get_user_bookings_by_day(self, user_id: int, year: int, month: int, day: int) -> List[Dict]:
         """Получить записи пользователя за определенный день"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT b.id, ts.datetime, ts.description
-                    FROM bookings b
-                    JOIN time_slots ts ON b.slot_id = ts.id
-                    WHERE b.user_id = ? AND b.cancelled_at IS NULL
-                    AND strftime('%Y', ts.datetime) = ? 
-                    AND strftime('%m', ts.datetime) = ?
-                    AND strftime('%d', ts.datetime) = ?
-                    ORDER BY ts.datetime
-                """, (user_id, str(year), f"{month:02d}", f"{day:02d}"))
-                results = cursor.fetchall()
+                results = self._fetch_user_bookings_between(cursor, user_id, *_day_range(year, month, day))
                 
                 bookings = []
                 for result in results:
@@ -635,86 +1892,79 @@ class Database:
             logger.error(f"Ошибка при получении записей пользователя {user_id} за {day}.{month}.{year}: {e}")
             return []
     
-    def get_available_slots_by_month(self, year: int, month: int) -> List[Dict]:
+    def get_available_slots_by_month(self, year: int, month: int, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
         """Получить доступные слоты за определенный месяц (только те, на которые можно записаться за 24+ часов)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, datetime, description
-                    FROM time_slots
-                    WHERE strftime('%Y', datetime) = ? AND strftime('%m', datetime) = ?
-                    AND is_booked = 0
-                    AND datetime > datetime('now', '+24 hours')
-                    ORDER BY datetime
-                """, (str(year), f"{month:02d}"))
-                results = cursor.fetchall()
-                
-                slots = []
-                for result in results:
-                    slots.append({
-                        'id': result[0],
-                        'datetime': datetime.fromisoformat(result[1]),
-                        'description': result[2]
-                    })
-                
-                return slots
+            period = _month_range(year, month)
+            return self._cached_availability(('available', tenant_id) + period,
+                                             lambda now: self._fetch_available_slots_in(tenant_id, period, now))
         except Exception as e:
             logger.error(f"Ошибка при получении доступных слотов за {month}.{year}: {e}")
             return []
     
-    def get_available_slots_by_day(self, year: int, month: int, day: int) -> List[Dict]:
+    def get_available_slots_by_day(self, year: int, month: int, day: int,
+                                   tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
         """Получить доступные слоты за определенный день (только те, на которые можно записаться за 24+ часов)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, datetime, description
-                    FROM time_slots
-                    WHERE strftime('%Y', datetime) = ? 
-                    AND strftime('%m', datetime) = ?
-                    AND strftime('%d', datetime) = ?
-                    AND is_booked = 0
-                    AND datetime > datetime('now', '+24 hours')
-                    ORDER BY datetime
-                """, (str(year), f"{month:02d}", f"{day:02d}"))
-                results = cursor.fetchall()
-                
-                slots = []
-                for result in results:
-                    slots.append({
-                        'id': result[0],
-                        'datetime': datetime.fromisoformat(result[1]),
-                        'description': result[2]
-                    })
-                
-                return slots
+            period = _day_range(year, month, day)
+            return self._cached_availability(('available', tenant_id) + period,
+                                             lambda now: self._fetch_available_slots_in(tenant_id, period, now))
         except Exception as e:
             logger.error(f"Ошибка при получении доступных слотов за {day}.{month}.{year}: {e}")
             return []
     
+    def _fetch_available_slots_in(self, tenant_id: int, period: Tuple[str, str], now: str) -> List[Dict]:
+        # Период переводится в границы bookable_until: весь запрос — один диапазон idx_time_slots_bookable
+        start, end = ((datetime.fromisoformat(bound) - BOOKING_LEAD).isoformat(' ') for bound in period)
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, datetime, description, capacity - seats_taken
+                FROM time_slots
+                WHERE tenant_id = ? AND bookable_until >= ? AND bookable_until < ?
+                AND is_booked = 0
+                AND bookable_until > ?
+                ORDER BY bookable_until
+            """, (tenant_id, start, end, now))
+            results = cursor.fetchall()
+            
+            slots = []
+            for result in results:
+                slots.append({
+                    'id': result[0],
+                    'datetime': datetime.fromisoformat(result[1]),
+                    'description': result[2],
+                    'seats_left': result[3]
+                })
+            
+            return slots
+    
     def get_user_role(self, user_id: int) -> str:
         """Получить роль пользователя"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT role FROM users WHERE user_id = ?
-                """, (user_id,))
-                result = cursor.fetchone()
-                
-                if result:
-                    return result[0] or 'user'
-                else:
-                    return 'user'  # По умолчанию обычный пользователь
+            self.sync_cache()
+            return self.cache.get_or_load('users', ('role', user_id), lambda: self._fetch_user_role(user_id))
         except Exception as e:
             logger.error(f"Ошибка при получении роли пользователя {user_id}: {e}")
             return 'user'
     
-    def set_user_role(self, user_id: int, role: str) -> bool:
-        """Установить роль пользователя"""
+    def _fetch_user_role(self, user_id: int) -> str:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT role FROM users WHERE user_id = ?
+            """, (user_id,))
+            result = cursor.fetchone()
+            
+            if result:
+                return result[0] or 'user'
+            else:
+                return 'user'  # По умолчанию обычный пользователь
+    
+    def set_user_role(self, user_id: int, role: str, tenant_id: int = DEFAULT_TENANT_ID) -> bool:
+        """Установить роль пользователя (арендатор задается, если пользователя еще нет в базе)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 cursor = conn.cursor()
                 
                 # Проверяем, существует ли пользователь
@@ -722,18 +1972,838 @@ class Database:
                 if not cursor.fetchone():
                     # Если пользователя нет, добавляем его
                     cursor.execute("""
-                        INSERT INTO users (user_id, username, is_allowed, role)
-                        VALUES (?, 'user', 1, ?)
-                    """, (user_id, role))
+                        INSERT INTO users (user_id, username, is_allowed, role, tenant_id)
+                        VALUES (?, 'user', 1, ?, ?)
+                    """, (user_id, role, tenant_id))
                 else:
                     # Обновляем роль существующего пользователя
                     cursor.execute("""
                         UPDATE users SET role = ? WHERE user_id = ?
                     """, (role, user_id))
                 
+                self._touch(cursor, 'users')
                 conn.commit()
+                self.cache.bump('users')
                 return True
         except Exception as e:
             logger.error(f"Ошибка при установке роли пользователя {user_id}: {e}")
             return False
+    
+    def get_admins(self, tenant_id: int = DEFAULT_TENANT_ID) -> list:
+        """Получить администраторов арендатора"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT user_id, username FROM users WHERE role = 'admin' AND tenant_id = ?
+                """, (tenant_id,))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Ошибка при получении списка администраторов: {e}")
+            return []
+    
+    def get_user_tenant(self, user_id: int) -> Optional[int]:
+        """Получить арендатора пользователя (None, если пользователя нет в базе)"""
+        try:
+            self.sync_cache()
+            return self.cache.get_or_load('users', ('tenant', user_id), lambda: self._fetch_user_tenant(user_id))
+        except Exception as e:
+            logger.error(f"Ошибка при получении арендатора пользователя {user_id}: {e}")
+            return None
+    
+    def _fetch_user_tenant(self, user_id: int) -> Optional[int]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT tenant_id FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    
+    def set_user_tenant(self, user_id: int, tenant_id: int) -> bool:
+        """Перевести пользователя к другому арендатору"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE users SET tenant_id = ? WHERE user_id = ?", (tenant_id, user_id))
+                self._touch(cursor, 'users')
+                conn.commit()
+                self.cache.bump('users')
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при смене арендатора пользователя {user_id}: {e}")
+            return False
+    
+    def add_tenant(self, name: str, slug: Optional[str] = None, group_id: Optional[int] = None) -> int:
+        """Добавить арендатора (автошколу или инструктора)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO tenants (name, slug, group_id) VALUES (?, ?, ?)
+                """, (name, slug, group_id))
+                self._touch(cursor, 'tenants')
+                conn.commit()
+                self.cache.bump('tenants')
+                return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении арендатора {name}: {e}")
+            return -1
+    
+    def ensure_tenant(self, name: str, slug: str, group_id: Optional[int] = None) -> int:
+        """Создать арендатора с кодом `slug`, если его еще нет; группа задается, если еще не настроена"""
+        tenant = self.get_tenant_by_slug(slug)
+        if tenant:
+            if tenant['group_id'] is None and group_id:
+                self.set_tenant_group(tenant['id'], group_id)
+            return tenant['id']
+        return self.add_tenant(name, slug, group_id)
+    
+    def get_tenants(self) -> List[Dict]:
+        """Получить всех арендаторов"""
+        try:
+            self.sync_cache()
+            return list(self.cache.get_or_load('tenants', 'all', self._fetch_tenants))
+        except Exception as e:
+            logger.error(f"Ошибка при получении арендаторов: {e}")
+            return []
+    
+    def _fetch_tenants(self) -> List[Dict]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, slug, group_id FROM tenants ORDER BY id")
+            return [
+                {'id': row[0], 'name': row[1], 'slug': row[2], 'group_id': row[3]}
+                for row in cursor.fetchall()
+            ]
+    
+    def get_tenant(self, tenant_id: int) -> Optional[Dict]:
+        """Получить арендатора по ID"""
+        for tenant in self.get_tenants():
+            if tenant['id'] == tenant_id:
+                return tenant
+        return None
+    
+    def get_tenant_by_slug(self, slug: str) -> Optional[Dict]:
+        """Получить арендатора по коду из deep link"""
+        for tenant in self.get_tenants():
+            if tenant['slug'] == slug:
+                return tenant
+        return None
+    
+    def get_tenant_by_group(self, group_id: int) -> Optional[Dict]:
+        """Получить арендатора по ID группы доступа"""
+        for tenant in self.get_tenants():
+            if tenant['group_id'] == group_id:
+                return tenant
+        return None
+    
+    def set_tenant_group(self, tenant_id: int, group_id: int) -> bool:
+        """Установить группу доступа арендатора"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE tenants SET group_id = ? WHERE id = ?", (group_id, tenant_id))
+                self._touch(cursor, 'tenants')
+                conn.commit()
+                self.cache.bump('tenants')
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при установке группы арендатора {tenant_id}: {e}")
+            return False
+    
+    def get_group_member(self, group_id: int, user_id: int) -> Optional[bool]:
+        """Состоит ли пользователь в группе по таблице group_members (None — неизвестно)"""
+        try:
+            self.sync_cache()
+            return self.cache.get_or_load('members', (group_id, user_id),
+                                          lambda: self._fetch_group_member(group_id, user_id))
+        except Exception as e:
+            logger.error(f"Ошибка при проверке членства {user_id} в группе {group_id}: {e}")
+            return None
+    
+    def _fetch_group_member(self, group_id: int, user_id: int) -> Optional[bool]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT is_member FROM group_members WHERE group_id = ? AND user_id = ?",
+                           (group_id, user_id))
+            result = cursor.fetchone()
+            return bool(result[0]) if result else None
+    
+    def set_group_member(self, group_id: int, user_id: int, is_member: bool) -> bool:
+        """Записать членство пользователя в группе (обновление chat_member или проверка в Telegram)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO group_members (group_id, user_id, is_member) VALUES (?, ?, ?)
+                    ON CONFLICT (group_id, user_id) DO UPDATE
+                    SET is_member = excluded.is_member, checked_at = CURRENT_TIMESTAMP
+                """, (group_id, user_id, int(is_member)))
+                self._touch(cursor, 'members')
+                conn.commit()
+                self.cache.bump('members')
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка при записи членства {user_id} в группе {group_id}: {e}")
+            return False
+    
+    def get_stale_group_members(self, group_id: int, tenant_id: int, max_age: float, limit: int = 50) -> List[int]:
+        """
+        Пользователи арендатора, чье членство в группе не подтверждалось дольше max_age секунд
+        (или не известно), — для редкой сверки с Telegram. Сначала давно не проверенные.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT u.user_id FROM users u
+                    LEFT JOIN group_members m ON m.group_id = ? AND m.user_id = u.user_id
+                    WHERE u.tenant_id = ? AND (m.checked_at IS NULL OR m.checked_at < datetime('now', ?))
+                    ORDER BY m.checked_at IS NOT NULL, m.checked_at, u.user_id
+                    LIMIT ?
+                """, (group_id, tenant_id, f"-{max_age} seconds", limit))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка при выборке участников группы {group_id} для сверки: {e}")
+            return []
+    
+    def try_acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """
+        Захватить или продлить аренду `name` на ttl секунд.
+        
+        Успешно, если аренда свободна, истекла или уже принадлежит `holder`.
+        """
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE
+                    SET holder = excluded.holder, expires_at = excluded.expires_at
+                    WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+                """, (name, holder, now + ttl, now))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при захвате аренды {name}: {e}")
+            return False
+    
+    def release_lease(self, name: str, holder: str) -> bool:
+        """Освободить аренду, если она принадлежит `holder`"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении аренды {name}: {e}")
+            return False
+    
+    def get_setting(self, key: str, default=None):
+        """Получить общую настройку (значение хранится в JSON)"""
+        try:
+            self.sync_cache()
+            value = self.cache.get_or_load('settings', key, lambda: self._fetch_setting(key))
+            return default if value is None else value
+        except Exception as e:
+            logger.error(f"Ошибка при получении настройки {key}: {e}")
+            return default
+    
+    def _fetch_setting(self, key: str):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
+            result = cursor.fetchone()
+            return json.loads(result[0]) if result else None
+    
+    def set_setting(self, key: str, value) -> bool:
+        """Сохранить общую настройку (видна всем процессам)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO settings (key, value) VALUES (?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+                """, (key, json.dumps(value, ensure_ascii=False)))
+                self._touch(cursor, 'settings')
+                conn.commit()
+                self.cache.bump('settings')
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении настройки {key}: {e}")
+            return False
+    
+    def get_user_state(self, user_id: int, key: str, default=None, max_age: Optional[float] = None):
+        """Получить состояние диалога пользователя (старше max_age секунд с последней записи — как отсутствующее)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                if max_age is None:
+                    cursor.execute("SELECT value FROM user_state WHERE user_id = ? AND key = ?", (user_id, key))
+                else:
+                    cursor.execute("""
+                        SELECT value FROM user_state
+                        WHERE user_id = ? AND key = ? AND updated_at >= datetime('now', ?)
+                    """, (user_id, key, f"-{max_age} seconds"))
+                result = cursor.fetchone()
+                return json.loads(result[0]) if result else default
+        except Exception as e:
+            logger.error(f"Ошибка при получении состояния пользователя {user_id}: {e}")
+            return default
+    
+    def set_user_state(self, user_id: int, key: str, value) -> bool:
+        """Сохранить состояние диалога пользователя"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO user_state (user_id, key, value) VALUES (?, ?, ?)
+                    ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+                """, (user_id, key, json.dumps(value, ensure_ascii=False)))
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояния пользователя {user_id}: {e}")
+            return False
+    
+    def clear_user_state(self, user_id: int, key: str) -> bool:
+        """Удалить состояние диалога пользователя. Возвращает True, если оно было"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM user_state WHERE user_id = ? AND key = ?", (user_id, key))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при удалении состояния пользователя {user_id}: {e}")
+            return False
+    
+    def set_user_states(self, items: List[Tuple[int, str, object]]) -> bool:
+        """Сохранить состояния нескольких пользователей одной транзакцией (значение None удаляет состояние)"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany("""
+                    INSERT INTO user_state (user_id, key, value) VALUES (?, ?, ?)
+                    ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+                """, [(user_id, key, json.dumps(value, ensure_ascii=False))
+                      for user_id, key, value in items if value is not None])
+                cursor.executemany("DELETE FROM user_state WHERE user_id = ? AND key = ?",
+                                   [(user_id, key) for user_id, key, value in items if value is None])
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояний пользователей: {e}")
+            return False
+    
+    def purge_user_state(self, max_age: float, batch_size: int = 500) -> int:
+        """Удалить состояния, не менявшиеся max_age секунд (брошенные диалоги). Возвращает число удаленных"""
+        purged = 0
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # Небольшими транзакциями: запись в базу другими процессами не ждет долго
+                while True:
+                    cursor.execute("""
+                        DELETE FROM user_state WHERE rowid IN (
+                            SELECT rowid FROM user_state WHERE updated_at < datetime('now', ?) LIMIT ?
+                        )
+                    """, (f"-{max_age} seconds", batch_size))
+                    conn.commit()
+                    purged += cursor.rowcount
+                    if cursor.rowcount < batch_size:
+                        break
+            if purged:
+                logger.info(f"Удалено брошенных состояний диалогов: {purged}")
+            return purged
+        except Exception as e:
+            logger.error(f"Ошибка при удалении старых состояний диалогов: {e}")
+            return purged
+    
+    def get_calendar_token(self, user_id: int) -> Optional[str]:
+        """Токен ленты .ics пользователя (создается при первом запросе). None — пользователя нет"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT token FROM calendar_tokens WHERE user_id = ?", (user_id,))
+                result = cursor.fetchone()
+                if result:
+                    return result[0]
+                if not cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone():
+                    return None
+                token = secrets.token_urlsafe(24)
+                # Токен мог создать другой процесс между проверкой и вставкой — тогда возвращается его токен
+                cursor.execute("INSERT OR IGNORE INTO calendar_tokens (user_id, token) VALUES (?, ?)", (user_id, token))
+                conn.commit()
+                return cursor.execute("SELECT token FROM calendar_tokens WHERE user_id = ?", (user_id,)).fetchone()[0]
+        except Exception as e:
+            logger.error(f"Ошибка при получении токена календаря пользователя {user_id}: {e}")
+            return None
+    
+    def reset_calendar_token(self, user_id: int) -> Optional[str]:
+        """Выдать новый токен ленты .ics; старая ссылка перестает работать"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                if not cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone():
+                    return None
+                token = secrets.token_urlsafe(24)
+                cursor.execute("""
+                    INSERT INTO calendar_tokens (user_id, token) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET token = excluded.token, created_at = CURRENT_TIMESTAMP
+                """, (user_id, token))
+                self._touch(cursor, 'users')
+                conn.commit()
+                self.cache.bump('users')
+                return token
+        except Exception as e:
+            logger.error(f"Ошибка при смене токена календаря пользователя {user_id}: {e}")
+            return None
+    
+    def get_user_by_calendar_token(self, token: str) -> Optional[int]:
+        """ID пользователя по токену ленты .ics (None — токен неизвестен или доступ закрыт)"""
+        try:
+            self.sync_cache()
+            return self.cache.get_or_load('users', ('calendar', token), lambda: self._fetch_calendar_user(token))
+        except Exception as e:
+            logger.error(f"Ошибка при проверке токена календаря: {e}")
+            return None
+    
+    def _fetch_calendar_user(self, token: str) -> Optional[int]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT u.user_id FROM calendar_tokens ct
+                JOIN users u ON u.user_id = ct.user_id
+                WHERE ct.token = ? AND u.is_allowed = 1
+            """, (token,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    
+    def join_waitlist(self, slot_id: int, user_id: int) -> int:
+        """
+        Встать в лист ожидания слота без свободных мест (повторный вызов ничего не меняет).
 
+        Возвращает место в очереди; 0 — встать нельзя: в слоте есть места, пользователь уже записан,
+        слот не найден или до него меньше 24 часов.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # Проверка и вставка — один запрос: слот может освободиться в другом процессе
+                cursor.execute("""
+                    INSERT OR IGNORE INTO waitlist (slot_id, user_id)
+                    SELECT :slot_id, :user_id WHERE EXISTS (
+                        SELECT 1 FROM time_slots
+                        WHERE id = :slot_id AND seats_taken >= capacity
+                        AND bookable_until > :now
+                    ) AND NOT EXISTS (
+                        SELECT 1 FROM bookings
+                        WHERE slot_id = :slot_id AND user_id = :user_id AND cancelled_at IS NULL
+                    )
+                """, {'slot_id': slot_id, 'user_id': user_id, 'now': self.clock.bucket().isoformat(' ')})
+                conn.commit()
+                cursor.execute("""
+                    SELECT COUNT(*) FROM waitlist
+                    WHERE slot_id = ? AND id <= (SELECT id FROM waitlist WHERE slot_id = ? AND user_id = ?)
+                """, (slot_id, slot_id, user_id))
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении в лист ожидания: {e}")
+            return 0
+    
+    def leave_waitlist(self, slot_id: int, user_id: int) -> bool:
+        """Выйти из листа ожидания слота"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM waitlist WHERE slot_id = ? AND user_id = ?", (slot_id, user_id))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Ошибка при выходе из листа ожидания: {e}")
+            return False
+    
+    def get_user_waitlist(self, user_id: int) -> List[Dict]:
+        """Будущие слоты, которые ждет пользователь, с местом в очереди"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT w.slot_id, ts.datetime, ts.description,
+                           (SELECT COUNT(*) FROM waitlist w2 WHERE w2.slot_id = w.slot_id AND w2.id <= w.id)
+                    FROM waitlist w
+                    JOIN time_slots ts ON ts.id = w.slot_id
+                    WHERE w.user_id = ? AND ts.datetime > ?
+                    ORDER BY ts.datetime, w.slot_id
+                """, (user_id, self.clock.now().isoformat(' ')))
+                return [
+                    {'slot_id': row[0], 'datetime': datetime.fromisoformat(row[1]), 'description': row[2],
+                     'position': row[3]}
+                    for row in cursor.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Ошибка при получении листа ожидания пользователя: {e}")
+            return []
+    
+    def take_notifications(self, limit: int = 100, retry_delay: float = 300,
+                           max_attempts: int = 5) -> List[Dict]:
+        """
+        Забрать исходящие уведомления для отправки.
+
+        Уведомление остается в очереди, пока его не подтвердит ack_notifications: неотправленное
+        (ошибка отправки или остановка процесса) выдается снова через retry_delay секунд, после
+        max_attempts попыток удаляется. Пока уведомление забрано, другие процессы его не получают.
+        """
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # Пустая очередь — обычный случай; проверка не блокирует запись
+                if not cursor.execute("""
+                    SELECT 1 FROM notifications WHERE claimed_at IS NULL OR claimed_at < ? LIMIT 1
+                """, (now - retry_delay,)).fetchone():
+                    return []
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("DELETE FROM notifications WHERE attempts >= ? AND claimed_at < ?",
+                               (max_attempts, now - retry_delay))
+                if cursor.rowcount:
+                    logger.warning(f"Не отправлено за {max_attempts} попыток, удалено уведомлений: {cursor.rowcount}")
+                cursor.execute("""
+                    SELECT id, user_id, kind, slot_id, slot_datetime, description, attempts + 1
+                    FROM notifications WHERE claimed_at IS NULL OR claimed_at < ?
+                    ORDER BY id LIMIT ?
+                """, (now - retry_delay, limit))
+                rows = cursor.fetchall()
+                cursor.executemany("UPDATE notifications SET claimed_at = ?, attempts = ? WHERE id = ?",
+                                   [(now, row[6], row[0]) for row in rows])
+                conn.commit()
+                return [
+                    {'id': row[0], 'user_id': row[1], 'kind': row[2], 'slot_id': row[3],
+                     'datetime': datetime.fromisoformat(row[4]) if row[4] else None, 'description': row[5],
+                     'attempts': row[6]}
+                    for row in rows
+                ]
+        except Exception as e:
+            logger.error(f"Ошибка при получении уведомлений: {e}")
+            return []
+    
+    def ack_notifications(self, notification_ids: List[int]) -> int:
+        """Удалить из очереди отправленные уведомления; возвращает число удаленных"""
+        if not notification_ids:
+            return 0
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.executemany("DELETE FROM notifications WHERE id = ?",
+                                   [(notification_id,) for notification_id in notification_ids])
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка при подтверждении уведомлений: {e}")
+            return 0
+    
+    def get_booking_events(self, slot_id: Optional[int] = None, user_id: Optional[int] = None,
+                           after_id: int = 0, limit: int = 100) -> List[Dict]:
+        """История записей из журнала: события слота или пользователя после события after_id"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                conditions, params = ["id > ?"], [after_id]
+                if slot_id is not None:
+                    conditions.append("slot_id = ?")
+                    params.append(slot_id)
+                if user_id is not None:
+                    conditions.append("user_id = ?")
+                    params.append(user_id)
+                cursor.execute(f"""
+                    SELECT id, event, booking_id, slot_id, user_id, created_at
+                    FROM booking_events
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY id
+                    LIMIT ?
+                """, params + [limit])
+                return [
+                    {'id': row[0], 'event': row[1], 'booking_id': row[2], 'slot_id': row[3],
+                     'user_id': row[4], 'created_at': datetime.fromisoformat(row[5])}
+                    for row in cursor.fetchall()
+                ]
+        except Exception as e:
+            logger.error(f"Ошибка при получении журнала записей: {e}")
+            return []
+    
+    @staticmethod
+    def _replay_booking_log(cursor: sqlite3.Cursor) -> Tuple[Dict[int, Tuple[int, int]], int, int]:
+        """Активные записи по последнему снимку и хвосту журнала: (состояние, последнее событие, применено)"""
+        cursor.execute("SELECT last_event_id, state FROM booking_snapshots ORDER BY id DESC LIMIT 1")
+        snapshot = cursor.fetchone()
+        state, last_event_id = {}, 0
+        if snapshot:
+            last_event_id = snapshot[0]
+            state = {booking_id: (slot_id, user_id) for booking_id, slot_id, user_id in json.loads(snapshot[1])}
+        
+        cursor.execute("""
+            SELECT id, event, booking_id, slot_id, user_id FROM booking_events WHERE id > ? ORDER BY id
+        """, (last_event_id,))
+        replayed = 0
+        for row in cursor:
+            replay_booking_events(state, [row[1:]])
+            last_event_id = row[0]
+            replayed += 1
+        return state, last_event_id, replayed
+    
+    def create_booking_snapshot(self) -> int:
+        """Сохранить снимок активных записей. Возвращает ID последнего события в снимке"""
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                previous = cursor.execute("SELECT MAX(last_event_id) FROM booking_snapshots").fetchone()[0]
+                state, last_event_id, _ = self._replay_booking_log(cursor)
+                if last_event_id == previous:
+                    return last_event_id
+                
+                cursor.execute("INSERT INTO booking_snapshots (last_event_id, state) VALUES (?, ?)", (
+                    last_event_id,
+                    json.dumps([[booking_id, slot_id, user_id]
+                                for booking_id, (slot_id, user_id) in sorted(state.items())])
+                ))
+                cursor.execute("""
+                    DELETE FROM booking_snapshots WHERE id NOT IN (
+                        SELECT id FROM booking_snapshots ORDER BY id DESC LIMIT ?
+                    )
+                """, (BOOKING_SNAPSHOTS_KEPT,))
+                conn.commit()
+                logger.info(f"Снимок журнала записей сохранен: {len(state)} активных записей, "
+                            f"событие {last_event_id}")
+                return last_event_id
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении снимка журнала записей: {e}")
+            return -1
+    
+    def rebuild_booking_state(self) -> Dict:
+        """
+        Восстановить текущее состояние записей (bookings.cancelled_at, занятые места слотов)
+        из последнего снимка и журнала. Возвращает количество исправленных строк.
+        """
+        try:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                # Запись блокируется сразу: журнал не должен измениться между чтением и исправлением
+                cursor.execute("BEGIN IMMEDIATE")
+                state, _, replayed = self._replay_booking_log(cursor)
+                
+                cursor.execute("SELECT id FROM bookings WHERE cancelled_at IS NULL")
+                active = {row[0] for row in cursor.fetchall()}
+                cursor.executemany("UPDATE bookings SET cancelled_at = CURRENT_TIMESTAMP WHERE id = ?",
+                                   [(booking_id,) for booking_id in active - state.keys()])
+                cursor.executemany("UPDATE bookings SET cancelled_at = NULL WHERE id = ?",
+                                   [(booking_id,) for booking_id in state.keys() - active])
+                bookings_fixed = len(active ^ state.keys())
+                
+                seats, bookers = {}, {}
+                for slot_id, user_id in state.values():
+                    seats[slot_id] = seats.get(slot_id, 0) + 1
+                    bookers[slot_id] = user_id
+                cursor.execute("""
+                    SELECT id, capacity, seats_taken, is_booked, booked_by FROM time_slots
+                    WHERE seats_taken > 0 OR is_booked = 1 OR booked_by IS NOT NULL
+                """)
+                current = {row[0]: row[1:] for row in cursor.fetchall()}
+                # Слоты с записями по журналу, но без занятых мест в таблице: нужна их вместимость
+                missing = list(seats.keys() - current.keys())
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    cursor.execute(f"""
+                        SELECT id, capacity, seats_taken, is_booked, booked_by FROM time_slots
+                        WHERE id IN ({','.join('?' * len(chunk))})
+                    """, chunk)
+                    current.update({row[0]: row[1:] for row in cursor.fetchall()})
+                fixes = []
+                for slot_id, (capacity, seats_taken, is_booked, booked_by) in current.items():
+                    taken = seats.get(slot_id, 0)
+                    want = (taken, taken >= capacity, bookers.get(slot_id) if capacity == 1 and taken else None)
+                    if (seats_taken, bool(is_booked), booked_by) != want:
+                        fixes.append(want + (slot_id,))
+                cursor.executemany("UPDATE time_slots SET seats_taken = ?, is_booked = ?, booked_by = ? WHERE id = ?",
+                                   fixes)
+                slots_fixed = len(fixes)
+                
+                self._touch(cursor, 'slots')
+                conn.commit()
+                self.cache.bump('slots')
+                result = {'events_replayed': replayed, 'bookings_fixed': bookings_fixed, 'slots_fixed': slots_fixed}
+                logger.info(f"Состояние записей восстановлено из журнала: {result}")
+                return result
+        except Exception as e:
+            logger.error(f"Ошибка при восстановлении состояния записей: {e}")
+            return {'events_replayed': 0, 'bookings_fixed': 0, 'slots_fixed': 0}
+    
+    def archive_old_data(self, before: datetime, batch_size: int = 500) -> Dict:
+        """
+        Перенести в архив слоты раньше `before` вместе с их записями и записи, отмененные раньше `before`.
+        
+        Перенос идет пачками по batch_size строк, каждая в своей короткой транзакции, поэтому
+        запись в базу не блокируется надолго. Возвращает количество перенесенных слотов и записей.
+        """
+        cutoff = before.isoformat(' ')
+        # cancelled_at хранится в UTC (CURRENT_TIMESTAMP), время слотов — местное
+        cancelled_cutoff = before.astimezone(timezone.utc).replace(tzinfo=None).isoformat(' ', 'seconds')
+        archived = {'slots': 0, 'bookings': 0}
+        try:
+            # Граница объявляется до переноса: выборки за более ранние даты сразу читают и архив
+            current = self.get_setting('archive_cutoff')
+            if current is None or current < cutoff:
+                self.set_setting('archive_cutoff', cutoff)
+            
+            tenant_ids = [tenant['id'] for tenant in self.get_tenants()]
+            for tenant_id in tenant_ids:
+                while True:
+                    moved = self._archive_slots_batch(tenant_id, cutoff, batch_size)
+                    archived['slots'] += moved[0]
+                    archived['bookings'] += moved[1]
+                    if moved[0] < batch_size:
+                        break
+            
+            last_id = 0
+            while True:
+                moved, last_id = self._archive_cancelled_batch(cancelled_cutoff, last_id, batch_size)
+                archived['bookings'] += moved
+                if last_id is None:
+                    break
+            
+            if archived['slots'] or archived['bookings']:
+                logger.info(f"В архив перенесено: {archived['slots']} слотов, {archived['bookings']} записей")
+            return archived
+        except Exception as e:
+            logger.error(f"Ошибка при переносе данных в архив: {e}")
+            return archived
+    
+    def _archive_slots_batch(self, tenant_id: int, cutoff: str, batch_size: int) -> Tuple[int, int]:
+        """Перенести одну пачку прошедших слотов арендатора с их записями. Возвращает (слотов, записей)"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id FROM time_slots WHERE tenant_id = ? AND datetime < ? ORDER BY datetime LIMIT ?
+            """, (tenant_id, cutoff, batch_size))
+            slot_ids = [row[0] for row in cursor.fetchall()]
+            if not slot_ids:
+                return 0, 0
+            
+            placeholders = ','.join('?' * len(slot_ids))
+            cursor.execute(f"""
+                INSERT INTO time_slots_archive ({SLOT_COLUMNS})
+                SELECT {SLOT_COLUMNS} FROM time_slots WHERE id IN ({placeholders})
+            """, slot_ids)
+            cursor.execute(f"""
+                INSERT INTO bookings_archive ({BOOKING_COLUMNS})
+                SELECT {BOOKING_COLUMNS} FROM bookings WHERE slot_id IN ({placeholders})
+            """, slot_ids)
+            bookings = cursor.rowcount
+            cursor.execute(f"DELETE FROM bookings WHERE slot_id IN ({placeholders})", slot_ids)
+            cursor.execute(f"DELETE FROM time_slots WHERE id IN ({placeholders})", slot_ids)
+            cursor.execute(f"DELETE FROM waitlist WHERE slot_id IN ({placeholders})", slot_ids)
+            self._append_events(cursor, [('slot_archived', None, slot_id, None) for slot_id in slot_ids])
+            self._touch(cursor, 'slots')
+            conn.commit()
+            self.cache.bump('slots')
+            return len(slot_ids), bookings
+    
+    def _archive_cancelled_batch(self, cutoff: str, last_id: int, batch_size: int) -> Tuple[int, Optional[int]]:
+        """
+        Перенести пачку записей, отмененных раньше `cutoff`, начиная после записи last_id.
+        Возвращает (перенесено, ID последней просмотренной записи или None, если записи кончились).
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            # Проход по первичному ключу: каждая пачка продолжает с места предыдущей
+            cursor.execute("""
+                SELECT id, cancelled_at IS NOT NULL AND cancelled_at < ? FROM bookings
+                WHERE id > ? ORDER BY id LIMIT ?
+            """, (cutoff, last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0, None
+            
+            booking_ids = [booking_id for booking_id, expired in rows if expired]
+            if booking_ids:
+                placeholders = ','.join('?' * len(booking_ids))
+                cursor.execute(f"""
+                    INSERT INTO bookings_archive ({BOOKING_COLUMNS})
+                    SELECT {BOOKING_COLUMNS} FROM bookings WHERE id IN ({placeholders})
+                """, booking_ids)
+                cursor.execute(f"DELETE FROM bookings WHERE id IN ({placeholders})", booking_ids)
+                self._touch(cursor, 'slots')
+                conn.commit()
+                self.cache.bump('slots')
+            return len(booking_ids), rows[-1][0] if len(rows) == batch_size else None
+    
+    def iter_slots(self, tenant_id: int = DEFAULT_TENANT_ID, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> Iterator[Dict]:
+        """
+        Слоты арендатора за период [start, end) по возрастанию времени, включая архив.
+        
+        Строки читаются курсором по мере перебора, а не загружаются списком: годовая выгрузка
+        не держится в памяти целиком.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute("""
+                SELECT ts.id, ts.datetime, ts.description, ts.is_booked, ts.booked_by, u.username,
+                       ts.capacity, ts.seats_taken
+                FROM all_time_slots ts
+                LEFT JOIN users u ON u.user_id = ts.booked_by
+                WHERE ts.tenant_id = ? AND ts.datetime >= ? AND ts.datetime < ?
+                ORDER BY ts.datetime
+            """, (tenant_id,) + _period(start, end))
+            for row in cursor:
+                yield {
+                    'id': row[0],
+                    'datetime': datetime.fromisoformat(row[1]),
+                    'description': row[2],
+                    'is_booked': bool(row[3]),
+                    'booked_by': row[4],
+                    'username': row[5],
+                    'capacity': row[6],
+                    'seats_taken': row[7]
+                }
+    
+    def iter_bookings(self, tenant_id: int = DEFAULT_TENANT_ID, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Записи (вместе с отмененными) на слоты арендатора за период [start, end), включая архив"""
+        with self._connect() as conn:
+            cursor = conn.execute("""
+                SELECT b.id, b.slot_id, ts.datetime, ts.description, b.user_id, u.username,
+                       b.created_at, b.cancelled_at
+                FROM all_time_slots ts
+                JOIN all_bookings b ON b.slot_id = ts.id
+                LEFT JOIN users u ON u.user_id = b.user_id
+                WHERE ts.tenant_id = ? AND ts.datetime >= ? AND ts.datetime < ?
+                ORDER BY ts.datetime, b.id
+            """, (tenant_id,) + _period(start, end))
+            for row in cursor:
+                yield {
+                    'id': row[0],
+                    'slot_id': row[1],
+                    'datetime': datetime.fromisoformat(row[2]),
+                    'description': row[3],
+                    'user_id': row[4],
+                    'username': row[5],
+                    'created_at': row[6],
+                    'cancelled_at': row[7]
+                }
+    
+    def iter_users(self, tenant_id: int = DEFAULT_TENANT_ID) -> Iterator[Dict]:
+        """Пользователи арендатора по возрастанию ID"""
+        with self._connect() as conn:
+            cursor = conn.execute("""
+                SELECT user_id, username, role, is_allowed, created_at
+                FROM users WHERE tenant_id = ? ORDER BY user_id
+            """, (tenant_id,))
+            for row in cursor:
+                yield {
+                    'user_id': row[0],
+                    'username': row[1],
+                    'role': row[2] or 'user',
+                    'is_allowed': bool(row[3]),
+                    'created_at': row[4]
+                }
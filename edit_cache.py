@@ -0,0 +1,114 @@
+"""
+Пропуск повторных правок сообщений
+
+Навигация по календарю и обновление дня вызывают edit_message_text, даже если текст и кнопки не
+изменились; Telegram отвечает "message is not modified" после полного запроса, который к тому же
+учитывается в лимитах. EditCache помнит отпечаток (хэш текста, разметки и кнопок) последней правки
+каждого сообщения и вместе с ним — состояние сообщения, которое вернул Telegram. Правка пропускается,
+только если отпечаток совпал и сообщение в callback'е не менялось с тех пор: правка другим
+процессом (при WORKERS > 1) меняет состояние, и тогда правка отправляется.
+"""
+
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from telegram.error import BadRequest
+
+from config import EDIT_CACHE_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(value) -> str:
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _markup(reply_markup):
+    return reply_markup.to_dict() if reply_markup is not None else None
+
+
+def edit_fingerprint(text: str, kwargs: dict) -> str:
+    """Отпечаток запроса правки: текст и все параметры (parse_mode, кнопки и т. д.)"""
+    return _digest([text, {key: _markup(value) if key == 'reply_markup' else value for key, value in kwargs.items()}])
+
+
+def message_state(message) -> str:
+    """Отпечаток сообщения в том виде, в каком его хранит Telegram"""
+    return _digest([message.text, message.edit_date, _markup(message.reply_markup)])
+
+
+class EditCache:
+    """Отпечатки последних правок сообщений: (chat_id, message_id) -> (отпечаток, состояние); LRU"""
+
+    def __init__(self, max_messages: int = EDIT_CACHE_MESSAGES, saved_counter=None):
+        self.max_messages = max_messages
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Счетчики: отправленные правки, пропущенные без запроса, отклоненные Telegram как неизмененные
+        self.sent = 0
+        self.saved = 0
+        self.not_modified = 0
+        self.saved_counter = saved_counter  # Счетчик Prometheus, если метрики включены
+
+    def is_current(self, message, fingerprint: str) -> bool:
+        """Показывает ли сообщение уже результат правки с этим отпечатком"""
+        key = (message.chat_id, message.message_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            self._entries.move_to_end(key)
+        return entry == (fingerprint, message_state(message))
+
+    def remember(self, message, fingerprint: str):
+        """Запомнить отпечаток правки и состояние сообщения после нее"""
+        key = (message.chat_id, message.message_id)
+        state = message_state(message)
+        with self._lock:
+            self._entries[key] = (fingerprint, state)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_messages:
+                self._entries.popitem(last=False)
+
+    def count_saved(self):
+        self.saved += 1
+        if self.saved_counter is not None:
+            self.saved_counter.inc()
+
+    def stats(self) -> dict:
+        return {'sent': self.sent, 'saved': self.saved, 'not_modified': self.not_modified,
+                'tracked': len(self._entries)}
+
+
+async def safe_edit(cache: EditCache, query, text: str, **kwargs) -> Optional[object]:
+    """
+    edit_message_text для callback'а без повторной отправки того же содержимого.
+
+    Callback к этому моменту уже подтвержден (query.answer() в handle_callback), поэтому при пропуске
+    пользователь сразу получает ответ. Возвращает сообщение после правки (или текущее при пропуске).
+    """
+    message = query.message
+    fingerprint = edit_fingerprint(text, kwargs)
+    if message is not None and cache.is_current(message, fingerprint):
+        cache.count_saved()
+        return message
+
+    try:
+        result = await query.edit_message_text(text, **kwargs)
+    except BadRequest as e:
+        if 'message is not modified' not in str(e).lower() or message is None:
+            raise
+        # Отпечаток был неизвестен (перезапуск, вытеснение из LRU): запоминаем, следующая правка не уйдет
+        cache.not_modified += 1
+        cache.remember(message, fingerprint)
+        return message
+
+    cache.sent += 1
+    # Для сообщений inline-режима Telegram возвращает True вместо сообщения
+    if result is not True and result is not None:
+        cache.remember(result, fingerprint)
+    return result
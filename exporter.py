@@ -0,0 +1,186 @@
+"""
+Выгрузка слотов, записей и пользователей в CSV и iCalendar
+
+Строки читаются генераторами хранилища (iter_slots, iter_bookings, iter_users) и сразу пишутся
+во временный файл: ни список строк, ни документ целиком в памяти не собираются. Файл остается
+в памяти до EXPORT_SPOOL_MAX_BYTES и затем переносится на диск.
+"""
+
+import io
+import csv
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from database import DEFAULT_TENANT_ID
+from config import DEFAULT_SLOT_DURATION, EXPORT_SPOOL_MAX_BYTES, EXPORT_PROGRESS_EVERY
+
+# Что выгружается: вид -> (метод хранилища, столбцы CSV)
+KINDS = {
+    'bookings': ('iter_bookings', ['id', 'slot_id', 'datetime', 'description', 'user_id', 'username',
+                                   'created_at', 'cancelled_at']),
+    'slots': ('iter_slots', ['id', 'datetime', 'description', 'capacity', 'seats_taken', 'is_booked', 'booked_by',
+                             'username']),
+    'users': ('iter_users', ['user_id', 'username', 'role', 'is_allowed', 'created_at']),
+}
+
+# Форматы для каждого вида: у пользователей нет времени, поэтому только CSV
+FORMATS = {
+    'bookings': ('csv', 'ics'),
+    'slots': ('csv', 'ics'),
+    'users': ('csv',),
+}
+
+# Текст копится в буфере и переносится в файл порциями такого размера
+_CHUNK_CHARS = 64 * 1024
+
+
+def _ical_escape(text) -> str:
+    """Экранирование текстового значения iCalendar (RFC 5545, 3.3.11)"""
+    return (str(text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _ical_fold(line: str) -> str:
+    """Перенос строки длиннее 75 октетов; продолжение начинается с пробела. Символы UTF-8 не разрезаются"""
+    if len(line.encode('utf-8')) <= 75:
+        return line + '\r\n'
+    parts, current, size = [], '', 0
+    for char in line:
+        length = len(char.encode('utf-8'))
+        if size + length > (75 if not parts else 74):
+            parts.append(current)
+            current, size = '', 0
+        current += char
+        size += length
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ical_time(value: datetime) -> str:
+    """Время для DTSTART/DTEND: без часового пояса (местное время расписания) или в UTC с суффиксом Z"""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def ical_header(name: str) -> str:
+    """Начало календаря VCALENDAR с названием `name`"""
+    return ''.join(_ical_fold(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//schedule_bot//RU',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_ical_escape(name)}',
+    ))
+
+
+ICAL_FOOTER = 'END:VCALENDAR\r\n'
+
+
+def ical_event(uid: str, start: datetime, summary: str, description: str = '', status: Optional[str] = None,
+               stamp: Optional[datetime] = None) -> str:
+    """Событие VEVENT длительностью DEFAULT_SLOT_DURATION минут"""
+    stamp = stamp or datetime.now(timezone.utc)
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{ical_time(stamp)}',
+        f'DTSTART:{ical_time(start)}',
+        f'DTEND:{ical_time(start + timedelta(minutes=DEFAULT_SLOT_DURATION))}',
+        f'SUMMARY:{_ical_escape(summary)}',
+    ]
+    if description:
+        lines.append(f'DESCRIPTION:{_ical_escape(description)}')
+    if status:
+        lines.append(f'STATUS:{status}')
+    lines.append('END:VEVENT')
+    return ''.join(_ical_fold(line) for line in lines)
+
+
+def _booking_event(row: Dict, stamp: datetime) -> str:
+    user = f"@{row['username']}" if row['username'] else f"ID {row['user_id']}"
+    return ical_event(f"booking-{row['id']}@schedule_bot", row['datetime'], f"{row['description']} — {user}",
+                      f"Пользователь {user} (ID: {row['user_id']}), слот {row['slot_id']}",
+                      'CANCELLED' if row['cancelled_at'] else 'CONFIRMED', stamp)
+
+
+def _slot_event(row: Dict, stamp: datetime) -> str:
+    if row['capacity'] > 1:
+        # Групповое занятие: записавшиеся — в выгрузке записей
+        description = f"Занято мест: {row['seats_taken']} из {row['capacity']}"
+    elif row['is_booked']:
+        user = f"@{row['username']}" if row['username'] else f"ID {row['booked_by']}"
+        description = f"Занят: {user}"
+    else:
+        description = "Свободен"
+    return ical_event(f"slot-{row['id']}@schedule_bot", row['datetime'], row['description'], description,
+                      'CONFIRMED' if row['seats_taken'] else 'TENTATIVE', stamp)
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, bool):
+        return int(value)
+    return '' if value is None else value
+
+
+def export_filename(kind: str, fmt: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> str:
+    """Имя файла выгрузки; end — исключающая граница периода"""
+    period = ''
+    if start and end:
+        period = f"_{start:%Y%m%d}-{end - timedelta(days=1):%Y%m%d}"
+    return f"{kind}{period}.{fmt}"
+
+
+def export_rows(storage, kind: str, fmt: str = 'csv', tenant_id: int = DEFAULT_TENANT_ID,
+                start: Optional[datetime] = None, end: Optional[datetime] = None,
+                progress: Optional[Callable[[int], None]] = None) -> Tuple[tempfile.SpooledTemporaryFile, int]:
+    """
+    Записать строки хранилища во временный файл.
+
+    Выполняется в отдельном потоке: чтение базы и запись файла блокируют. `progress(строк)` вызывается
+    каждые EXPORT_PROGRESS_EVERY строк. Возвращает файл, установленный на начало, и число строк;
+    закрывает файл вызывающий.
+    """
+    if fmt not in FORMATS.get(kind, ()):
+        raise ValueError(f"Выгрузка {kind} в формате {fmt} не поддерживается")
+    method, columns = KINDS[kind]
+    rows: Iterable[Dict] = (getattr(storage, method)(tenant_id) if kind == 'users'
+                            else getattr(storage, method)(tenant_id, start, end))
+
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    buffer = io.StringIO()
+    count = 0
+    try:
+        if fmt == 'csv':
+            # BOM — чтобы Excel открыл кириллицу без выбора кодировки
+            buffer.write('\ufeff')
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            write = lambda row: writer.writerow([_csv_value(row[column]) for column in columns])
+        else:
+            stamp = datetime.now(timezone.utc)
+            to_event = _booking_event if kind == 'bookings' else _slot_event
+            buffer.write(ical_header("Записи" if kind == 'bookings' else "Слоты"))
+            write = lambda row: buffer.write(to_event(row, stamp))
+
+        for row in rows:
+            write(row)
+            count += 1
+            if buffer.tell() >= _CHUNK_CHARS:
+                spool.write(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+            if progress and count % EXPORT_PROGRESS_EVERY == 0:
+                progress(count)
+
+        if fmt == 'ics':
+            buffer.write(ICAL_FOOTER)
+        spool.write(buffer.getvalue().encode('utf-8'))
+        spool.seek(0)
+        return spool, count
+    except Exception:
+        spool.close()
+        raise
@@ -0,0 +1,116 @@
+"""
+Неблокирующее логирование: записи передаются через очередь в отдельный поток,
+который форматирует их и пишет в консоль и файлы
+"""
+
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.config
+import logging.handlers
+from datetime import datetime
+
+# Запись с extra={'sampled': True} — частое сообщение на каждый запрос, которое можно прореживать
+SAMPLED_ATTR = 'sampled'
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записей в JSON Lines"""
+
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает одну из `every` записей с пометкой sampled (отдельно для каждого шаблона сообщения).
+
+    Остальные записи проходят без изменений. Счетчик детерминированный, поэтому первое
+    сообщение каждого вида всегда попадает в лог.
+    """
+
+    def __init__(self, every: int = 1):
+        super().__init__()
+        self.every = max(1, every)
+        self._counters = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or not getattr(record, SAMPLED_ATTR, False):
+            return True
+        key = (record.name, record.msg)
+        count = self._counters.get(key, 0)
+        self._counters[key] = count + 1
+        return count % self.every == 0
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в вызывающем потоке.
+
+    Стандартный prepare() подставляет аргументы и форматирует traceback до помещения в очередь;
+    слушатель работает в этом же процессе, поэтому запись можно передать как есть.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(config: dict, json_logs: bool = False, sample_every: int = 1) -> logging.handlers.QueueListener:
+    """
+    Настроить логирование по словарю dictConfig через очередь.
+
+    Обработчики из `config` переносятся в поток QueueListener, у корневого логгера остается
+    только LazyQueueHandler. При json_logs файловые обработчики пишут JSON Lines.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    config = copy.deepcopy(config)  # копия, чтобы не менять исходный словарь
+    if json_logs:
+        config.setdefault('formatters', {})['json'] = {'()': JsonFormatter}
+        for handler in config.get('handlers', {}).values():
+            if 'filename' in handler:
+                handler['formatter'] = 'json'
+
+    logging.config.dictConfig(config)
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_every))
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Дописать оставшиеся записи и остановить поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
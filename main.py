@@ -1,26 +1,160 @@
+import io
+import os
+import time
+import importlib
+import socket
 import logging
 import asyncio
-import sqlite3
 from datetime import datetime, timedelta, date
+from urllib.parse import urlparse
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from database import Database
-from config import BOT_TOKEN, ADMIN_IDS, ALLOWED_GROUP_ID
+from telegram.ext import (Application, CommandHandler, CallbackQueryHandler, ChatMemberHandler, MessageHandler,
+                          filters, ContextTypes)
+from database import DEFAULT_TENANT_ID, BOOKING_LEAD, search_terms
+from clock import ScheduleClock
+from storage import create_storage
+from sql_profiler import SQLProfiler
+from logging_setup import setup_logging
+from startup import STARTUP_TIMER
+from exporter import FORMATS as EXPORT_FORMATS, export_rows, export_filename
+from user_import import read_users
+from analytics import occupancy_report
+from notifier import Notifier
+from edit_cache import EditCache, safe_edit
+from conversation_state import ConversationStore, StatePersistence
+from config import (BOT_TOKEN, ADMIN_IDS, ALLOWED_GROUP_ID, TENANTS, DATABASE_PATH, STORAGE_BACKEND, METRICS_ENABLED, METRICS_HOST, METRICS_PORT,
+                    SQL_PROFILE_ENABLED, SQL_SLOW_QUERY_MS, SQL_PROFILE_TOP_N,
+                    WORKERS, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+                    CACHE_SYNC_INTERVAL, LEADER_LEASE_SECONDS, GROUP_CHECK_INTERVAL, GROUP_RECONCILE_AGE,
+                    GROUP_RECONCILE_BATCH, BOOKING_SNAPSHOT_INTERVAL,
+                    ARCHIVE_RETENTION_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE,
+                    CALENDAR_FEED_ENABLED, CALENDAR_HOST, CALENDAR_PORT, CALENDAR_PUBLIC_URL, NOTIFY_POLL_INTERVAL,
+                    NOTIFY_RETRY_DELAY, NOTIFY_MAX_ATTEMPTS,
+                    DASHBOARD_ENABLED, DASHBOARD_HOST, DASHBOARD_PORT,
+                    CONVERSATION_PURGE_INTERVAL, IMPORT_MAX_BYTES, IMPORT_MAX_USERS,
+                    IMPORT_CHECK_CONCURRENCY,
+                    DEFAULT_SLOT_DURATION, MAX_SLOTS_PER_DAY, MAX_SLOT_CAPACITY, SCHEDULE_TIMEZONE, AVAILABILITY_BUCKET_SECONDS,
+                    SLOT_GENERATION_HORIZON_DAYS, SLOT_GENERATION_INTERVAL, USERS_PAGE_SIZE, BOOKINGS_PAGE_SIZE, FIND_PAGE_SIZE,
+                    LOGGING_CONFIG, LOG_JSON, LOG_SAMPLE_EVERY)
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования (запись в консоль и файл идет в отдельном потоке)
+setup_logging(LOGGING_CONFIG, json_logs=LOG_JSON, sample_every=LOG_SAMPLE_EVERY)
 logger = logging.getLogger(__name__)
 
 # Инициализация базы данных
 
 class ScheduleBot:
-    def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
-        self.database = Database()
+    def __init__(self, worker_index: int = 0):
+        # Номер процесса-обработчика (0 при запуске одного процесса) и его имя для аренды лидера
+        self.worker_index = worker_index
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        builder = Application.builder().token(BOT_TOKEN)
+        builder.post_init(self.post_init).post_shutdown(self.post_shutdown)
+        # context.user_data хранится в базе; хранилище подключается, когда база открыта
+        self.persistence = StatePersistence()
+        builder.persistence(self.persistence)
+        if METRICS_ENABLED:
+            from metrics import create_instrumented_request
+            builder.request(create_instrumented_request(connection_pool_size=256))
+        self.application = builder.build()
+        self.persistence.application = self.application
+        # Уведомления из очереди в базе отправляются с ограничением частоты; событие будит отправку сразу
+        self.notifier = Notifier(self.application.bot)
+        self.notifications_pending = asyncio.Event()
+        self.edit_cache = EditCache()
+        STARTUP_TIMER.mark("приложение")
+        # "Сейчас" в поясе расписания: от него считаются правила записи и в боте, и в хранилище
+        self.clock = ScheduleClock(SCHEDULE_TIMEZONE, AVAILABILITY_BUCKET_SECONDS)
+        self.database = create_storage(STORAGE_BACKEND, DATABASE_PATH, profiler=SQLProfiler(
+            enabled=SQL_PROFILE_ENABLED,
+            threshold_ms=SQL_SLOW_QUERY_MS,
+            top_n=SQL_PROFILE_TOP_N
+        ), cache_sync_interval=CACHE_SYNC_INTERVAL if WORKERS > 1 else None, clock=self.clock)
+        # Состояние диалогов: LRU в памяти только у единственного процесса
+        self.state = ConversationStore(self.database, cache=WORKERS == 1)
+        self.persistence.store = self.state
+        self.seed_tenants()
+        STARTUP_TIMER.mark("база данных")
+        self.web_servers = {}
         self.setup_handlers()
+        STARTUP_TIMER.mark("обработчики")
+        
+        if METRICS_ENABLED:
+            from metrics import instrument_database, instrument_handlers, metrics_route, MESSAGE_EDITS_SAVED
+            instrument_database(self.database)
+            self.edit_cache.saved_counter = MESSAGE_EDITS_SAVED
+            instrument_handlers(self.application)
+            self.get_web_server(METRICS_HOST, METRICS_PORT + worker_index).add_route("/metrics", metrics_route)
+        
+        if CALENDAR_FEED_ENABLED:
+            from calendar_feed import CalendarFeed, FEED_PREFIX
+            self.calendar_feed = CalendarFeed(self.database)
+            self.get_web_server(CALENDAR_HOST, CALENDAR_PORT + worker_index).add_route(
+                FEED_PREFIX, self.calendar_feed.handle, prefix=True)
+        
+        if DASHBOARD_ENABLED:
+            from dashboard import Dashboard, DASHBOARD_PREFIX
+            self.dashboard = Dashboard(self.database, self.clock)
+            server = self.get_web_server(DASHBOARD_HOST, DASHBOARD_PORT + worker_index)
+            server.add_route(DASHBOARD_PREFIX.rstrip('/'), self.dashboard.handle)
+            server.add_route(DASHBOARD_PREFIX, self.dashboard.handle, prefix=True)
+    
+    def seed_tenants(self):
+        """Создать арендаторов из config.py (основной получает ALLOWED_GROUP_ID)"""
+        self.database.ensure_tenant("Основная", "default", ALLOWED_GROUP_ID)
+        for tenant in TENANTS:
+            self.database.ensure_tenant(tenant['name'], tenant['slug'], tenant.get('group_id'))
+    
+    def get_web_server(self, host: str, port: int):
+        """Получить HTTP-сервер для адреса (серверы с одинаковым адресом общие)"""
+        from web import WebServer
+        key = (host, port)
+        if key not in self.web_servers:
+            self.web_servers[key] = WebServer(host, port)
+        return self.web_servers[key]
+    
+    async def post_init(self, application: Application):
+        """Запуск служебных задач в цикле событий бота"""
+        STARTUP_TIMER.mark("инициализация бота")
+        for server in self.web_servers.values():
+            await server.start()
+        STARTUP_TIMER.log_summary()
+        
+        # Кэши прогреваются в фоне, когда опрос обновлений уже запущен
+        application.create_task(self.prewarm_caches())
+        application.create_task(self.periodic_jobs())
+        application.create_task(self.deliver_notifications())
+    
+    async def prewarm_caches(self):
+        """Прогреть кэши и отложенные импорты после старта опроса"""
+        await asyncio.sleep(0)
+        
+        def prewarm():
+            # Загрузить модуль заранее: календари импортируют его локально при показе
+            importlib.import_module('calendar')
+            now = self.clock.now()
+            next_year, next_month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+            for tenant in self.database.get_tenants():
+                self.database.get_slots_by_month(now.year, now.month, tenant['id'])
+                self.database.get_slots_by_month(next_year, next_month, tenant['id'])
+            for admin_id in ADMIN_IDS:
+                self.database.get_user_role(admin_id)
+        
+        try:
+            await asyncio.to_thread(prewarm)
+            logger.info("Кэши прогреты")
+        except Exception as e:
+            logger.warning("Не удалось прогреть кэши: %s", e)
+    
+    async def post_shutdown(self, application: Application):
+        """Остановка служебных задач"""
+        for server in self.web_servers.values():
+            await server.stop()
+        
+        # Другой процесс сразу становится лидером, не дожидаясь истечения аренды
+        if self.is_leader:
+            self.database.release_lease('leader', self.worker_id)
     
     def setup_handlers(self):
         """Настройка обработчиков команд"""
@@ -29,6 +163,7 @@ class ScheduleBot:
         self.application.add_handler(CommandHandler("help", self.help))
         self.application.add_handler(CommandHandler("schedule", self.show_schedule))
         self.application.add_handler(CommandHandler("my_bookings", self.show_my_bookings))
+        self.application.add_handler(CommandHandler("calendar", self.calendar_link))
         self.application.add_handler(CommandHandler("my_id", self.get_my_id))
         self.application.add_handler(CommandHandler("group_id", self.get_group_id))
         
@@ -36,23 +171,48 @@ class ScheduleBot:
         self.application.add_handler(CommandHandler("admin", self.admin_panel))
         self.application.add_handler(CommandHandler("add_slot", self.add_slot))
         self.application.add_handler(CommandHandler("remove_slot", self.remove_slot))
+        self.application.add_handler(CommandHandler("set_capacity", self.set_capacity))
+        self.application.add_handler(CommandHandler("add_template", self.add_template))
+        self.application.add_handler(CommandHandler("templates", self.list_templates))
+        self.application.add_handler(CommandHandler("remove_template", self.remove_template))
         self.application.add_handler(CommandHandler("add_user", self.add_user))
+        self.application.add_handler(CommandHandler("import_users", self.import_users))
         self.application.add_handler(CommandHandler("remove_user", self.remove_user))
+        self.application.add_handler(CommandHandler("find", self.find))
         self.application.add_handler(CommandHandler("set_group", self.set_group))
         self.application.add_handler(CommandHandler("make_admin", self.make_admin))
         self.application.add_handler(CommandHandler("remove_admin", self.remove_admin))
         self.application.add_handler(CommandHandler("list_admins", self.list_admins))
+        self.application.add_handler(CommandHandler("sql_profile", self.sql_profile))
+        self.application.add_handler(CommandHandler("analytics", self.analytics))
+        self.application.add_handler(CommandHandler("export", self.export_data))
+        
+        # Команды суперадминистраторов (ADMIN_IDS)
+        self.application.add_handler(CommandHandler("tenants", self.list_tenants))
+        self.application.add_handler(CommandHandler("add_tenant", self.add_tenant))
+        self.application.add_handler(CommandHandler("switch_tenant", self.switch_tenant))
+        self.application.add_handler(CommandHandler("rebuild_bookings", self.rebuild_bookings))
         
         # Обработчики callback'ов
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
         
+        # Вход и выход участников групп арендаторов
+        self.application.add_handler(ChatMemberHandler(self.track_group_member, ChatMemberHandler.CHAT_MEMBER))
+        
         # Обработчик текстовых сообщений
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        # Файлы (список пользователей для /import_users)
+        self.application.add_handler(MessageHandler(filters.Document.ALL & filters.ChatType.PRIVATE,
+                                                    self.handle_document))
     
     def get_message_object(self, update: Update):
         """Получить объект сообщения для ответа"""
         return update.message or update.callback_query.message
     
+    async def edit_message(self, query, text: str, **kwargs):
+        """Изменить сообщение callback'а; та же правка повторно в Telegram не отправляется"""
+        return await safe_edit(self.edit_cache, query, text, **kwargs)
+    
     def is_admin(self, user_id: int) -> bool:
         """Проверить, является ли пользователь администратором"""
         # Проверяем статических администраторов из config.py
@@ -77,54 +237,141 @@ class ScheduleBot:
         
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
     
-    async def is_user_in_group(self, user_id: int, group_id: int) -> bool:
-        """Проверить, состоит ли пользователь в группе"""
+    @staticmethod
+    def is_member_status(chat_member) -> bool:
+        """Участник ли группы по ChatMember (ограниченный участник тоже состоит в группе)"""
+        if chat_member.status in ('member', 'administrator', 'creator'):
+            return True
+        return chat_member.status == 'restricted' and bool(getattr(chat_member, 'is_member', False))
+    
+    async def fetch_group_membership(self, user_id: int, group_id: int):
+        """Запросить членство в Telegram (getChatMember). None — проверить не удалось"""
         try:
             # Получаем информацию о пользователе
             chat_member = await self.application.bot.get_chat_member(group_id, user_id)
             
             # Проверяем статус пользователя в группе
-            if chat_member.status in ['member', 'administrator', 'creator']:
-                logger.info(f"Пользователь {user_id} найден в группе {group_id} со статусом: {chat_member.status}")
+            if self.is_member_status(chat_member):
+                logger.info("Пользователь %s найден в группе %s со статусом: %s",
+                            user_id, group_id, chat_member.status, extra={'sampled': True})
                 return True
             else:
-                logger.info(f"Пользователь {user_id} не является участником группы {group_id}, статус: {chat_member.status}")
+                logger.info("Пользователь %s не является участником группы %s, статус: %s",
+                            user_id, group_id, chat_member.status)
                 return False
                 
         except Exception as e:
-            # Если не удалось проверить (пользователь не в группе или ошибка)
-            logger.warning(f"Не удалось проверить членство в группе для пользователя {user_id}: {e}")
+            logger.warning("Не удалось проверить членство в группе для пользователя %s: %s", user_id, e)
+            return None
+    
+    async def is_group_member(self, user_id: int, group_id: int) -> bool:
+        """
+        Состоит ли пользователь в группе — по таблице членства, которую ведут обновления chat_member.
+
+        В Telegram запрашиваются только неизвестные и вышедшие (отказ редок, а обновление о возвращении
+        в группу могло не дойти); ответ запоминается. Ошибка проверки — не состоит.
+        """
+        if self.database.get_group_member(group_id, user_id):
+            return True
+        is_member = await self.fetch_group_membership(user_id, group_id)
+        if is_member is None:
             return False
+        self.database.set_group_member(group_id, user_id, is_member)
+        return is_member
+    
+    def expel_user(self, user_id: int, username: str):
+        """Пользователь больше не в группе: освободить его места и удалить из базы"""
+        freed_slots = self.database.free_user_bookings(user_id)
+        logger.info("Освобождено %s слотов пользователя %s (@%s)", freed_slots, user_id, username)
+        self.database.remove_user(user_id)
+        self.notifications_pending.set()
+        logger.info("Пользователь %s (@%s) исключен из группы и удален из базы", user_id, username)
+    
+    def get_tenant_id(self, user_id: int) -> int:
+        """Арендатор пользователя (суперадминистраторы без записи в базе работают с основным)"""
+        return self.database.get_user_tenant(user_id) or DEFAULT_TENANT_ID
+    
+    def is_super_admin(self, user_id: int) -> bool:
+        """Администраторы из config.py управляют всеми арендаторами"""
+        return user_id in ADMIN_IDS
+    
+    def can_manage_user(self, admin_id: int, target_user_id: int) -> bool:
+        """Может ли администратор управлять пользователем (только в пределах своего арендатора)"""
+        if self.is_super_admin(admin_id):
+            return True
+        target_tenant = self.database.get_user_tenant(target_user_id)
+        return target_tenant is None or target_tenant == self.get_tenant_id(admin_id)
+    
+    def can_manage_slot(self, admin_id: int, slot_id: int) -> bool:
+        """Принадлежит ли слот арендатору администратора"""
+        if self.is_super_admin(admin_id):
+            return True
+        slot = self.database.get_slot(slot_id)
+        return slot is None or slot['tenant_id'] == self.get_tenant_id(admin_id)
     
-    async def check_user_access(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-        """Проверить доступ пользователя к боту"""
+    async def resolve_tenant(self, user_id: int, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Определить арендатора пользователя.
+        
+        Возвращает (арендатор, членство_проверено). Порядок: код из deep link (/start t_КОД),
+        арендатор из базы, затем поиск по группам арендаторов, затем арендатор без группы.
+        """
+        hinted_id = context.user_data.pop('tenant_hint', None) if context.user_data is not None else None
+        if hinted_id is not None:
+            tenant = self.database.get_tenant(hinted_id)
+            if tenant:
+                return tenant, False
+        
+        tenant_id = self.database.get_user_tenant(user_id)
+        if tenant_id is not None:
+            tenant = self.database.get_tenant(tenant_id)
+            if tenant:
+                return tenant, False
+        
+        tenants = self.database.get_tenants()
+        for tenant in tenants:
+            if tenant['group_id'] and await self.is_group_member(user_id, tenant['group_id']):
+                return tenant, True
+        
+        for tenant in tenants:
+            if not tenant['group_id']:
+                return tenant, True
+        return None, False
+    
+    async def check_user_access(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Проверить доступ пользователя к боту. Возвращает арендатора или None"""
         user_id = update.effective_user.id
         username = update.effective_user.username or "Неизвестно"
         
+        tenant, membership_checked = await self.resolve_tenant(user_id, context)
+        
         # Обновляем username пользователя при каждом обращении
         if self.database.user_exists(user_id):
             self.database.add_user(user_id, username)
         
-        # Проверяем, состоит ли пользователь в разрешенной группе
-        if ALLOWED_GROUP_ID and not await self.is_user_in_group(user_id, ALLOWED_GROUP_ID):
+        # Проверяем, состоит ли пользователь в группе своего арендатора
+        # (суперадминистраторы переключаются между арендаторами и в их группах не состоят)
+        group_id = tenant['group_id'] if tenant else None
+        if tenant is None or (group_id and not membership_checked and not self.is_super_admin(user_id)
+                              and not await self.is_group_member(user_id, group_id)):
             # Если пользователь был в базе, но исключен из группы - удаляем его
-            if self.database.user_exists(user_id):
-                # Освобождаем все забронированные слоты пользователя
-                freed_slots = self.database.free_user_bookings(user_id)
-                logger.info(f"Освобождено {freed_slots} слотов пользователя {user_id} (@{username})")
-                
-                # Удаляем пользователя из базы
-                self.database.remove_user(user_id)
-                logger.info(f"Пользователь {user_id} (@{username}) исключен из группы и удален из базы")
+            if tenant is not None and self.database.get_user_tenant(user_id) == tenant['id']:
+                self.expel_user(user_id, username)
             
-            await update.message.reply_text(
+            await self.get_message_object(update).reply_text(
                 "❌ Доступ запрещен.\n\n"
                 "Для использования бота необходимо состоять в группе.\n\n"
                 "Обратитесь к администратору для получения доступа."
             )
-            return False
+            return None
+        
+        # Пользователь пришел по ссылке другого арендатора и состоит в его группе
+        current_tenant_id = self.database.get_user_tenant(user_id)
+        if current_tenant_id is not None and current_tenant_id != tenant['id']:
+            self.database.set_user_tenant(user_id, tenant['id'])
+            logger.info("Пользователь %s переведен к арендатору %s", user_id, tenant['id'])
         
-        return True
+        return tenant
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -133,8 +380,15 @@ class ScheduleBot:
         if update.message.chat.type != 'private':
             return
         
+        # Deep link вида t.me/бот?start=t_КОД выбирает арендатора
+        if context.args and context.args[0].startswith('t_'):
+            hinted = self.database.get_tenant_by_slug(context.args[0][2:])
+            if hinted:
+                context.user_data['tenant_hint'] = hinted['id']
+        
         # Проверяем доступ пользователя
-        if not await self.check_user_access(update, context):
+        tenant = await self.check_user_access(update, context)
+        if not tenant:
             return
             
         user_id = update.effective_user.id
@@ -143,12 +397,12 @@ class ScheduleBot:
         # Проверяем, есть ли пользователь в базе
         if not self.database.user_exists(user_id):
             # Добавляем пользователя в базу
-            self.database.add_user(user_id, username)
-            logger.info(f"Добавлен новый пользователь: {user_id} (@{username})")
+            self.database.add_user(user_id, username, tenant['id'])
+            logger.info("Добавлен новый пользователь: %s (@%s), арендатор %s", user_id, username, tenant['id'])
         else:
             # Обновляем username, если он изменился
             self.database.add_user(user_id, username)
-            logger.info(f"Обновлен username пользователя: {user_id} (@{username})")
+            logger.info("Обновлен username пользователя: %s (@%s)", user_id, username, extra={'sampled': True})
         
         # Получаем клавиатуру в зависимости от прав пользователя
         reply_keyboard = self.get_user_keyboard(user_id)
@@ -235,15 +489,30 @@ class ScheduleBot:
 • `/start` - Начать работу с ботом
 • `/schedule` - Показать доступные слоты
 • `/my_bookings` - Мои записи
+• `/calendar` - Подписка на записи в календаре телефона
 • `/help` - Показать эту справку
 
 **Для администраторов:**
 • `/admin` - Панель администратора
 • `/add_slot` - Добавить слот времени
 • `/remove_slot` - Удалить слот времени
+• `/set_capacity` - Число мест в слоте (групповое занятие)
+• `/add_template` - Шаблон расписания: слоты создаются автоматически
+• `/templates` - Шаблоны расписания
 • `/add_user` - Добавить пользователя
+• `/import_users` - Добавить пользователей из файла CSV
 • `/remove_user` - Удалить пользователя
+• `/find` - Поиск пользователей и слотов
 • `/set_group` - Настроить группу для автоматического доступа
+• `/sql_profile` - Профилирование SQL-запросов
+• `/analytics` - Заполняемость по дням и часам, заблаговременность записей и отмены
+• `/export` - Выгрузка записей, слотов и пользователей в CSV/iCal
+
+**Для суперадминистраторов:**
+• `/tenants` - Арендаторы и ссылки для записи
+• `/add_tenant` - Добавить арендатора
+• `/switch_tenant` - Перейти к расписанию арендатора
+• `/rebuild_bookings` - Восстановить записи из журнала
 
 **Как записаться:**
 1. Нажмите "Показать расписание"
@@ -252,6 +521,9 @@ class ScheduleBot:
 
 **Отмена записи:**
 Используйте кнопку "Отменить" в разделе "Мои записи"
+
+**Лист ожидания:**
+Если нужное время занято, встаньте в лист ожидания в расписании дня. Когда место освободится, бот запишет вас автоматически и пришлет сообщение
         """
         message_obj = self.get_message_object(update)
         await message_obj.reply_text(help_text, parse_mode='Markdown')
@@ -271,7 +543,8 @@ class ScheduleBot:
     
     async def show_schedule_calendar(self, update: Update, context: ContextTypes.DEFAULT_TYPE, year=None, month=None):
         """Показать календарь доступных слотов"""
-        if not await self.check_user_access(update, context):
+        tenant = await self.check_user_access(update, context)
+        if not tenant:
             return
             
         user_id = update.effective_user.id
@@ -280,15 +553,15 @@ class ScheduleBot:
         
         # Устанавливаем текущую дату если не указана
         if year is None or month is None:
-            now = datetime.now()
+            now = self.clock.now()
             year = now.year
             month = now.month
         
         # Получаем все слоты за месяц
-        slots = self.database.get_slots_by_month(year, month)
+        slots = self.database.get_slots_by_month(year, month, tenant['id'])
         
         # Получаем доступные слоты за месяц
-        available_slots = self.database.get_available_slots_by_month(year, month)
+        available_slots = self.database.get_available_slots_by_month(year, month, tenant['id'])
         
         # Создаем календарь с датами
         calendar_text = f"📅 **Расписание - {month:02d}.{year}**\n\n"
@@ -336,8 +609,8 @@ class ScheduleBot:
         nav_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"schedule_cal_prev_{prev_year}_{prev_month}"))
         
         # Текущий месяц
-        current_month = datetime.now().month
-        current_year = datetime.now().year
+        current_month = self.clock.now().month
+        current_year = self.clock.now().year
         nav_buttons.append(InlineKeyboardButton(f"{month:02d}.{year}", callback_data=f"schedule_cal_current_{current_year}_{current_month}"))
         
         # Следующий месяц
@@ -355,7 +628,7 @@ class ScheduleBot:
         
         try:
             if hasattr(update, 'callback_query') and update.callback_query:
-                await update.callback_query.edit_message_text(
+                await self.edit_message(update.callback_query,
                     calendar_text,
                     reply_markup=reply_markup,
                     parse_mode='Markdown'
@@ -375,7 +648,8 @@ class ScheduleBot:
     
     async def show_schedule_day_slots(self, update: Update, context: ContextTypes.DEFAULT_TYPE, year: int, month: int, day: int):
         """Показать доступные слоты на выбранный день"""
-        if not await self.check_user_access(update, context):
+        tenant = await self.check_user_access(update, context)
+        if not tenant:
             return
             
         user_id = update.effective_user.id
@@ -386,17 +660,31 @@ class ScheduleBot:
         date_str = selected_date.strftime('%d.%m.%Y')
         
         # Получаем доступные слоты на этот день
-        available_slots = self.database.get_available_slots_by_day(year, month, day)
+        available_slots = self.database.get_available_slots_by_day(year, month, day, tenant['id'])
+        
+        # Слоты без свободных мест, на которые еще действует запись: в них можно встать в лист ожидания
+        booking_deadline = self.clock.bucket() + BOOKING_LEAD
+        month_slots = self.database.get_slots_by_month(year, month, tenant['id'])
+        capacities = {slot[0]: slot[4] for slot in month_slots}
+        booked_slots = [
+            (slot_id, slot_datetime, description)
+            for slot_id, slot_datetime, description, booking_count, capacity in month_slots
+            if slot_datetime.date() == selected_date and booking_count >= capacity and slot_datetime > booking_deadline
+        ]
         
         message_text = f"📅 **Доступные слоты на {date_str}:**\n\n"
+        keyboard = []
         
         if available_slots:
             message_text += "**Свободные слоты:**\n"
-            keyboard = []
             
             for slot in available_slots:
                 time_str = slot['datetime'].strftime('%H:%M')
-                message_text += f"• {time_str} - {slot['description']}\n"
+                message_text += f"• {time_str} - {slot['description']}"
+                capacity = capacities.get(slot['id'], 1)
+                if capacity > 1:
+                    message_text += f" (свободно мест: {slot['seats_left']} из {capacity})"
+                message_text += "\n"
                 
                 # Создаем кнопку для записи
                 keyboard.append([InlineKeyboardButton(
@@ -405,7 +693,17 @@ class ScheduleBot:
                 )])
         else:
             message_text += "На этот день нет доступных слотов.\n"
-            keyboard = []
+        
+        if booked_slots:
+            message_text += "\n**Мест нет (можно встать в лист ожидания):**\n"
+            for slot_id, slot_datetime, description in booked_slots:
+                time_str = slot_datetime.strftime('%H:%M')
+                message_text += f"• {time_str} - {description}\n"
+                keyboard.append([InlineKeyboardButton(
+                    f"⏳ {time_str} - лист ожидания",
+                    callback_data=f"wait_{slot_id}"
+                )])
+            message_text += "\nЕсли место освободится, бот запишет вас автоматически и пришлет сообщение.\n"
         
         # Создаем кнопки
         # Кнопка "Назад к календарю"
@@ -414,14 +712,14 @@ class ScheduleBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         try:
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 message_text,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
         except Exception as e:
             logger.error(f"Ошибка при показе слотов дня {date_str}: {e}")
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 "❌ Произошла ошибка при загрузке слотов. Попробуйте еще раз.",
                 reply_markup=reply_markup
             )
@@ -437,12 +735,13 @@ class ScheduleBot:
         
         
         bookings = self.database.get_user_bookings(user_id)
+        waitlist = self.database.get_user_waitlist(user_id)
         
-        if not bookings:
+        if not bookings and not waitlist:
             await message_obj.reply_text("📋 У вас нет будущих записей.\n\nВсе прошедшие записи скрыты из списка.")
             return
         
-        message = "📋 **Ваши записи:**\n\n"
+        message = "📋 **Ваши записи:**\n\n" if bookings else "📋 У вас нет будущих записей.\n\n"
         keyboard = []
         
         for booking in bookings:
@@ -455,9 +754,49 @@ class ScheduleBot:
                 callback_data=f"cancel_{booking['id']}"
             )])
         
+        if waitlist:
+            message += "⏳ **Лист ожидания:**\n\n"
+            for entry in waitlist:
+                date_str = entry['datetime'].strftime('%d.%m.%Y %H:%M')
+                message += f"📅 {date_str} — место в очереди: {entry['position']}\n"
+                message += f"📝 {entry['description']}\n\n"
+                keyboard.append([InlineKeyboardButton(
+                    f"🚪 Выйти из очереди {date_str}",
+                    callback_data=f"unwait_{entry['slot_id']}"
+                )])
+        
+        if CALENDAR_FEED_ENABLED and CALENDAR_PUBLIC_URL:
+            message += "📆 Записи в календаре телефона: /calendar"
+        
         reply_markup = InlineKeyboardMarkup(keyboard)
         await message_obj.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
     
+    async def calendar_link(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ссылка на ленту .ics с записями пользователя: /calendar [reset]"""
+        if not await self.check_user_access(update, context):
+            return
+        
+        if not CALENDAR_FEED_ENABLED or not CALENDAR_PUBLIC_URL:
+            await update.message.reply_text("❌ Подписка на календарь не настроена. Обратитесь к администратору.")
+            return
+        
+        from calendar_feed import feed_path
+        user_id = update.effective_user.id
+        reset = bool(context.args) and context.args[0].lower() == "reset"
+        token = (self.database.reset_calendar_token(user_id) if reset
+                 else self.database.get_calendar_token(user_id))
+        if token is None:
+            await update.message.reply_text("❌ Не удалось получить ссылку на календарь.")
+            return
+        
+        message = "🔄 Выдана новая ссылка, старая больше не работает.\n\n" if reset else ""
+        message += (f"📆 Ссылка для подписки на ваши записи:\n{CALENDAR_PUBLIC_URL.rstrip('/')}{feed_path(token)}\n\n"
+                    "Добавьте ее в календарь телефона (Google Календарь: «Добавить по URL», "
+                    "iPhone: Настройки → Календарь → Учетные записи → Подписной календарь). "
+                    "Записи и отмены появятся в календаре автоматически.\n\n"
+                    "Ссылка личная. Если она попала к другим людям, получите новую: /calendar reset")
+        await update.message.reply_text(message, disable_web_page_preview=True)
+    
     async def show_user_calendar(self, update: Update, context: ContextTypes.DEFAULT_TYPE, year=None, month=None):
         """Показать календарь записей пользователя"""
         user_id = update.effective_user.id
@@ -466,12 +805,12 @@ class ScheduleBot:
         
         # Устанавливаем текущую дату если не указана
         if year is None or month is None:
-            now = datetime.now()
+            now = self.clock.now()
             year = now.year
             month = now.month
         
         # Получаем все слоты за месяц
-        slots = self.database.get_slots_by_month(year, month)
+        slots = self.database.get_slots_by_month(year, month, self.get_tenant_id(user_id))
         
         # Получаем записи пользователя за месяц
         user_bookings = self.database.get_user_bookings_by_month(user_id, year, month)
@@ -522,8 +861,8 @@ class ScheduleBot:
         nav_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"user_cal_prev_{prev_year}_{prev_month}"))
         
         # Текущий месяц
-        current_month = datetime.now().month
-        current_year = datetime.now().year
+        current_month = self.clock.now().month
+        current_year = self.clock.now().year
         nav_buttons.append(InlineKeyboardButton(f"{month:02d}.{year}", callback_data=f"user_cal_current_{current_year}_{current_month}"))
         
         # Следующий месяц
@@ -541,7 +880,7 @@ class ScheduleBot:
         
         try:
             if hasattr(update, 'callback_query') and update.callback_query:
-                await update.callback_query.edit_message_text(
+                await self.edit_message(update.callback_query,
                     calendar_text,
                     reply_markup=reply_markup,
                     parse_mode='Markdown'
@@ -589,14 +928,14 @@ class ScheduleBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         try:
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 message_text,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
         except Exception as e:
             logger.error(f"Ошибка при показе записей дня {date_str}: {e}")
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 "❌ Произошла ошибка при загрузке записей. Попробуйте еще раз.",
                 reply_markup=reply_markup
             )
@@ -634,12 +973,12 @@ class ScheduleBot:
         
         # Устанавливаем текущую дату если не указана
         if year is None or month is None:
-            now = datetime.now()
+            now = self.clock.now()
             year = now.year
             month = now.month
         
         # Получаем все слоты за месяц
-        slots = self.database.get_slots_by_month(year, month)
+        slots = self.database.get_slots_by_month(year, month, self.get_tenant_id(user_id))
         
         # Создаем календарь с датами
         calendar_text = f"📅 **Календарь слотов - {month:02d}.{year}**\n\n"
@@ -691,7 +1030,7 @@ class ScheduleBot:
         
         # Отправляем или редактируем сообщение
         if update.callback_query:
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 calendar_text,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
@@ -713,7 +1052,7 @@ class ScheduleBot:
         
         # Получаем слоты за день
         target_date = date(year, month, day)
-        slots = self.database.get_slots_by_month(year, month)
+        slots = self.database.get_slots_by_month(year, month, self.get_tenant_id(user_id))
         day_slots = [slot for slot in slots if slot[1].date() == target_date]
         
         # Создаем текст сообщения
@@ -722,22 +1061,22 @@ class ScheduleBot:
         if day_slots:
             message_text += "**Доступные слоты:**\n"
             for slot in day_slots:
-                slot_id = slot[0]
-                # Получаем записи на этот слот
-                bookings = self.database.get_bookings_by_slot(slot_id)
-                active_bookings = bookings  # Все записи активны, так как мы работаем с time_slots
+                slot_id, seats_taken, capacity = slot[0], slot[3], slot[4]
+                # Записи запрашиваются только для слотов, где есть занятые места
+                active_bookings = self.database.get_bookings_by_slot(slot_id) if seats_taken else []
                 
-                message_text += f"• {slot[1].strftime('%H:%M')} - {slot[2]}\n"
+                message_text += f"• {slot[1].strftime('%H:%M')} - {slot[2]}"
+                message_text += f" (мест: {seats_taken}/{capacity}, ID {slot_id})\n" if capacity > 1 else "\n"
                 
-                if active_bookings:
-                    # Показываем username первого активного пользователя
-                    username = active_bookings[0][5] or f"ID:{active_bookings[0][4]}"
+                usernames = []
+                for booking in active_bookings:
+                    username = booking[5] or f"ID:{booking[4]}"
                     # Добавляем @ для кликабельности и экранируем специальные символы Markdown
-                    if username.startswith('@'):
-                        username_escaped = username.replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace('`', '\\`')
-                    else:
-                        username_escaped = f"@{username}".replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace('`', '\\`')
-                    message_text += f"  Записан: {username_escaped}\n"
+                    if not username.startswith('@'):
+                        username = f"@{username}"
+                    usernames.append(username.replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace('`', '\\`'))
+                if usernames:
+                    message_text += f"  {'Записаны' if len(usernames) > 1 else 'Записан'}: {', '.join(usernames)}\n"
                 else:
                     message_text += f"  Свободен\n"
         else:
@@ -761,7 +1100,7 @@ class ScheduleBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.callback_query.edit_message_text(
+        await self.edit_message(update.callback_query,
             message_text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
@@ -777,7 +1116,7 @@ class ScheduleBot:
         
         # Получаем слоты за день
         target_date = date(year, month, day)
-        slots = self.database.get_slots_by_month(year, month)
+        slots = self.database.get_slots_by_month(year, month, self.get_tenant_id(user_id))
         day_slots = [slot for slot in slots if slot[1].date() == target_date]
         
         if not day_slots:
@@ -806,7 +1145,7 @@ class ScheduleBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.callback_query.edit_message_text(
+        await self.edit_message(update.callback_query,
             message_text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
@@ -820,7 +1159,7 @@ class ScheduleBot:
             await update.message.reply_text("❌ У вас нет прав администратора.")
             return
         
-        now = datetime.now()
+        now = self.clock.now()
         current_year = now.year
         current_month = now.month
         
@@ -887,7 +1226,7 @@ class ScheduleBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.callback_query.edit_message_text(
+        await self.edit_message(update.callback_query,
             calendar_text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
@@ -913,8 +1252,9 @@ class ScheduleBot:
         # Разбиваем на группы по 4 времени для удобства
         for i in range(0, len(workday_times), 4):
             time_buttons = []
-            for time in workday_times[i:i+4]:
-                time_buttons.append(InlineKeyboardButton(time, callback_data=f"time_select_{year}_{month}_{day}_{time}"))
+            for slot_time in workday_times[i:i+4]:
+                time_buttons.append(InlineKeyboardButton(
+                    slot_time, callback_data=f"time_select_{year}_{month}_{day}_{slot_time}"))
             keyboard.append(time_buttons)
         
         # Кнопка для ввода произвольного времени
@@ -925,7 +1265,7 @@ class ScheduleBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.callback_query.edit_message_text(
+        await self.edit_message(update.callback_query,
             f"🕐 **Выберите время для {date_str}**\n\n"
             "Нажмите на время или выберите 'Другое время' для ввода вручную.",
             reply_markup=reply_markup,
@@ -945,13 +1285,13 @@ class ScheduleBot:
         date_str = selected_date.strftime('%d.%m.%Y')
         
         
-        # Сохраняем данные в контексте
-        context.user_data['pending_time'] = {
+        # Сохраняем данные в базе: следующее сообщение может обработать другой процесс
+        self.state.set(user_id, 'pending_time', {
             'year': year,
             'month': month,
             'day': day,
             'date_str': date_str
-        }
+        })
         
         keyboard = [
             [InlineKeyboardButton("🔙 Назад к выбору времени", callback_data=f"cal_select_{year}_{month}_{day}")],
@@ -960,7 +1300,7 @@ class ScheduleBot:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.callback_query.edit_message_text(
+        await self.edit_message(update.callback_query,
             f"🕐 **Введите время для {date_str}**\n\n"
             "Отправьте время в формате ЧЧ:ММ\n"
             "Например: 14:30\n\n"
@@ -990,10 +1330,10 @@ class ScheduleBot:
             )
             
             # Проверяем, что время в будущем
-            if slot_datetime <= datetime.now():
+            if slot_datetime <= self.clock.now():
                 message_obj = self.get_message_object(update)
                 if update.callback_query:
-                    await update.callback_query.edit_message_text(
+                    await self.edit_message(update.callback_query,
                         "❌ Нельзя создать слот в прошлом времени.",
                         parse_mode='Markdown'
                     )
@@ -1004,38 +1344,28 @@ class ScheduleBot:
                     )
                 return
             
-            # Проверяем, нет ли уже слота на это время
-            existing_slots = self.database.get_slots_by_month(year, month)
-            for slot in existing_slots:
-                if slot[1] == slot_datetime:
-                    date_str = date(year, month, day).strftime('%d.%m.%Y')
-                    message_obj = self.get_message_object(update)
-                    if update.callback_query:
-                        await update.callback_query.edit_message_text(
-                            f"❌ **Слот уже существует!**\n\n"
-                            f"📅 Дата: {date_str}\n"
-                            f"🕐 Время: {time}\n\n"
-                            f"На это время уже есть слот. Выберите другое время.",
-                            parse_mode='Markdown'
-                        )
-                    else:
-                        await message_obj.reply_text(
-                            f"❌ **Слот уже существует!**\n\n"
-                            f"📅 Дата: {date_str}\n"
-                            f"🕐 Время: {time}\n\n"
-                            f"На это время уже есть слот. Выберите другое время.",
-                            parse_mode='Markdown'
-                        )
-                    return
-            
-            # Добавляем слот в базу данных
-            slot_id = self.database.add_slot(slot_datetime, description)
+            # Добавляем слот; пересечение с другим слотом и лимит слотов в день проверяет хранилище
+            result = self.database.add_slots([(slot_datetime, description)], self.get_tenant_id(user_id),
+                                             duration=DEFAULT_SLOT_DURATION, max_per_day=MAX_SLOTS_PER_DAY)
+            slot_id = result['created'][0] if result['created'] else None
+            if not slot_id and result['rejected'][0]['reason'] in ('overlap', 'day_full'):
+                date_str = date(year, month, day).strftime('%d.%m.%Y')
+                text = (f"❌ **Слот не создан!**\n\n"
+                        f"📅 Дата: {date_str}\n"
+                        f"🕐 Время: {time}\n\n"
+                        f"{self.slot_rejection_text(result['rejected'][0])}")
+                message_obj = self.get_message_object(update)
+                if update.callback_query:
+                    await self.edit_message(update.callback_query, text, parse_mode='Markdown')
+                else:
+                    await message_obj.reply_text(text, parse_mode='Markdown')
+                return
             
             if slot_id:
                 date_str = date(year, month, day).strftime('%d.%m.%Y')
                 message_obj = self.get_message_object(update)
                 if update.callback_query:
-                    await update.callback_query.edit_message_text(
+                    await self.edit_message(update.callback_query,
                         f"✅ **Слот успешно создан!**\n\n"
                         f"📅 Дата: {date_str}\n"
                         f"🕐 Время: {time}\n\n"
@@ -1053,7 +1383,7 @@ class ScheduleBot:
             else:
                 message_obj = self.get_message_object(update)
                 if update.callback_query:
-                    await update.callback_query.edit_message_text(
+                    await self.edit_message(update.callback_query,
                         "❌ Ошибка при создании слота. Попробуйте еще раз.",
                         parse_mode='Markdown'
                     )
@@ -1067,7 +1397,7 @@ class ScheduleBot:
             logger.error(f"Ошибка при создании слота: {e}")
             message_obj = self.get_message_object(update)
             if update.callback_query:
-                await update.callback_query.edit_message_text(
+                await self.edit_message(update.callback_query,
                     "❌ Ошибка при создании слота. Проверьте правильность данных.",
                     parse_mode='Markdown'
                 )
@@ -1087,19 +1417,13 @@ class ScheduleBot:
         
         try:
             # Получаем информацию о слоте
-            slots = self.database.get_all_slots()
-            slot_info = None
+            slot_info = self.database.get_slot(slot_id)
             
-            for slot in slots:
-                if slot[0] == slot_id:  # slot[0] - это ID
-                    slot_info = slot
-                    break
-            
-            if not slot_info:
+            if not slot_info or not self.can_manage_slot(user_id, slot_id):
                 await update.callback_query.answer("❌ Слот не найден.")
                 return
             
-            slot_id, slot_datetime, description = slot_info
+            slot_datetime, description = slot_info['datetime'], slot_info['description']
             
             # Получаем количество записей на этот слот
             bookings = self.database.get_bookings_by_slot(slot_id)
@@ -1130,7 +1454,7 @@ class ScheduleBot:
             
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 text=text,
                 reply_markup=reply_markup,
                 parse_mode='Markdown'
@@ -1148,11 +1472,17 @@ class ScheduleBot:
             await update.callback_query.answer("❌ У вас нет прав администратора.")
             return
         
+        # Слот другого арендатора — как несуществующий (ID приходит из callback_data)
+        if not self.can_manage_slot(user_id, slot_id):
+            await update.callback_query.answer("❌ Слот не найден.")
+            return
+        
         try:
             # Сначала пробуем обычное удаление
             success, message = self.database.delete_slot(slot_id)
             
             if success:
+                self.notifications_pending.set()
                 await update.callback_query.answer("✅ Слот успешно удален!")
                 # Возвращаемся к календарю
                 await self.show_admin_calendar(update, context)
@@ -1166,7 +1496,7 @@ class ScheduleBot:
                     ]
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     
-                    await update.callback_query.edit_message_text(
+                    await self.edit_message(update.callback_query,
                         f"⚠️ **Предупреждение**\n\n"
                         f"На этот слот есть активные записи.\n\n"
                         f"При принудительном удалении:\n"
@@ -1192,6 +1522,11 @@ class ScheduleBot:
             await update.callback_query.answer("❌ У вас нет прав администратора.")
             return
         
+        # Слот другого арендатора — как несуществующий (ID приходит из callback_data)
+        if not self.can_manage_slot(user_id, slot_id):
+            await update.callback_query.answer("❌ Слот не найден.")
+            return
+        
         try:
             # Принудительно удаляем слот
             success, message, affected_users = self.database.force_delete_slot(slot_id)
@@ -1200,18 +1535,17 @@ class ScheduleBot:
                 # Уведомляем затронутых пользователей
                 if affected_users:
                     for user_id_affected, username in affected_users:
-                        try:
-                            await self.application.bot.send_message(
-                                chat_id=user_id_affected,
-                                text="⚠️ **Ваша запись была отменена**\n\n"
-                                     "Администратор удалил слот, на который вы были записаны.\n"
-                                     "Пожалуйста, выберите другое время для записи.",
-                                parse_mode='Markdown'
-                            )
-                        except Exception as e:
-                            logger.error(f"Не удалось уведомить пользователя {user_id_affected}: {e}")
+                        await self.notifier.send(
+                            user_id_affected,
+                            "⚠️ **Ваша запись была отменена**\n\n"
+                            "Администратор удалил слот, на который вы были записаны.\n"
+                            "Пожалуйста, выберите другое время для записи.",
+                            parse_mode='Markdown'
+                        )
+                # Ожидавшим слот в листе ожидания
+                self.notifications_pending.set()
                 
-                await update.callback_query.edit_message_text(
+                await self.edit_message(update.callback_query,
                     f"✅ **Слот принудительно удален**\n\n"
                     f"Уведомлено пользователей: {len(affected_users)}",
                     parse_mode='Markdown'
@@ -1227,6 +1561,16 @@ class ScheduleBot:
             logger.error(f"Ошибка при принудительном удалении слота: {e}")
             await update.callback_query.answer("❌ Произошла ошибка при удалении слота.")
     
+    def slot_rejection_text(self, rejection: dict) -> str:
+        """Почему слот не создан (элемент rejected из add_slots)"""
+        if rejection['reason'] == 'day_full':
+            return f"В этот день уже {MAX_SLOTS_PER_DAY} слотов — больше добавить нельзя."
+        conflict = self.database.get_slot(rejection['conflict_id']) if rejection['conflict_id'] else None
+        if conflict:
+            return (f"Время пересекается со слотом {conflict['datetime'].strftime('%H:%M')}–"
+                    f"{conflict['end_datetime'].strftime('%H:%M')} (ID {conflict['id']}). Выберите другое время.")
+        return "Время пересекается с другим слотом. Выберите другое время."
+    
     async def add_slot(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Добавить слот времени (команда)"""
         user_id = update.effective_user.id
@@ -1239,39 +1583,96 @@ class ScheduleBot:
         if len(context.args) < 2:
             await update.message.reply_text(
                 "❌ Неверный формат команды.\n"
-                "Используйте: /add_slot ДД.ММ.ГГГГ ЧЧ:ММ Описание\n"
-                "Пример: /add_slot 25.12.2024 14:30 Занятие по вождению"
+                "Используйте: /add_slot ДД.ММ.ГГГГ ЧЧ:ММ Описание [мест=N]\n"
+                "Пример: /add_slot 25.12.2024 14:30 Занятие по вождению\n"
+                "Групповое занятие: /add_slot 25.12.2024 18:00 Теория мест=12"
             )
             return
         
         try:
             date_str = context.args[0]
             time_str = context.args[1]
-            description = " ".join(context.args[2:]) if len(context.args) > 2 else "Занятие"
+            # Необязательное "мест=N" — групповое занятие на N мест в одном слоте
+            words = [word for word in context.args[2:] if not word.lower().startswith("мест=")]
+            capacity_args = [word for word in context.args[2:] if word.lower().startswith("мест=")]
+            capacity = int(capacity_args[-1].split("=", 1)[1]) if capacity_args else 1
+            description = " ".join(words) if words else "Занятие"
+            
+            if not 1 <= capacity <= MAX_SLOT_CAPACITY:
+                await update.message.reply_text(f"❌ Число мест должно быть от 1 до {MAX_SLOT_CAPACITY}.")
+                return
             
             # Парсим дату и время
             slot_datetime = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
             
             # Проверяем, что слот в будущем
-            if slot_datetime <= datetime.now():
+            if slot_datetime <= self.clock.now():
                 await update.message.reply_text("❌ Нельзя добавить слот в прошлом.")
                 return
             
             # Добавляем слот
-            slot_id = self.database.add_slot(slot_datetime, description)
+            result = self.database.add_slots([(slot_datetime, description)], self.get_tenant_id(user_id), capacity,
+                                             duration=DEFAULT_SLOT_DURATION, max_per_day=MAX_SLOTS_PER_DAY)
+            if not result['created']:
+                if result['rejected'][0]['reason'] in ('overlap', 'day_full'):
+                    await update.message.reply_text(self.slot_rejection_text(result['rejected'][0]))
+                else:
+                    await update.message.reply_text("❌ Ошибка при создании слота. Попробуйте еще раз.")
+                return
             
             await update.message.reply_text(
                 f"✅ Слот успешно добавлен!\n"
                 f"📅 {slot_datetime.strftime('%d.%m.%Y %H:%M')}\n"
-                f"📝 {description}"
+                f"📝 {description}" + (f"\n👥 Мест: {capacity}" if capacity > 1 else "")
             )
             
         except ValueError:
             await update.message.reply_text(
-                "❌ Неверный формат даты или времени.\n"
+                "❌ Неверный формат даты, времени или числа мест.\n"
                 "Используйте формат: ДД.ММ.ГГГГ ЧЧ:ММ"
             )
     
+    async def set_capacity(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Изменить число мест в слоте (команда)"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        if len(context.args) != 2:
+            await update.message.reply_text(
+                "❌ Неверный формат команды.\n"
+                "Используйте: /set_capacity ID_слота число_мест\n"
+                "Пример: /set_capacity 15 12"
+            )
+            return
+        
+        try:
+            slot_id, capacity = int(context.args[0]), int(context.args[1])
+        except ValueError:
+            await update.message.reply_text("❌ ID слота и число мест должны быть числами.")
+            return
+        
+        if not self.can_manage_slot(user_id, slot_id):
+            await update.message.reply_text(f"❌ Слот с ID {slot_id} не найден.")
+            return
+        
+        if not 1 <= capacity <= MAX_SLOT_CAPACITY:
+            await update.message.reply_text(f"❌ Число мест должно быть от 1 до {MAX_SLOT_CAPACITY}.")
+            return
+        
+        if self.database.set_slot_capacity(slot_id, capacity):
+            # Новые места могли достаться ожидающим в листе ожидания
+            self.notifications_pending.set()
+            await update.message.reply_text(f"✅ В слоте {slot_id} теперь мест: {capacity}.")
+        elif not self.database.get_slot(slot_id):
+            await update.message.reply_text(f"❌ Слот с ID {slot_id} не найден.")
+        else:
+            await update.message.reply_text(
+                f"❌ Не удалось изменить число мест: в слоте {slot_id} уже занято больше {capacity}."
+            )
+    
     async def remove_slot(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Удалить слот времени (команда)"""
         user_id = update.effective_user.id
@@ -1290,7 +1691,12 @@ class ScheduleBot:
         try:
             slot_id = int(context.args[0])
             
+            if not self.can_manage_slot(user_id, slot_id):
+                await update.message.reply_text(f"❌ Слот с ID {slot_id} не найден.")
+                return
+            
             if self.database.remove_slot(slot_id):
+                self.notifications_pending.set()
                 await update.message.reply_text(f"✅ Слот {slot_id} успешно удален.")
             else:
                 await update.message.reply_text(f"❌ Слот с ID {slot_id} не найден.")
@@ -1298,6 +1704,126 @@ class ScheduleBot:
         except ValueError:
             await update.message.reply_text("❌ ID слота должен быть числом.")
     
+    @staticmethod
+    def parse_weekdays(text: str) -> list:
+        """Дни недели шаблона: "пн,ср,пт" или "пн-пт" -> номера (0 — понедельник); ValueError — неизвестный день"""
+        week_days = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+        weekdays = []
+        for part in text.lower().split(','):
+            first, _, last = part.partition('-')
+            weekdays.extend(range(week_days.index(first.strip()), week_days.index((last or first).strip()) + 1))
+        return weekdays
+    
+    @staticmethod
+    def template_text(template: dict) -> str:
+        """Строка шаблона расписания для списка /templates"""
+        week_days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+        text = (f"#{template['id']} {', '.join(week_days[day] for day in template['weekdays'])}: "
+                f"{', '.join(template['times'])} — {template['description']}")
+        if template['capacity'] > 1:
+            text += f" (мест: {template['capacity']})"
+        if template['generated_until']:
+            text += f"\n   слоты созданы до {template['generated_until'].strftime('%d.%m.%Y')}"
+        return text
+    
+    def generate_template_slots(self) -> dict:
+        """Создать слоты по шаблонам на SLOT_GENERATION_HORIZON_DAYS дней вперед, начиная с завтрашнего"""
+        start = self.clock.now().date() + timedelta(days=1)
+        return self.database.generate_template_slots(start, start + timedelta(days=SLOT_GENERATION_HORIZON_DAYS - 1),
+                                                     MAX_SLOTS_PER_DAY)
+    
+    async def add_template(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Добавить шаблон расписания (команда)"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        if len(context.args) < 2:
+            await update.message.reply_text(
+                "❌ Неверный формат команды.\n"
+                "Используйте: /add_template ДНИ ЧЧ:ММ[,ЧЧ:ММ...] Описание [мест=N]\n"
+                "Пример: /add_template пн-пт 08:00,09:30,11:00 Занятие по вождению\n"
+                f"Слоты создаются автоматически на {SLOT_GENERATION_HORIZON_DAYS} дней вперед."
+            )
+            return
+        
+        try:
+            weekdays = self.parse_weekdays(context.args[0])
+            times = context.args[1].split(',')
+            words = [word for word in context.args[2:] if not word.lower().startswith("мест=")]
+            capacity_args = [word for word in context.args[2:] if word.lower().startswith("мест=")]
+            capacity = int(capacity_args[-1].split("=", 1)[1]) if capacity_args else 1
+        except ValueError:
+            await update.message.reply_text(
+                "❌ Неверные дни недели или число мест.\n"
+                "Дни: пн, вт, ср, чт, пт, сб, вс — через запятую или диапазоном (пн-пт)."
+            )
+            return
+        
+        if not 1 <= capacity <= MAX_SLOT_CAPACITY:
+            await update.message.reply_text(f"❌ Число мест должно быть от 1 до {MAX_SLOT_CAPACITY}.")
+            return
+        
+        description = " ".join(words) if words else "Занятие"
+        template_id = self.database.add_schedule_template(weekdays, times, description, self.get_tenant_id(user_id),
+                                                          capacity, DEFAULT_SLOT_DURATION)
+        if template_id <= 0:
+            await update.message.reply_text("❌ Неверный шаблон: проверьте дни недели и время (ЧЧ:ММ).")
+            return
+        
+        # Слоты на горизонт создаются сразу, дальше их дополняет фоновая задача
+        stats = await asyncio.to_thread(self.generate_template_slots)
+        await update.message.reply_text(
+            f"✅ Шаблон {template_id} добавлен.\n"
+            f"Создано слотов на {SLOT_GENERATION_HORIZON_DAYS} дней вперед: {stats['created']}"
+            + (f"\nПропущено (время занято или день заполнен): {stats['skipped']}" if stats['skipped'] else "")
+        )
+    
+    async def list_templates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Шаблоны расписания арендатора (команда)"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        templates = self.database.get_schedule_templates(self.get_tenant_id(user_id))
+        if not templates:
+            await update.message.reply_text(
+                "📋 Шаблонов расписания нет.\n"
+                "Добавить: /add_template пн-пт 08:00,09:30 Занятие по вождению"
+            )
+            return
+        
+        await update.message.reply_text(
+            "📋 Шаблоны расписания:\n\n" + "\n".join(self.template_text(template) for template in templates) +
+            "\n\nУдалить шаблон: /remove_template ID (созданные слоты останутся)"
+        )
+    
+    async def remove_template(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Удалить шаблон расписания (команда)"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        try:
+            template_id = int(context.args[0])
+        except (IndexError, ValueError):
+            await update.message.reply_text("❌ Используйте: /remove_template ID_шаблона")
+            return
+        
+        # Шаблоны другого арендатора не видны
+        templates = self.database.get_schedule_templates(self.get_tenant_id(user_id))
+        if any(template['id'] == template_id for template in templates) and \
+                self.database.remove_schedule_template(template_id):
+            await update.message.reply_text(f"✅ Шаблон {template_id} удален. Созданные по нему слоты остались.")
+        else:
+            await update.message.reply_text(f"❌ Шаблон с ID {template_id} не найден.")
+    
     async def add_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Добавить пользователя (команда)"""
         user_id = update.effective_user.id
@@ -1317,7 +1843,7 @@ class ScheduleBot:
             new_user_id = int(context.args[0])
             username = context.args[1] if len(context.args) > 1 else "Пользователь"
             
-            if self.database.add_user(new_user_id, username):
+            if self.database.add_user(new_user_id, username, self.get_tenant_id(user_id)):
                 await update.message.reply_text(f"✅ Пользователь {new_user_id} добавлен.")
             else:
                 await update.message.reply_text(f"❌ Пользователь {new_user_id} уже существует.")
@@ -1325,6 +1851,100 @@ class ScheduleBot:
         except ValueError:
             await update.message.reply_text("❌ ID пользователя должен быть числом.")
     
+    async def import_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Добавить пользователей из файла: /import_users [check], затем файл CSV или текст"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        check = bool(context.args) and context.args[0].lower() == 'check'
+        self.state.set(user_id, 'import_users', {'check': check})
+        await update.message.reply_text(
+            "📥 **Импорт пользователей**\n\n"
+            "Отправьте файл CSV или текст: в каждой строке ID пользователя и username "
+            "через запятую, точку с запятой или пробел. Строка заголовка пропускается.\n\n"
+            "`123456789,ivanov`\n`987654321,petrova`\n\n"
+            f"Не больше {IMPORT_MAX_USERS} пользователей в файле."
+            + ("\n\nПользователи не из группы добавлены не будут." if check else
+               "\n\n`/import_users check` — добавить только участников группы."),
+            parse_mode='Markdown'
+        )
+    
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Файл от администратора после /import_users"""
+        user_id = update.effective_user.id
+        if not self.is_admin(user_id):
+            return
+        
+        pending = self.state.get(user_id, 'import_users')
+        if pending is None:
+            await update.message.reply_text("ℹ️ Чтобы добавить пользователей из файла, сначала отправьте /import_users.")
+            return
+        self.state.clear(user_id, 'import_users')
+        
+        document = update.message.document
+        if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+            await update.message.reply_text(f"❌ Файл больше {IMPORT_MAX_BYTES // 1024} КБ.")
+            return
+        
+        status = await update.message.reply_text("⏳ Читаю файл...")
+        # Файл не больше IMPORT_MAX_BYTES; строки разбираются по одной, без списка строк и split()
+        raw = io.BytesIO()
+        file = await document.get_file()
+        await file.download_to_memory(raw)
+        raw.seek(0)
+        with io.TextIOWrapper(raw, encoding='utf-8-sig', errors='replace') as lines:
+            parsed = await asyncio.to_thread(read_users, lines)
+        
+        tenant = self.database.get_tenant(self.get_tenant_id(user_id))
+        users, not_in_group = parsed['users'], 0
+        if pending['check'] and tenant and tenant['group_id'] and users:
+            await status.edit_text(f"⏳ Проверяю членство в группе: {len(users)} пользователей...")
+            members = await self.group_members_of([uid for uid, _ in users], tenant['group_id'])
+            not_in_group = len(users) - len(members)
+            users = [(uid, username) for uid, username in users if uid in members]
+        
+        result = await asyncio.to_thread(self.database.add_users, users, self.get_tenant_id(user_id))
+        await status.edit_text(self.import_report(parsed, result, not_in_group))
+    
+    async def group_members_of(self, user_ids: list, group_id: int) -> set:
+        """Кто из пользователей состоит в группе (не больше IMPORT_CHECK_CONCURRENCY проверок одновременно)"""
+        semaphore = asyncio.Semaphore(IMPORT_CHECK_CONCURRENCY)
+        
+        async def check(member_id: int):
+            async with semaphore:
+                return member_id, await self.is_group_member(member_id, group_id)
+        
+        results = await asyncio.gather(*(check(member_id) for member_id in user_ids))
+        return {member_id for member_id, is_member in results if is_member}
+    
+    @staticmethod
+    def import_report(parsed: dict, result: dict, not_in_group: int = 0) -> str:
+        """Итог /import_users одним сообщением"""
+        if result is None:
+            return "❌ Не удалось сохранить пользователей. Попробуйте позже."
+        lines = [
+            "📥 Импорт пользователей завершен",
+            "",
+            f"Строк с пользователями: {parsed['rows']}",
+            f"✅ Добавлено: {result['added']}",
+            f"✏️ Обновлен username: {result['updated']}",
+            f"➖ Без изменений: {result['unchanged']}",
+        ]
+        if parsed['duplicates']:
+            lines.append(f"🔁 Повторов в файле: {parsed['duplicates']}")
+        if not_in_group:
+            lines.append(f"🚫 Не в группе: {not_in_group}")
+        if parsed['errors']:
+            shown = ', '.join(map(str, parsed['errors'][:10]))
+            more = f" и еще {len(parsed['errors']) - 10}" if len(parsed['errors']) > 10 else ""
+            lines.append(f"❌ Ошибки в строках: {shown}{more}")
+        if parsed['truncated']:
+            lines.append(f"⚠️ Прочитаны первые {IMPORT_MAX_USERS} пользователей, остальные пропущены")
+        return "\n".join(lines)
+    
     async def remove_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Удалить пользователя (команда)"""
         user_id = update.effective_user.id
@@ -1343,7 +1963,12 @@ class ScheduleBot:
         try:
             user_to_remove = int(context.args[0])
             
+            if not self.can_manage_user(user_id, user_to_remove):
+                await update.message.reply_text(f"❌ Пользователь {user_to_remove} не найден.")
+                return
+            
             if self.database.remove_user(user_to_remove):
+                self.notifications_pending.set()
                 await update.message.reply_text(f"✅ Пользователь {user_to_remove} удален.")
             else:
                 await update.message.reply_text(f"❌ Пользователь {user_to_remove} не найден.")
@@ -1374,9 +1999,8 @@ class ScheduleBot:
         try:
             group_id = int(context.args[0])
             
-            # Обновляем конфигурацию
-            global ALLOWED_GROUP_ID
-            ALLOWED_GROUP_ID = group_id
+            # Группа сохраняется для арендатора администратора
+            self.database.set_tenant_group(self.get_tenant_id(user_id), group_id)
             
             # Проверяем доступ к группе
             try:
@@ -1427,8 +2051,16 @@ class ScheduleBot:
             booking_id = int(data.split("_")[1])
             await self.cancel_booking(update, context, booking_id)
         
+        elif data.startswith("wait_"):
+            slot_id = int(data.split("_")[1])
+            await self.join_waitlist(update, context, slot_id)
+        
+        elif data.startswith("unwait_"):
+            slot_id = int(data.split("_")[1])
+            await self.leave_waitlist(update, context, slot_id)
+        
         elif data == "admin_add_slot":
-            await query.edit_message_text(
+            await self.edit_message(query,
                 "➕ **Добавление слота**\n\n"
                 "Используйте команду:\n"
                 "`/add_slot ДД.ММ.ГГГГ ЧЧ:ММ Описание`\n\n"
@@ -1438,7 +2070,7 @@ class ScheduleBot:
             )
         
         elif data == "admin_remove_slot":
-            await query.edit_message_text(
+            await self.edit_message(query,
                 "➖ **Удаление слота**\n\n"
                 "Используйте команду:\n"
                 "`/remove_slot ID_слота`\n\n"
@@ -1449,6 +2081,12 @@ class ScheduleBot:
         elif data == "admin_users":
             await self.show_users_management(update, context)
         
+        elif data.startswith("users_next_"):
+            await self.show_users_management(update, context, after_id=int(data.split("_")[2]))
+        
+        elif data.startswith("users_prev_"):
+            await self.show_users_management(update, context, before_id=int(data.split("_")[2]))
+        
         elif data == "admin_stats":
             await self.show_stats(update, context)
         
@@ -1547,31 +2185,59 @@ class ScheduleBot:
         
         elif data == "admin_all_bookings":
             await self.show_all_bookings(update, context)
+        
+        elif data.startswith("find_page_"):
+            await self.show_find_results(update, context, int(data.split("_")[2]))
+        
+        elif data.startswith("find_user_"):
+            await self.show_found_user(update, context, int(data.split("_")[2]))
+        
+        elif data.startswith("find_rm_"):
+            await self.confirm_remove_found_user(update, context, int(data.split("_")[2]))
+        
+        elif data.startswith("find_rmok_"):
+            await self.remove_found_user(update, context, int(data.split("_")[2]))
+        
+        elif data.startswith("find_admin_"):
+            await self.make_found_user_admin(update, context, int(data.split("_")[2]))
+        
+        elif data.startswith("bookings_next_"):
+            await self.show_all_bookings(update, context, after=self.parse_booking_cursor(data.split("_", 2)[2]))
+        
+        elif data.startswith("bookings_prev_"):
+            await self.show_all_bookings(update, context, before=self.parse_booking_cursor(data.split("_", 2)[2]))
     
     async def book_slot(self, update: Update, context: ContextTypes.DEFAULT_TYPE, slot_id: int):
         """Записаться на слот"""
-        if not await self.check_user_access(update, context):
+        tenant = await self.check_user_access(update, context)
+        if not tenant:
             return
             
         user_id = update.effective_user.id
         
         # Проверяем, свободен ли слот
         slot = self.database.get_slot(slot_id)
-        if not slot:
-            await update.callback_query.edit_message_text("❌ Слот не найден.")
+        if not slot or slot['tenant_id'] != tenant['id']:
+            await self.edit_message(update.callback_query, "❌ Слот не найден.")
             return
         
         if slot['is_booked']:
-            await update.callback_query.edit_message_text("❌ Этот слот уже занят.")
+            await self.edit_message(update.callback_query,
+                ("❌ Все места на это занятие заняты." if slot['capacity'] > 1 else "❌ Этот слот уже занят.") +
+                "\n\nВстаньте в лист ожидания: если место освободится, "
+                "бот запишет вас автоматически.",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("⏳ Встать в лист ожидания", callback_data=f"wait_{slot_id}")
+                ]])
+            )
             return
         
-        # Проверяем, что до начала занятия остается не менее 24 часов
-        from datetime import timedelta
-        time_until_slot = slot['datetime'] - datetime.now()
+        # Проверяем, что до начала занятия остается не менее 24 часов (граница та же, что в списке слотов)
+        time_until_slot = slot['datetime'] - self.clock.now()
         
-        if time_until_slot.total_seconds() < 24 * 3600:  # 24 часа в секундах
+        if slot['bookable_until'] <= self.clock.bucket():
             hours_left = int(time_until_slot.total_seconds() / 3600)
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 f"❌ **Нельзя записаться на этот слот!**\n\n"
                 f"📅 Дата: {slot['datetime'].strftime('%d.%m.%Y %H:%M')}\n"
                 f"⏰ До начала: {hours_left} часов\n\n"
@@ -1582,15 +2248,19 @@ class ScheduleBot:
         
         # Записываем пользователя
         if self.database.book_slot(slot_id, user_id):
-            await update.callback_query.edit_message_text(
+            await self.edit_message(update.callback_query,
                 f"✅ **Вы успешно записались!**\n\n"
                 f"📅 {slot['datetime'].strftime('%d.%m.%Y %H:%M')}\n"
                 f"📝 {slot['description']}\n\n"
                 f"Используйте кнопку \"📋 Мои записи\" для просмотра ваших записей.",
                 parse_mode='Markdown'
             )
+        elif slot['capacity'] > 1:
+            await self.edit_message(update.callback_query,
+                "❌ Не удалось записаться: вы уже записаны на это занятие или места закончились."
+            )
         else:
-            await update.callback_query.edit_message_text("❌ Ошибка при записи. Попробуйте еще раз.")
+            await self.edit_message(update.callback_query, "❌ Ошибка при записи. Попробуйте еще раз.")
     
     async def cancel_booking(self, update: Update, context: ContextTypes.DEFAULT_TYPE, booking_id: int):
         """Отменить запись"""
@@ -1600,62 +2270,294 @@ class ScheduleBot:
         user_id = update.effective_user.id
         
         if self.database.cancel_booking(booking_id, user_id):
-            await update.callback_query.edit_message_text("✅ Запись успешно отменена.")
+            # Слот мог достаться следующему в листе ожидания — уведомление отправляется сразу
+            self.notifications_pending.set()
+            await self.edit_message(update.callback_query, "✅ Запись успешно отменена.")
+        else:
+            await self.edit_message(update.callback_query, "❌ Ошибка при отмене записи.")
+    
+    async def join_waitlist(self, update: Update, context: ContextTypes.DEFAULT_TYPE, slot_id: int):
+        """Встать в лист ожидания занятого слота"""
+        tenant = await self.check_user_access(update, context)
+        if not tenant:
+            return
+        
+        user_id = update.effective_user.id
+        slot = self.database.get_slot(slot_id)
+        if not slot or slot['tenant_id'] != tenant['id']:
+            await self.edit_message(update.callback_query, "❌ Слот не найден.")
+            return
+        
+        position = self.database.join_waitlist(slot_id, user_id)
+        if position:
+            await self.edit_message(update.callback_query,
+                f"⏳ **Вы в листе ожидания**\n\n"
+                f"📅 {slot['datetime'].strftime('%d.%m.%Y %H:%M')}\n"
+                f"📝 {slot['description']}\n"
+                f"Место в очереди: {position}\n\n"
+                f"Если место освободится не позднее чем за 24 часа до начала, бот запишет вас "
+                f"автоматически и пришлет сообщение. Обновлять расписание не нужно.",
+                parse_mode='Markdown'
+            )
+        elif not slot['is_booked']:
+            await self.edit_message(update.callback_query, "✅ В слоте есть свободные места — запишитесь через расписание.")
+        elif slot['bookable_until'] <= self.clock.bucket():
+            await self.edit_message(update.callback_query,
+                "❌ Встать в лист ожидания нельзя: до начала занятия меньше 24 часов."
+            )
         else:
-            await update.callback_query.edit_message_text("❌ Ошибка при отмене записи.")
+            await self.edit_message(update.callback_query, "ℹ️ Вы уже записаны на этот слот.")
     
-    async def show_users_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать управление пользователями"""
-        users = self.database.get_all_users()
+    async def leave_waitlist(self, update: Update, context: ContextTypes.DEFAULT_TYPE, slot_id: int):
+        """Выйти из листа ожидания"""
+        if not await self.check_user_access(update, context):
+            return
+        
+        if self.database.leave_waitlist(slot_id, update.effective_user.id):
+            await self.edit_message(update.callback_query, "✅ Вы вышли из листа ожидания.")
+        else:
+            await self.edit_message(update.callback_query, "ℹ️ Вас уже нет в листе ожидания этого слота.")
+    
+    @staticmethod
+    def page_buttons(prefix: str, page: dict, first_key, last_key):
+        """Кнопки "Назад"/"Далее" страницы списка; курсор — ключ крайней строки страницы"""
+        buttons = []
+        if page['has_prev']:
+            buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{prefix}_prev_{first_key}"))
+        if page['has_next']:
+            buttons.append(InlineKeyboardButton("Далее ➡️", callback_data=f"{prefix}_next_{last_key}"))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+    
+    @staticmethod
+    def booking_cursor(booking: dict) -> str:
+        """Курсор страницы записей для callback_data: время слота, ID слота и ID записи"""
+        return f"{booking['datetime'].strftime('%Y%m%d%H%M%S')}_{booking['slot_id']}_{booking['id']}"
+    
+    @staticmethod
+    def parse_booking_cursor(cursor: str) -> tuple:
+        """Курсор из callback_data -> (время слота, ID слота, ID записи)"""
+        moment, slot_id, booking_id = cursor.split("_")
+        return datetime.strptime(moment, '%Y%m%d%H%M%S'), int(slot_id), int(booking_id)
+    
+    async def show_users_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                     after_id: int = None, before_id: int = None):
+        """Показать управление пользователями (страница списка после after_id или перед before_id)"""
+        tenant_id = self.get_tenant_id(update.effective_user.id)
+        page = self.database.get_users_page(tenant_id, after_id, before_id, USERS_PAGE_SIZE)
+        if not page['users'] and before_id is not None:
+            # Пользователи перед курсором удалены — показываем начало списка
+            page = self.database.get_users_page(tenant_id, limit=USERS_PAGE_SIZE)
+        users = page['users']
         
         message = "👥 **Управление пользователями**\n\n"
-        message += f"Всего пользователей: {len(users)}\n\n"
         
-        for user in users[:10]:  # Показываем первых 10
-            message += f"🆔 {user['user_id']} - @{user['username']}\n"
+        for user_id, username in users:
+            message += f"🆔 {user_id} - @{username}\n"
         
-        if len(users) > 10:
-            message += f"\n... и еще {len(users) - 10} пользователей"
+        if not users:
+            message += "Пользователей нет\n"
         
-        message += "\n\n**Команды:**\n"
+        message += "\n**Команды:**\n"
         message += "`/add_user USER_ID username` - Добавить пользователя\n"
-        message += "`/remove_user USER_ID` - Удалить пользователя"
-        
-        await update.callback_query.edit_message_text(message, parse_mode='Markdown')
+        message += "`/import_users` - Добавить пользователей из файла\n"
+        message += "`/remove_user USER_ID` - Удалить пользователя\n"
+        message += "`/export users` - Полный список в CSV"
+        
+        reply_markup = None
+        if users:
+            reply_markup = self.page_buttons("users", page, users[0][0], users[-1][0])
+        await self.edit_message(update.callback_query, message, parse_mode='Markdown', reply_markup=reply_markup)
     
     async def show_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать статистику"""
-        stats = self.database.get_stats()
+        stats = self.database.get_stats(self.get_tenant_id(update.effective_user.id))
         
         message = "📊 **Статистика**\n\n"
         message += f"👥 Всего пользователей: {stats['total_users']}\n"
         message += f"📅 Всего слотов: {stats['total_slots']}\n"
         message += f"✅ Записей: {stats['total_bookings']}\n"
         message += f"🆓 Свободных слотов: {stats['available_slots']}\n"
-        message += f"📈 Заполненность: {stats['occupancy_rate']:.1f}%"
+        message += f"📈 Заполненность: {stats['occupancy_rate']:.1f}%\n\n"
         
-        await update.callback_query.edit_message_text(message, parse_mode='Markdown')
+        edits = self.edit_cache.stats()
+        message += (f"✏️ Правок сообщений (этот процесс): отправлено {edits['sent']}, "
+                    f"пропущено без запроса {edits['saved']}")
+        
+        await self.edit_message(update.callback_query, message, parse_mode='Markdown')
     
-    async def show_all_bookings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать все записи"""
-        bookings = self.database.get_all_bookings()
+    async def show_all_bookings(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                after: tuple = None, before: tuple = None):
+        """Показать все записи (страница после курсора after или перед курсором before)"""
+        tenant_id = self.get_tenant_id(update.effective_user.id)
+        page = self.database.get_bookings_page(tenant_id, after, before, BOOKINGS_PAGE_SIZE)
+        if not page['bookings'] and (after is not None or before is not None):
+            # Записи у курсора отменены — показываем начало списка
+            page = self.database.get_bookings_page(tenant_id, limit=BOOKINGS_PAGE_SIZE)
+        bookings = page['bookings']
         
         if not bookings:
-            await update.callback_query.edit_message_text("📋 Нет активных записей.")
+            await self.edit_message(update.callback_query, "📋 Нет активных записей.")
             return
         
         message = "📋 **Все записи**\n\n"
         
-        for booking in bookings[:15]:  # Показываем первые 15
+        for booking in bookings:
             date_str = booking['datetime'].strftime('%d.%m.%Y %H:%M')
             message += f"📅 {date_str}\n"
             message += f"👤 @{booking['username']} (ID: {booking['user_id']})\n"
             message += f"📝 {booking['description']}\n\n"
         
-        if len(bookings) > 15:
-            message += f"... и еще {len(bookings) - 15} записей"
+        if page['has_next']:
+            message += "Полный список: `/export bookings`"
+        
+        reply_markup = self.page_buttons("bookings", page, self.booking_cursor(bookings[0]),
+                                         self.booking_cursor(bookings[-1]))
+        await self.edit_message(update.callback_query, message, parse_mode='Markdown', reply_markup=reply_markup)
+    
+    async def find(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Поиск пользователей и предстоящих слотов по тексту (команда)"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        text = ' '.join(context.args) if context.args else ''
+        if not search_terms(text):
+            await update.message.reply_text(
+                "Использование: /find ТЕКСТ\n\n"
+                "Ищет пользователей по username или ID и предстоящие слоты по описанию.\n"
+                "Пример: /find ivan"
+            )
+            return
+        
+        # Запрос хранится в состоянии: в callback_data помещается только номер страницы
+        self.state.set(user_id, 'find_query', text)
+        await self.show_find_results(update, context, 0)
+    
+    async def show_find_results(self, update: Update, context: ContextTypes.DEFAULT_TYPE, offset: int):
+        """Страница результатов /find: пользователи с действиями и слоты"""
+        user_id = update.effective_user.id
+        if not self.is_admin(user_id):
+            return
+        
+        text = self.state.get(user_id, 'find_query')
+        if text is None:
+            await self.edit_message(update.callback_query, "❌ Поиск устарел, повторите /find.")
+            return
+        
+        tenant_id = self.get_tenant_id(user_id)
+        users = self.database.search_users(text, tenant_id, offset, FIND_PAGE_SIZE)
+        slots = self.database.search_slots(text, tenant_id, offset, FIND_PAGE_SIZE)
+        
+        # Без Markdown: подчеркивания в username ломают разметку
+        message = f"🔎 Поиск: {text}\n\n"
+        keyboard = []
+        
+        if users['users']:
+            message += "👥 Пользователи (📋 записи, 🗑️ удалить, 👑 сделать администратором):\n"
+            for user in users['users']:
+                role = " 👑" if user['role'] == 'admin' else ""
+                message += f"🆔 {user['user_id']} - @{user['username']}{role}\n"
+                keyboard.append([
+                    InlineKeyboardButton(f"📋 @{user['username']}", callback_data=f"find_user_{user['user_id']}"),
+                    InlineKeyboardButton("🗑️", callback_data=f"find_rm_{user['user_id']}"),
+                    InlineKeyboardButton("👑", callback_data=f"find_admin_{user['user_id']}")
+                ])
+            message += "\n"
+        
+        if slots['slots']:
+            message += "📅 Предстоящие слоты:\n"
+            for slot in slots['slots']:
+                date_str = slot['datetime'].strftime('%d.%m.%Y %H:%M')
+                message += f"{date_str} — {slot['description']} (мест: {slot['seats_taken']}/{slot['capacity']})\n"
+                keyboard.append([InlineKeyboardButton(f"📅 {date_str} {slot['description']}",
+                                                      callback_data=f"slot_details_{slot['id']}")])
+        
+        if not users['users'] and not slots['slots']:
+            message += "Ничего не найдено." if offset == 0 else "Больше результатов нет."
+        
+        navigation = []
+        if offset > 0:
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Назад", callback_data=f"find_page_{max(0, offset - FIND_PAGE_SIZE)}"))
+        if users['has_next'] or slots['has_next']:
+            navigation.append(InlineKeyboardButton("Далее ➡️", callback_data=f"find_page_{offset + FIND_PAGE_SIZE}"))
+        if navigation:
+            keyboard.append(navigation)
+        
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        if update.callback_query:
+            await self.edit_message(update.callback_query, message, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(message, reply_markup=reply_markup)
+    
+    async def show_found_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, target_user_id: int):
+        """Записи пользователя из результатов /find"""
+        user_id = update.effective_user.id
+        if not self.is_admin(user_id) or not self.can_manage_user(user_id, target_user_id):
+            await update.callback_query.answer("❌ Пользователь не найден.")
+            return
+        
+        bookings = self.database.get_user_bookings(target_user_id)
+        message = f"🆔 {target_user_id}\n\n"
+        if bookings:
+            message += "📋 Будущие записи:\n"
+            for booking in bookings:
+                message += f"📅 {booking['datetime'].strftime('%d.%m.%Y %H:%M')} — {booking['description']}\n"
+        else:
+            message += "📋 Будущих записей нет."
+        
+        keyboard = [
+            [InlineKeyboardButton("🗑️ Удалить", callback_data=f"find_rm_{target_user_id}"),
+             InlineKeyboardButton("👑 Сделать администратором", callback_data=f"find_admin_{target_user_id}")],
+            [InlineKeyboardButton("🔙 К результатам поиска", callback_data="find_page_0")]
+        ]
+        await self.edit_message(update.callback_query, message, reply_markup=InlineKeyboardMarkup(keyboard))
+    
+    async def confirm_remove_found_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                        target_user_id: int):
+        """Подтверждение удаления пользователя из результатов /find"""
+        user_id = update.effective_user.id
+        if not self.is_admin(user_id) or not self.can_manage_user(user_id, target_user_id):
+            await update.callback_query.answer("❌ Пользователь не найден.")
+            return
+        
+        keyboard = [
+            [InlineKeyboardButton("🗑️ Да, удалить", callback_data=f"find_rmok_{target_user_id}")],
+            [InlineKeyboardButton("🔙 К результатам поиска", callback_data="find_page_0")]
+        ]
+        await self.edit_message(update.callback_query,
+            f"⚠️ Удалить пользователя {target_user_id}? Его будущие записи будут отменены.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
+    async def remove_found_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE, target_user_id: int):
+        """Удалить пользователя из результатов /find"""
+        user_id = update.effective_user.id
+        if not self.is_admin(user_id) or not self.can_manage_user(user_id, target_user_id):
+            await update.callback_query.answer("❌ Пользователь не найден.")
+            return
         
-        await update.callback_query.edit_message_text(message, parse_mode='Markdown')
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 К результатам поиска", callback_data="find_page_0")]])
+        if self.database.remove_user(target_user_id):
+            self.notifications_pending.set()
+            await self.edit_message(update.callback_query, f"✅ Пользователь {target_user_id} удален.", reply_markup=back)
+        else:
+            await self.edit_message(update.callback_query, f"❌ Пользователь {target_user_id} не найден.", reply_markup=back)
+    
+    async def make_found_user_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE, target_user_id: int):
+        """Назначить администратором пользователя из результатов /find"""
+        user_id = update.effective_user.id
+        if not self.is_admin(user_id) or not self.can_manage_user(user_id, target_user_id):
+            await update.callback_query.answer("❌ Пользователь относится к другому арендатору.")
+            return
+        
+        if self.database.set_user_role(target_user_id, 'admin', self.get_tenant_id(user_id)):
+            await update.callback_query.answer(f"✅ Пользователь {target_user_id} назначен администратором.")
+            await self.show_find_results(update, context, 0)
+        else:
+            await update.callback_query.answer("❌ Ошибка при назначении администратора.")
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений"""
@@ -1698,32 +2600,29 @@ class ScheduleBot:
         # Сначала проверяем кнопки навигации (они должны работать всегда)
         if message_text == "📅 Расписание":
             # Очищаем состояние ввода времени, если оно было активно
-            if 'pending_time' in context.user_data:
-                context.user_data.pop('pending_time', None)
+            self.state.clear(user_id, 'pending_time')
             await self.show_schedule(update, context)
             return
         elif message_text == "📋 Мои записи":
             # Очищаем состояние ввода времени, если оно было активно
-            if 'pending_time' in context.user_data:
-                context.user_data.pop('pending_time', None)
+            self.state.clear(user_id, 'pending_time')
             await self.show_my_bookings(update, context)
             return
         elif message_text == "📅 Календарь слотов" and self.is_admin(user_id):
             # Очищаем состояние ввода времени, если оно было активно
-            if 'pending_time' in context.user_data:
-                context.user_data.pop('pending_time', None)
+            self.state.clear(user_id, 'pending_time')
             await self.show_admin_calendar(update, context)
             return
         
         # Проверяем, ожидается ли ввод времени
-        if 'pending_time' in context.user_data:
+        pending_data = self.state.get(user_id, 'pending_time')
+        if pending_data:
             time_text = update.message.text
             
             # Проверяем команды отмены
             if time_text.lower() in ['отмена', 'cancel', 'отменить', 'назад']:
-                pending_data = context.user_data['pending_time']
                 # Очищаем данные о времени
-                context.user_data.pop('pending_time', None)
+                self.state.clear(user_id, 'pending_time')
                 # Возвращаемся к выбору времени
                 await self.show_time_selector(update, context, 
                                             pending_data['year'], 
@@ -1736,7 +2635,6 @@ class ScheduleBot:
                 hour, minute = map(int, time_text.split(':'))
                 if 0 <= hour <= 23 and 0 <= minute <= 59:
                     time_str = f"{hour:02d}:{minute:02d}"
-                    pending_data = context.user_data['pending_time']
                     
                     # Создаем слот сразу
                     await self.create_slot_from_calendar(update, context, 
@@ -1747,7 +2645,7 @@ class ScheduleBot:
                                                         "Слот")
                     
                     # Очищаем данные о времени
-                    context.user_data.pop('pending_time', None)
+                    self.state.clear(user_id, 'pending_time')
                     return
                 else:
                     await update.message.reply_text(
@@ -1787,7 +2685,11 @@ class ScheduleBot:
         try:
             target_user_id = int(context.args[0])
             
-            if self.database.set_user_role(target_user_id, 'admin'):
+            if not self.can_manage_user(user_id, target_user_id):
+                await update.message.reply_text("❌ Пользователь относится к другому арендатору.")
+                return
+            
+            if self.database.set_user_role(target_user_id, 'admin', self.get_tenant_id(user_id)):
                 await update.message.reply_text(f"✅ Пользователь {target_user_id} назначен администратором.")
             else:
                 await update.message.reply_text("❌ Ошибка при назначении администратора.")
@@ -1818,7 +2720,11 @@ class ScheduleBot:
                 await update.message.reply_text("❌ Нельзя убрать права у самого себя.")
                 return
             
-            if self.database.set_user_role(target_user_id, 'user'):
+            if not self.can_manage_user(user_id, target_user_id):
+                await update.message.reply_text("❌ Пользователь относится к другому арендатору.")
+                return
+            
+            if self.database.set_user_role(target_user_id, 'user', self.get_tenant_id(user_id)):
                 await update.message.reply_text(f"✅ У пользователя {target_user_id} убраны права администратора.")
             else:
                 await update.message.reply_text("❌ Ошибка при изменении прав.")
@@ -1836,71 +2742,408 @@ class ScheduleBot:
             return
         
         try:
-            with sqlite3.connect("schedule_bot.db") as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT user_id, username FROM users WHERE role = 'admin'
-                """)
-                admins = cursor.fetchall()
-                
-                if admins:
-                    message = "👥 **Список администраторов:**\n\n"
-                    for admin_id, username in admins:
-                        message += f"• ID: {admin_id}\n"
-                        if username and username != 'admin':
-                            message += f"  Username: @{username}\n"
-                        message += "\n"
-                else:
-                    message = "❌ Администраторы не найдены."
-                
-                await update.message.reply_text(message, parse_mode='Markdown')
-                
+            admins = self.database.get_admins(self.get_tenant_id(user_id))
+            
+            if admins:
+                message = "👥 **Список администраторов:**\n\n"
+                for admin_id, username in admins:
+                    message += f"• ID: {admin_id}\n"
+                    if username and username != 'admin':
+                        message += f"  Username: @{username}\n"
+                    message += "\n"
+            else:
+                message = "❌ Администраторы не найдены."
+            
+            await update.message.reply_text(message, parse_mode='Markdown')
+            
         except Exception as e:
             logger.error(f"Ошибка при получении списка администраторов: {e}")
             await update.message.reply_text("❌ Ошибка при получении списка администраторов.")
 
-    async def periodic_group_check(self):
-        """Периодическая проверка группы на исключенных пользователей"""
+    async def sql_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Управление профилированием SQL: /sql_profile [on|off|top|slow|reset|threshold МС]"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        profiler = self.database.profiler
+        action = context.args[0].lower() if context.args else "status"
+        
+        if action == "on":
+            profiler.enabled = True
+            message = f"✅ Профилирование SQL включено (порог {profiler.threshold_ms:g} мс)."
+        elif action == "off":
+            profiler.enabled = False
+            message = "✅ Профилирование SQL выключено."
+        elif action == "reset":
+            profiler.reset()
+            message = "✅ Статистика SQL очищена."
+        elif action == "threshold":
+            try:
+                profiler.threshold_ms = float(context.args[1])
+                message = f"✅ Порог медленного запроса: {profiler.threshold_ms:g} мс."
+            except (IndexError, ValueError):
+                message = "Использование: /sql_profile threshold МИЛЛИСЕКУНДЫ"
+        elif action == "top":
+            top = profiler.top()
+            if not top:
+                message = "Статистика SQL пуста."
+            else:
+                message = "Запросы по суммарному времени:\n\n"
+                for item in top:
+                    message += (f"{item['total_ms']:.1f} мс всего, {item['count']} раз, "
+                                f"ср. {item['avg_ms']:.2f}, макс. {item['max_ms']:.2f}\n"
+                                f"{item['sql'][:200]}\n\n")
+        elif action == "slow":
+            slow = profiler.slow_queries()[-5:]
+            if not slow:
+                message = "Медленных запросов нет."
+            else:
+                message = "Последние медленные запросы:\n\n"
+                for item in slow:
+                    message += (f"{item['duration_ms']:.1f} мс: {item['sql'][:200]}\n"
+                                f"Параметры: {item['params']!r}\n"
+                                f"План: {' | '.join(item['plan'])}\n\n")
+        else:
+            state = "включено" if profiler.enabled else "выключено"
+            message = (f"Профилирование SQL {state}, порог {profiler.threshold_ms:g} мс.\n\n"
+                       "Использование: /sql_profile on|off|top|slow|reset|threshold МС")
+        
+        # Остальные процессы применят настройку при следующей сверке (см. apply_shared_settings)
+        if action in ("on", "off", "threshold"):
+            self.database.set_setting('sql_profile', {'enabled': profiler.enabled,
+                                                      'threshold_ms': profiler.threshold_ms})
+        
+        # Текст SQL может содержать символы разметки, поэтому отправляем без Markdown
+        await update.message.reply_text(message[:4000])
+    
+    async def analytics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отчет по заполняемости расписания арендатора за всю историю: /analytics"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        # Сводка кэшируется до следующей записи; пересчет по всей истории выполняется вне цикла событий
+        analytics = await asyncio.to_thread(self.database.get_booking_analytics, self.get_tenant_id(user_id))
+        report = occupancy_report(analytics)
+        await update.message.reply_text(f"📊 Аналитика записей\n\n```\n{report[:3900]}\n```", parse_mode='Markdown')
+    
+    async def list_tenants(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать арендаторов и ссылки для записи"""
+        user_id = update.effective_user.id
+        
+        if not self.is_super_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав суперадминистратора.")
+            return
+        
+        current_tenant_id = self.get_tenant_id(user_id)
+        message = "🏢 Арендаторы:\n\n"
+        for tenant in self.database.get_tenants():
+            marker = " (текущий)" if tenant['id'] == current_tenant_id else ""
+            message += f"• {tenant['id']}. {tenant['name']}{marker}\n"
+            message += f"  Код: {tenant['slug']}, группа: {tenant['group_id'] or 'не задана'}\n"
+            if tenant['slug']:
+                message += f"  Ссылка: https://t.me/{context.bot.username}?start=t_{tenant['slug']}\n"
+            message += "\n"
+        
+        # Коды и ссылки содержат символы разметки, поэтому отправляем без Markdown
+        await update.message.reply_text(message)
+    
+    async def add_tenant(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Добавить арендатора: /add_tenant КОД [GROUP_ID] НАЗВАНИЕ"""
+        user_id = update.effective_user.id
+        
+        if not self.is_super_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав суперадминистратора.")
+            return
+        
+        if len(context.args) < 2:
+            await update.message.reply_text(
+                "Использование: /add_tenant КОД [GROUP_ID] НАЗВАНИЕ\n\n"
+                "Пример: /add_tenant north -1001234567890 Автошкола Север"
+            )
+            return
+        
+        slug = context.args[0].lower()
+        name_args = context.args[1:]
+        group_id = None
+        if name_args[0].lstrip('-').isdigit():
+            group_id = int(name_args[0])
+            name_args = name_args[1:]
+        name = " ".join(name_args) or slug
+        
+        if self.database.get_tenant_by_slug(slug):
+            await update.message.reply_text(f"❌ Арендатор с кодом {slug} уже существует.")
+            return
+        
+        tenant_id = self.database.add_tenant(name, slug, group_id)
+        if tenant_id > 0:
+            await update.message.reply_text(
+                f"✅ Арендатор {name} добавлен (ID {tenant_id}).\n"
+                f"Ссылка для записи: https://t.me/{context.bot.username}?start=t_{slug}"
+            )
+        else:
+            await update.message.reply_text("❌ Ошибка при добавлении арендатора.")
+    
+    async def switch_tenant(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Перейти к расписанию арендатора: /switch_tenant КОД"""
+        user_id = update.effective_user.id
+        
+        if not self.is_super_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав суперадминистратора.")
+            return
+        
+        if not context.args:
+            await update.message.reply_text("Использование: /switch_tenant КОД")
+            return
+        
+        tenant = self.database.get_tenant_by_slug(context.args[0].lower())
+        if not tenant:
+            await update.message.reply_text("❌ Арендатор не найден. Список: /tenants")
+            return
+        
+        username = update.effective_user.username or "Неизвестно"
+        if not self.database.user_exists(user_id):
+            self.database.add_user(user_id, username, tenant['id'])
+        else:
+            self.database.set_user_tenant(user_id, tenant['id'])
+        
+        await update.message.reply_text(f"✅ Текущий арендатор: {tenant['name']}.")
+    
+    async def export_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка в файл: /export bookings|slots|users [csv|ics] [ДД.ММ.ГГГГ ДД.ММ.ГГГГ]"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав администратора.")
+            return
+        
+        usage = ("Использование: /export bookings|slots|users [csv|ics] [ДД.ММ.ГГГГ ДД.ММ.ГГГГ]\n"
+                 "Например: /export bookings ics 01.09.2025 30.09.2025")
+        args = [arg.lower() for arg in context.args or []]
+        kind = args.pop(0) if args else "bookings"
+        fmt = args.pop(0) if args and not args[0][:1].isdigit() else "csv"
+        if kind not in EXPORT_FORMATS or fmt not in EXPORT_FORMATS[kind]:
+            await update.message.reply_text(f"❌ Неизвестный вид или формат выгрузки.\n\n{usage}")
+            return
+        
+        # Период включает обе даты; без дат выгружается все
+        start = end = None
+        if args:
+            try:
+                start, last = (datetime.strptime(arg, "%d.%m.%Y") for arg in args)
+            except ValueError:
+                await update.message.reply_text(f"❌ Неверный период.\n\n{usage}")
+                return
+            end = last + timedelta(days=1)
+            if start >= end:
+                await update.message.reply_text("❌ Дата начала периода позже даты окончания.")
+                return
+        
+        status = await update.message.reply_text("⏳ Готовлю выгрузку...")
+        loop = asyncio.get_running_loop()
+        last_update = [time.monotonic()]
+        
+        def progress(rows: int):
+            # Вызывается из потока выгрузки; сообщение обновляется не чаще раза в 2 секунды
+            now = time.monotonic()
+            if now - last_update[0] >= 2:
+                last_update[0] = now
+                asyncio.run_coroutine_threadsafe(status.edit_text(f"⏳ Выгружено строк: {rows}..."), loop)
+        
+        try:
+            # Чтение базы и запись файла выполняются вне цикла событий
+            file, rows = await asyncio.to_thread(export_rows, self.database, kind, fmt,
+                                                 self.get_tenant_id(user_id), start, end, progress)
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки {kind} ({fmt}): {e}")
+            await status.edit_text("❌ Ошибка при подготовке выгрузки.")
+            return
+        
+        with file:
+            await update.message.reply_document(document=file, filename=export_filename(kind, fmt, start, end),
+                                                caption=f"Строк: {rows}")
+        await status.edit_text(f"✅ Выгрузка готова, строк: {rows}.")
+    
+    async def rebuild_bookings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Восстановить занятость слотов и активные записи из журнала: /rebuild_bookings"""
+        user_id = update.effective_user.id
+        
+        if not self.is_super_admin(user_id):
+            await update.message.reply_text("❌ У вас нет прав суперадминистратора.")
+            return
+        
+        # Восстановление читает снимок и журнал целиком, поэтому выполняется вне цикла событий
+        result = await asyncio.to_thread(self.database.rebuild_booking_state)
+        await update.message.reply_text(
+            f"✅ Состояние записей восстановлено из журнала.\n\n"
+            f"Применено событий после снимка: {result['events_replayed']}\n"
+            f"Исправлено записей: {result['bookings_fixed']}\n"
+            f"Исправлено слотов: {result['slots_fixed']}"
+        )
+    
+    async def track_group_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обновление chat_member: вход и выход из группы арендатора применяются сразу"""
+        change = update.chat_member
+        tenant = self.database.get_tenant_by_group(change.chat.id)
+        if not tenant:
+            return
+        
+        member = change.new_chat_member
+        user_id = member.user.id
+        is_member = self.is_member_status(member)
+        self.database.set_group_member(tenant['group_id'], user_id, is_member)
+        logger.info("Пользователь %s %s группу %s", user_id, "вошел в" if is_member else "покинул",
+                    tenant['group_id'])
+        
+        # Администраторы из config.py не удаляются
+        if not is_member and not self.is_super_admin(user_id) and \
+                self.database.get_user_tenant(user_id) == tenant['id']:
+            self.expel_user(user_id, member.user.username or "Неизвестно")
+    
+    async def check_group_members(self):
+        """
+        Сверка членства с Telegram — страховка на случай пропущенных обновлений chat_member.
+        За раз проверяются не больше GROUP_RECONCILE_BATCH пользователей каждой группы, давно не подтверждавшихся
+        """
+        for tenant in self.database.get_tenants():
+            if not tenant['group_id']:
+                continue
+            
+            stale = self.database.get_stale_group_members(tenant['group_id'], tenant['id'], GROUP_RECONCILE_AGE,
+                                                          GROUP_RECONCILE_BATCH)
+            for user_id in stale:
+                is_member = await self.fetch_group_membership(user_id, tenant['group_id'])
+                if is_member is None:
+                    continue
+                self.database.set_group_member(tenant['group_id'], user_id, is_member)
+                
+                # Администраторы из config.py не удаляются
+                if not is_member and not self.is_super_admin(user_id):
+                    self.expel_user(user_id, "Неизвестно")
+    
+    def apply_shared_settings(self):
+        """Применить настройки, измененные командами в других процессах"""
+        sql_profile = self.database.get_setting('sql_profile')
+        if sql_profile:
+            self.database.profiler.enabled = sql_profile['enabled']
+            self.database.profiler.threshold_ms = sql_profile['threshold_ms']
+    
+    @staticmethod
+    def notification_text(notification: dict) -> str:
+        """Текст уведомления из очереди (без Markdown: символы разметки в описании слота ломают отправку)"""
+        date_str = notification['datetime'].strftime('%d.%m.%Y %H:%M') if notification['datetime'] else ""
+        if notification['kind'] == 'waitlist_promoted':
+            return (f"🎉 Место освободилось — вы записаны!\n\n"
+                    f"📅 {date_str}\n"
+                    f"📝 {notification['description']}\n\n"
+                    f"Запись сделана из листа ожидания. Если не сможете прийти, отмените ее "
+                    f"в разделе \"📋 Мои записи\", чтобы место досталось следующему.")
+        return (f"⚠️ Слот удален\n\n"
+                f"Слот {date_str} ({notification['description']}), которого вы ждали в листе ожидания, "
+                f"удален администратором. Пожалуйста, выберите другое время.")
+    
+    async def deliver_notifications(self):
+        """
+        Отправка уведомлений из очереди в базе.
+        
+        Уведомления добавляет транзакция изменения в любом процессе, поэтому очередь проверяется
+        каждые NOTIFY_POLL_INTERVAL секунд; изменения в этом процессе будят отправку сразу.
+        Уведомление удаляется из очереди только после доставки: неотправленное повторяется через
+        NOTIFY_RETRY_DELAY секунд, не больше NOTIFY_MAX_ATTEMPTS раз.
+        """
         while True:
             try:
-                await asyncio.sleep(300)  # Проверяем каждые 5 минут
+                await asyncio.wait_for(self.notifications_pending.wait(), NOTIFY_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.notifications_pending.clear()
+            try:
+                while True:
+                    notifications = await asyncio.to_thread(self.database.take_notifications, 100,
+                                                            NOTIFY_RETRY_DELAY, NOTIFY_MAX_ATTEMPTS)
+                    if not notifications:
+                        break
+                    for notification in notifications:
+                        # Подтверждение сразу после доставки: при остановке процесса повторятся только неотправленные
+                        if await self.notifier.send(notification['user_id'], self.notification_text(notification)):
+                            await asyncio.to_thread(self.database.ack_notifications, [notification['id']])
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомлений: {e}")
+    
+    async def periodic_jobs(self):
+        """
+        Периодические задачи процесса.
+        
+        Каждый процесс применяет общие настройки и продлевает или захватывает аренду лидера;
+        проверку групп, снимки журнала записей, перенос старых данных в архив и создание слотов
+        по шаблонам выполняет только лидер, поэтому при нескольких процессах они не дублируются.
+        """
+        renew_interval = LEADER_LEASE_SECONDS / 3
+        last_group_check = last_snapshot = last_state_purge = time.monotonic()
+        # Первый перенос в архив и создание слотов по шаблонам — вскоре после того, как процесс станет лидером
+        last_archive = time.monotonic() - ARCHIVE_INTERVAL
+        last_generation = time.monotonic() - SLOT_GENERATION_INTERVAL
+        while True:
+            try:
+                await asyncio.sleep(renew_interval)
+                self.apply_shared_settings()
                 
-                # Получаем всех пользователей из базы
-                users = self.database.get_all_users()
+                is_leader = await asyncio.to_thread(
+                    self.database.try_acquire_lease, 'leader', self.worker_id, LEADER_LEASE_SECONDS
+                )
+                if is_leader != self.is_leader:
+                    logger.info("Процесс %s %s лидером", self.worker_id, "стал" if is_leader else "больше не является")
+                    self.is_leader = is_leader
                 
-                for user_id, username in users:
-                    # Проверяем, состоит ли пользователь в группе
-                    if not await self.is_user_in_group(user_id, ALLOWED_GROUP_ID):
-                        logger.info(f"Пользователь {user_id} (@{username}) исключен из группы")
-                        
-                        # Освобождаем слоты
-                        freed_slots = self.database.free_user_bookings(user_id)
-                        logger.info(f"Освобождено {freed_slots} слотов пользователя {user_id}")
-                        
-                        # Удаляем пользователя
-                        self.database.remove_user(user_id)
-                        logger.info(f"Пользователь {user_id} удален из базы")
+                if is_leader and time.monotonic() - last_group_check >= GROUP_CHECK_INTERVAL:
+                    last_group_check = time.monotonic()
+                    await self.check_group_members()
+                
+                if is_leader and time.monotonic() - last_snapshot >= BOOKING_SNAPSHOT_INTERVAL:
+                    last_snapshot = time.monotonic()
+                    await asyncio.to_thread(self.database.create_booking_snapshot)
+                
+                if is_leader and ARCHIVE_RETENTION_DAYS and time.monotonic() - last_archive >= ARCHIVE_INTERVAL:
+                    last_archive = time.monotonic()
+                    await asyncio.to_thread(self.database.archive_old_data,
+                                            self.clock.now() - timedelta(days=ARCHIVE_RETENTION_DAYS),
+                                            ARCHIVE_BATCH_SIZE)
+                
+                if is_leader and time.monotonic() - last_generation >= SLOT_GENERATION_INTERVAL:
+                    last_generation = time.monotonic()
+                    await asyncio.to_thread(self.generate_template_slots)
+                
+                if is_leader and time.monotonic() - last_state_purge >= CONVERSATION_PURGE_INTERVAL:
+                    last_state_purge = time.monotonic()
+                    await asyncio.to_thread(self.state.purge_expired)
                         
             except Exception as e:
-                logger.error(f"Ошибка при периодической проверке группы: {e}")
+                logger.error(f"Ошибка при выполнении периодических задач: {e}")
 
     def run(self):
         """Запуск бота"""
         logger.info("Запуск бота...")
         
-        # Запускаем периодическую проверку в отдельном потоке
-        if ALLOWED_GROUP_ID:
-            import threading
-            def run_periodic_check():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(self.periodic_group_check())
-            
-            periodic_thread = threading.Thread(target=run_periodic_check, daemon=True)
-            periodic_thread.start()
-            logger.info("Запущена периодическая проверка группы")
-        
-        self.application.run_polling()
+        if WEBHOOK_URL:
+            # Режим вебхука: процесс N слушает свой порт, запросы распределяет балансировщик
+            port = WEBHOOK_PORT + self.worker_index
+            logger.info("Процесс %s принимает вебхук на порту %s", self.worker_index, port)
+            self.application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=port,
+                url_path=urlparse(WEBHOOK_URL).path.lstrip('/'),
+                webhook_url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            # chat_member не приходят без явной подписки
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     bot = ScheduleBot()
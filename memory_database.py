@@ -0,0 +1,1323 @@
+"""
+Хранилище в памяти с тем же интерфейсом, что и Database (для бенчмарков, нагрузочных прогонов и отладки)
+"""
+
+import copy
+import time
+import secrets
+import bisect
+import itertools
+import sqlite3
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Iterator, Optional, Tuple
+
+from sql_profiler import SQLProfiler
+from clock import ScheduleClock
+from database import (Database, SCHEMA_VERSION, DEFAULT_TENANT_ID, BOOKING_LEAD, BOOKING_SNAPSHOTS_KEPT,
+                      LEAD_TIME_BUCKETS, SLOT_DEFAULT_MINUTES, SLOT_MAX_MINUTES, TEMPLATE_COLUMNS,
+                      replay_booking_events, search_terms, slot_window, plan_new_slots, template_fields,
+                      template_from_row, template_slots)
+
+logger = logging.getLogger(__name__)
+
+
+def _sqlite_now() -> datetime:
+    """Текущее время так, как его видит datetime('now') в SQLite (UTC без часового пояса)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _month_bounds(year: int, month: int) -> Tuple[datetime, datetime]:
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def _day_bounds(year: int, month: int, day: int) -> Tuple[datetime, datetime]:
+    start = datetime(year, month, day)
+    return start, start + timedelta(days=1)
+
+
+class MemoryDatabase:
+    """
+    Данные хранятся в словарях, слоты каждого арендатора — в отсортированном списке (datetime, id).
+
+    Выборки по месяцу и дню идут бинарным поиском по этому списку, записи пользователя и слота —
+    по отдельным индексам активных записей. Результаты совпадают с Database по форме и порядку.
+    """
+
+    def __init__(self, profiler: Optional[SQLProfiler] = None, clock: Optional[ScheduleClock] = None):
+        # Профилировщик SQL здесь ничего не замеряет, но /sql_profile работает без изменений
+        self.profiler = profiler or SQLProfiler()
+        self.clock = clock or ScheduleClock()
+        self._lock = threading.RLock()
+        self.init_database()
+
+    def schema_version(self) -> int:
+        return SCHEMA_VERSION
+
+    def sync_cache(self, force: bool = False):
+        """Кэша нет: данные одного процесса всегда актуальны"""
+
+    def cache_version(self, *namespaces: str) -> Optional[Tuple[int, ...]]:
+        """Изменения не отслеживаются по пространствам имен: None — готовые ответы не переиспользуются"""
+        return None
+
+    def init_database(self):
+        """Создать пустое хранилище с арендатором по умолчанию"""
+        with self._lock:
+            self._users = {}
+            self._tenants = {}
+            self._slots = {}
+            self._bookings = {}
+            self._slot_index = {}
+            self._active_by_user = {}
+            self._active_by_slot = {}
+            self._leases = {}
+            self._settings = {}
+            self._user_state = {}
+            self._group_members = {}  # (group_id, user_id) -> (состоит ли, время подтверждения)
+            self._calendar_tokens = {}  # user_id -> токен ленты .ics
+            self._calendar_users = {}  # токен -> user_id
+            self._waitlist = {}  # slot_id -> [(id, user_id)] в порядке очереди
+            self._templates = {}  # id -> шаблон расписания (как возвращает get_schedule_templates)
+            self._next_template_id = 1
+            self._notifications = []
+            self._next_waitlist_id = 1
+            self._next_notification_id = 1
+            self._events = []
+            self._snapshots = []
+            self._archived_slots = {}
+            self._archive_index = {}
+            self._archived_bookings = {}
+            self._archived_active_by_slot = {}
+            self._archived_active_by_user = {}
+            self._next_slot_id = 1
+            self._next_booking_id = 1
+            self._next_tenant_id = 1
+            self._insert_tenant('Основная', 'default', None, tenant_id=DEFAULT_TENANT_ID)
+        logger.info("Хранилище в памяти инициализировано")
+
+    @classmethod
+    def from_sqlite(cls, db_path: str, profiler: Optional[SQLProfiler] = None,
+                    clock: Optional[ScheduleClock] = None) -> 'MemoryDatabase':
+        """Загрузить данные из базы SQLite (например, синтетической базы бенчмарков)"""
+        db = cls(profiler, clock)
+        # Файл старой версии схемы сначала обновляется (в нем может не быть журнала или архива)
+        Database(db_path)
+        with sqlite3.connect(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, slug, group_id FROM tenants")
+            for tenant_id, name, slug, group_id in cursor.fetchall():
+                db._tenants.pop(tenant_id, None)
+                db._insert_tenant(name, slug, group_id, tenant_id=tenant_id)
+
+            cursor.execute("SELECT user_id, username, is_allowed, role, tenant_id FROM users")
+            for user_id, username, is_allowed, role, tenant_id in cursor.fetchall():
+                db._users[user_id] = {'username': username, 'is_allowed': is_allowed,
+                                      'role': role, 'tenant_id': tenant_id}
+
+            cursor.execute("""
+                SELECT id, datetime, description, is_booked, booked_by, tenant_id, capacity, seats_taken, end_datetime
+                FROM time_slots
+            """)
+            for slot_id, datetime_str, description, is_booked, booked_by, tenant_id, capacity, seats_taken, end_str \
+                    in cursor.fetchall():
+                db._insert_slot(slot_id, datetime.fromisoformat(datetime_str), description, tenant_id, capacity,
+                                is_booked=bool(is_booked), booked_by=booked_by, seats_taken=seats_taken,
+                                end_datetime=datetime.fromisoformat(end_str))
+
+            cursor.execute("SELECT id, slot_id, user_id, cancelled_at, created_at FROM bookings")
+            for booking_id, slot_id, user_id, cancelled_at, created_at in cursor.fetchall():
+                db._insert_booking(booking_id, slot_id, user_id, cancelled_at, created_at)
+
+            cursor.execute("SELECT id, slot_id, user_id FROM waitlist ORDER BY id")
+            for entry_id, slot_id, user_id in cursor.fetchall():
+                db._waitlist.setdefault(slot_id, []).append((entry_id, user_id))
+                db._next_waitlist_id = entry_id + 1
+            cursor.execute("""
+                SELECT id, user_id, kind, slot_id, slot_datetime, description, claimed_at, attempts
+                FROM notifications ORDER BY id
+            """)
+            for (notification_id, user_id, kind, slot_id, slot_datetime, description,
+                 claimed_at, attempts) in cursor.fetchall():
+                db._notifications.append({
+                    'id': notification_id, 'user_id': user_id, 'kind': kind, 'slot_id': slot_id,
+                    'datetime': datetime.fromisoformat(slot_datetime) if slot_datetime else None,
+                    'description': description, 'claimed_at': claimed_at, 'attempts': attempts,
+                })
+                db._next_notification_id = notification_id + 1
+
+            cursor.execute(f"SELECT {TEMPLATE_COLUMNS} FROM schedule_templates")
+            for template in map(template_from_row, cursor.fetchall()):
+                db._templates[template['id']] = template
+                db._next_template_id = max(db._next_template_id, template['id'] + 1)
+
+            cursor.execute("SELECT group_id, user_id, is_member, checked_at FROM group_members")
+            for group_id, user_id, is_member, checked_at in cursor.fetchall():
+                db._group_members[(group_id, user_id)] = (bool(is_member), datetime.fromisoformat(checked_at))
+
+            cursor.execute("SELECT user_id, token FROM calendar_tokens")
+            for user_id, token in cursor.fetchall():
+                db._set_calendar_token(user_id, token)
+
+            cursor.execute("SELECT id, event, booking_id, slot_id, user_id, created_at FROM booking_events ORDER BY id")
+            db._events = [tuple(row) for row in cursor.fetchall()]
+
+            cursor.execute("""
+                SELECT id, datetime, description, is_booked, booked_by, tenant_id, capacity, seats_taken, end_datetime
+                FROM time_slots_archive
+            """)
+            for slot_id, datetime_str, description, is_booked, booked_by, tenant_id, capacity, seats_taken, end_str \
+                    in cursor.fetchall():
+                db._archive_slot({'id': slot_id, 'datetime': datetime.fromisoformat(datetime_str),
+                                  'description': description, 'is_booked': bool(is_booked),
+                                  'booked_by': booked_by, 'tenant_id': tenant_id, 'capacity': capacity,
+                                  'seats_taken': seats_taken, 'end_datetime': datetime.fromisoformat(end_str),
+                                  'bookable_until': datetime.fromisoformat(datetime_str) - BOOKING_LEAD})
+            cursor.execute("SELECT id, slot_id, user_id, cancelled_at, created_at FROM bookings_archive")
+            for booking_id, slot_id, user_id, cancelled_at, created_at in cursor.fetchall():
+                db._archive_booking({'id': booking_id, 'slot_id': slot_id, 'user_id': user_id,
+                                     'cancelled_at': cancelled_at, 'created_at': created_at})
+
+        logger.info(f"В память загружено: {len(db._users)} пользователей, {len(db._slots)} слотов, "
+                    f"{len(db._bookings)} записей")
+        return db
+
+    # Внутренние операции (вызываются под блокировкой)
+
+    def _insert_tenant(self, name, slug, group_id, tenant_id=None) -> int:
+        for tenant in self._tenants.values():
+            if (slug is not None and tenant['slug'] == slug) or \
+                    (group_id is not None and tenant['group_id'] == group_id):
+                raise ValueError("UNIQUE constraint failed: tenants")
+        if tenant_id is None:
+            tenant_id = self._next_tenant_id
+        self._next_tenant_id = max(self._next_tenant_id, tenant_id + 1)
+        self._tenants[tenant_id] = {'id': tenant_id, 'name': name, 'slug': slug, 'group_id': group_id}
+        return tenant_id
+
+    def _insert_slot(self, slot_id, slot_datetime, description, tenant_id, capacity=1, is_booked=False,
+                     booked_by=None, seats_taken=0, end_datetime=None):
+        self._slots[slot_id] = {
+            'id': slot_id, 'datetime': slot_datetime, 'description': description,
+            'is_booked': is_booked, 'booked_by': booked_by, 'tenant_id': tenant_id,
+            'capacity': capacity, 'seats_taken': seats_taken,
+            'end_datetime': end_datetime or slot_datetime + timedelta(minutes=SLOT_DEFAULT_MINUTES),
+            'bookable_until': slot_datetime - BOOKING_LEAD
+        }
+        bisect.insort(self._slot_index.setdefault(tenant_id, []), (slot_datetime, slot_id))
+        self._next_slot_id = max(self._next_slot_id, slot_id + 1)
+
+    def _insert_booking(self, booking_id, slot_id, user_id, cancelled_at=None, created_at=None):
+        self._bookings[booking_id] = {'id': booking_id, 'slot_id': slot_id, 'user_id': user_id,
+                                      'cancelled_at': cancelled_at,
+                                      'created_at': created_at or _sqlite_now().isoformat(' ', 'seconds')}
+        if cancelled_at is None:
+            self._active_by_user.setdefault(user_id, set()).add(booking_id)
+            self._active_by_slot.setdefault(slot_id, set()).add(booking_id)
+        self._next_booking_id = max(self._next_booking_id, booking_id + 1)
+
+    def _append_event(self, event, booking_id=None, slot_id=None, user_id=None):
+        event_id = self._events[-1][0] + 1 if self._events else 1
+        self._events.append((event_id, event, booking_id, slot_id, user_id,
+                             _sqlite_now().isoformat(' ', 'seconds')))
+
+    def _events_after(self, event_id):
+        """События журнала с ID больше event_id (журнал упорядочен по ID), без копирования списка"""
+        # Кортеж (event_id, <максимальная строка>) больше любого события с этим ID
+        start = bisect.bisect_right(self._events, (event_id, '\U0010ffff'))
+        return itertools.islice(self._events, start, None)
+
+    def _cancel_booking_record(self, booking_id):
+        booking = self._bookings[booking_id]
+        booking['cancelled_at'] = _sqlite_now().isoformat(' ', 'seconds')
+        self._active_by_user.get(booking['user_id'], set()).discard(booking_id)
+        self._active_by_slot.get(booking['slot_id'], set()).discard(booking_id)
+
+    def _has_booking(self, slot_id, user_id) -> bool:
+        """Есть ли у пользователя активная запись на слот"""
+        return any(self._bookings[booking_id]['user_id'] == user_id
+                   for booking_id in self._active_by_slot.get(slot_id, ()))
+
+    def _take_seat(self, slot, user_id) -> bool:
+        """Занять место в слоте (как _TAKE_SEAT_SQL в Database)"""
+        if slot['seats_taken'] >= slot['capacity'] or self._has_booking(slot['id'], user_id):
+            return False
+        slot['seats_taken'] += 1
+        slot['is_booked'] = slot['seats_taken'] >= slot['capacity']
+        slot['booked_by'] = user_id if slot['capacity'] == 1 else None
+        return True
+
+    def _release_seats(self, slot_ids) -> list:
+        """Освободить по одному месту в слотах отмененных записей. Возвращает слоты, где место освободилось"""
+        freed = []
+        for slot_id in slot_ids:
+            slot = self._slots.get(slot_id)
+            if slot and slot['seats_taken'] > 0:
+                slot['seats_taken'] -= 1
+                slot['is_booked'] = False
+                slot['booked_by'] = None
+                freed.append(slot_id)
+        return freed
+
+    def _delete_slot_record(self, slot_id) -> bool:
+        slot = self._slots.pop(slot_id, None)
+        if slot is None:
+            return False
+        index = self._slot_index[slot['tenant_id']]
+        del index[bisect.bisect_left(index, (slot['datetime'], slot_id))]
+        return True
+
+    def _cancel_bookings_of(self, user_id) -> list:
+        """Отменить активные записи пользователя. Возвращает [(booking_id, slot_id)]"""
+        cancelled = []
+        for booking_id in sorted(self._active_by_user.get(user_id, ())):
+            cancelled.append((booking_id, self._bookings[booking_id]['slot_id']))
+            self._cancel_booking_record(booking_id)
+        return cancelled
+
+    def _notify(self, user_id, kind, slot):
+        self._notifications.append({'id': self._next_notification_id, 'user_id': user_id, 'kind': kind,
+                                    'slot_id': slot['id'], 'datetime': slot['datetime'],
+                                    'description': slot['description'], 'claimed_at': None, 'attempts': 0})
+        self._next_notification_id += 1
+
+    def _promote_waitlist(self, slot_ids) -> int:
+        """Отдать освободившиеся места первым в листе ожидания (правило 24 часов, как при записи)"""
+        promoted = 0
+        for slot_id in slot_ids:
+            slot = self._slots.get(slot_id)
+            if (not slot or slot['seats_taken'] >= slot['capacity']
+                    or slot['bookable_until'] <= self.clock.bucket()):
+                continue
+            queue = self._waitlist.get(slot_id, [])
+            entry = next((entry for entry in queue
+                          if self.is_user_allowed(entry[1]) and not self._has_booking(slot_id, entry[1])), None)
+            if entry is None:
+                continue
+            queue.remove(entry)
+            user_id = entry[1]
+            self._take_seat(slot, user_id)
+            booking_id = self._next_booking_id
+            self._insert_booking(booking_id, slot_id, user_id)
+            self._append_event('booked', booking_id, slot_id, user_id)
+            self._notify(user_id, 'waitlist_promoted', slot)
+            promoted += 1
+        if promoted:
+            logger.info(f"Из листа ожидания записано: {promoted}")
+        return promoted
+
+    def _drop_waitlist(self, slot_id):
+        """Удалить очередь слота перед удалением слота; ожидавшим — уведомление"""
+        slot = self._slots.get(slot_id)
+        for _, user_id in self._waitlist.pop(slot_id, []):
+            if slot:
+                self._notify(user_id, 'waitlist_slot_deleted', slot)
+
+    def _archive_slot(self, slot):
+        self._archived_slots[slot['id']] = slot
+        bisect.insort(self._archive_index.setdefault(slot['tenant_id'], []), (slot['datetime'], slot['id']))
+        self._next_slot_id = max(self._next_slot_id, slot['id'] + 1)
+
+    def _archive_booking(self, booking):
+        self._archived_bookings[booking['id']] = booking
+        if booking['cancelled_at'] is None:
+            self._archived_active_by_user.setdefault(booking['user_id'], set()).add(booking['id'])
+            self._archived_active_by_slot.setdefault(booking['slot_id'], set()).add(booking['id'])
+        self._next_booking_id = max(self._next_booking_id, booking['id'] + 1)
+
+    def _move_booking_to_archive(self, booking_id):
+        booking = self._bookings.pop(booking_id)
+        self._active_by_user.get(booking['user_id'], set()).discard(booking_id)
+        self._active_by_slot.get(booking['slot_id'], set()).discard(booking_id)
+        self._archive_booking(booking)
+
+    def _archived_between(self, tenant_id, start, end) -> list:
+        """Архивные слоты арендатора в полуинтервале [start, end)"""
+        index = self._archive_index.get(tenant_id, [])
+        lo = bisect.bisect_left(index, (start,))
+        hi = bisect.bisect_left(index, (end,))
+        return [self._archived_slots[slot_id] for _, slot_id in index[lo:hi]]
+
+    def _user_bookings_between(self, user_id, start, end) -> list:
+        """Активные записи пользователя (рабочие и архивные) на слоты в [start, end)"""
+        bookings = [(booking_id, slot) for booking_id, slot in self._active_bookings_of(user_id)
+                    if start <= slot['datetime'] < end]
+        for booking_id in self._archived_active_by_user.get(user_id, ()):
+            slot = self._archived_slots.get(self._archived_bookings[booking_id]['slot_id'])
+            if slot and start <= slot['datetime'] < end:
+                bookings.append((booking_id, slot))
+        bookings.sort(key=lambda item: (item[1]['datetime'], item[0]))
+        return bookings
+
+    def _slots_between(self, tenant_id, start, end) -> list:
+        """Слоты арендатора в полуинтервале [start, end) по возрастанию времени"""
+        index = self._slot_index.get(tenant_id, [])
+        lo = bisect.bisect_left(index, (start,))
+        hi = bisect.bisect_left(index, (end,))
+        return [self._slots[slot_id] for _, slot_id in index[lo:hi]]
+
+    def _slots_after(self, tenant_id, moment) -> list:
+        """Слоты арендатора строго позже `moment`"""
+        index = self._slot_index.get(tenant_id, [])
+        lo = bisect.bisect_right(index, (moment, float('inf')))
+        return [self._slots[slot_id] for _, slot_id in index[lo:]]
+
+    def _active_bookings_of(self, user_id) -> list:
+        """Активные записи пользователя со слотами, по возрастанию времени слота"""
+        result = []
+        for booking_id in self._active_by_user.get(user_id, ()):
+            slot = self._slots.get(self._bookings[booking_id]['slot_id'])
+            if slot:
+                result.append((booking_id, slot))
+        result.sort(key=lambda item: (item[1]['datetime'], item[0]))
+        return result
+
+    @staticmethod
+    def _available(slots, moment) -> List[Dict]:
+        return [
+            {'id': slot['id'], 'datetime': slot['datetime'], 'description': slot['description'],
+             'seats_left': slot['capacity'] - slot['seats_taken']}
+            for slot in slots if not slot['is_booked'] and slot['datetime'] > moment
+        ]
+
+    @staticmethod
+    def _booking_dicts(bookings) -> List[Dict]:
+        return [
+            {'id': booking_id, 'datetime': slot['datetime'], 'description': slot['description']}
+            for booking_id, slot in bookings
+        ]
+
+    # Пользователи
+
+    def add_user(self, user_id: int, username: str, tenant_id: int = DEFAULT_TENANT_ID) -> bool:
+        """Добавить пользователя (арендатор задается только при создании)"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user:
+                user['username'] = username
+            else:
+                self._users[user_id] = {'username': username, 'is_allowed': 1, 'role': 'user',
+                                        'tenant_id': tenant_id}
+            return True
+
+    def add_users(self, users: List[Tuple[int, str]], tenant_id: int = DEFAULT_TENANT_ID) -> Dict:
+        """Добавить пользователей пачкой (пользователи других арендаторов не меняются)"""
+        stats = {'added': 0, 'updated': 0, 'unchanged': 0}
+        with self._lock:
+            for user_id, username in users:
+                user = self._users.get(user_id)
+                if user is None:
+                    self._users[user_id] = {'username': username, 'is_allowed': 1, 'role': 'user',
+                                            'tenant_id': tenant_id}
+                    stats['added'] += 1
+                elif user['tenant_id'] == tenant_id and user['username'] != username:
+                    user['username'] = username
+                    stats['updated'] += 1
+                else:
+                    stats['unchanged'] += 1
+        logger.info(f"Импорт пользователей: добавлено {stats['added']}, обновлено {stats['updated']}")
+        return stats
+
+    def free_user_bookings(self, user_id: int) -> int:
+        """Освободить все места, занятые пользователем. Возвращает число слотов"""
+        with self._lock:
+            cancelled = self._cancel_bookings_of(user_id)
+            freed = self._release_seats([slot_id for _, slot_id in cancelled])
+            count = len(freed)
+            for booking_id, slot_id in cancelled:
+                self._append_event('cancelled', booking_id, slot_id, user_id)
+            self._promote_waitlist(freed)
+        logger.info(f"Освобождено {count} слотов пользователя {user_id}")
+        return count
+
+    def remove_user(self, user_id: int) -> bool:
+        """Удалить пользователя"""
+        with self._lock:
+            cancelled = self._cancel_bookings_of(user_id)
+            freed = self._release_seats([slot_id for _, slot_id in cancelled])
+            removed = self._users.pop(user_id, None) is not None
+            self._calendar_users.pop(self._calendar_tokens.pop(user_id, None), None)
+            for queue in self._waitlist.values():
+                queue[:] = [entry for entry in queue if entry[1] != user_id]
+            self._notifications = [item for item in self._notifications if item['user_id'] != user_id]
+            if removed or cancelled:
+                self._append_event('user_removed', user_id=user_id)
+            self._promote_waitlist(freed)
+            return removed
+
+    def is_user_allowed(self, user_id: int) -> bool:
+        """Проверить, разрешен ли пользователь"""
+        user = self._users.get(user_id)
+        return user is not None and user['is_allowed'] == 1
+
+    def user_exists(self, user_id: int) -> bool:
+        """Проверить, существует ли пользователь в базе"""
+        return user_id in self._users
+
+    def get_all_users(self, tenant_id: Optional[int] = None) -> list:
+        """Получить всех пользователей (или только пользователей арендатора)"""
+        with self._lock:
+            return [
+                (user_id, user['username']) for user_id, user in sorted(self._users.items())
+                if tenant_id is None or user['tenant_id'] == tenant_id
+            ]
+
+    def get_users_page(self, tenant_id: int = DEFAULT_TENANT_ID, after_id: Optional[int] = None,
+                       before_id: Optional[int] = None, limit: int = 10) -> Dict:
+        """Страница пользователей арендатора по возрастанию ID: после after_id или перед before_id"""
+        with self._lock:
+            user_ids = sorted(user_id for user_id, user in self._users.items() if user['tenant_id'] == tenant_id)
+            if before_id is not None:
+                hi = bisect.bisect_left(user_ids, before_id)
+                page = user_ids[max(0, hi - limit):hi]
+                has_prev, has_next = hi > limit, True
+            else:
+                lo = bisect.bisect_right(user_ids, after_id) if after_id is not None else 0
+                page = user_ids[lo:lo + limit]
+                has_prev, has_next = after_id is not None, len(user_ids) > lo + limit
+            return {'users': [(user_id, self._users[user_id]['username']) for user_id in page],
+                    'has_prev': has_prev, 'has_next': has_next}
+
+    def get_user_role(self, user_id: int) -> str:
+        """Получить роль пользователя"""
+        user = self._users.get(user_id)
+        return (user['role'] or 'user') if user else 'user'
+
+    def set_user_role(self, user_id: int, role: str, tenant_id: int = DEFAULT_TENANT_ID) -> bool:
+        """Установить роль пользователя (арендатор задается, если пользователя еще нет в базе)"""
+        with self._lock:
+            user = self._users.setdefault(user_id, {'username': 'user', 'is_allowed': 1, 'role': role,
+                                                    'tenant_id': tenant_id})
+            user['role'] = role
+            return True
+
+    def get_admins(self, tenant_id: int = DEFAULT_TENANT_ID) -> list:
+        """Получить администраторов арендатора"""
+        with self._lock:
+            return [
+                (user_id, user['username']) for user_id, user in sorted(self._users.items())
+                if user['role'] == 'admin' and user['tenant_id'] == tenant_id
+            ]
+
+    def get_user_tenant(self, user_id: int) -> Optional[int]:
+        """Получить арендатора пользователя (None, если пользователя нет в базе)"""
+        user = self._users.get(user_id)
+        return user['tenant_id'] if user else None
+
+    def set_user_tenant(self, user_id: int, tenant_id: int) -> bool:
+        """Перевести пользователя к другому арендатору"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if not user:
+                return False
+            user['tenant_id'] = tenant_id
+            return True
+
+    # Слоты и записи
+
+    def add_slot(self, datetime_obj: datetime, description: str, tenant_id: int = DEFAULT_TENANT_ID,
+                 capacity: int = 1, duration: int = SLOT_DEFAULT_MINUTES, max_per_day: Optional[int] = None) -> int:
+        """Добавить слот времени на capacity мест длительностью duration минут (0 — пересечение или день заполнен)"""
+        result = self.add_slots([(datetime_obj, description)], tenant_id, capacity, duration, max_per_day)
+        if result['created']:
+            return result['created'][0]
+        return 0 if result['rejected'][0]['reason'] in ('overlap', 'day_full') else -1
+
+    def add_slots(self, slots: List[Tuple[datetime, str]], tenant_id: int = DEFAULT_TENANT_ID, capacity: int = 1,
+                  duration: int = SLOT_DEFAULT_MINUTES, max_per_day: Optional[int] = None) -> Dict:
+        """Добавить слоты без пересечений и сверх max_per_day в день (результат — как у Database.add_slots)"""
+        if not slots:
+            return {'created': [], 'rejected': []}
+        if not 0 < duration <= SLOT_MAX_MINUTES:
+            return {'created': [], 'rejected': [{'datetime': slot_datetime, 'reason': 'invalid', 'conflict_id': None}
+                                                for slot_datetime, _ in slots]}
+
+        intervals = [(slot_datetime, slot_datetime + timedelta(minutes=duration)) for slot_datetime, _ in slots]
+        with self._lock:
+            existing = [(slot['datetime'], slot['end_datetime'], slot['id'])
+                        for slot in self._slots_between(tenant_id, *slot_window(intervals))]
+            created, rejected = [], []
+            for (slot_datetime, description), (_, end), verdict in zip(slots, intervals,
+                                                                       plan_new_slots(existing, intervals, max_per_day)):
+                if verdict is not None:
+                    rejected.append({'datetime': slot_datetime, 'reason': verdict[0], 'conflict_id': verdict[1]})
+                    continue
+                slot_id = self._next_slot_id
+                self._insert_slot(slot_id, slot_datetime, description, tenant_id, capacity, end_datetime=end)
+                created.append(slot_id)
+            return {'created': created, 'rejected': rejected}
+
+    def set_slot_capacity(self, slot_id: int, capacity: int) -> bool:
+        """Изменить число мест в слоте (не меньше занятых); появившиеся места получает лист ожидания"""
+        with self._lock:
+            slot = self._slots.get(slot_id)
+            if capacity < 1 or not slot or slot['seats_taken'] > capacity:
+                return False
+            slot['capacity'] = capacity
+            slot['is_booked'] = slot['seats_taken'] >= capacity
+            slot['booked_by'] = None
+            if capacity == 1 and slot['seats_taken']:
+                slot['booked_by'] = self._bookings[min(self._active_by_slot[slot_id])]['user_id']
+            self._promote_waitlist([slot_id] * (capacity - slot['seats_taken']))
+            return True
+
+    def add_schedule_template(self, weekdays: List[int], times: List[str], description: str,
+                              tenant_id: int = DEFAULT_TENANT_ID, capacity: int = 1,
+                              duration: int = SLOT_DEFAULT_MINUTES) -> int:
+        """Добавить шаблон расписания: слоты в дни недели weekdays (0 — понедельник) во время times ('ЧЧ:ММ')"""
+        try:
+            if not 0 < duration <= SLOT_MAX_MINUTES or capacity < 1:
+                raise ValueError(f"длительность {duration}, мест {capacity}")
+            weekdays_value, times_value = template_fields(weekdays, times)
+        except ValueError as e:
+            logger.error(f"Ошибка при добавлении шаблона расписания: {e}")
+            return -1
+        with self._lock:
+            template_id = self._next_template_id
+            self._next_template_id += 1
+            self._templates[template_id] = template_from_row((template_id, tenant_id, weekdays_value, times_value,
+                                                              description, capacity, duration, None))
+            return template_id
+
+    def get_schedule_templates(self, tenant_id: Optional[int] = None) -> List[Dict]:
+        """Шаблоны расписания арендатора (None — всех арендаторов)"""
+        with self._lock:
+            return [copy.deepcopy(template) for _, template in sorted(self._templates.items())
+                    if tenant_id is None or template['tenant_id'] == tenant_id]
+
+    def remove_schedule_template(self, template_id: int) -> bool:
+        """Удалить шаблон расписания (уже созданные по нему слоты остаются)"""
+        with self._lock:
+            return self._templates.pop(template_id, None) is not None
+
+    def generate_template_slots(self, start: date, end: date, max_per_day: Optional[int] = None) -> Dict:
+        """Создать слоты по шаблонам на дни [start, end] (как Database.generate_template_slots)"""
+        stats = {'templates': 0, 'created': 0, 'skipped': 0}
+        with self._lock:
+            new_slots = {}
+            for _, template in sorted(self._templates.items()):
+                if template['generated_until'] is not None and template['generated_until'] >= end:
+                    continue
+                stats['templates'] += 1
+                for interval in template_slots(template, start, end):
+                    new_slots.setdefault(template['tenant_id'], []).append(interval + (template,))
+                template['generated_until'] = end
+
+            for tenant_id, slots in new_slots.items():
+                intervals = [(slot_start, slot_end) for slot_start, slot_end, _ in slots]
+                existing = [(slot['datetime'], slot['end_datetime'], slot['id'])
+                            for slot in self._slots_between(tenant_id, *slot_window(intervals))]
+                for (slot_start, slot_end, template), verdict in zip(slots, plan_new_slots(existing, intervals,
+                                                                                           max_per_day)):
+                    if verdict is not None:
+                        stats['skipped'] += 1
+                        continue
+                    self._insert_slot(self._next_slot_id, slot_start, template['description'], tenant_id,
+                                      template['capacity'], end_datetime=slot_end)
+                    stats['created'] += 1
+        if stats['templates']:
+            logger.info(f"Слоты по шаблонам до {end.isoformat()}: {stats}")
+        return stats
+
+    def remove_slot(self, slot_id: int) -> bool:
+        """Удалить слот времени"""
+        with self._lock:
+            for booking_id in list(self._active_by_slot.get(slot_id, ())):
+                self._cancel_booking_record(booking_id)
+            self._drop_waitlist(slot_id)
+            if not self._delete_slot_record(slot_id):
+                return False
+            self._append_event('slot_deleted', slot_id=slot_id)
+            return True
+
+    def get_slot(self, slot_id: int) -> Optional[Dict]:
+        """Получить информацию о слоте"""
+        slot = self._slots.get(slot_id) or self._archived_slots.get(slot_id)
+        return dict(slot) if slot else None
+
+    def get_available_slots(self, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
+        """Получить доступные слоты (только те, на которые можно записаться за 24+ часов)"""
+        with self._lock:
+            return [
+                {'id': slot['id'], 'datetime': slot['datetime'], 'description': slot['description'],
+                 'is_booked': False, 'booked_by': slot['booked_by'],
+                 'seats_left': slot['capacity'] - slot['seats_taken']}
+                for slot in self._slots_after(tenant_id, self.clock.bucket() + BOOKING_LEAD)
+                if not slot['is_booked']
+            ]
+
+    def book_slot(self, slot_id: int, user_id: int) -> bool:
+        """Записаться на слот"""
+        with self._lock:
+            slot = self._slots.get(slot_id)
+            if not slot or not self._take_seat(slot, user_id):
+                return False
+            booking_id = self._next_booking_id
+            self._insert_booking(booking_id, slot_id, user_id)
+            self._append_event('booked', booking_id, slot_id, user_id)
+            queue = self._waitlist.get(slot_id, [])
+            queue[:] = [entry for entry in queue if entry[1] != user_id]
+            return True
+
+    def cancel_booking(self, booking_id: int, user_id: int) -> bool:
+        """Отменить запись"""
+        with self._lock:
+            booking = self._bookings.get(booking_id)
+            if not booking or booking['user_id'] != user_id or booking['cancelled_at'] is not None:
+                return False
+            self._cancel_booking_record(booking_id)
+            freed = self._release_seats([booking['slot_id']])
+            self._append_event('cancelled', booking_id, booking['slot_id'], user_id)
+            self._promote_waitlist(freed)
+            return True
+
+    def get_user_bookings(self, user_id: int) -> List[Dict]:
+        """Получить записи пользователя (только будущие)"""
+        with self._lock:
+            now = self.clock.now()
+            return self._booking_dicts(
+                (booking_id, slot) for booking_id, slot in self._active_bookings_of(user_id)
+                if slot['datetime'] > now
+            )
+
+    def get_all_bookings(self, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
+        """Получить все активные записи"""
+        with self._lock:
+            bookings = []
+            for _, slot_id in self._slot_index.get(tenant_id, []):
+                slot = self._slots[slot_id]
+                for booking_id in sorted(self._active_by_slot.get(slot['id'], ())):
+                    user_id = self._bookings[booking_id]['user_id']
+                    user = self._users.get(user_id)
+                    if user:
+                        bookings.append({
+                            'id': booking_id,
+                            'datetime': slot['datetime'],
+                            'description': slot['description'],
+                            'username': user['username'],
+                            'user_id': user_id
+                        })
+            return bookings
+
+    def get_bookings_page(self, tenant_id: int = DEFAULT_TENANT_ID,
+                          after: Optional[Tuple[datetime, int, int]] = None,
+                          before: Optional[Tuple[datetime, int, int]] = None, limit: int = 15) -> Dict:
+        """Страница активных записей по времени слота: после курсора after или перед курсором before"""
+        backward = before is not None
+        key = before if backward else after
+        with self._lock:
+            index = self._slot_index.get(tenant_id, [])
+            if backward:
+                position = bisect.bisect_right(index, key[:2])
+                slot_keys = reversed(index[:position])
+            else:
+                position = bisect.bisect_left(index, key[:2]) if key is not None else 0
+                slot_keys = index[position:]
+
+            bookings = []
+            for slot_datetime, slot_id in slot_keys:
+                booking_ids = sorted(self._active_by_slot.get(slot_id, ()), reverse=backward)
+                for booking_id in booking_ids:
+                    booking_key = (slot_datetime, slot_id, booking_id)
+                    if key is not None and (booking_key >= key if backward else booking_key <= key):
+                        continue
+                    user_id = self._bookings[booking_id]['user_id']
+                    user = self._users.get(user_id)
+                    if user:
+                        bookings.append({
+                            'id': booking_id,
+                            'datetime': slot_datetime,
+                            'description': self._slots[slot_id]['description'],
+                            'username': user['username'],
+                            'user_id': user_id,
+                            'slot_id': slot_id
+                        })
+                if len(bookings) > limit:
+                    break
+
+            has_more = len(bookings) > limit
+            bookings = bookings[:limit]
+            if backward:
+                return {'bookings': bookings[::-1], 'has_prev': has_more, 'has_next': True}
+            return {'bookings': bookings, 'has_prev': key is not None, 'has_next': has_more}
+
+    @staticmethod
+    def _text_matches(terms: List[str], text: str) -> bool:
+        """Каждое слово запроса — начало какого-то слова текста (как префиксный запрос FTS5)"""
+        words = search_terms(text)
+        return all(any(word.startswith(term) for word in words) for term in terms)
+
+    def search_users(self, text: str, tenant_id: int = DEFAULT_TENANT_ID, offset: int = 0,
+                     limit: int = 10) -> Dict:
+        """Пользователи арендатора, в username которых есть слова, начинающиеся со слов запроса"""
+        terms = search_terms(text)
+        if not terms:
+            return {'users': [], 'has_next': False}
+        with self._lock:
+            found = []
+            user_id_text = text.strip().lstrip('@')
+            if offset == 0 and user_id_text.isdigit():
+                user = self._users.get(int(user_id_text))
+                if user and user['tenant_id'] == tenant_id:
+                    found.append(int(user_id_text))
+
+            matches = sorted((user_id for user_id, user in self._users.items()
+                              if user['tenant_id'] == tenant_id and self._text_matches(terms, user['username'])),
+                             key=lambda user_id: (self._users[user_id]['username'] != user_id_text,
+                                                  len(self._users[user_id]['username']), user_id))
+            matches = matches[offset:offset + limit + 1]
+            found += [user_id for user_id in matches[:limit] if user_id not in found]
+            return {
+                'users': [{'user_id': user_id, 'username': self._users[user_id]['username'],
+                           'role': self._users[user_id]['role'] or 'user'} for user_id in found],
+                'has_next': len(matches) > limit
+            }
+
+    def search_slots(self, text: str, tenant_id: int = DEFAULT_TENANT_ID, offset: int = 0,
+                     limit: int = 10) -> Dict:
+        """Предстоящие слоты арендатора, в описании которых есть слова, начинающиеся со слов запроса"""
+        terms = search_terms(text)
+        if not terms:
+            return {'slots': [], 'has_next': False}
+        now = self.clock.now()
+        with self._lock:
+            matches = [slot for slot in self._slots_between(tenant_id, now, datetime.max)
+                       if self._text_matches(terms, slot['description'])]
+            matches = matches[offset:offset + limit + 1]
+            return {
+                'slots': [{'id': slot['id'], 'datetime': slot['datetime'], 'description': slot['description'],
+                           'capacity': slot['capacity'], 'seats_taken': slot['seats_taken']} for slot in matches[:limit]],
+                'has_next': len(matches) > limit
+            }
+
+    def get_stats(self, tenant_id: int = DEFAULT_TENANT_ID) -> Dict:
+        """Получить статистику"""
+        with self._lock:
+            future = self._slots_after(tenant_id, self.clock.bucket())
+            total_slots = len(future)
+            total_seats = sum(slot['capacity'] for slot in future)
+            total_bookings = sum(
+                len(self._active_by_slot.get(slot_id, ())) for _, slot_id in self._slot_index.get(tenant_id, [])
+            )
+            return {
+                'total_users': sum(1 for user in self._users.values() if user['tenant_id'] == tenant_id),
+                'total_slots': total_slots,
+                'total_bookings': total_bookings,
+                'available_slots': sum(1 for slot in future if not slot['is_booked']),
+                'occupancy_rate': (total_bookings / total_seats * 100) if total_seats > 0 else 0
+            }
+
+    def get_booking_analytics(self, tenant_id: int = DEFAULT_TENANT_ID) -> Dict:
+        """Сводка для /analytics за всю историю: ячейки день недели × час и заблаговременность записей"""
+        # Время слота местное, created_at записи — UTC
+        offset = self.clock.utc_offset()
+        cells = {}
+        lead_time = [0] * (len(LEAD_TIME_BUCKETS) + 1)
+        with self._lock:
+            slots = {slot['id']: slot for slot in self._slots_between(tenant_id, datetime.min, datetime.max)
+                     + self._archived_between(tenant_id, datetime.min, datetime.max)}
+            for slot in slots.values():
+                cell = cells.setdefault((slot['datetime'].weekday(), slot['datetime'].hour),
+                                        {'slots': 0, 'seats': 0, 'booked': 0, 'cancelled': 0})
+                cell['slots'] += 1
+                cell['seats'] += slot['capacity']
+            for booking in itertools.chain(self._bookings.values(), self._archived_bookings.values()):
+                slot = slots.get(booking['slot_id'])
+                if not slot:
+                    continue
+                cell = cells[(slot['datetime'].weekday(), slot['datetime'].hour)]
+                cell['cancelled' if booking['cancelled_at'] else 'booked'] += 1
+                lead = slot['datetime'] - datetime.fromisoformat(booking['created_at']) - offset
+                lead_time[bisect.bisect_right(LEAD_TIME_BUCKETS, lead.total_seconds() / 3600)] += 1
+        return {
+            'cells': [{'weekday': weekday, 'hour': hour, **cell} for (weekday, hour), cell in sorted(cells.items())],
+            'lead_time': lead_time
+        }
+
+    def get_slots_by_month(self, year, month, tenant_id: int = DEFAULT_TENANT_ID):
+        """Получить все слоты за определенный месяц"""
+        start, end = _month_bounds(year, month)
+        with self._lock:
+            slots = [
+                (slot['id'], slot['datetime'], slot['description'], slot['seats_taken'], slot['capacity'])
+                for slot in self._slots_between(tenant_id, start, end)
+            ]
+            archived = [
+                (slot['id'], slot['datetime'], slot['description'], slot['seats_taken'], slot['capacity'])
+                for slot in self._archived_between(tenant_id, start, end)
+            ]
+            return sorted(slots + archived, key=lambda row: (row[1], row[0])) if archived else slots
+
+    def delete_slot(self, slot_id):
+        """Удалить слот по ID"""
+        with self._lock:
+            active_bookings = len(self._active_by_slot.get(slot_id, ()))
+            if active_bookings > 0:
+                return False, f"Нельзя удалить слот с {active_bookings} активными записями"
+            self._drop_waitlist(slot_id)
+            if self._delete_slot_record(slot_id):
+                self._append_event('slot_deleted', slot_id=slot_id)
+                logger.info(f"Слот {slot_id} успешно удален")
+                return True, "Слот успешно удален"
+            return False, "Слот не найден"
+
+    def force_delete_slot(self, slot_id):
+        """Принудительно удалить слот с уведомлением пользователей"""
+        with self._lock:
+            if slot_id not in self._slots:
+                return False, "Слот не найден", []
+            affected_users = []
+            for booking_id in sorted(self._active_by_slot.get(slot_id, ())):
+                user_id = self._bookings[booking_id]['user_id']
+                if user_id in self._users:
+                    affected_users.append((user_id, self._users[user_id]['username']))
+                self._cancel_booking_record(booking_id)
+            self._drop_waitlist(slot_id)
+            self._delete_slot_record(slot_id)
+            self._append_event('slot_deleted', slot_id=slot_id)
+        logger.info(f"Слот {slot_id} принудительно удален, затронуто пользователей: {len(affected_users)}")
+        return True, "Слот принудительно удален", affected_users
+
+    def get_bookings_by_slot(self, slot_id):
+        """Активные записи слота, по строке на место (в виде строк таблицы, как в Database)"""
+        with self._lock:
+            if slot_id in self._slots:
+                slot, bookings, active = self._slots[slot_id], self._bookings, self._active_by_slot
+            elif slot_id in self._archived_slots:
+                slot, bookings, active = (self._archived_slots[slot_id], self._archived_bookings,
+                                          self._archived_active_by_slot)
+            else:
+                return []
+            rows = []
+            for booking_id in sorted(active.get(slot_id, ())):
+                user_id = bookings[booking_id]['user_id']
+                user = self._users.get(user_id)
+                rows.append((slot['id'], slot['datetime'].isoformat(' '), slot['description'], int(slot['is_booked']),
+                             user_id, user['username'] if user else None))
+            return rows
+
+    def get_user_bookings_by_month(self, user_id: int, year: int, month: int) -> List[Dict]:
+        """Получить записи пользователя за определенный месяц"""
+        with self._lock:
+            return self._booking_dicts(self._user_bookings_between(user_id, *_month_bounds(year, month)))
+
+    def get_user_bookings_by_day(self, user_id: int, year: int, month: int, day: int) -> List[Dict]:
+        """Получить записи пользователя за определенный день"""
+        with self._lock:
+            return self._booking_dicts(self._user_bookings_between(user_id, *_day_bounds(year, month, day)))
+
+    def get_available_slots_by_month(self, year: int, month: int, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
+        """Получить доступные слоты за определенный месяц (только те, на которые можно записаться за 24+ часов)"""
+        with self._lock:
+            return self._available(self._slots_between(tenant_id, *_month_bounds(year, month)),
+                                   self.clock.bucket() + BOOKING_LEAD)
+
+    def get_available_slots_by_day(self, year: int, month: int, day: int,
+                                   tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]:
+        """Получить доступные слоты за определенный день (только те, на которые можно записаться за 24+ часов)"""
+        with self._lock:
+            return self._available(self._slots_between(tenant_id, *_day_bounds(year, month, day)),
+                                   self.clock.bucket() + BOOKING_LEAD)
+
+    # Арендаторы
+
+    def add_tenant(self, name: str, slug: Optional[str] = None, group_id: Optional[int] = None) -> int:
+        """Добавить арендатора (автошколу или инструктора)"""
+        try:
+            with self._lock:
+                return self._insert_tenant(name, slug, group_id)
+        except ValueError as e:
+            logger.error(f"Ошибка при добавлении арендатора {name}: {e}")
+            return -1
+
+    def ensure_tenant(self, name: str, slug: str, group_id: Optional[int] = None) -> int:
+        """Создать арендатора с кодом `slug`, если его еще нет; группа задается, если еще не настроена"""
+        tenant = self.get_tenant_by_slug(slug)
+        if tenant:
+            if tenant['group_id'] is None and group_id:
+                self.set_tenant_group(tenant['id'], group_id)
+            return tenant['id']
+        return self.add_tenant(name, slug, group_id)
+
+    def get_tenants(self) -> List[Dict]:
+        """Получить всех арендаторов"""
+        with self._lock:
+            return [dict(self._tenants[tenant_id]) for tenant_id in sorted(self._tenants)]
+
+    def get_tenant(self, tenant_id: int) -> Optional[Dict]:
+        """Получить арендатора по ID"""
+        tenant = self._tenants.get(tenant_id)
+        return dict(tenant) if tenant else None
+
+    def get_tenant_by_slug(self, slug: str) -> Optional[Dict]:
+        """Получить арендатора по коду из deep link"""
+        for tenant in self.get_tenants():
+            if tenant['slug'] == slug:
+                return tenant
+        return None
+
+    def get_tenant_by_group(self, group_id: int) -> Optional[Dict]:
+        """Получить арендатора по ID группы доступа"""
+        for tenant in self.get_tenants():
+            if tenant['group_id'] == group_id:
+                return tenant
+        return None
+
+    def set_tenant_group(self, tenant_id: int, group_id: int) -> bool:
+        """Установить группу доступа арендатора"""
+        with self._lock:
+            tenant = self._tenants.get(tenant_id)
+            if not tenant:
+                return False
+            if group_id is not None and any(other['group_id'] == group_id and other['id'] != tenant_id
+                                            for other in self._tenants.values()):
+                logger.error(f"Ошибка при установке группы арендатора {tenant_id}: группа уже занята")
+                return False
+            tenant['group_id'] = group_id
+            return True
+
+    # Участники групп
+
+    def get_group_member(self, group_id: int, user_id: int) -> Optional[bool]:
+        """Состоит ли пользователь в группе по записанным обновлениям (None — неизвестно)"""
+        entry = self._group_members.get((group_id, user_id))
+        return entry[0] if entry else None
+
+    def set_group_member(self, group_id: int, user_id: int, is_member: bool) -> bool:
+        """Записать членство пользователя в группе"""
+        with self._lock:
+            self._group_members[(group_id, user_id)] = (bool(is_member), _sqlite_now().replace(microsecond=0))
+            return True
+
+    def get_stale_group_members(self, group_id: int, tenant_id: int, max_age: float, limit: int = 50) -> List[int]:
+        """Пользователи арендатора, чье членство не подтверждалось дольше max_age секунд (сначала давние)"""
+        with self._lock:
+            threshold = self._state_cutoff(max_age)
+            stale = []
+            for user_id, user in self._users.items():
+                if user['tenant_id'] != tenant_id:
+                    continue
+                entry = self._group_members.get((group_id, user_id))
+                if entry is None or entry[1] < threshold:
+                    stale.append((entry is not None, entry[1] if entry else None, user_id))
+            stale.sort(key=lambda item: (item[0], item[1] or datetime.min, item[2]))
+            return [user_id for _, _, user_id in stale[:limit]]
+
+    # Аренды, настройки и состояние диалогов
+
+    def try_acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Захватить или продлить аренду `name` на ttl секунд"""
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(name)
+            if current and current[0] != holder and current[1] >= now:
+                return False
+            self._leases[name] = (holder, now + ttl)
+            return True
+
+    def release_lease(self, name: str, holder: str) -> bool:
+        """Освободить аренду, если она принадлежит `holder`"""
+        with self._lock:
+            if self._leases.get(name, (None,))[0] != holder:
+                return False
+            del self._leases[name]
+            return True
+
+    def get_setting(self, key: str, default=None):
+        """Получить общую настройку"""
+        value = self._settings.get(key)
+        return default if value is None else copy.deepcopy(value)
+
+    def set_setting(self, key: str, value) -> bool:
+        """Сохранить общую настройку"""
+        self._settings[key] = copy.deepcopy(value)
+        return True
+
+    @staticmethod
+    def _state_cutoff(max_age: float) -> datetime:
+        """Граница возраста состояния с точностью CURRENT_TIMESTAMP (секунды)"""
+        return (_sqlite_now() - timedelta(seconds=max_age)).replace(microsecond=0)
+
+    def get_user_state(self, user_id: int, key: str, default=None, max_age: Optional[float] = None):
+        """Получить состояние диалога пользователя (старше max_age секунд с последней записи — как отсутствующее)"""
+        entry = self._user_state.get((user_id, key))
+        if entry is None or (max_age is not None and entry[1] < self._state_cutoff(max_age)):
+            return default
+        return copy.deepcopy(entry[0])
+
+    def set_user_state(self, user_id: int, key: str, value) -> bool:
+        """Сохранить состояние диалога пользователя"""
+        self._user_state[(user_id, key)] = (copy.deepcopy(value), _sqlite_now().replace(microsecond=0))
+        return True
+
+    def clear_user_state(self, user_id: int, key: str) -> bool:
+        """Удалить состояние диалога пользователя. Возвращает True, если оно было"""
+        return self._user_state.pop((user_id, key), None) is not None
+
+    def set_user_states(self, items: List[Tuple[int, str, object]]) -> bool:
+        """Сохранить состояния нескольких пользователей (значение None удаляет состояние)"""
+        with self._lock:
+            for user_id, key, value in items:
+                if value is None:
+                    self._user_state.pop((user_id, key), None)
+                else:
+                    self._user_state[(user_id, key)] = (copy.deepcopy(value), _sqlite_now().replace(microsecond=0))
+        return True
+
+    def purge_user_state(self, max_age: float, batch_size: int = 500) -> int:
+        """Удалить состояния, не менявшиеся max_age секунд. Возвращает число удаленных"""
+        cutoff = self._state_cutoff(max_age)
+        with self._lock:
+            expired = [state_key for state_key, (_, updated_at) in self._user_state.items() if updated_at < cutoff]
+            for state_key in expired:
+                del self._user_state[state_key]
+        return len(expired)
+
+    def get_calendar_token(self, user_id: int) -> Optional[str]:
+        """Токен ленты .ics пользователя (создается при первом запросе). None — пользователя нет"""
+        with self._lock:
+            if user_id not in self._users:
+                return None
+            if user_id not in self._calendar_tokens:
+                self._set_calendar_token(user_id)
+            return self._calendar_tokens[user_id]
+
+    def reset_calendar_token(self, user_id: int) -> Optional[str]:
+        """Выдать новый токен ленты .ics; старая ссылка перестает работать"""
+        with self._lock:
+            if user_id not in self._users:
+                return None
+            self._calendar_users.pop(self._calendar_tokens.get(user_id), None)
+            return self._set_calendar_token(user_id)
+
+    def _set_calendar_token(self, user_id: int, token: Optional[str] = None) -> str:
+        token = token or secrets.token_urlsafe(24)
+        self._calendar_tokens[user_id] = token
+        self._calendar_users[token] = user_id
+        return token
+
+    def get_user_by_calendar_token(self, token: str) -> Optional[int]:
+        """ID пользователя по токену ленты .ics (None — токен неизвестен или доступ закрыт)"""
+        user_id = self._calendar_users.get(token)
+        return user_id if self.is_user_allowed(user_id) else None
+
+    # Лист ожидания и уведомления
+
+    def join_waitlist(self, slot_id: int, user_id: int) -> int:
+        """Встать в лист ожидания занятого слота. Возвращает место в очереди (0 — встать нельзя)"""
+        with self._lock:
+            queue = self._waitlist.get(slot_id, [])
+            slot = self._slots.get(slot_id)
+            if (slot and slot['seats_taken'] >= slot['capacity'] and not self._has_booking(slot_id, user_id)
+                    and slot['bookable_until'] > self.clock.bucket()
+                    and all(entry[1] != user_id for entry in queue)):
+                queue = self._waitlist.setdefault(slot_id, [])
+                queue.append((self._next_waitlist_id, user_id))
+                self._next_waitlist_id += 1
+            for position, entry in enumerate(queue, 1):
+                if entry[1] == user_id:
+                    return position
+            return 0
+
+    def leave_waitlist(self, slot_id: int, user_id: int) -> bool:
+        """Выйти из листа ожидания слота"""
+        with self._lock:
+            queue = self._waitlist.get(slot_id, [])
+            for entry in queue:
+                if entry[1] == user_id:
+                    queue.remove(entry)
+                    return True
+            return False
+
+    def get_user_waitlist(self, user_id: int) -> List[Dict]:
+        """Будущие слоты, которые ждет пользователь, с местом в очереди"""
+        with self._lock:
+            now = self.clock.now()
+            result = []
+            for slot_id, queue in self._waitlist.items():
+                slot = self._slots.get(slot_id)
+                if not slot or slot['datetime'] <= now:
+                    continue
+                for position, entry in enumerate(queue, 1):
+                    if entry[1] == user_id:
+                        result.append({'slot_id': slot_id, 'datetime': slot['datetime'],
+                                       'description': slot['description'], 'position': position})
+            result.sort(key=lambda item: (item['datetime'], item['slot_id']))
+            return result
+
+    def take_notifications(self, limit: int = 100, retry_delay: float = 300,
+                           max_attempts: int = 5) -> List[Dict]:
+        """Забрать уведомления для отправки: остаются в очереди до ack_notifications (см. Database)"""
+        now = time.time()
+        with self._lock:
+            expired = {item['id'] for item in self._notifications
+                       if item['attempts'] >= max_attempts and item['claimed_at'] is not None
+                       and item['claimed_at'] < now - retry_delay}
+            if expired:
+                logger.warning(f"Не отправлено за {max_attempts} попыток, удалено уведомлений: {len(expired)}")
+                self._notifications = [item for item in self._notifications if item['id'] not in expired]
+            taken = [item for item in self._notifications
+                     if item['claimed_at'] is None or item['claimed_at'] < now - retry_delay][:limit]
+            for item in taken:
+                item['claimed_at'] = now
+                item['attempts'] += 1
+            return [{key: value for key, value in item.items() if key != 'claimed_at'} for item in taken]
+
+    def ack_notifications(self, notification_ids: List[int]) -> int:
+        """Удалить из очереди отправленные уведомления; возвращает число удаленных"""
+        acked = set(notification_ids)
+        with self._lock:
+            count = len(self._notifications)
+            self._notifications = [item for item in self._notifications if item['id'] not in acked]
+            return count - len(self._notifications)
+
+    # Журнал записей
+
+    def get_booking_events(self, slot_id: Optional[int] = None, user_id: Optional[int] = None,
+                           after_id: int = 0, limit: int = 100) -> List[Dict]:
+        """История записей из журнала: события слота или пользователя после события after_id"""
+        with self._lock:
+            result = []
+            for event_id, event, booking_id, event_slot_id, event_user_id, created_at in self._events_after(after_id):
+                if len(result) >= limit:
+                    break
+                if (slot_id is None or event_slot_id == slot_id) and (user_id is None or event_user_id == user_id):
+                    result.append({'id': event_id, 'event': event, 'booking_id': booking_id,
+                                   'slot_id': event_slot_id, 'user_id': event_user_id,
+                                   'created_at': datetime.fromisoformat(created_at)})
+            return result
+
+    def _replay_booking_log(self):
+        """Активные записи по последнему снимку и хвосту журнала: (состояние, последнее событие, применено)"""
+        state, last_event_id = {}, 0
+        if self._snapshots:
+            last_event_id, snapshot_state = self._snapshots[-1]
+            state = dict(snapshot_state)
+        tail = list(self._events_after(last_event_id))
+        replay_booking_events(state, (event[1:5] for event in tail))
+        return state, tail[-1][0] if tail else last_event_id, len(tail)
+
+    def create_booking_snapshot(self) -> int:
+        """Сохранить снимок активных записей. Возвращает ID последнего события в снимке"""
+        with self._lock:
+            state, last_event_id, _ = self._replay_booking_log()
+            if self._snapshots and self._snapshots[-1][0] == last_event_id:
+                return last_event_id
+            self._snapshots.append((last_event_id, state))
+            del self._snapshots[:-BOOKING_SNAPSHOTS_KEPT]
+            return last_event_id
+
+    def rebuild_booking_state(self) -> Dict:
+        """Восстановить текущее состояние записей и слотов из последнего снимка и журнала"""
+        with self._lock:
+            state, _, replayed = self._replay_booking_log()
+            active = {booking_id for booking_id, booking in self._bookings.items() if booking['cancelled_at'] is None}
+            for booking_id in active - state.keys():
+                self._cancel_booking_record(booking_id)
+            for booking_id in state.keys() - active:
+                booking = self._bookings.get(booking_id)
+                if booking:
+                    self._bookings.pop(booking_id)
+                    self._insert_booking(booking_id, booking['slot_id'], booking['user_id'],
+                                         created_at=booking['created_at'])
+
+            seats, bookers = {}, {}
+            for slot_id, user_id in state.values():
+                seats[slot_id] = seats.get(slot_id, 0) + 1
+                bookers[slot_id] = user_id
+            slots_fixed = 0
+            for slot in self._slots.values():
+                taken = seats.get(slot['id'], 0)
+                want = (taken, taken >= slot['capacity'],
+                        bookers.get(slot['id']) if slot['capacity'] == 1 and taken else None)
+                if (slot['seats_taken'], slot['is_booked'], slot['booked_by']) != want:
+                    slot['seats_taken'], slot['is_booked'], slot['booked_by'] = want
+                    slots_fixed += 1
+            return {'events_replayed': replayed, 'bookings_fixed': len(active ^ state.keys()),
+                    'slots_fixed': slots_fixed}
+
+    # Архив
+
+    def archive_old_data(self, before: datetime, batch_size: int = 500) -> Dict:
+        """Перенести в архив слоты раньше `before` с их записями и записи, отмененные раньше `before`"""
+        cancelled_cutoff = before.astimezone(timezone.utc).replace(tzinfo=None).isoformat(' ', 'seconds')
+        with self._lock:
+            current = self._settings.get('archive_cutoff')
+            if current is None or current < before.isoformat(' '):
+                self._settings['archive_cutoff'] = before.isoformat(' ')
+
+            archived_slot_ids = set()
+            for tenant_id in sorted(self._tenants):
+                index = self._slot_index.get(tenant_id, [])
+                hi = bisect.bisect_left(index, (before,))
+                for _, slot_id in index[:hi]:
+                    slot = self._slots.pop(slot_id)
+                    self._archive_slot(slot)
+                    self._waitlist.pop(slot_id, None)
+                    self._append_event('slot_archived', slot_id=slot_id)
+                    archived_slot_ids.add(slot_id)
+                del index[:hi]
+
+            moved = [
+                booking_id for booking_id, booking in self._bookings.items()
+                if booking['slot_id'] in archived_slot_ids
+                or (booking['cancelled_at'] is not None and booking['cancelled_at'] < cancelled_cutoff)
+            ]
+            for booking_id in moved:
+                self._move_booking_to_archive(booking_id)
+
+        archived = {'slots': len(archived_slot_ids), 'bookings': len(moved)}
+        if moved or archived_slot_ids:
+            logger.info(f"В архив перенесено: {archived['slots']} слотов, {archived['bookings']} записей")
+        return archived
+
+    # Выгрузка
+
+    def iter_slots(self, tenant_id: int = DEFAULT_TENANT_ID, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Слоты арендатора за период [start, end) по возрастанию времени, включая архив"""
+        start, end = start or datetime.min, end or datetime.max
+        with self._lock:
+            slots = self._slots_between(tenant_id, start, end) + self._archived_between(tenant_id, start, end)
+            slots.sort(key=lambda slot: (slot['datetime'], slot['id']))
+            rows = [
+                {'id': slot['id'], 'datetime': slot['datetime'], 'description': slot['description'],
+                 'is_booked': slot['is_booked'], 'booked_by': slot['booked_by'],
+                 'username': self._users[slot['booked_by']]['username'] if slot['booked_by'] in self._users else None,
+                 'capacity': slot['capacity'], 'seats_taken': slot['seats_taken']}
+                for slot in slots
+            ]
+        yield from rows
+
+    def iter_bookings(self, tenant_id: int = DEFAULT_TENANT_ID, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Записи (вместе с отмененными) на слоты арендатора за период [start, end), включая архив"""
+        start, end = start or datetime.min, end or datetime.max
+        with self._lock:
+            slots = {slot['id']: slot for slot in
+                     self._slots_between(tenant_id, start, end) + self._archived_between(tenant_id, start, end)}
+            rows = []
+            for booking in list(self._bookings.values()) + list(self._archived_bookings.values()):
+                slot = slots.get(booking['slot_id'])
+                if slot:
+                    user = self._users.get(booking['user_id'])
+                    rows.append({'id': booking['id'], 'slot_id': slot['id'], 'datetime': slot['datetime'],
+                                 'description': slot['description'], 'user_id': booking['user_id'],
+                                 'username': user['username'] if user else None,
+                                 'created_at': booking['created_at'],
+                                 'cancelled_at': booking['cancelled_at']})
+            rows.sort(key=lambda row: (row['datetime'], row['id']))
+        yield from rows
+
+    def iter_users(self, tenant_id: int = DEFAULT_TENANT_ID) -> Iterator[Dict]:
+        """Пользователи арендатора по возрастанию ID"""
+        with self._lock:
+            rows = [
+                {'user_id': user_id, 'username': user['username'], 'role': user['role'] or 'user',
+                 'is_allowed': bool(user['is_allowed']), 'created_at': None}
+                for user_id, user in sorted(self._users.items()) if user['tenant_id'] == tenant_id
+            ]
+        yield from rows
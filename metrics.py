@@ -0,0 +1,307 @@
+"""
+Метрики в формате Prometheus: гистограммы задержек, счетчики ошибок и gauge запросов в работе
+"""
+
+import time
+import logging
+import functools
+import threading
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и уменьшаться"""
+    metric_type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей в секундах"""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label_values -> [счетчики по корзинам..., сумма, количество]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, *label_values) -> int:
+        state = self._values.get(label_values)
+        return state[-1] if state else 0
+
+    def render(self) -> list:
+        lines = self.header()
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for label_values, state in items:
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += state[index]
+                le = _format_labels(self.label_names, label_values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.label_names, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {state[-1]}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """Набор метрик, отдаваемых одним эндпоинтом"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names=()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names=()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        """Текст в формате Prometheus exposition 0.0.4"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "schedule_bot_handler_seconds", "Длительность обработчиков Telegram", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter(
+    "schedule_bot_handler_errors_total", "Исключения в обработчиках Telegram", ("handler",))
+HANDLER_IN_FLIGHT = REGISTRY.gauge(
+    "schedule_bot_handler_in_flight", "Обработчики, выполняющиеся сейчас", ("handler",))
+
+DB_LATENCY = REGISTRY.histogram(
+    "schedule_bot_db_seconds", "Длительность методов Database", ("method",))
+DB_ERRORS = REGISTRY.counter(
+    "schedule_bot_db_errors_total", "Исключения в методах Database", ("method",))
+DB_IN_FLIGHT = REGISTRY.gauge(
+    "schedule_bot_db_in_flight", "Методы Database, выполняющиеся сейчас", ("method",))
+
+API_LATENCY = REGISTRY.histogram(
+    "schedule_bot_telegram_api_seconds", "Длительность запросов к Bot API", ("endpoint",))
+API_ERRORS = REGISTRY.counter(
+    "schedule_bot_telegram_api_errors_total", "Ошибки запросов к Bot API", ("endpoint",))
+API_IN_FLIGHT = REGISTRY.gauge(
+    "schedule_bot_telegram_api_in_flight", "Запросы к Bot API, выполняющиеся сейчас", ("endpoint",))
+MESSAGE_EDITS_SAVED = REGISTRY.counter(
+    "schedule_bot_message_edits_saved_total", "Правки сообщений, пропущенные без запроса (содержимое не изменилось)")
+
+
+def _callback_name(callback) -> str:
+    return getattr(callback, '__name__', None) or type(callback).__name__
+
+
+def instrument_async(func, name: str, latency: Histogram, errors: Counter, in_flight: Gauge):
+    """Обернуть корутинную функцию замером времени"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        in_flight.inc(name)
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started, name)
+            in_flight.dec(name)
+    return wrapper
+
+
+def instrument_sync(func, name: str, latency: Histogram, errors: Counter, in_flight: Gauge):
+    """Обернуть обычную функцию замером времени"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        in_flight.inc(name)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started, name)
+            in_flight.dec(name)
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Обернуть callback каждого зарегистрированного обработчика"""
+    count = 0
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = handler.callback
+            if getattr(callback, '_metrics_wrapped', False):
+                continue
+            wrapper = instrument_async(callback, _callback_name(callback),
+                                       HANDLER_LATENCY, HANDLER_ERRORS, HANDLER_IN_FLIGHT)
+            wrapper._metrics_wrapped = True
+            handler.callback = wrapper
+            count += 1
+    logger.info(f"Метрики подключены к {count} обработчикам")
+
+
+def instrument_database(database):
+    """Обернуть публичные методы объекта базы данных"""
+    count = 0
+    for name in dir(type(database)):
+        if name.startswith('_'):
+            continue
+        method = getattr(database, name)
+        if not callable(method) or getattr(method, '_metrics_wrapped', False):
+            continue
+        wrapper = instrument_sync(method, name, DB_LATENCY, DB_ERRORS, DB_IN_FLIGHT)
+        wrapper._metrics_wrapped = True
+        setattr(database, name, wrapper)
+        count += 1
+    logger.info(f"Метрики подключены к {count} методам базы данных")
+
+
+def create_instrumented_request(**kwargs):
+    """
+    HTTPXRequest для Bot API с замером каждого запроса.
+
+    Подключается через Application.builder().request(...), поэтому не трогает long polling
+    (getUpdates идет через отдельный объект запроса и искажал бы гистограмму).
+    """
+    from telegram.request import HTTPXRequest
+
+    class InstrumentedRequest(HTTPXRequest):
+        async def do_request(self, url, method, *args, **kw):
+            endpoint = url.rsplit('/', 1)[-1]
+            API_IN_FLIGHT.inc(endpoint)
+            started = time.perf_counter()
+            try:
+                code, payload = await super().do_request(url, method, *args, **kw)
+                if code >= 400:
+                    API_ERRORS.inc(endpoint)
+                return code, payload
+            except Exception:
+                API_ERRORS.inc(endpoint)
+                raise
+            finally:
+                API_LATENCY.observe(time.perf_counter() - started, endpoint)
+                API_IN_FLIGHT.dec(endpoint)
+
+    return InstrumentedRequest(**kwargs)
+
+
+def metrics_route(request):
+    """Обработчик GET /metrics для web.WebServer"""
+    from web import Response
+    return Response(200, REGISTRY.render().encode('utf-8'), content_type="text/plain; version=0.0.4; charset=utf-8")
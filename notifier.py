@@ -0,0 +1,68 @@
+"""
+Отправка сообщений пользователям с ограничением частоты
+
+Bot API принимает около 30 сообщений в секунду от бота и не больше одного сообщения в секунду
+в один чат; сверх этого Telegram отвечает RetryAfter. Notifier распределяет отправки так, чтобы
+лимиты не превышались, а после RetryAfter приостанавливает все отправки на указанное время.
+"""
+
+import time
+import asyncio
+import logging
+
+from telegram.error import RetryAfter, Forbidden
+
+from config import NOTIFY_RATE_PER_SECOND, NOTIFY_PER_CHAT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Столько чатов помнится для интервала между сообщениями; старые записи удаляются
+MAX_TRACKED_CHATS = 10000
+
+
+class Notifier:
+    """Ограничитель частоты для bot.send_message (один на процесс)"""
+
+    def __init__(self, bot, rate: float = NOTIFY_RATE_PER_SECOND, per_chat_interval: float = NOTIFY_PER_CHAT_INTERVAL):
+        self.bot = bot
+        self.interval = 1 / rate
+        self.per_chat_interval = per_chat_interval
+        self._next_send = 0.0  # monotonic-время, раньше которого следующее сообщение не отправляется
+        self._chat_next_send = {}
+        self._lock = asyncio.Lock()
+        self.sent = 0
+        self.failed = 0
+
+    async def _wait_turn(self, chat_id: int):
+        """Занять ближайшее время отправки с учетом общего лимита и лимита чата и дождаться его"""
+        async with self._lock:
+            now = time.monotonic()
+            if len(self._chat_next_send) > MAX_TRACKED_CHATS:
+                self._chat_next_send = {chat: moment for chat, moment in self._chat_next_send.items() if moment > now}
+            moment = max(now, self._next_send, self._chat_next_send.get(chat_id, 0.0))
+            self._next_send = moment + self.interval
+            self._chat_next_send[chat_id] = moment + self.per_chat_interval
+        delay = moment - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Отправить сообщение; после RetryAfter — одна повторная попытка. Возвращает True, если доставлено"""
+        for _ in range(2):
+            await self._wait_turn(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Превышен лимит отправки Telegram, пауза {e.retry_after} с")
+                async with self._lock:
+                    self._next_send = max(self._next_send, time.monotonic() + float(e.retry_after))
+            except Forbidden:
+                logger.info(f"Пользователь {chat_id} заблокировал бота, сообщение не доставлено")
+                break
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                break
+        self.failed += 1
+        return False
@@ -0,0 +1,213 @@
+"""
+Профилирование SQL: журнал медленных запросов с планом выполнения и сводка по нормализованным запросам
+"""
+
+import re
+import time
+import itertools
+import sqlite3
+import logging
+import threading
+from collections import deque
+from typing import List, Dict
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(sql: str) -> str:
+    """Привести запрос к шаблону: литералы заменяются на ?, пробелы схлопываются"""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    return _IN_LIST.sub("(?, ...)", sql)
+
+
+class SQLProfiler:
+    """
+    Сборщик статистики по SQL-запросам.
+
+    Включается и выключается во время работы (команда /sql_profile), пока выключен —
+    соединения открываются без оберток.
+    """
+
+    def __init__(self, enabled: bool = False, threshold_ms: float = 50.0, top_n: int = 15, slow_log_size: int = 50):
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self.top_n = top_n
+        self._stats: Dict[str, list] = {}  # шаблон -> [количество, суммарно мс, максимум мс]
+        self._slow = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def connect(self, db_path: str, **kwargs) -> sqlite3.Connection:
+        """Открыть соединение, запросы которого попадают в профилировщик"""
+        conn = sqlite3.connect(db_path, factory=ProfilingConnection, **kwargs)
+        conn.profiler = self
+        return conn
+
+    def record(self, conn: sqlite3.Connection, sql: str, params, duration_ms: float):
+        """Учесть выполненный запрос"""
+        template = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(template)
+            if stats is None:
+                stats = self._stats[template] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += duration_ms
+            stats[2] = max(stats[2], duration_ms)
+
+        if duration_ms >= self.threshold_ms:
+            plan = self.explain(conn, sql, params)
+            with self._lock:
+                self._slow.append({
+                    'sql': template,
+                    'params': params,
+                    'duration_ms': duration_ms,
+                    'plan': plan,
+                    'at': time.time(),
+                })
+            logger.warning(
+                "Медленный запрос (%.1f мс): %s; параметры: %r; план: %s",
+                duration_ms, template, params, " | ".join(plan)
+            )
+
+    def explain(self, conn: sqlite3.Connection, sql: str, params) -> List[str]:
+        """EXPLAIN QUERY PLAN для запроса с теми же параметрами"""
+        statement = sql.lstrip().upper()
+        if not statement.startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH", "REPLACE")):
+            return []
+        try:
+            cursor = sqlite3.Cursor(conn)
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params if params is not None else ())
+            return [row[-1] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            return [f"план недоступен: {e}"]
+
+    def top(self, limit: int = None) -> List[Dict]:
+        """Шаблоны запросов, отсортированные по суммарному времени"""
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: item[1][1], reverse=True)
+        return [
+            {
+                'sql': template,
+                'count': count,
+                'total_ms': total,
+                'avg_ms': total / count if count else 0.0,
+                'max_ms': maximum,
+            }
+            for template, (count, total, maximum) in items[:limit or self.top_n]
+        ]
+
+    def slow_queries(self) -> List[Dict]:
+        """Последние медленные запросы"""
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """
+    Курсор, замеряющий время запроса вместе с чтением строк.
+
+    SELECT выполняется в SQLite по мере выборки строк, поэтому время execute складывается со временем
+    fetch* и итерации. Запрос учитывается, когда строки закончились, курсор закрыт или удален либо
+    на нем выполняется следующий запрос; запрос без строк (INSERT, UPDATE, DDL) — сразу.
+    """
+
+    _pending = None  # [sql, параметры, мс] запроса, строки которого еще читаются
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            self.connection.profiler.record(self.connection, *pending)
+
+    def _add_time(self, started: float, exhausted: bool):
+        if self._pending is not None:
+            self._pending[2] += (time.perf_counter() - started) * 1000
+            if exhausted:
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._pending = [sql, parameters, (time.perf_counter() - started) * 1000]
+            if self.description is None:
+                self._finish()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        # План строится по первому набору параметров; итератор при этом не теряет его
+        parameters = iter(seq_of_parameters)
+        first = next(parameters, None)
+        if first is not None:
+            parameters = itertools.chain([first], parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self.connection.profiler.record(self.connection, sql, first, (time.perf_counter() - started) * 1000)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._add_time(started, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add_time(started, len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._add_time(started, True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add_time(started, True)
+            raise
+        self._add_time(started, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Соединение, создающее профилирующие курсоры"""
+
+    profiler = None
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
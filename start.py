@@ -4,7 +4,33 @@
 """
 
 import sys
-from main import ScheduleBot
+import multiprocessing
+from startup import STARTUP_TIMER
+
+def run_worker(worker_index: int = 0):
+    """Запуск одного процесса бота"""
+    # Импорт main тянет python-telegram-bot, поэтому замеряется отдельным этапом
+    from main import ScheduleBot
+    STARTUP_TIMER.mark("импорт")
+    
+    bot = ScheduleBot(worker_index)
+    bot.run()
+
+def run_workers(count: int):
+    """Запуск нескольких процессов-обработчиков вебхука с общей базой"""
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(index,), name=f"worker-{index}") for index in range(count)]
+    for worker in workers:
+        worker.start()
+    print(f"Запущено процессов: {count}")
+    
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
 
 def main():
     """Запуск бота"""
@@ -12,8 +38,16 @@ def main():
     print("Нажмите Ctrl+C для остановки")
     
     try:
-        bot = ScheduleBot()
-        bot.run()
+        from config import WORKERS, WEBHOOK_URL
+        
+        if WORKERS > 1:
+            # Long polling допускает только одного получателя обновлений
+            if not WEBHOOK_URL:
+                print("Ошибка: для WORKERS > 1 укажите WEBHOOK_URL в config.py")
+                sys.exit(1)
+            run_workers(WORKERS)
+        else:
+            run_worker()
     except KeyboardInterrupt:
         print("\nБот остановлен")
     except Exception as e:
@@ -0,0 +1,37 @@
+"""
+Замер этапов запуска бота
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Отметки времени этапов запуска относительно создания таймера"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = []
+
+    def mark(self, stage: str):
+        """Завершить этап `stage` (длительность — от предыдущей отметки)"""
+        now = time.perf_counter()
+        self.stages.append((stage, (now - self._last) * 1000))
+        self._last = now
+
+    def total_ms(self) -> float:
+        return (self._last - self.started) * 1000
+
+    def summary(self) -> str:
+        parts = ", ".join(f"{stage} {duration:.0f} мс" for stage, duration in self.stages)
+        return f"{parts}; всего {self.total_ms():.0f} мс"
+
+    def log_summary(self):
+        logger.info("Время запуска: %s", self.summary())
+
+
+# Общий таймер процесса: start.py создает его первым делом, остальные модули только отмечают этапы
+STARTUP_TIMER = StartupTimer()
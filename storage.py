@@ -0,0 +1,238 @@
+"""
+Интерфейс хранилища бота и выбор реализации по конфигурации
+"""
+
+from datetime import date, datetime
+from typing import Protocol, List, Dict, Iterator, Optional, Tuple, runtime_checkable
+
+from database import DEFAULT_TENANT_ID, SLOT_DEFAULT_MINUTES
+
+# Доступные реализации: имя из config.STORAGE_BACKEND -> "модуль:класс"
+BACKENDS = {
+    'sqlite': 'database:Database',
+    'memory': 'memory_database:MemoryDatabase',
+}
+
+
+@runtime_checkable
+class Storage(Protocol):
+    """
+    Операции, которые ScheduleBot выполняет над хранилищем.
+
+    Форматы результатов (кортежи, словари, сообщения об ошибках) у всех реализаций одинаковые —
+    это проверяет `python -m benchmarks conformance`.
+    """
+
+    profiler: object
+    clock: object
+
+    def schema_version(self) -> int: ...
+
+    def init_database(self): ...
+
+    def sync_cache(self, force: bool = False): ...
+
+    def cache_version(self, *namespaces: str) -> Optional[Tuple[int, ...]]: ...
+
+    # Пользователи
+    def add_user(self, user_id: int, username: str, tenant_id: int = DEFAULT_TENANT_ID) -> bool: ...
+
+    def add_users(self, users: List[Tuple[int, str]], tenant_id: int = DEFAULT_TENANT_ID) -> Dict: ...
+
+    def free_user_bookings(self, user_id: int) -> int: ...
+
+    def remove_user(self, user_id: int) -> bool: ...
+
+    def is_user_allowed(self, user_id: int) -> bool: ...
+
+    def user_exists(self, user_id: int) -> bool: ...
+
+    def get_all_users(self, tenant_id: Optional[int] = None) -> list: ...
+
+    def get_users_page(self, tenant_id: int = DEFAULT_TENANT_ID, after_id: Optional[int] = None,
+                       before_id: Optional[int] = None, limit: int = 10) -> Dict: ...
+
+    def get_user_role(self, user_id: int) -> str: ...
+
+    def set_user_role(self, user_id: int, role: str, tenant_id: int = DEFAULT_TENANT_ID) -> bool: ...
+
+    def get_admins(self, tenant_id: int = DEFAULT_TENANT_ID) -> list: ...
+
+    def get_user_tenant(self, user_id: int) -> Optional[int]: ...
+
+    def set_user_tenant(self, user_id: int, tenant_id: int) -> bool: ...
+
+    # Слоты и записи
+    def add_slot(self, datetime_obj: datetime, description: str, tenant_id: int = DEFAULT_TENANT_ID,
+                 capacity: int = 1, duration: int = SLOT_DEFAULT_MINUTES, max_per_day: Optional[int] = None) -> int: ...
+
+    def add_slots(self, slots: List[Tuple[datetime, str]], tenant_id: int = DEFAULT_TENANT_ID, capacity: int = 1,
+                  duration: int = SLOT_DEFAULT_MINUTES, max_per_day: Optional[int] = None) -> Dict: ...
+
+    def set_slot_capacity(self, slot_id: int, capacity: int) -> bool: ...
+
+    def remove_slot(self, slot_id: int) -> bool: ...
+
+    def get_slot(self, slot_id: int) -> Optional[Dict]: ...
+
+    def get_available_slots(self, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]: ...
+
+    def book_slot(self, slot_id: int, user_id: int) -> bool: ...
+
+    def cancel_booking(self, booking_id: int, user_id: int) -> bool: ...
+
+    def get_user_bookings(self, user_id: int) -> List[Dict]: ...
+
+    def get_all_bookings(self, tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]: ...
+
+    def get_bookings_page(self, tenant_id: int = DEFAULT_TENANT_ID,
+                          after: Optional[Tuple[datetime, int, int]] = None,
+                          before: Optional[Tuple[datetime, int, int]] = None, limit: int = 15) -> Dict: ...
+
+    # Поиск (/find)
+    def search_users(self, text: str, tenant_id: int = DEFAULT_TENANT_ID, offset: int = 0,
+                     limit: int = 10) -> Dict: ...
+
+    def search_slots(self, text: str, tenant_id: int = DEFAULT_TENANT_ID, offset: int = 0,
+                     limit: int = 10) -> Dict: ...
+
+    def get_stats(self, tenant_id: int = DEFAULT_TENANT_ID) -> Dict: ...
+
+    def get_booking_analytics(self, tenant_id: int = DEFAULT_TENANT_ID) -> Dict: ...
+
+    def get_slots_by_month(self, year, month, tenant_id: int = DEFAULT_TENANT_ID): ...
+
+    def delete_slot(self, slot_id) -> Tuple[bool, str]: ...
+
+    def force_delete_slot(self, slot_id) -> Tuple[bool, str, list]: ...
+
+    def get_bookings_by_slot(self, slot_id) -> list: ...
+
+    def get_user_bookings_by_month(self, user_id: int, year: int, month: int) -> List[Dict]: ...
+
+    def get_user_bookings_by_day(self, user_id: int, year: int, month: int, day: int) -> List[Dict]: ...
+
+    def get_available_slots_by_month(self, year: int, month: int,
+                                     tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]: ...
+
+    def get_available_slots_by_day(self, year: int, month: int, day: int,
+                                   tenant_id: int = DEFAULT_TENANT_ID) -> List[Dict]: ...
+
+    # Шаблоны расписания
+    def add_schedule_template(self, weekdays: List[int], times: List[str], description: str,
+                              tenant_id: int = DEFAULT_TENANT_ID, capacity: int = 1,
+                              duration: int = SLOT_DEFAULT_MINUTES) -> int: ...
+
+    def get_schedule_templates(self, tenant_id: Optional[int] = None) -> List[Dict]: ...
+
+    def remove_schedule_template(self, template_id: int) -> bool: ...
+
+    def generate_template_slots(self, start: date, end: date, max_per_day: Optional[int] = None) -> Dict: ...
+
+    # Журнал записей
+    def get_booking_events(self, slot_id: Optional[int] = None, user_id: Optional[int] = None,
+                           after_id: int = 0, limit: int = 100) -> List[Dict]: ...
+
+    def create_booking_snapshot(self) -> int: ...
+
+    def rebuild_booking_state(self) -> Dict: ...
+
+    def archive_old_data(self, before: datetime, batch_size: int = 500) -> Dict: ...
+
+    # Выгрузка (генераторы: строки отдаются по мере чтения)
+    def iter_slots(self, tenant_id: int = DEFAULT_TENANT_ID, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> Iterator[Dict]: ...
+
+    def iter_bookings(self, tenant_id: int = DEFAULT_TENANT_ID, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> Iterator[Dict]: ...
+
+    def iter_users(self, tenant_id: int = DEFAULT_TENANT_ID) -> Iterator[Dict]: ...
+
+    # Арендаторы
+    def add_tenant(self, name: str, slug: Optional[str] = None, group_id: Optional[int] = None) -> int: ...
+
+    def ensure_tenant(self, name: str, slug: str, group_id: Optional[int] = None) -> int: ...
+
+    def get_tenants(self) -> List[Dict]: ...
+
+    def get_tenant(self, tenant_id: int) -> Optional[Dict]: ...
+
+    def get_tenant_by_slug(self, slug: str) -> Optional[Dict]: ...
+
+    def get_tenant_by_group(self, group_id: int) -> Optional[Dict]: ...
+
+    def set_tenant_group(self, tenant_id: int, group_id: int) -> bool: ...
+
+    # Участники групп арендаторов (обновления chat_member)
+    def get_group_member(self, group_id: int, user_id: int) -> Optional[bool]: ...
+
+    def set_group_member(self, group_id: int, user_id: int, is_member: bool) -> bool: ...
+
+    def get_stale_group_members(self, group_id: int, tenant_id: int, max_age: float, limit: int = 50) -> List[int]: ...
+
+    # Совместная работа нескольких процессов
+    def try_acquire_lease(self, name: str, holder: str, ttl: float) -> bool: ...
+
+    def release_lease(self, name: str, holder: str) -> bool: ...
+
+    def get_setting(self, key: str, default=None): ...
+
+    def set_setting(self, key: str, value) -> bool: ...
+
+    def get_user_state(self, user_id: int, key: str, default=None, max_age: Optional[float] = None): ...
+
+    def set_user_state(self, user_id: int, key: str, value) -> bool: ...
+
+    def clear_user_state(self, user_id: int, key: str) -> bool: ...
+
+    def set_user_states(self, items: List[Tuple[int, str, object]]) -> bool: ...
+
+    def purge_user_state(self, max_age: float, batch_size: int = 500) -> int: ...
+
+    # Лист ожидания и исходящие уведомления
+    def join_waitlist(self, slot_id: int, user_id: int) -> int: ...
+
+    def leave_waitlist(self, slot_id: int, user_id: int) -> bool: ...
+
+    def get_user_waitlist(self, user_id: int) -> List[Dict]: ...
+
+    def take_notifications(self, limit: int = 100, retry_delay: float = 300,
+                           max_attempts: int = 5) -> List[Dict]: ...
+
+    def ack_notifications(self, notification_ids: List[int]) -> int: ...
+
+    # Подписка на календарь
+    def get_calendar_token(self, user_id: int) -> Optional[str]: ...
+
+    def reset_calendar_token(self, user_id: int) -> Optional[str]: ...
+
+    def get_user_by_calendar_token(self, token: str) -> Optional[int]: ...
+
+
+def storage_methods() -> List[str]:
+    """Имена методов интерфейса Storage"""
+    return sorted(
+        name for name, member in vars(Storage).items()
+        if callable(member) and not name.startswith('_')
+    )
+
+
+def create_storage(backend: str = 'sqlite', db_path: str = "schedule_bot.db", profiler=None,
+                   cache_sync_interval: Optional[float] = None, clock=None) -> Storage:
+    """
+    Создать хранилище по имени реализации из BACKENDS.
+
+    cache_sync_interval передается только SQLite: хранилище в памяти не разделяется между процессами.
+    clock (ScheduleClock) — "сейчас" для правил записи, общий для бота и хранилища.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестное хранилище {backend!r}, доступны: {', '.join(sorted(BACKENDS))}")
+
+    # Реализация импортируется только выбранная
+    module_name, class_name = BACKENDS[backend].split(':')
+    module = __import__(module_name)
+    storage_class = getattr(module, class_name)
+
+    if backend == 'sqlite':
+        return storage_class(db_path, profiler=profiler, cache_sync_interval=cache_sync_interval, clock=clock)
+    return storage_class(profiler=profiler, clock=clock)
@@ -0,0 +1,58 @@
+"""
+Разбор файла для массового добавления пользователей (/import_users)
+
+В строке — ID пользователя Telegram и, необязательно, username через запятую, точку с запятой,
+табуляцию или пробел: подходит и CSV из таблицы, и простой список. Строка заголовка, пустые строки
+и строки, начинающиеся с #, пропускаются. Файл читается построчно из потока: в памяти собираются
+только проверенные пары (ID, username), по одной на пользователя.
+"""
+
+import re
+from typing import Dict, Iterable
+
+from config import IMPORT_MAX_USERS
+
+# Username без указания в файле (как у /add_user без второго аргумента)
+DEFAULT_USERNAME = "Пользователь"
+
+_SEPARATOR = re.compile(r'[,;\t ]+')
+
+
+def read_users(lines: Iterable[str], max_users: int = IMPORT_MAX_USERS) -> Dict:
+    """
+    Проверить строки файла.
+
+    Возвращает {'users': [(user_id, username)], 'rows', 'duplicates', 'errors': [номера строк],
+    'truncated'}. При повторе ID действует последняя строка; после max_users разных пользователей
+    чтение останавливается (truncated).
+    """
+    users = {}
+    stats = {'rows': 0, 'duplicates': 0, 'errors': [], 'truncated': False}
+    header_allowed = True
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = [field.strip('"\'') for field in _SEPARATOR.split(line, maxsplit=1)]
+        is_number = fields[0].isascii() and fields[0].isdigit()
+        if not is_number and header_allowed:
+            # Первая строка с текстом вместо ID — заголовок таблицы
+            header_allowed = False
+            continue
+        header_allowed = False
+        stats['rows'] += 1
+        user_id = int(fields[0]) if is_number else 0
+        if not user_id:
+            stats['errors'].append(line_number)
+            continue
+
+        username = fields[1].lstrip('@').strip() if len(fields) > 1 else ''
+        if user_id in users:
+            stats['duplicates'] += 1
+        elif len(users) >= max_users:
+            stats['truncated'] = True
+            break
+        users[user_id] = username or DEFAULT_USERNAME
+
+    stats['users'] = list(users.items())
+    return stats
@@ -0,0 +1,152 @@
+"""
+Минимальный HTTP-сервер на asyncio для служебных эндпоинтов бота
+"""
+
+import asyncio
+import inspect
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+MAX_HEADER_LINES = 100
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Проверка If-None-Match: список тегов через запятую, слабые теги (W/) сравниваются как сильные"""
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+class Request:
+    """Разобранный HTTP-запрос"""
+
+    def __init__(self, method: str, target: str, headers: dict):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers
+
+
+class Response:
+    """HTTP-ответ"""
+
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str = "text/plain; charset=utf-8",
+                 headers: dict = None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+class WebServer:
+    """HTTP/1.0-сервер с таблицей маршрутов, работающий в цикле событий бота"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._prefix_routes = []
+        self._server = None
+
+    def add_route(self, path: str, handler, prefix: bool = False):
+        """
+        Зарегистрировать обработчик пути.
+
+        Обработчик принимает Request и возвращает Response (может быть корутиной).
+        При prefix=True обработчик получает все пути, начинающиеся с `path`.
+        """
+        if prefix:
+            self._prefix_routes.append((path, handler))
+        else:
+            self._routes[path] = handler
+
+    def _resolve(self, path: str):
+        handler = self._routes.get(path)
+        if handler is not None:
+            return handler
+        for prefix, prefix_handler in self._prefix_routes:
+            if path.startswith(prefix):
+                return prefix_handler
+        return None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"HTTP-сервер запущен на {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            if not request_line:
+                return
+            try:
+                method, target, _ = request_line.split(' ', 2)
+            except ValueError:
+                await self._write(writer, Response(400, b"Bad Request"), head=False)
+                return
+
+            headers = {}
+            for _ in range(MAX_HEADER_LINES):
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if method not in ('GET', 'HEAD'):
+                await self._write(writer, Response(405, b"Method Not Allowed"), head=False)
+                return
+
+            request = Request(method, target, headers)
+            handler = self._resolve(request.path)
+            if handler is None:
+                response = Response(404, b"Not Found")
+            else:
+                try:
+                    response = handler(request)
+                    if inspect.isawaitable(response):
+                        response = await response
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке HTTP-запроса {request.path}: {e}")
+                    response = Response(500, b"Internal Server Error")
+
+            await self._write(writer, response, head=method == 'HEAD')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write(self, writer: asyncio.StreamWriter, response: Response, head: bool):
+        body = b"" if response.status == 304 else response.body
+        lines = [f"HTTP/1.0 {response.status} {STATUS_TEXT.get(response.status, 'Unknown')}"]
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(body)),
+            "Connection": "close",
+        }
+        headers.update(response.headers)
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        if not head:
+            writer.write(body)
+        await writer.drain()